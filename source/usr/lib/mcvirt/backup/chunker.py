@@ -0,0 +1,131 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import hashlib
+import math
+
+from mcvirt.mcvirt import MCVirtException
+
+
+class InvalidChunkSizeException(MCVirtException):
+    """The chunk sizes given to the chunker are not valid"""
+    pass
+
+
+# Gear table used by the rolling hash. This is derived from a fixed string, so that
+# chunk boundaries are identical across nodes and MCVirt versions.
+GEAR_TABLE = [int(hashlib.sha256('mcvirt-chunker-%i' % byte).hexdigest()[:8], 16)
+              for byte in range(256)]
+
+
+class Chunker(object):
+    """Splits data into content-defined chunks, using a gear-based rolling hash.
+    Chunk boundaries depend only on the surrounding bytes, so data that has been
+    shifted within a disk image still produces identical chunks"""
+
+    HASH_MASK = 0xFFFFFFFF
+    HASH_BITS = 32
+
+    def __init__(self, minimum_size, average_size, maximum_size):
+        """Sets member variables and calculates the boundary masks"""
+        if (not (0 < minimum_size < average_size < maximum_size)):
+            raise InvalidChunkSizeException(
+                'Chunk sizes must satisfy minimum < average < maximum'
+            )
+        self.minimum_size = minimum_size
+        self.average_size = average_size
+        self.maximum_size = maximum_size
+
+        # Use normalised chunking: a stricter mask is used before the average size
+        # has been reached and a looser mask afterwards, which narrows the chunk size
+        # distribution around the average
+        bits = int(round(math.log(average_size, 2)))
+        self.small_mask = self._generateMask(bits + 2)
+        self.large_mask = self._generateMask(bits - 2)
+
+        # Determine where a chunk boundary falls within a run of zero bytes,
+        # allowing zeroed areas of disks to be chunked without scanning them
+        self.zero_chunk_size = None
+        zero_data = '\0' * maximum_size
+        self.zero_chunk_size = self._findBoundary(zero_data, bytearray(zero_data),
+                                                  0, maximum_size)
+
+    def getConfig(self):
+        """Returns the chunk sizes used by the chunker"""
+        return {
+            'minimum_size': self.minimum_size,
+            'average_size': self.average_size,
+            'maximum_size': self.maximum_size
+        }
+
+    def _generateMask(self, bits):
+        """Returns a mask covering the given number of the most significant hash bits"""
+        bits = max(1, min(bits, self.HASH_BITS))
+        return ((1 << bits) - 1) << (self.HASH_BITS - bits)
+
+    def getChunkLengths(self, data):
+        """Returns the lengths of the chunks that the data is split into"""
+        data_bytes = bytearray(data)
+        lengths = []
+        position = 0
+        data_length = len(data)
+        while (position < data_length):
+            length = self._findBoundary(data, data_bytes, position, data_length)
+            lengths.append(length)
+            position += length
+        return lengths
+
+    def getChunkLength(self, data):
+        """Returns the length of the first chunk of the data. The data must contain at
+        least the maximum chunk size, unless it extends to the end of the source"""
+        return self._findBoundary(data, bytearray(data), 0, len(data))
+
+    def _findBoundary(self, data, data_bytes, start, end):
+        """Returns the length of the chunk starting at the given position"""
+        remaining = end - start
+        if (remaining <= self.minimum_size):
+            return remaining
+
+        # Zeroed areas always produce the same chunk, so avoid scanning them
+        zero_chunk_size = self.zero_chunk_size
+        if (zero_chunk_size and remaining >= zero_chunk_size and
+                data.count('\0', start, start + zero_chunk_size) == zero_chunk_size):
+            return zero_chunk_size
+
+        maximum_end = start + min(remaining, self.maximum_size)
+        average_end = min(maximum_end, start + self.average_size)
+
+        # Bytes before the minimum chunk size can never form a boundary, so are skipped
+        gear_table = GEAR_TABLE
+        hash_mask = self.HASH_MASK
+        rolling_hash = 0
+        position = start + self.minimum_size
+        boundary_mask = self.small_mask
+        while (position < average_end):
+            rolling_hash = ((rolling_hash << 1) + gear_table[data_bytes[position]]) & hash_mask
+            position += 1
+            if (not rolling_hash & boundary_mask):
+                return position - start
+
+        boundary_mask = self.large_mask
+        while (position < maximum_end):
+            rolling_hash = ((rolling_hash << 1) + gear_table[data_bytes[position]]) & hash_mask
+            position += 1
+            if (not rolling_hash & boundary_mask):
+                return position - start
+
+        return maximum_end - start
@@ -0,0 +1,592 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import binascii
+from collections import deque
+import fcntl
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+import time
+import uuid
+import zlib
+from texttable import Texttable
+
+from mcvirt.mcvirt import MCVirt, MCVirtException
+from mcvirt.auth import Auth
+from mcvirt.backup.chunker import Chunker
+
+
+class UnsupportedBackupRepositoryException(MCVirtException):
+    """The backup repository uses an unsupported format version"""
+    pass
+
+
+class BackupDoesNotExistException(MCVirtException):
+    """The given backup does not exist in the repository"""
+    pass
+
+
+class BackupChunkMissingException(MCVirtException):
+    """A chunk referenced by a backup is not present in the repository"""
+    pass
+
+
+class BackupChunkCorruptException(MCVirtException):
+    """The data for a chunk does not match its hash"""
+    pass
+
+
+class BackupRepositoryVerificationException(MCVirtException):
+    """Errors were found whilst verifying the backup repository"""
+    pass
+
+
+# Worker state, which is inherited by the processes of the backup worker pool
+_worker_chunker = None
+_worker_known_digests = frozenset()
+_worker_compression_level = None
+
+
+def _initialiseWorker(chunker, known_digests, compression_level):
+    """Stores the state required by the backup worker processes"""
+    global _worker_chunker, _worker_known_digests, _worker_compression_level
+    _worker_chunker = chunker
+    _worker_known_digests = known_digests
+    _worker_compression_level = compression_level
+
+
+def _processChunk(chunk_data, known_digests, compression_level):
+    """Hashes a chunk and compresses it, if it is not already stored in the repository"""
+    digest = hashlib.sha256(chunk_data).digest()
+    compressed_data = None
+    if (digest not in known_digests):
+        compressed_data = zlib.compress(chunk_data, compression_level)
+    return digest, len(chunk_data), compressed_data
+
+
+def _processSegment(segment):
+    """Reads a segment of the source, splits it into chunks and hashes them.
+    Chunks that are not already stored in the repository are also compressed,
+    so that the parent process only has to append them to a pack"""
+    source_path, offset, length = segment
+    with open(source_path, 'rb') as source_fh:
+        source_fh.seek(offset)
+        data = source_fh.read(length)
+
+    chunks = []
+    position = 0
+    for chunk_length in _worker_chunker.getChunkLengths(data):
+        chunks.append(_processChunk(data[position:position + chunk_length],
+                                    _worker_known_digests, _worker_compression_level))
+        position += chunk_length
+    return chunks
+
+
+def _verifyPack(pack_check):
+    """Reads each of the given chunks from a pack and checks them against their digest"""
+    pack_path, chunks = pack_check
+    if (not os.path.isfile(pack_path)):
+        return [digest for digest, _, _ in chunks]
+    corrupt_digests = []
+    with open(pack_path, 'rb') as pack_fh:
+        for digest, offset, length in chunks:
+            pack_fh.seek(offset)
+            try:
+                chunk_data = zlib.decompress(pack_fh.read(length))
+            except zlib.error:
+                corrupt_digests.append(digest)
+                continue
+            if (hashlib.sha256(chunk_data).digest() != digest):
+                corrupt_digests.append(digest)
+    return corrupt_digests
+
+
+class BackupRepository(object):
+    """Provides a deduplicating store for backups of VM disks. Disk data is split into
+    content-defined chunks, which are compressed and stored once, in pack files.
+    A compact binary index maps each chunk hash to its location and a manifest is
+    stored for each backup, listing the chunks that make up the disk"""
+
+    FORMAT_VERSION = 1
+    DEFAULT_CHUNK_SIZES = {
+        'minimum_size': 256 * 1024,
+        'average_size': 1024 * 1024,
+        'maximum_size': 4 * 1024 * 1024
+    }
+    COMPRESSION_LEVEL = 3
+    SEGMENT_SIZE = 64 * 1024 * 1024
+    PACK_MAXIMUM_SIZE = 512 * 1024 * 1024
+    # Index records contain: SHA-256 digest, pack ID, offset in pack, compressed length
+    INDEX_RECORD = struct.Struct('>32sIQI')
+
+    def __init__(self, mcvirt_instance, path=None):
+        """Sets member variables and loads the repository configuration,
+        initialising the repository if it does not exist"""
+        self.mcvirt_instance = mcvirt_instance
+        self.path = path or MCVirt.BACKUP_STORAGE_DIR
+
+        # Ensure the user has permission to manage backups
+        self.mcvirt_instance.getAuthObject().assertPermission(Auth.PERMISSIONS.BACKUP_VM)
+
+        if (not os.path.isfile(self._getConfigPath())):
+            self._initialise()
+
+        with open(self._getConfigPath(), 'r') as config_fh:
+            self.config = json.load(config_fh)
+        if (self.config['version'] != self.FORMAT_VERSION):
+            raise UnsupportedBackupRepositoryException(
+                'Backup repository %s uses unsupported format version %s' %
+                (self.path, self.config['version'])
+            )
+
+        self.chunker = Chunker(**self.config['chunk_sizes'])
+        self.index = None
+        self.pack_id = None
+        self.pack_fh = None
+
+    def _initialise(self):
+        """Creates the directory structure and configuration for a new repository"""
+        for directory in [self.path, self._getPackDirectory(), self._getManifestDirectory()]:
+            if (not os.path.isdir(directory)):
+                os.makedirs(directory, 0700)
+        config = {
+            'version': self.FORMAT_VERSION,
+            'chunk_sizes': self.DEFAULT_CHUNK_SIZES,
+            'compression_level': self.COMPRESSION_LEVEL
+        }
+        self._writeFile(self._getConfigPath(), json.dumps(config, indent=2, sort_keys=True))
+        open(self._getIndexPath(), 'ab').close()
+
+    def _getConfigPath(self):
+        """Returns the path of the repository configuration file"""
+        return os.path.join(self.path, 'config.json')
+
+    def _getIndexPath(self):
+        """Returns the path of the chunk index"""
+        return os.path.join(self.path, 'index')
+
+    def _getPackDirectory(self):
+        """Returns the directory that pack files are stored in"""
+        return os.path.join(self.path, 'packs')
+
+    def _getPackPath(self, pack_id):
+        """Returns the path of a pack file"""
+        return os.path.join(self._getPackDirectory(), '%08i.pack' % pack_id)
+
+    def _getManifestDirectory(self):
+        """Returns the directory that backup manifests are stored in"""
+        return os.path.join(self.path, 'manifests')
+
+    def _getManifestPath(self, backup_id):
+        """Returns the path of the manifest for a backup"""
+        return os.path.join(self._getManifestDirectory(), '%s.json' % backup_id)
+
+    def _getLockPath(self):
+        """Returns the path of the file used to lock the repository"""
+        return os.path.join(self.path, 'lock')
+
+    def _obtainLock(self, exclusive=True):
+        """Waits for and obtains the repository lock, which is held exclusively whilst
+        the repository is modified. Returns the file object holding the lock, which
+        is released when it is closed"""
+        lock_fh = open(self._getLockPath(), 'a')
+        fcntl.flock(lock_fh, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+        # The repository may have been modified whilst waiting for the lock
+        self.index = None
+        return lock_fh
+
+    def _getPackIds(self):
+        """Returns the IDs of the pack files in the repository"""
+        return sorted([int(pack_file.split('.')[0])
+                       for pack_file in os.listdir(self._getPackDirectory())
+                       if pack_file.endswith('.pack')])
+
+    @staticmethod
+    def _writeFile(path, data):
+        """Atomically writes data to a file, ensuring that it has reached the disk"""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file_fh:
+            file_fh.write(data)
+            file_fh.flush()
+            os.fsync(file_fh.fileno())
+        os.rename(temp_path, path)
+
+    def _getIndex(self):
+        """Loads the chunk index into memory"""
+        if (self.index is None):
+            self.index = {}
+            record_size = self.INDEX_RECORD.size
+            with open(self._getIndexPath(), 'rb') as index_fh:
+                index_data = index_fh.read()
+
+            # Any incomplete trailing record is the result of an interrupted backup.
+            # The chunk that it refers to will be removed by garbage collection.
+            for record_offset in xrange(0, len(index_data) - record_size + 1, record_size):
+                digest, pack_id, offset, length = self.INDEX_RECORD.unpack_from(index_data,
+                                                                                record_offset)
+                self.index[digest] = (pack_id, offset, length)
+        return self.index
+
+    def _openPack(self):
+        """Opens a new pack file to append chunks to"""
+        pack_ids = self._getPackIds()
+        self.pack_id = (pack_ids[-1] + 1) if pack_ids else 1
+        self.pack_fh = open(self._getPackPath(self.pack_id), 'ab')
+
+    def _closePack(self):
+        """Flushes and closes the current pack file"""
+        if (self.pack_fh):
+            self.pack_fh.flush()
+            os.fsync(self.pack_fh.fileno())
+            self.pack_fh.close()
+            self.pack_fh = None
+            self.pack_id = None
+
+    def _storeChunks(self, chunks):
+        """Appends compressed chunks to the current pack file and returns
+        the index records for them"""
+        records = []
+        for digest, compressed_data in chunks:
+            if (self.pack_fh is None or self.pack_fh.tell() >= self.PACK_MAXIMUM_SIZE):
+                self._closePack()
+                self._openPack()
+            offset = self.pack_fh.tell()
+            self.pack_fh.write(compressed_data)
+            records.append((digest, self.pack_id, offset, len(compressed_data)))
+        return records
+
+    def _appendIndexRecords(self, records):
+        """Flushes the pack data that the records refer to and appends the records to the index"""
+        if (not records):
+            return
+        self.pack_fh.flush()
+        os.fsync(self.pack_fh.fileno())
+        with open(self._getIndexPath(), 'ab') as index_fh:
+            index_fh.write(''.join([self.INDEX_RECORD.pack(*record) for record in records]))
+            index_fh.flush()
+            os.fsync(index_fh.fileno())
+        for digest, pack_id, offset, length in records:
+            self.index[digest] = (pack_id, offset, length)
+
+    def _getWorkerCount(self):
+        """Returns the number of worker processes used for hashing and compression"""
+        return max(1, multiprocessing.cpu_count())
+
+    def createBackup(self, source_path, vm_name, disk_id):
+        """Stores the contents of the source path in the repository and returns
+        the ID of the new backup"""
+        lock_fh = self._obtainLock()
+        try:
+            return self._createBackup(source_path, vm_name, disk_id)
+        finally:
+            lock_fh.close()
+
+    def _createBackup(self, source_path, vm_name, disk_id):
+        """Stores the contents of the source path in the repository, whilst the
+        repository lock is held"""
+        index = self._getIndex()
+        known_digests = frozenset(index.keys())
+        compression_level = self.config['compression_level']
+
+        # The disk may be backed up more than once within a second, so the time
+        # alone does not identify the backup
+        backup_id = '%s-disk-%s-%s-%s' % (vm_name, disk_id, time.strftime('%Y%m%d%H%M%S'),
+                                          uuid.uuid4().hex[:8])
+        manifest_chunks = []
+        statistics = {'chunks': 0, 'new_chunks': 0, 'new_bytes': 0}
+        # Offset in the source of the start of the next chunk of the backup
+        state = {'position': 0}
+
+        def storeChunks(chunks):
+            new_chunks = []
+            new_digests = set()
+            for digest, chunk_length, compressed_data in chunks:
+                manifest_chunks.append((binascii.hexlify(digest), chunk_length))
+                statistics['chunks'] += 1
+                # Chunks may be duplicated within the backup, so must be
+                # checked against the index again
+                if (digest not in index and compressed_data is not None and
+                        digest not in new_digests):
+                    new_digests.add(digest)
+                    new_chunks.append((digest, compressed_data))
+                    statistics['new_chunks'] += 1
+                    statistics['new_bytes'] += len(compressed_data)
+            self._appendIndexRecords(self._storeChunks(new_chunks))
+
+        def storeSegment(segment_offset, segment_chunks):
+            # The last chunk of a segment is cut short by the end of the segment,
+            # unless the segment is at the end of the source
+            if (segment_offset + self.SEGMENT_SIZE < source_size):
+                segment_chunks = segment_chunks[:-1]
+            chunk_numbers = {}
+            chunk_offset = segment_offset
+            for chunk_number, (_, chunk_length, _) in enumerate(segment_chunks):
+                chunk_numbers[chunk_offset] = chunk_number
+                chunk_offset += chunk_length
+
+            # The worker started chunking at the start of the segment, rather than at
+            # the end of the last chunk of the previous segment, so its chunks only match
+            # those of the whole source from the first boundary that both share. Until
+            # that boundary is reached, the chunking is continued from the previous chunk.
+            chunks = []
+            while (state['position'] < chunk_offset and
+                   state['position'] not in chunk_numbers):
+                source_fh.seek(state['position'])
+                chunk_data = source_fh.read(self.chunker.maximum_size)
+                chunk_data = chunk_data[:self.chunker.getChunkLength(chunk_data)]
+                chunks.append(_processChunk(chunk_data, known_digests, compression_level))
+                state['position'] += len(chunk_data)
+            if (state['position'] in chunk_numbers):
+                chunks.extend(segment_chunks[chunk_numbers[state['position']]:])
+                state['position'] = chunk_offset
+            storeChunks(chunks)
+
+        with open(source_path, 'rb') as source_fh:
+            source_fh.seek(0, os.SEEK_END)
+            source_size = source_fh.tell()
+
+            # Each worker reads, chunks, hashes and compresses a segment of the source. The
+            # number of outstanding segments is bounded, to limit memory usage.
+            worker_count = self._getWorkerCount()
+            pool = multiprocessing.Pool(worker_count, _initialiseWorker,
+                                        (self.chunker, known_digests, compression_level))
+            try:
+                pending_segments = deque()
+                for offset in xrange(0, source_size, self.SEGMENT_SIZE):
+                    pending_segments.append((offset, pool.apply_async(
+                        _processSegment, ((source_path, offset, self.SEGMENT_SIZE),)
+                    )))
+                    if (len(pending_segments) >= worker_count * 2):
+                        segment_offset, segment_result = pending_segments.popleft()
+                        storeSegment(segment_offset, segment_result.get())
+                while (pending_segments):
+                    segment_offset, segment_result = pending_segments.popleft()
+                    storeSegment(segment_offset, segment_result.get())
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+                self._closePack()
+
+        manifest = {
+            'version': self.FORMAT_VERSION,
+            'id': backup_id,
+            'vm_name': vm_name,
+            'disk_id': disk_id,
+            'created': int(time.time()),
+            'size': source_size,
+            'chunks': manifest_chunks
+        }
+        self._writeFile(self._getManifestPath(backup_id), json.dumps(manifest))
+        return backup_id, statistics
+
+    def getManifest(self, backup_id):
+        """Returns the manifest for a backup"""
+        if (not os.path.isfile(self._getManifestPath(backup_id))):
+            raise BackupDoesNotExistException('Backup does not exist: %s' % backup_id)
+        with open(self._getManifestPath(backup_id), 'r') as manifest_fh:
+            return json.load(manifest_fh)
+
+    def getBackupIds(self, vm_name=None):
+        """Returns the IDs of the backups in the repository, optionally for a single VM"""
+        backup_ids = []
+        for manifest_file in sorted(os.listdir(self._getManifestDirectory())):
+            if (not manifest_file.endswith('.json')):
+                continue
+            backup_id = manifest_file[:-len('.json')]
+            if (vm_name is None or backup_id.startswith('%s-disk-' % vm_name)):
+                backup_ids.append(backup_id)
+        return backup_ids
+
+    def list(self, vm_name=None):
+        """Returns a table of the backups in the repository"""
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('Backup ID', 'VM', 'Disk ID', 'Created', 'Size (MB)'))
+        for backup_id in self.getBackupIds(vm_name):
+            manifest = self.getManifest(backup_id)
+            table.add_row((backup_id, manifest['vm_name'], manifest['disk_id'],
+                           time.strftime('%Y-%m-%d %H:%M:%S',
+                                         time.localtime(manifest['created'])),
+                           manifest['size'] / (1024 * 1024)))
+        return table.draw()
+
+    def deleteBackup(self, backup_id):
+        """Removes the manifest for a backup. The chunk data is reclaimed
+        by the next garbage collection"""
+        lock_fh = self._obtainLock()
+        try:
+            self.getManifest(backup_id)
+            os.unlink(self._getManifestPath(backup_id))
+        finally:
+            lock_fh.close()
+
+    def restoreBackup(self, backup_id, destination_path):
+        """Writes the contents of a backup to the destination path"""
+        # Prevent the chunks of the backup from being moved by a garbage collection
+        lock_fh = self._obtainLock(exclusive=False)
+        try:
+            self._restoreBackup(backup_id, destination_path)
+        finally:
+            lock_fh.close()
+
+    def _restoreBackup(self, backup_id, destination_path):
+        """Writes the contents of a backup to the destination path, whilst the
+        repository lock is held"""
+        manifest = self.getManifest(backup_id)
+        index = self._getIndex()
+        pack_fhs = {}
+        try:
+            with open(destination_path, 'r+b') as destination_fh:
+                for hex_digest, chunk_length in manifest['chunks']:
+                    digest = binascii.unhexlify(hex_digest)
+                    if (digest not in index):
+                        raise BackupChunkMissingException(
+                            'Chunk %s of backup %s is missing from the repository' %
+                            (hex_digest, backup_id)
+                        )
+                    pack_id, offset, length = index[digest]
+                    if (pack_id not in pack_fhs):
+                        pack_fhs[pack_id] = open(self._getPackPath(pack_id), 'rb')
+                    pack_fhs[pack_id].seek(offset)
+                    chunk_data = zlib.decompress(pack_fhs[pack_id].read(length))
+                    if (hashlib.sha256(chunk_data).digest() != digest or
+                            len(chunk_data) != chunk_length):
+                        raise BackupChunkCorruptException(
+                            'Chunk %s of backup %s is corrupt' % (hex_digest, backup_id)
+                        )
+                    destination_fh.write(chunk_data)
+                destination_fh.flush()
+                os.fsync(destination_fh.fileno())
+        finally:
+            for pack_fh in pack_fhs.values():
+                pack_fh.close()
+
+    def _getReferencedDigests(self):
+        """Returns the digests of all chunks referenced by backup manifests"""
+        referenced_digests = set()
+        for backup_id in self.getBackupIds():
+            for hex_digest, _ in self.getManifest(backup_id)['chunks']:
+                referenced_digests.add(binascii.unhexlify(hex_digest))
+        return referenced_digests
+
+    def garbageCollect(self):
+        """Removes chunks that are no longer referenced by any backup, rewriting the
+        pack files that contain them. Returns the number of chunks and bytes removed"""
+        lock_fh = self._obtainLock()
+        try:
+            return self._garbageCollect()
+        finally:
+            lock_fh.close()
+
+    def _garbageCollect(self):
+        """Removes chunks that are no longer referenced by any backup, whilst the
+        repository lock is held"""
+        index = self._getIndex()
+        referenced_digests = self._getReferencedDigests()
+
+        # Determine the live chunks in each pack and the packs that contain garbage
+        pack_ids = self._getPackIds()
+        live_chunks = dict([(pack_id, []) for pack_id in pack_ids])
+        for digest in referenced_digests:
+            if (digest in index):
+                pack_id, offset, length = index[digest]
+                live_chunks.setdefault(pack_id, []).append((digest, offset, length))
+        removed_chunks = len([digest for digest in index if digest not in referenced_digests])
+        removed_bytes = 0
+        garbage_pack_ids = []
+        for pack_id in pack_ids:
+            live_bytes = sum([chunk_length for _, _, chunk_length in live_chunks[pack_id]])
+            pack_size = os.path.getsize(self._getPackPath(pack_id))
+            if (live_bytes < pack_size):
+                garbage_pack_ids.append(pack_id)
+                removed_bytes += pack_size - live_bytes
+
+        # Copy the live chunks from the packs containing garbage into new packs
+        new_index = dict([(digest, index[digest]) for digest in referenced_digests
+                          if digest in index])
+        try:
+            for pack_id in garbage_pack_ids:
+                with open(self._getPackPath(pack_id), 'rb') as pack_fh:
+                    chunks = []
+                    for digest, offset, length in sorted(live_chunks[pack_id],
+                                                         key=lambda chunk: chunk[1]):
+                        pack_fh.seek(offset)
+                        chunks.append((digest, pack_fh.read(length)))
+                for digest, new_pack_id, offset, length in self._storeChunks(chunks):
+                    new_index[digest] = (new_pack_id, offset, length)
+        finally:
+            self._closePack()
+
+        # Replace the index, before removing the old packs
+        self._writeFile(self._getIndexPath(),
+                        ''.join([self.INDEX_RECORD.pack(digest, *new_index[digest])
+                                 for digest in new_index]))
+        self.index = new_index
+        for pack_id in garbage_pack_ids:
+            os.unlink(self._getPackPath(pack_id))
+
+        return removed_chunks, removed_bytes
+
+    def verify(self):
+        """Checks that every chunk referenced by a backup is present and that the stored
+        chunk data matches its hash. Returns a list of errors found"""
+        lock_fh = self._obtainLock(exclusive=False)
+        try:
+            return self._verify()
+        finally:
+            lock_fh.close()
+
+    def _verify(self):
+        """Verifies the repository, whilst the repository lock is held"""
+        index = self._getIndex()
+        errors = []
+        for backup_id in self.getBackupIds():
+            missing_chunks = [hex_digest for hex_digest, _ in self.getManifest(backup_id)['chunks']
+                              if binascii.unhexlify(hex_digest) not in index]
+            if (missing_chunks):
+                errors.append('Backup %s is missing %i chunk(s)' %
+                              (backup_id, len(missing_chunks)))
+
+        # Verify each of the packs in parallel
+        pack_checks = {}
+        for digest, (pack_id, offset, length) in index.items():
+            pack_checks.setdefault(pack_id, []).append((digest, offset, length))
+        pool = multiprocessing.Pool(self._getWorkerCount())
+        try:
+            corrupt_digests = pool.map(
+                _verifyPack,
+                [(self._getPackPath(pack_id), sorted(chunks, key=lambda chunk: chunk[1]))
+                 for pack_id, chunks in pack_checks.items()]
+            )
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        for pack_corrupt_digests in corrupt_digests:
+            for digest in pack_corrupt_digests:
+                errors.append('Chunk %s is corrupt' % binascii.hexlify(digest))
+        return errors
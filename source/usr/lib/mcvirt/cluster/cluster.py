@@ -150,6 +150,9 @@ class Cluster:
         # Sync VMs
         self.syncVirtualMachines(remote)
 
+        # Sync the DRBD minor and port allocations
+        self.syncDrbdAllocations(remote)
+
     def syncNetworks(self, remote_object):
         """Add the local networks to the remote node"""
         from mcvirt.node.network import Network
@@ -222,6 +225,12 @@ class Cluster:
                                            {'vm_name': vm_object.getName(),
                                             'node': vm_object.getNode()})
 
+    def syncDrbdAllocations(self, remote_object):
+        """Replaces the DRBD allocation table on the remote node with the local table"""
+        from mcvirt.node.drbd import DRBDAllocation
+        remote_object.runRemoteCommand('node-drbd-setAllocationTable',
+                                       {'table': DRBDAllocation.getTable()})
+
     def checkRemoteMachine(self, remote_object):
         """Performs checks on the remote node to ensure that there will be
            no object conflicts when syncing the Network and VM configurations"""
@@ -19,6 +19,7 @@ import json
 from paramiko.client import SSHClient, AutoAddPolicy
 from paramiko.ssh_exception import AuthenticationException
 import os
+import threading
 
 from mcvirt.mcvirt import MCVirtException
 from cluster import Cluster
@@ -180,6 +181,10 @@ class Remote:
             vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
             vm_object.stop()
 
+        elif (action == 'virtual_machine-shutdown'):
+            vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
+            return_data = vm_object.shutdown(timeout=arguments['timeout'])
+
         elif (action == 'virtual_machine-reset'):
             vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
             vm_object.reset()
@@ -191,6 +196,12 @@ class Remote:
             vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
             NetworkAdapter.create(vm_object, network_object, arguments['mac_address'])
 
+        elif (action == 'network_adapter-delete'):
+            from mcvirt.virtual_machine.network_adapter import NetworkAdapter
+            vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
+            network_adapter_object = NetworkAdapter(arguments['mac_address'], vm_object)
+            network_adapter_object.delete()
+
         elif (action == 'virtual_machine-getState'):
             vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
             return_data = vm_object.getState().value
@@ -231,6 +242,12 @@ class Remote:
                                                   name=arguments['name'],
                                                   ignore_non_existent=ignore_non_existent)
 
+        elif (action == 'virtual_machine-hard_drive-getLogicalVolumePath'):
+            from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
+            hard_drive_config_object = HardDriveFactory.getRemoteConfigObject(mcvirt_instance,
+                                                                              arguments['config'])
+            return_data = hard_drive_config_object._getLogicalVolumePath(arguments['name'])
+
         elif (action == 'virtual_machine-hard_drive-activateLogicalVolume'):
             from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
             hard_drive_config_object = HardDriveFactory.getRemoteConfigObject(mcvirt_instance,
@@ -248,6 +265,24 @@ class Remote:
                                                 name=arguments['name'],
                                                 size=arguments['size'])
 
+        elif (action == 'virtual_machine-hard_drive-extendLogicalVolume'):
+            from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
+            hard_drive_config_object = HardDriveFactory.getRemoteConfigObject(mcvirt_instance,
+                                                                              arguments['config'])
+            hard_drive_class = HardDriveFactory.getClass(hard_drive_config_object._getType())
+            hard_drive_class._extendLogicalVolume(hard_drive_config_object,
+                                                  name=arguments['name'],
+                                                  increase_size=arguments['increase_size'])
+
+        elif (action == 'virtual_machine-hard_drive-reduceLogicalVolume'):
+            from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
+            hard_drive_config_object = HardDriveFactory.getRemoteConfigObject(mcvirt_instance,
+                                                                              arguments['config'])
+            hard_drive_class = HardDriveFactory.getClass(hard_drive_config_object._getType())
+            hard_drive_class._reduceLogicalVolume(hard_drive_config_object,
+                                                  name=arguments['name'],
+                                                  decrease_size=arguments['decrease_size'])
+
         elif (action == 'virtual_machine-hard_drive-drbd-generateDrbdConfig'):
             from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
             hard_drive_config_object = HardDriveFactory.getRemoteConfigObject(mcvirt_instance,
@@ -260,6 +295,15 @@ class Remote:
                                                                               arguments['config'])
             hard_drive_config_object._removeDrbdConfig()
 
+        elif (action == 'virtual_machine-hard_drive-drbd-createReplica'):
+            from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
+            hard_drive_config_object = HardDriveFactory.getRemoteConfigObject(mcvirt_instance,
+                                                                              arguments['config'])
+            hard_drive_class = HardDriveFactory.getClass(hard_drive_config_object._getType())
+            hard_drive_class._createReplica(hard_drive_config_object,
+                                            size=arguments['size'],
+                                            meta_size=arguments['meta_size'])
+
         elif (action == 'virtual_machine-hard_drive-drbd-initialiseMetaData'):
             from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
             hard_drive_config_object = HardDriveFactory.getRemoteConfigObject(mcvirt_instance,
@@ -313,6 +357,12 @@ class Remote:
             hard_drive_object = HardDriveFactory.getObject(vm_object, arguments['disk_id'])
             hard_drive_object._drbdSetSecondary()
 
+        elif (action == 'virtual_machine-hard_drive-drbd-setResyncRate'):
+            from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
+            vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
+            hard_drive_object = HardDriveFactory.getObject(vm_object, arguments['disk_id'])
+            hard_drive_object._setResyncRate(arguments['rate'])
+
         elif (action == 'virtual_machine-hard_drive-drbd-setTwoPrimariesConfig'):
             from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
             vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
@@ -350,6 +400,22 @@ class Remote:
             from mcvirt.node.network import Network
             return_data = Network.getConfig()
 
+        elif (action == 'node-capacity-getLocalCapacity'):
+            from mcvirt.node.capacity import Capacity
+            return_data = Capacity.getLocalCapacity()
+
+        elif (action == 'node-placement-getLocalLoad'):
+            from mcvirt.node.placement import Placement
+            return_data = Placement.getLocalLoad(mcvirt_instance)
+
+        elif (action == 'virtual_machine-migration_history-getLocalRecords'):
+            from mcvirt.virtual_machine.migration_history import MigrationHistory
+            return_data = MigrationHistory.getLocalRecords(arguments['vm_name'])
+
+        elif (action == 'node-getMigrationIpAddress'):
+            from mcvirt.node.node import Node
+            return_data = Node.getMigrationIpAddress()
+
         elif (action == 'node-drbd-isInstalled'):
             from mcvirt.node.drbd import DRBD
             return_data = DRBD.isInstalled()
@@ -362,6 +428,28 @@ class Remote:
             from mcvirt.node.drbd import DRBD
             DRBD.enable(mcvirt_instance, arguments['secret'])
 
+        elif (action == 'node-drbd-supportsDisklessClients'):
+            from mcvirt.node.drbd import DRBD
+            return_data = DRBD.supportsDisklessClients()
+
+        elif (action == 'node-drbd-adjust'):
+            from mcvirt.node.drbd import DRBD
+            DRBD.adjustDRBDConfig(mcvirt_instance, arguments['resource'])
+
+        elif (action == 'node-drbd-reserveAllocation'):
+            from mcvirt.node.drbd import DRBDAllocation
+            DRBDAllocation.reserve(mcvirt_instance, arguments['resource_name'],
+                                   minor=arguments['minor'], port=arguments['port'])
+
+        elif (action == 'node-drbd-releaseAllocation'):
+            from mcvirt.node.drbd import DRBDAllocation
+            DRBDAllocation.release(mcvirt_instance, arguments['resource_name'],
+                                   arguments['minor'], arguments['port'])
+
+        elif (action == 'node-drbd-setAllocationTable'):
+            from mcvirt.node.drbd import DRBDAllocation
+            DRBDAllocation.setTable(arguments['table'])
+
         elif (action == 'virtual_machine-hard_drive-drbd-setSyncState'):
             from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
             vm_object = VirtualMachine(mcvirt_instance, arguments['vm_name'])
@@ -401,6 +489,9 @@ class Remote:
         self.password = password
         self.save_hostkey = save_hostkey
         self.initialise_node = initialise_node
+        # Commands are sent over a single channel, so only one thread may
+        # run a command at a time
+        self.lock = threading.RLock()
 
         self._initialiseKnownHosts()
 
@@ -491,30 +582,36 @@ class Remote:
 
     def runRemoteCommand(self, action, arguments):
         """Prepare and run a remote command on a cluster node"""
-        # Ensure connection is alive
-        if (self.connection is None):
-            self.__connect()
-
-        # Generate a JSON of the command and arguments
-        command_json = json.dumps({'action': action, 'arguments': arguments}, sort_keys=True)
-
-        # Perform the remote command
-        self.stdin.write("%s\n" % command_json)
-        self.stdin.flush()
-        stdout = self.stdout.readline()
-
-        # Attempt to convert stdout to JSON
-        try:
-            # Obtains the first line of output and decode JSON
-            return json.loads(str.strip(str(stdout)))
-        except ValueError:
-            # If the exit code was not 0, close the SSH session and throw an exception
-            stderr = self.stderr.readlines()
-            if (stderr):
-                exit_code = self.stdout.channel.recv_exit_status()
-                self.connection.close()
-                self.connection = None
-                raise RemoteCommandExecutionFailedException(
-                    "Exit Code: %s\nNode: %s\nCommand: %s\nStdout: %s\nStderr: %s" %
-                    (exit_code, self.name, command_json, ''.join(stdout), ''.join(stderr))
-                )
+        with self.lock:
+            # Ensure connection is alive
+            if (self.connection is None):
+                self.__connect()
+
+            # Generate a JSON of the command and arguments
+            command_json = json.dumps({'action': action, 'arguments': arguments}, sort_keys=True)
+
+            # Perform the remote command
+            self.stdin.write("%s\n" % command_json)
+            self.stdin.flush()
+            stdout = self.stdout.readline()
+
+            # Commands that modify DRBD resources change the peer state seen by the local node
+            if ('-drbd-' in action):
+                from mcvirt.node.drbd import DRBDStatus
+                DRBDStatus.invalidate()
+
+            # Attempt to convert stdout to JSON
+            try:
+                # Obtains the first line of output and decode JSON
+                return json.loads(str.strip(str(stdout)))
+            except ValueError:
+                # If the exit code was not 0, close the SSH session and throw an exception
+                stderr = self.stderr.readlines()
+                if (stderr):
+                    exit_code = self.stdout.channel.recv_exit_status()
+                    self.connection.close()
+                    self.connection = None
+                    raise RemoteCommandExecutionFailedException(
+                        "Exit Code: %s\nNode: %s\nCommand: %s\nStdout: %s\nStderr: %s" %
+                        (exit_code, self.name, command_json, ''.join(stdout), ''.join(stderr))
+                    )
@@ -0,0 +1,95 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import threading
+import time
+
+
+class ConcurrentRunner(object):
+    """Performs an operation on each of a number of VMs using a number of threads,
+    limited by the concurrency, recording the result of the operation for each VM.
+    Each VM is described by an entry, containing at least the name of the VM"""
+
+    # Interval (in seconds) between checks for completed operations, so that waiting
+    # for the operations can be interrupted
+    CHECK_INTERVAL = 1
+
+    RESULT_COMPLETED = 'Completed'
+    RESULT_FAILED = 'Failed'
+    RESULT_SKIPPED = 'Skipped'
+
+    # Message reporting a failed operation, given the name of the VM and the error
+    FAILURE_MESSAGE = 'The operation on the VM \'%s\' failed: %s'
+
+    def __init__(self, concurrency):
+        """Sets member variables"""
+        self.concurrency = concurrency
+
+    @staticmethod
+    def _initialiseResult(entry):
+        """Records that the operation has not been performed on the VM of an entry"""
+        entry['result'] = ConcurrentRunner.RESULT_SKIPPED
+        entry['error'] = None
+        entry['duration'] = 0
+        return entry
+
+    def _run(self, pending, function):
+        """Calls the function with each of the pending entries, using a number of
+        threads, limited by the concurrency, recording the result in each entry"""
+        pending = list(pending)
+        pending_lock = threading.Lock()
+        cancelled = threading.Event()
+
+        def worker():
+            while (not cancelled.is_set()):
+                with pending_lock:
+                    if (not pending):
+                        return
+                    entry = pending.pop(0)
+                start_time = time.time()
+                try:
+                    function(entry)
+                    entry['result'] = self.RESULT_COMPLETED
+                except Exception, e:
+                    entry['result'] = self.RESULT_FAILED
+                    entry['error'] = str(e)
+                entry['duration'] = int(time.time() - start_time)
+
+        threads = []
+        for _ in range(min(self.concurrency, len(pending))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            # Wait with a timeout, as waiting indefinitely cannot be interrupted
+            for thread in threads:
+                while (thread.is_alive()):
+                    thread.join(self.CHECK_INTERVAL)
+        except KeyboardInterrupt:
+            # Do not start any further operations, but allow those in progress to complete
+            cancelled.set()
+            for thread in threads:
+                thread.join()
+            raise
+
+    @classmethod
+    def getFailures(cls, results):
+        """Returns messages for the VMs that the operation failed for"""
+        return [cls.FAILURE_MESSAGE % (entry['vm_name'], entry['error'])
+                for entry in results if entry['result'] == cls.RESULT_FAILED]
@@ -22,7 +22,7 @@ import os
 class ConfigFile():
     """Provides operations to obtain and set the MCVirt configuration for a VM"""
 
-    CURRENT_VERSION = 2
+    CURRENT_VERSION = 11
     GIT = '/usr/bin/git'
 
     def __init__(self):
@@ -18,6 +18,7 @@
 
 import sys
 import os
+import socket
 
 sys.path.insert(0, '/usr/lib')
 
@@ -26,25 +27,24 @@ from mcvirt.node.drbd import DRBDSocket
 # Obtain DRBD resource name from argument
 drbd_resource = os.environ['DRBD_RESOURCE']
 
-# Determine if DRBD socket exists
-if (os.path.exists(DRBDSocket.SOCKET_PATH)):
-    import socket
-
-    # Connect to socket and send DRBD resource name to be set as out-of-sync
-    socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-
-    socket.connect(DRBDSocket.SOCKET_PATH)
-    socket.send(drbd_resource)
-    socket.close()
-else:
-    from mcvirt.mcvirt import MCVirt
-    from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
-
-    # Otherwise, create an MCVirt object and update the VM directly
-    mcvirt_instance = MCVirt(obtain_lock=True, initialise_nodes=False)
-    hard_drive_object = HardDriveFactory.getDrbdObjectByResourceName(
-        mcvirt_instance,
-        drbd_resource
-    )
-    hard_drive_object.setSyncState(False, update_remote=False)
-    mcvirt_instance = None
+try:
+    # Send the DRBD resource name to the MCVirt socket, to be set as out-of-sync
+    DRBDSocket.sendResources([drbd_resource])
+except socket.error:
+    # Otherwise, record the resource in the spool. The spool is processed by a
+    # single hook script at a time, using one MCVirt instance, so that a verification
+    # that finds many out-of-sync blocks does not start an MCVirt instance for each event.
+    # If the spool is not processed here, it is processed by the next DRBD verification
+    DRBDSocket.spoolResource(drbd_resource)
+    spool_lock = DRBDSocket.obtainSpoolLock()
+    if (spool_lock):
+        from mcvirt.mcvirt import MCVirt, MCVirtException
+        try:
+            mcvirt_instance = MCVirt(obtain_lock=True, initialise_nodes=False)
+        except MCVirtException:
+            # Another instance of MCVirt is running
+            mcvirt_instance = None
+        if (mcvirt_instance):
+            DRBDSocket.drainSpool(mcvirt_instance)
+            mcvirt_instance = None
+        spool_lock.close()
@@ -32,6 +32,7 @@ class MCVirt(object):
     NODE_STORAGE_DIR = BASE_STORAGE_DIR + '/' + socket.gethostname()
     BASE_VM_STORAGE_DIR = NODE_STORAGE_DIR + '/vm'
     ISO_STORAGE_DIR = NODE_STORAGE_DIR + '/iso'
+    BACKUP_STORAGE_DIR = NODE_STORAGE_DIR + '/backup'
     LOCK_FILE_DIR = '/var/run/lock/mcvirt'
     LOCK_FILE = LOCK_FILE_DIR + '/lock'
 
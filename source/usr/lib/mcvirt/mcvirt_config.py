@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
 
+import json
 import os
 
 from config_file import ConfigFile
@@ -71,12 +72,14 @@ class MCVirtConfig(ConfigFile):
                 'cluster':
                 {
                     'cluster_ip': '',
+                    'migration_ip': '',
                     'nodes': {}
                 },
                 'virtual_machines': [],
                 'networks': {
                     'default': 'virbr0'
                 },
+                'network_interfaces': {},
                 'drbd': NodeDRBD.getDefaultConfig(),
                 'git':
                 {
@@ -137,3 +140,45 @@ class MCVirtConfig(ConfigFile):
                 'commit_name': '',
                 'commit_email': ''
             }
+
+        if (self._getVersion() < 5):
+            # Build the DRBD minor and port allocation table from the DRBD hard
+            # drives in the VM configurations, which are read directly, as the
+            # VM configurations may not have been upgraded yet
+            from node.drbd import DRBDAllocation
+            from virtual_machine.virtual_machine_config import VirtualMachineConfig
+            resources = []
+            for vm_name in config['virtual_machines']:
+                vm_config_path = VirtualMachineConfig.getConfigPath(vm_name)
+                if (not os.path.isfile(vm_config_path)):
+                    continue
+                vm_config_file = open(vm_config_path, 'r')
+                vm_config = json.loads(vm_config_file.read())
+                vm_config_file.close()
+                if (vm_config.get('storage_type') != 'DRBD'):
+                    continue
+                for disk_id, disk_config in vm_config['hard_disks'].items():
+                    resources.append(('mcvirt_vm-%s-disk-%s' % (vm_name, disk_id),
+                                      disk_config.get('drbd_minor'),
+                                      disk_config.get('drbd_port')))
+            config['drbd']['allocation'] = DRBDAllocation.buildTable(resources)
+
+        if (self._getVersion() < 8):
+            # Add the IP address of the network used for live migrations
+            config['cluster']['migration_ip'] = ''
+
+        if (self._getVersion() < 11):
+            # Build the index of the VM network interfaces connected to each network
+            # from the VM configurations, which are read directly, as the VM
+            # configurations may not have been upgraded yet
+            from virtual_machine.virtual_machine_config import VirtualMachineConfig
+            config['network_interfaces'] = {}
+            for vm_name in config['virtual_machines']:
+                vm_config_path = VirtualMachineConfig.getConfigPath(vm_name)
+                if (not os.path.isfile(vm_config_path)):
+                    continue
+                vm_config_file = open(vm_config_path, 'r')
+                vm_config = json.loads(vm_config_file.read())
+                vm_config_file.close()
+                for mac_address, network in vm_config.get('network_interfaces', {}).items():
+                    config['network_interfaces'].setdefault(network, {})[mac_address] = vm_name
@@ -0,0 +1,184 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import re
+import threading
+from texttable import Texttable
+
+from mcvirt.mcvirt import MCVirtException
+from mcvirt.mcvirt_config import MCVirtConfig
+from mcvirt.system import System, MCVirtCommandException
+
+
+class InsufficientStorageSpaceException(MCVirtException):
+    """There is not enough free space in the volume group on one or more nodes"""
+    pass
+
+
+class Capacity(object):
+    """Provides an index of the storage capacity of the nodes in the cluster,
+    used to ensure that there is enough space before storage is created"""
+
+    # Matches the logical volumes created for VM hard drives, as well as their
+    # DRBD meta/raw volumes and backup snapshots
+    LOGICAL_VOLUME_RE = re.compile(r'^mcvirt_vm-(.+)-disk-[0-9]+(-drbd-[a-z]+)?(_snapshot)?$')
+
+    def __init__(self, mcvirt_instance):
+        """Sets member variables"""
+        self.mcvirt_instance = mcvirt_instance
+        self.index = {}
+
+    @staticmethod
+    def getLocalCapacity():
+        """Returns the size and free space of the MCVirt volume group on the
+        local node, along with the space allocated to each VM (all in MB)"""
+        volume_group = MCVirtConfig().getConfig()['vm_storage_vg']
+
+        # Obtain the volume group details and all logical volumes in a single call
+        command_args = ('vgs', '--noheadings', '--nosuffix', '--units', 'm',
+                        '--separator', ':',
+                        '--options', 'vg_size,vg_free,lv_name,lv_size', volume_group)
+        try:
+            (_, command_output, _) = System.runCommand(command_args)
+        except MCVirtCommandException, e:
+            raise MCVirtException('Error whilst obtaining the capacity of volume group %s:\n%s' %
+                                  (volume_group, str(e)))
+
+        capacity = {
+            'volume_group': volume_group,
+            'size': 0,
+            'free': 0,
+            'allocated': 0,
+            'virtual_machines': {}
+        }
+        for line in command_output.strip().split('\n'):
+            if (not line.strip()):
+                continue
+            vg_size, vg_free, lv_name, lv_size = line.strip().split(':')
+            capacity['size'] = int(float(vg_size))
+            capacity['free'] = int(float(vg_free))
+
+            # Logical volumes that are not used by MCVirt are not included
+            lv_name_match = Capacity.LOGICAL_VOLUME_RE.match(lv_name)
+            if (lv_name_match):
+                vm_name = lv_name_match.group(1)
+                lv_size = int(float(lv_size))
+                capacity['allocated'] += lv_size
+                capacity['virtual_machines'][vm_name] = \
+                    capacity['virtual_machines'].get(vm_name, 0) + lv_size
+
+        return capacity
+
+    def refresh(self, nodes=None):
+        """Obtains the capacity of the given nodes (or all nodes), querying
+        the remote nodes in parallel"""
+        from mcvirt.cluster.cluster import Cluster
+        local_hostname = Cluster.getHostname()
+        cluster_instance = Cluster(self.mcvirt_instance)
+        if (nodes is None):
+            nodes = [local_hostname]
+            if (self.mcvirt_instance.initialiseNodes()):
+                nodes += cluster_instance.getNodes()
+
+        threads = []
+        for node in set(nodes):
+            if (node == local_hostname):
+                continue
+            if (node in cluster_instance.getFailedNodes()):
+                self.index[node] = {'error': 'Node is unavailable'}
+                continue
+
+            # Obtain the remote node object before starting the thread, as the
+            # remote node objects are cached on the MCVirt instance
+            remote_object = cluster_instance.getRemoteNode(node)
+
+            def getRemoteCapacity(node, remote_object):
+                try:
+                    self.index[node] = remote_object.runRemoteCommand(
+                        'node-capacity-getLocalCapacity', {})
+                except Exception, e:
+                    self.index[node] = {'error': str(e)}
+
+            thread = threading.Thread(target=getRemoteCapacity, args=(node, remote_object))
+            thread.start()
+            threads.append(thread)
+
+        if (local_hostname in nodes):
+            try:
+                self.index[local_hostname] = Capacity.getLocalCapacity()
+            except MCVirtException, e:
+                self.index[local_hostname] = {'error': str(e)}
+
+        for thread in threads:
+            thread.join()
+
+        return self.index
+
+    def ensureFreeSpace(self, required_space):
+        """Ensures that each node has the required amount of free space,
+        given a dict of nodes and the space required on each (in MB). An
+        exception, describing each of the unsuitable nodes, is raised if not"""
+        required_space = dict((node, size) for node, size in required_space.items() if size)
+        if (not required_space):
+            return
+
+        self.refresh(required_space.keys())
+        failures = []
+        for node in sorted(required_space):
+            capacity = self.index[node]
+            if ('error' in capacity):
+                failures.append('%s: could not determine free space (%s)' %
+                                (node, capacity['error']))
+            elif (capacity['free'] < required_space[node]):
+                failures.append('%s: %sMB required, %sMB free in volume group %s' %
+                                (node, required_space[node], capacity['free'],
+                                 capacity['volume_group']))
+
+        if (failures):
+            raise InsufficientStorageSpaceException(
+                'There is not enough storage space available:\n  %s' % '\n  '.join(failures)
+            )
+
+    def getCapacityTable(self):
+        """Returns a table of the capacity of each of the nodes, followed by a table
+        of the space allocated to each VM"""
+        self.refresh()
+
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('Node', 'Volume Group', 'Size (MB)', 'VM Allocated (MB)', 'Free (MB)',
+                      'Free (%)'))
+        for node in sorted(self.index):
+            capacity = self.index[node]
+            if ('error' in capacity):
+                table.add_row((node, '-', '-', '-', '-', 'Unavailable'))
+                continue
+            free_percentage = 0
+            if (capacity['size']):
+                free_percentage = (capacity['free'] * 100) / capacity['size']
+            table.add_row((node, capacity['volume_group'], capacity['size'],
+                           capacity['allocated'], capacity['free'], free_percentage))
+        node_table = table.draw()
+
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('VM', 'Node', 'Allocated (MB)'))
+        for node in sorted(self.index):
+            virtual_machines = self.index[node].get('virtual_machines', {})
+            for vm_name in sorted(virtual_machines):
+                table.add_row((vm_name, node, virtual_machines[vm_name]))
+        return node_table + "\n" + table.draw()
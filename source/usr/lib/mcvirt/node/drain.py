@@ -0,0 +1,252 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import json
+import os
+import threading
+from texttable import Texttable
+
+from mcvirt.mcvirt import MCVirt, MCVirtException
+from mcvirt.auth import Auth
+from mcvirt.concurrent_runner import ConcurrentRunner
+from mcvirt.cluster.cluster import Cluster
+from mcvirt.virtual_machine.virtual_machine import VirtualMachine, PowerStates
+
+
+class InvalidDrainOptionException(MCVirtException):
+    """The options given for draining the node are not valid"""
+    pass
+
+
+class NodeNotDrainedException(MCVirtException):
+    """The node has not been drained, so there are no VMs to return to it"""
+    pass
+
+
+class NodeDrainFailedException(MCVirtException):
+    """One or more VMs could not be moved whilst draining or undraining the node"""
+    pass
+
+
+class NodeDrain(ConcurrentRunner):
+    """Moves the VMs registered on the local node to other nodes, so that maintenance
+    can be performed on the node, running a number of migrations concurrently. The
+    original placement of the VMs is recorded, so that they can be returned afterwards"""
+
+    STATE_FILE = MCVirt.NODE_STORAGE_DIR + '/drain.json'
+    DEFAULT_CONCURRENCY = 2
+
+    ACTION_ONLINE_MIGRATE = 'Online migrate'
+    ACTION_OFFLINE_MIGRATE = 'Offline migrate'
+    ACTION_NONE = 'Cannot be moved'
+
+    FAILURE_MESSAGE = 'The VM \'%s\' could not be moved: %s'
+
+    def __init__(self, mcvirt_instance, concurrency=None, bandwidth=None):
+        """Sets member variables and validates the options"""
+        super(NodeDrain, self).__init__(
+            self.DEFAULT_CONCURRENCY if concurrency is None else concurrency
+        )
+        self.mcvirt_instance = mcvirt_instance
+        if (self.concurrency < 1):
+            raise InvalidDrainOptionException('At least one VM must be able to be moved at a time')
+        self.bandwidth = bandwidth
+        if (self.bandwidth is not None and self.bandwidth < 1):
+            raise InvalidDrainOptionException('The migration bandwidth must be at least 1MiB/s')
+
+        # Protects the recorded state, which is updated by each move
+        self.lock = threading.Lock()
+
+    def getMigrationBandwidth(self, vm_object):
+        """Returns the bandwidth (in MiB/s) of an online migration of a VM, so that the
+        concurrent migrations do not exceed the bandwidth of the migration link"""
+        vm_bandwidth = vm_object.getMigrationTuningConfig().get('bandwidth')
+        if (self.bandwidth is None):
+            return vm_bandwidth
+        bandwidth = max(1, self.bandwidth / self.concurrency)
+        return min(bandwidth, vm_bandwidth) if vm_bandwidth else bandwidth
+
+    def _loadState(self):
+        """Returns the original placement of the VMs that have been moved from the node"""
+        if (not os.path.isfile(self.STATE_FILE)):
+            return {}
+        state_file = open(self.STATE_FILE, 'r')
+        state = json.loads(state_file.read())
+        state_file.close()
+        return state
+
+    def _saveState(self, state):
+        """Records the original placement of the VMs that have been moved from the node"""
+        if (not state):
+            if (os.path.isfile(self.STATE_FILE)):
+                os.remove(self.STATE_FILE)
+            return
+        state_file = open(self.STATE_FILE, 'w')
+        state_file.write(json.dumps(state, indent=2, separators=(',', ': ')))
+        state_file.close()
+
+    def getPlan(self):
+        """Returns the action that is performed for each of the VMs registered on the
+        local node to move it to another node"""
+        local_hostname = Cluster.getHostname()
+        failed_nodes = Cluster(self.mcvirt_instance).getFailedNodes()
+        plan = []
+        for vm_name in sorted(VirtualMachine.getAllVms(self.mcvirt_instance,
+                                                       node=local_hostname)):
+            vm_object = VirtualMachine(self.mcvirt_instance, vm_name)
+            running = (vm_object.getState() is PowerStates.RUNNING)
+            entry = {
+                'vm_name': vm_name,
+                'running': running,
+                'action': self.ACTION_NONE,
+                'destination': None,
+                'reason': None
+            }
+            plan.append(entry)
+
+            if (vm_object.getStorageType() != 'DRBD'):
+                entry['reason'] = 'VMs using local storage must be migrated individually'
+                continue
+
+            # Prefer the node holding the other replica of the storage over diskless nodes
+            destinations = [node for node in (vm_object.getAvailableNodes() +
+                                              vm_object.getDisklessNodes())
+                            if node != local_hostname and node not in failed_nodes]
+            if (not destinations):
+                entry['reason'] = 'No other node is available to host the VM'
+                continue
+
+            entry['destination'] = destinations[0]
+            entry['action'] = (self.ACTION_ONLINE_MIGRATE if running
+                               else self.ACTION_OFFLINE_MIGRATE)
+
+        return plan
+
+    def drain(self, progress_callback=None):
+        """Moves each of the VMs registered on the local node to another node,
+        returning the plan, with the result of each move"""
+        self.mcvirt_instance.getAuthObject().assertPermission(Auth.PERMISSIONS.MIGRATE_VM)
+        plan = self.getPlan()
+        state = self._loadState()
+        local_hostname = Cluster.getHostname()
+
+        def moveVirtualMachine(entry):
+            vm_object = VirtualMachine(self.mcvirt_instance, entry['vm_name'])
+            if (entry['action'] == self.ACTION_ONLINE_MIGRATE):
+                bandwidth = self.getMigrationBandwidth(vm_object)
+                vm_object.onlineMigrate(
+                    entry['destination'],
+                    tuning_config={'bandwidth': bandwidth} if bandwidth else None,
+                    progress_callback=self._getProgressCallback(entry, progress_callback)
+                )
+            else:
+                vm_object.offlineMigrate(entry['destination'])
+
+            # Record the original placement of the VM, so that it can be returned
+            with self.lock:
+                state[entry['vm_name']] = {
+                    'node': local_hostname,
+                    'destination': entry['destination'],
+                    'running': entry['running']
+                }
+                self._saveState(state)
+
+        self._connectNodes([entry['destination'] for entry in plan
+                            if entry['action'] != self.ACTION_NONE])
+        self._runPlan(plan, moveVirtualMachine)
+        return plan
+
+    def undrain(self, progress_callback=None):
+        """Returns the VMs that were moved from the local node when it was drained,
+        returning the plan, with the result of each move"""
+        self.mcvirt_instance.getAuthObject().assertPermission(Auth.PERMISSIONS.MIGRATE_VM)
+        state = self._loadState()
+        if (not state):
+            raise NodeNotDrainedException('No VMs have been moved from the node by a drain')
+
+        plan = []
+        for vm_name in sorted(state):
+            plan.append({
+                'vm_name': vm_name,
+                'running': state[vm_name]['running'],
+                'action': None,
+                'destination': Cluster.getHostname(),
+                'reason': None
+            })
+
+        def returnVirtualMachine(entry):
+            vm_name = entry['vm_name']
+            if (vm_name not in VirtualMachine.getAllVms(self.mcvirt_instance)):
+                entry['reason'] = 'The VM no longer exists'
+            else:
+                vm_object = VirtualMachine(self.mcvirt_instance, vm_name)
+                if (vm_object.isRegisteredLocally()):
+                    entry['reason'] = 'The VM is already registered on the node'
+                elif (vm_object.getState() is PowerStates.RUNNING):
+                    # Running VMs are migrated online, so that they are not stopped
+                    entry['action'] = self.ACTION_ONLINE_MIGRATE
+                    bandwidth = self.getMigrationBandwidth(vm_object)
+                    vm_object.onlineMigrateToLocalNode(
+                        tuning_config={'bandwidth': bandwidth} if bandwidth else None,
+                        progress_callback=self._getProgressCallback(entry, progress_callback)
+                    )
+                else:
+                    entry['action'] = self.ACTION_OFFLINE_MIGRATE
+                    vm_object.offlineMigrateToLocalNode()
+
+            # The VM has been returned, or can no longer be returned, to the node
+            with self.lock:
+                del state[vm_name]
+                self._saveState(state)
+
+        self._connectNodes([state[vm_name]['destination'] for vm_name in state])
+        self._runPlan(plan, returnVirtualMachine)
+        return plan
+
+    def _getProgressCallback(self, entry, progress_callback):
+        """Returns a function that reports the progress of the migration of a VM"""
+        if (progress_callback is None):
+            return None
+        return lambda progress: progress_callback('%s: %s' % (entry['vm_name'], progress))
+
+    def _connectNodes(self, nodes):
+        """Obtains the connections to the given nodes before the moves are started,
+        as the connections are cached on the MCVirt instance"""
+        cluster_instance = Cluster(self.mcvirt_instance)
+        for node in set(nodes):
+            self.mcvirt_instance.getRemoteLibvirtConnection(cluster_instance.getRemoteNode(node))
+
+    def _runPlan(self, plan, move_function):
+        """Performs the moves in the plan concurrently, recording the result
+        of each move in the plan"""
+        for entry in plan:
+            ConcurrentRunner._initialiseResult(entry)
+        self._run([entry for entry in plan if entry['action'] != self.ACTION_NONE],
+                  move_function)
+
+    @staticmethod
+    def getSummary(plan):
+        """Returns a report of the actions performed for each VM"""
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('VM', 'Action', 'Destination', 'Result', 'Duration'))
+        for entry in plan:
+            table.add_row((entry['vm_name'], entry['action'] or '-',
+                           entry['destination'] or '-',
+                           entry['reason'] or entry['result'],
+                           '%is' % entry['duration']))
+        return table.draw()
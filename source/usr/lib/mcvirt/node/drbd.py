@@ -16,14 +16,21 @@
 # along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
 
 from Cheetah.Template import Template
+import atexit
+import collections
+import fcntl
+import json
 import os
+import re
 import socket
-import thread
+import subprocess
+import threading
+import time
 from texttable import Texttable
 
 from mcvirt.mcvirt import MCVirt, MCVirtException
 from mcvirt.mcvirt_config import MCVirtConfig
-from mcvirt.system import System
+from mcvirt.system import System, MCVirtCommandException
 from mcvirt.auth import Auth
 
 
@@ -42,6 +49,505 @@ class DRBDNotEnabledOnNode(MCVirtException):
     pass
 
 
+class DRBDResourceNotConfiguredException(MCVirtException):
+    """The DRBD resource is not configured on the node"""
+    pass
+
+
+class DRBDStateTimeoutException(MCVirtException):
+    """The DRBD resource did not reach the required state within the timeout"""
+    pass
+
+
+class DRBDDisklessClientsNotSupportedException(MCVirtException):
+    """The version of DRBD on the node does not support diskless clients"""
+    pass
+
+
+class DRBDAllocationConflictException(MCVirtException):
+    """The DRBD minor or port has already been allocated to another resource"""
+    pass
+
+
+class DRBDStatus(object):
+    """Obtains the status of all DRBD resources on the node using a single command,
+    rather than running drbdadm for each state of each resource"""
+
+    PROC_DRBD = '/proc/drbd'
+    # Number of seconds that the status is cached for, so that states that
+    # DRBD changes itself, such as the completion of a sync, are picked up
+    CACHE_TIMEOUT = 2
+    # Minimum and maximum number of seconds between the samples used to estimate
+    # the speed of a sync, where the speed is not reported by DRBD
+    SPEED_SAMPLE_INTERVAL = 1
+    SPEED_SAMPLE_MAX_AGE = 60
+
+    # Maps DRBD 9 style connection states to the DRBD 8.4 connection states
+    CONNECTION_STATES = {
+        'Connecting': 'WFConnection'
+    }
+
+    # The status is shared by all objects in the MCVirt command
+    resources = None
+    obtained_time = None
+    # The status previously obtained, which is used to estimate sync speeds
+    previous_resources = None
+    previous_time = None
+
+    @staticmethod
+    def invalidate():
+        """Removes the cached status, after the state of a resource has been changed,
+        so that the status is obtained again when next used"""
+        DRBDStatus.resources = None
+
+    @staticmethod
+    def getAllResources():
+        """Returns the status of each of the DRBD resources on the node, indexed by minor"""
+        if (DRBDStatus.resources is None or
+                (time.time() - DRBDStatus.obtained_time) > DRBDStatus.CACHE_TIMEOUT):
+            try:
+                resources = DRBDStatus._obtainEvents2Status()
+            except (MCVirtCommandException, OSError):
+                resources = DRBDStatus._obtainProcStatus()
+            obtained_time = time.time()
+
+            # Estimate the speed of syncs from the previous status, retaining the
+            # previous status until enough time has passed to provide a useful sample
+            if (DRBDStatus.previous_resources is not None):
+                elapsed = obtained_time - DRBDStatus.previous_time
+                if (elapsed <= DRBDStatus.SPEED_SAMPLE_MAX_AGE):
+                    DRBDStatus._estimateSyncProgress(resources, DRBDStatus.previous_resources,
+                                                     elapsed)
+            if (DRBDStatus.previous_resources is None or
+                    (obtained_time - DRBDStatus.previous_time) >=
+                    DRBDStatus.SPEED_SAMPLE_INTERVAL):
+                DRBDStatus.previous_resources = resources
+                DRBDStatus.previous_time = obtained_time
+
+            DRBDStatus.resources = resources
+            DRBDStatus.obtained_time = obtained_time
+        return DRBDStatus.resources
+
+    @staticmethod
+    def isSyncing(status):
+        """Returns whether a sync or verification of a resource is in progress"""
+        return status['sync_remaining'] is not None
+
+    @staticmethod
+    def _estimateSyncProgress(resources, previous_resources, elapsed):
+        """Calculates the speed and ETA of syncs that DRBD has not provided, from the
+        amount of data that has been synced since the previous status was obtained"""
+        for minor, status in resources.items():
+            if (not DRBDStatus.isSyncing(status)):
+                continue
+            previous_status = previous_resources.get(minor)
+            if (status['sync_speed'] is None and elapsed > 0 and
+                    previous_status is not None and
+                    previous_status['sync_remaining'] is not None and
+                    previous_status['connection_state'] == status['connection_state']):
+                synced = previous_status['sync_remaining'] - status['sync_remaining']
+                if (synced > 0):
+                    status['sync_speed'] = int(synced / elapsed)
+            if (status['sync_eta'] is None and status['sync_speed']):
+                status['sync_eta'] = int(status['sync_remaining'] / status['sync_speed'])
+
+    @staticmethod
+    def getResource(minor, resource_name=None):
+        """Returns the status of a DRBD resource, given its minor"""
+        resources = DRBDStatus.getAllResources()
+        if (int(minor) not in resources):
+            raise DRBDResourceNotConfiguredException(
+                'DRBD resource %s is not configured on this node' % (resource_name or minor)
+            )
+        return resources[int(minor)]
+
+    @staticmethod
+    def _getDefaultStatus(minor, resource_name=None):
+        """Returns the status of a resource, before any states have been determined"""
+        return {
+            'resource': resource_name,
+            'minor': minor,
+            'role': ['Unknown', 'Unknown'],
+            'connection_state': 'StandAlone',
+            'disk_state': ['Diskless', 'DUnknown'],
+            'out_of_sync': None,
+            'sync_percent': None,
+            # The state of each of the peers of the resource, indexed by node ID,
+            # which is only available for DRBD 9
+            'peers': {},
+            # The progress of a sync or verification: the amount of data remaining
+            # in KiB, the speed in KiB/s and the estimated time remaining in seconds
+            'sync_remaining': None,
+            'sync_speed': None,
+            'sync_eta': None
+        }
+
+    @staticmethod
+    def _obtainEvents2Status():
+        """Obtains the status of all resources from a single drbdsetup events2 call"""
+        _, stdout, _ = System.runCommand([DRBD.DRBDSETUP, 'events2', '--now',
+                                          '--statistics', 'all'])
+        events2_state = DRBDStatus._getEmptyEvents2State()
+        for line in stdout.split('\n'):
+            DRBDStatus._parseEvents2Line(events2_state, line)
+        return DRBDStatus._buildEvents2Status(events2_state)
+
+    @staticmethod
+    def _getEmptyEvents2State():
+        """Returns the objects used to record the state reported by drbdsetup events2"""
+        return {
+            'resources': {},
+            'connections': {},
+            'devices': {},
+            'peer_devices': {}
+        }
+
+    @staticmethod
+    def _parseEvents2Line(events2_state, line):
+        """Updates the recorded state with a line of drbdsetup events2 output. Returns
+        the type of event, object and the attributes of the line, or None if the line
+        does not describe an object"""
+        fields = line.strip().split(' ')
+        if (len(fields) < 3):
+            return None
+        event_type, object_type = fields[0], fields[1]
+        attributes = dict(field.split(':', 1) for field in fields[2:] if ':' in field)
+        resource_name = attributes.get('name')
+        volume_key = (resource_name, attributes.get('volume'))
+        # DRBD 9 resources may have multiple peers, which are identified by their node ID
+        peer_node_id = attributes.get('peer-node-id')
+        object_keys = {
+            'resource': ('resources', resource_name),
+            'connection': ('connections', (resource_name, peer_node_id)),
+            'device': ('devices', volume_key),
+            'peer-device': ('peer_devices', volume_key + (peer_node_id,))
+        }
+        if (object_type in object_keys):
+            object_dict, key = object_keys[object_type]
+            if (event_type == 'destroy'):
+                events2_state[object_dict].pop(key, None)
+            elif (event_type in ['exists', 'create', 'change']):
+                # Change events only contain the attributes that have changed
+                events2_state[object_dict].setdefault(key, {}).update(attributes)
+        return (event_type, object_type, attributes)
+
+    @staticmethod
+    def _buildEvents2Status(events2_state):
+        """Returns the status of each resource, indexed by minor, from the state
+        recorded from drbdsetup events2"""
+        resources = {}
+        for volume_key, device in events2_state['devices'].items():
+            if ('minor' not in device):
+                continue
+            resource_name = volume_key[0]
+            minor = int(device['minor'])
+            status = DRBDStatus._getDefaultStatus(minor, resource_name)
+            status['role'][0] = events2_state['resources'].get(resource_name,
+                                                               {}).get('role', 'Unknown')
+            status['disk_state'][0] = device.get('disk', 'Diskless')
+
+            # Record the state of each of the peers of the resource. The remote state
+            # of the resource is that of the peer holding a replica of the data, rather
+            # than any DRBD 9 diskless clients
+            peer_node_ids = sorted([key[1] for key in events2_state['connections']
+                                    if key[0] == resource_name],
+                                   key=lambda peer_node_id: int(peer_node_id or 0))
+            replica_node_id = peer_node_ids[0] if peer_node_ids else None
+            for peer_node_id in reversed(peer_node_ids):
+                connection = events2_state['connections'][(resource_name, peer_node_id)]
+                peer_device = events2_state['peer_devices'].get(volume_key + (peer_node_id,), {})
+                status['peers'][peer_node_id] = {
+                    'connection_state': DRBDStatus._getPeerConnectionState(connection,
+                                                                           peer_device),
+                    'role': connection.get('role', 'Unknown'),
+                    'disk_state': peer_device.get('peer-disk', 'DUnknown')
+                }
+                if (status['peers'][peer_node_id]['disk_state'] != 'Diskless'):
+                    replica_node_id = peer_node_id
+
+            connection = events2_state['connections'].get((resource_name, replica_node_id), {})
+            peer_device = events2_state['peer_devices'].get(volume_key + (replica_node_id,), {})
+            replication_state = peer_device.get('replication', 'Off')
+            status['connection_state'] = DRBDStatus._getPeerConnectionState(connection,
+                                                                            peer_device)
+            status['role'][1] = connection.get('role', 'Unknown')
+            status['disk_state'][1] = peer_device.get('peer-disk', 'DUnknown')
+            if ('out-of-sync' in peer_device):
+                status['out_of_sync'] = int(peer_device['out-of-sync'])
+            if ('done' in peer_device):
+                status['sync_percent'] = float(peer_device['done'])
+                if (replication_state.startswith('Verify')):
+                    # The out-of-sync count of a verification is the amount of data
+                    # found to differ, so the data remaining is determined from the size
+                    if ('size' in device):
+                        status['sync_remaining'] = int(
+                            int(device['size']) * (100 - status['sync_percent']) / 100
+                        )
+                elif (status['out_of_sync'] is not None):
+                    status['sync_remaining'] = status['out_of_sync']
+            resources[minor] = status
+        return resources
+
+    @staticmethod
+    def _getPeerConnectionState(connection, peer_device):
+        """Returns the DRBD 8.4 style connection state of a peer of a resource"""
+        connection_state = connection.get('connection', 'StandAlone')
+        replication_state = peer_device.get('replication', 'Off')
+        if (connection_state == 'Connected' and
+                replication_state not in ['Off', 'Established']):
+            # Whilst connected, the replication state provides the DRBD 8.4
+            # connection state for syncs and verifications
+            connection_state = replication_state
+        return DRBDStatus.CONNECTION_STATES.get(connection_state, connection_state)
+
+    @staticmethod
+    def _obtainProcStatus():
+        """Obtains the status of all resources from /proc/drbd, as provided by DRBD 8.4"""
+        resources = {}
+        with open(DRBDStatus.PROC_DRBD, 'r') as proc_fh:
+            proc_lines = proc_fh.readlines()
+
+        status = None
+        for line in proc_lines:
+            resource_match = re.match(r'^\s*([0-9]+): cs:(\S+)(.*)$', line)
+            if (resource_match):
+                minor = int(resource_match.group(1))
+                status = DRBDStatus._getDefaultStatus(minor)
+                status['connection_state'] = resource_match.group(2)
+                attributes = dict(field.split(':', 1)
+                                  for field in resource_match.group(3).split() if ':' in field)
+                if ('ro' in attributes):
+                    status['role'] = attributes['ro'].split('/')
+                if ('ds' in attributes):
+                    status['disk_state'] = attributes['ds'].split('/')
+                resources[minor] = status
+                continue
+            if (status is None):
+                continue
+
+            # Statistics and sync progress are displayed below the resource
+            out_of_sync_match = re.search(r'\boos:([0-9]+)', line)
+            if (out_of_sync_match):
+                status['out_of_sync'] = int(out_of_sync_match.group(1))
+            sync_match = re.search(
+                r"(sync'ed|verified):\s*([0-9.]+)%(\s*\(([0-9]+)/[0-9]+\)M)?", line
+            )
+            if (sync_match):
+                status['sync_percent'] = float(sync_match.group(2))
+                # The data remaining is displayed in MiB
+                if (sync_match.group(4)):
+                    status['sync_remaining'] = int(sync_match.group(4)) * 1024
+                elif (sync_match.group(1) == "sync'ed" and status['out_of_sync'] is not None):
+                    status['sync_remaining'] = status['out_of_sync']
+            finish_match = re.search(r'finish:\s*([0-9]+):([0-9]+):([0-9]+)', line)
+            if (finish_match):
+                hours, minutes, seconds = [int(value) for value in finish_match.groups()]
+                status['sync_eta'] = (hours * 3600) + (minutes * 60) + seconds
+            speed_match = re.search(r'speed:\s*([0-9,]+)', line)
+            if (speed_match):
+                status['sync_speed'] = int(speed_match.group(1).replace(',', ''))
+
+        # Resources that have not been brought up are not included
+        return dict((minor, status) for minor, status in resources.items()
+                    if status['connection_state'] != 'Unconfigured')
+
+
+class DRBDMonitor(object):
+    """Monitors the state of all DRBD resources on the node, using the drbdsetup
+    events2 stream, allowing callers to wait for a resource to reach a state,
+    rather than polling the state of the resource"""
+
+    # Interval used to poll the DRBD status, if the events2 stream is not available
+    POLL_INTERVAL = 0.5
+    # Time to wait for drbdsetup to report the initial state of the resources
+    INITIAL_STATE_TIMEOUT = 10
+    # Number of state changes retained, so that transitions that occur between
+    # a caller performing an action and waiting for the result are not missed
+    HISTORY_SIZE = 1000
+
+    instance = None
+
+    @staticmethod
+    def getInstance():
+        """Returns the monitor for the node, starting it if it is not already running"""
+        if (DRBDMonitor.instance is None):
+            DRBDMonitor.instance = DRBDMonitor()
+            DRBDMonitor.instance.start()
+        return DRBDMonitor.instance
+
+    def __init__(self):
+        """Sets member variables"""
+        self.condition = threading.Condition()
+        self.events2_state = DRBDStatus._getEmptyEvents2State()
+        self.resources = {}
+        self.event_id = 0
+        self.history = collections.deque(maxlen=self.HISTORY_SIZE)
+        self.process = None
+        self.streaming = False
+        self.initialised = False
+
+    def start(self):
+        """Starts the drbdsetup events2 process and the thread that reads its events"""
+        try:
+            self.process = subprocess.Popen([DRBD.DRBDSETUP, 'events2', '--statistics', 'all'],
+                                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            # If drbdsetup cannot be run, callers fall back to polling the status
+            self.process = None
+            return
+
+        self.streaming = True
+        atexit.register(self.stop)
+        reader_thread = threading.Thread(target=self._readEvents)
+        reader_thread.daemon = True
+        reader_thread.start()
+
+        # Wait for drbdsetup to report the existing state of all resources
+        deadline = time.time() + self.INITIAL_STATE_TIMEOUT
+        with self.condition:
+            while (self.streaming and not self.initialised and time.time() < deadline):
+                self.condition.wait(deadline - time.time())
+            if (not self.initialised):
+                self.streaming = False
+
+    def stop(self):
+        """Stops the drbdsetup events2 process"""
+        self.streaming = False
+        if (self.process is not None and self.process.poll() is None):
+            try:
+                self.process.terminate()
+            except OSError:
+                pass
+
+    def _readEvents(self):
+        """Reads events from drbdsetup, updating the state of the resources and
+        notifying any callers that are waiting for a state"""
+        for line in iter(self.process.stdout.readline, ''):
+            with self.condition:
+                if (line.strip() == 'exists -'):
+                    self.initialised = True
+                    self.resources = DRBDStatus._buildEvents2Status(self.events2_state)
+                    self.condition.notify_all()
+                    continue
+                event = DRBDStatus._parseEvents2Line(self.events2_state, line)
+                if (event is None):
+                    continue
+                event_type, object_type, attributes = event
+
+                self.resources = DRBDStatus._buildEvents2Status(self.events2_state)
+                self.event_id += 1
+
+                # Record the new state of the resources that the event relates to
+                for minor, status in self.resources.items():
+                    if (status['resource'] == attributes.get('name')):
+                        self.history.append((self.event_id, minor, status, None))
+
+                # Record the completion of handlers, such as the out-of-sync handler
+                if (event_type == 'response' and object_type == 'helper' and
+                        'minor' in attributes):
+                    self.history.append((self.event_id, int(attributes['minor']), None,
+                                         attributes.get('helper')))
+                self.condition.notify_all()
+
+        # The events stream has ended, so waiting callers must fall back to polling
+        with self.condition:
+            self.streaming = False
+            self.condition.notify_all()
+
+    def getEventId(self):
+        """Returns the ID of the latest event, which can be passed to the wait methods
+        to only consider states that occur after this point"""
+        with self.condition:
+            return self.event_id
+
+    def _getCurrentStatus(self, minor):
+        """Returns the current status of a resource, or None if it is not configured"""
+        if (self.streaming):
+            return self.resources.get(minor)
+        DRBDStatus.invalidate()
+        return DRBDStatus.getAllResources().get(minor)
+
+    def waitForState(self, minor, condition_function, timeout=None, since=None):
+        """Waits for the resource with the given minor to reach a state, for which
+        condition_function returns True when given the status of the resource. If an event
+        ID is given, only states that have been reached after the event are considered.
+        Returns the status of the resource, or raises an exception after the timeout"""
+        minor = int(minor)
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while True:
+                if (since is not None and self.streaming):
+                    statuses = [status for event_id, event_minor, status, _ in self.history
+                                if (event_id > since and event_minor == minor and
+                                    status is not None)]
+                else:
+                    statuses = [self._getCurrentStatus(minor)]
+
+                for status in statuses:
+                    if (status is not None and condition_function(status)):
+                        return status
+
+                wait_time = None if deadline is None else deadline - time.time()
+                if (wait_time is not None and wait_time <= 0):
+                    raise DRBDStateTimeoutException(
+                        'DRBD resource with minor %s did not reach the required state'
+                        ' within %s seconds' % (minor, timeout)
+                    )
+                if (not self.streaming):
+                    wait_time = (self.POLL_INTERVAL if wait_time is None else
+                                 min(wait_time, self.POLL_INTERVAL))
+                self.condition.wait(wait_time)
+
+    def waitForChange(self, minor, since, timeout):
+        """Waits for any change to the state of a resource after the given event ID.
+        Returns whether a change occurred within the timeout"""
+        if (not self.streaming):
+            # Changes cannot be detected without the events stream, so wait for the timeout
+            time.sleep(timeout)
+            return False
+        try:
+            self.waitForState(minor, lambda status: True, timeout=timeout, since=since)
+            return True
+        except DRBDStateTimeoutException:
+            return False
+
+    def waitForEvent(self, since, timeout):
+        """Waits for an event for any resource after the given event ID.
+        Returns whether an event occurred within the timeout"""
+        if (not self.streaming):
+            # Events cannot be detected without the events stream, so wait for
+            # the poll interval, allowing the caller to check the status
+            time.sleep(min(timeout, self.POLL_INTERVAL))
+            return False
+        deadline = time.time() + timeout
+        with self.condition:
+            while (self.streaming and self.event_id <= since):
+                wait_time = deadline - time.time()
+                if (wait_time <= 0):
+                    return False
+                self.condition.wait(wait_time)
+            return self.event_id > since
+
+    def waitForHelper(self, minor, helper, since, timeout):
+        """Waits for DRBD to complete running a handler for a resource after the
+        given event ID. Returns whether the handler completed within the timeout"""
+        if (not self.streaming):
+            # Handlers cannot be detected without the events stream, so wait for the timeout
+            time.sleep(timeout)
+            return False
+        minor = int(minor)
+        deadline = time.time() + timeout
+        with self.condition:
+            while (self.streaming):
+                for event_id, event_minor, _, event_helper in self.history:
+                    if (event_id > since and event_minor == minor and event_helper == helper):
+                        return True
+                if (time.time() >= deadline):
+                    return False
+                self.condition.wait(deadline - time.time())
+        return False
+
+
 class DRBD:
     """Performs configuration of DRBD on the node"""
 
@@ -49,9 +555,13 @@ class DRBD:
     GLOBAL_CONFIG = CONFIG_DIRECTORY + '/global_common.conf'
     GLOBAL_CONFIG_TEMPLATE = MCVirt.TEMPLATE_DIR + '/drbd_global.conf'
     DRBDADM = '/sbin/drbdadm'
+    DRBDSETUP = '/sbin/drbdsetup'
     INITIAL_PORT = 7789
     INITIAL_MINOR_ID = 1
     CLUSTER_SIZE = 2
+    # Version of DRBD required for diskless clients, which access the data
+    # of a DRBD resource over the network
+    DISKLESS_CLIENT_VERSION = (9, 0)
 
     @staticmethod
     def isEnabled():
@@ -83,6 +593,44 @@ class DRBD:
             raise DRBDNotInstalledException('drbdadm not found' +
                                             ' (Is the drbd8-utils package installed?)')
 
+    @staticmethod
+    def getVersion():
+        """Returns the version of the DRBD kernel module, as a tuple of the major
+        and minor version, or None if the module is not loaded"""
+        try:
+            with open(DRBDStatus.PROC_DRBD, 'r') as proc_fh:
+                version_line = proc_fh.readline()
+        except IOError:
+            return None
+        version_match = re.match(r'^version:\s*([0-9]+)\.([0-9]+)', version_line)
+        if (not version_match):
+            return None
+        return (int(version_match.group(1)), int(version_match.group(2)))
+
+    @staticmethod
+    def supportsDisklessClients():
+        """Determines whether the version of DRBD on the node supports diskless clients"""
+        version = DRBD.getVersion()
+        return (version is not None and version >= DRBD.DISKLESS_CLIENT_VERSION)
+
+    @staticmethod
+    def ensureDisklessClientsSupported(mcvirt_instance, nodes):
+        """Ensures that the given nodes support DRBD diskless clients"""
+        from mcvirt.cluster.cluster import Cluster
+        cluster_instance = Cluster(mcvirt_instance)
+        for node in nodes:
+            if (node == Cluster.getHostname()):
+                supported = DRBD.supportsDisklessClients()
+            else:
+                supported = cluster_instance.getRemoteNode(node).runRemoteCommand(
+                    'node-drbd-supportsDisklessClients', {}
+                )
+            if (not supported):
+                raise DRBDDisklessClientsNotSupportedException(
+                    'DRBD %s.%s or later is required on %s to use diskless clients' %
+                    (DRBD.DISKLESS_CLIENT_VERSION + (node,))
+                )
+
     @staticmethod
     def enable(mcvirt_instance, secret=None):
         """Ensures the machine is suitable to run DRBD"""
@@ -133,7 +681,8 @@ class DRBD:
                 'enabled': 0,
                 'secret': '',
                 'sync_rate': '10M',
-                'protocol': 'C'
+                'protocol': 'C',
+                'allocation': DRBDAllocation.getEmptyTable()
             }
         return default_config
 
@@ -174,8 +723,10 @@ class DRBD:
     @staticmethod
     def adjustDRBDConfig(mcvirt_instance, resource='all'):
         """Performs a DRBD adjust, which updates the DRBD running configuration"""
-        if (len(DRBD.getAllDrbdHardDriveObjects(mcvirt_instance))):
+        # A specific resource must exist, so only check for resources when adjusting all
+        if (resource != 'all' or len(DRBD.getAllDrbdHardDriveObjects(mcvirt_instance))):
             System.runCommand([DRBD.DRBDADM, 'adjust', resource])
+            DRBDStatus.invalidate()
 
     @staticmethod
     def getAllDrbdHardDriveObjects(mcvirt_instance, include_remote=False):
@@ -197,23 +748,13 @@ class DRBD:
 
     @staticmethod
     def getUsedDrbdPorts(mcvirt_object):
-        used_ports = []
-
-        for hard_drive_object in DRBD.getAllDrbdHardDriveObjects(mcvirt_object,
-                                                                 include_remote=True):
-            used_ports.append(hard_drive_object.getConfigObject()._getDrbdPort())
-
-        return used_ports
+        """Returns the DRBD ports that are allocated in the cluster"""
+        return DRBDAllocation.getAllocatedValues('port')
 
     @staticmethod
     def getUsedDrbdMinors(mcvirt_object):
-        used_minors = []
-
-        for hard_drive_object in DRBD.getAllDrbdHardDriveObjects(mcvirt_object,
-                                                                 include_remote=True):
-            used_minors.append(hard_drive_object.getConfigObject()._getDrbdMinor())
-
-        return used_minors
+        """Returns the DRBD minors that are allocated in the cluster"""
+        return DRBDAllocation.getAllocatedValues('minor')
 
     @staticmethod
     def list(mcvirt_instance):
@@ -222,69 +763,607 @@ class DRBD:
         table = Texttable()
         table.set_deco(Texttable.HEADER | Texttable.VLINES)
         table.header(('Volume Name', 'VM', 'Minor', 'Port', 'Role', 'Connection State',
-                      'Disk State', 'Sync Status'))
+                      'Disk State', 'Sync Status', 'Progress'))
 
         # Set column alignment and widths
-        table.set_cols_width((30, 20, 5, 5, 20, 20, 20, 13))
-        table.set_cols_align(('l', 'l', 'c', 'c', 'l', 'c', 'l', 'c'))
+        table.set_cols_width((30, 20, 5, 5, 20, 20, 20, 13, 20))
+        table.set_cols_align(('l', 'l', 'c', 'c', 'l', 'c', 'l', 'c', 'l'))
 
-        # Iterate over DRBD objects, adding to the table
+        # Iterate over DRBD objects, adding to the table. The status of all resources
+        # is obtained once, rather than for each of the objects
         for drbd_object in DRBD.getAllDrbdHardDriveObjects(mcvirt_instance, True):
-            table.add_row((drbd_object.getConfigObject()._getResourceName(),
+            config_object = drbd_object.getConfigObject()
+            try:
+                status = DRBDStatus.getResource(config_object._getDrbdMinor(),
+                                                config_object._getResourceName())
+                role = 'Local: %s, Remote: %s' % tuple(status['role'])
+                connection_state = status['connection_state']
+                disk_state = 'Local: %s, Remote: %s' % tuple(status['disk_state'])
+                progress = DRBD._formatProgress(status)
+            except DRBDResourceNotConfiguredException:
+                role = connection_state = disk_state = 'Not configured'
+                progress = ''
+            table.add_row((config_object._getResourceName(),
                            drbd_object.getVmObject().getName(),
-                           drbd_object.getConfigObject()._getDrbdMinor(),
-                           drbd_object.getConfigObject()._getDrbdPort(),
-                           'Local: %s, Remote: %s' % (drbd_object._drbdGetRole()[0].name,
-                                                      drbd_object._drbdGetRole()[1].name),
-                           drbd_object._drbdGetConnectionState().name,
-                           'Local: %s, Remote: %s' % (drbd_object._drbdGetDiskState()[0].name,
-                                                      drbd_object._drbdGetDiskState()[1].name),
-                           'In Sync' if drbd_object._isInSync() else 'Out of Sync'))
+                           config_object._getDrbdMinor(),
+                           config_object._getDrbdPort(),
+                           role,
+                           connection_state,
+                           disk_state,
+                           'In Sync' if drbd_object._isInSync() else 'Out of Sync',
+                           progress))
         return table.draw()
 
+    @staticmethod
+    def getStatus(mcvirt_instance):
+        """Returns the status and the progress of any sync or verification
+        of each of the DRBD volumes on the node"""
+        drbd_objects = DRBD.getAllDrbdHardDriveObjects(mcvirt_instance)
+
+        # Where DRBD does not report the speed of a sync, it is estimated from
+        # the change in the data remaining between two samples of the status
+        resources = DRBDStatus.getAllResources()
+        if ([status for status in resources.values()
+             if DRBDStatus.isSyncing(status) and status['sync_speed'] is None]):
+            time.sleep(DRBDStatus.SPEED_SAMPLE_INTERVAL)
+            DRBDStatus.invalidate()
+            resources = DRBDStatus.getAllResources()
+
+        volume_statuses = []
+        for drbd_object in drbd_objects:
+            config_object = drbd_object.getConfigObject()
+            minor = config_object._getDrbdMinor()
+            volume_status = {
+                'volume': config_object._getResourceName(),
+                'vm': drbd_object.getVmObject().getName(),
+                'minor': minor,
+                'port': config_object._getDrbdPort(),
+                'configured': int(minor) in resources,
+                'in_sync': drbd_object._isInSync(),
+                'role': None,
+                'connection_state': None,
+                'disk_state': None,
+                'syncing': False,
+                'sync_percent': None,
+                'sync_speed_bytes': None,
+                'outstanding_bytes': None,
+                'eta_seconds': None
+            }
+            if (volume_status['configured']):
+                status = resources[int(minor)]
+                volume_status.update({
+                    'role': status['role'],
+                    'connection_state': status['connection_state'],
+                    'disk_state': status['disk_state'],
+                    'syncing': DRBDStatus.isSyncing(status),
+                    'sync_percent': status['sync_percent'],
+                    'eta_seconds': status['sync_eta']
+                })
+                # DRBD reports sizes in KiB
+                if (status['sync_speed'] is not None):
+                    volume_status['sync_speed_bytes'] = status['sync_speed'] * 1024
+                if (status['sync_remaining'] is not None):
+                    volume_status['outstanding_bytes'] = status['sync_remaining'] * 1024
+            volume_statuses.append(volume_status)
+        return volume_statuses
+
+    @staticmethod
+    def status(mcvirt_instance, json_output=False):
+        """Returns the sync progress of the DRBD volumes on the node, either as a
+        table or as JSON, for use by monitoring tools"""
+        volume_statuses = DRBD.getStatus(mcvirt_instance)
+        if (json_output):
+            return json.dumps(volume_statuses, indent=2, sort_keys=True)
+
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('Volume Name', 'VM', 'Connection State', 'Done', 'Speed',
+                      'Outstanding', 'ETA'))
+        table.set_cols_width((30, 20, 20, 7, 12, 12, 9))
+        table.set_cols_align(('l', 'l', 'c', 'r', 'r', 'r', 'r'))
+        for volume_status in volume_statuses:
+            if (not volume_status['configured']):
+                table.add_row((volume_status['volume'], volume_status['vm'],
+                               'Not configured', '', '', '', ''))
+                continue
+            if (volume_status['syncing']):
+                done = '%.1f%%' % volume_status['sync_percent']
+                speed = System.formatSize(volume_status['sync_speed_bytes'], '/s')
+                outstanding = System.formatSize(volume_status['outstanding_bytes'])
+                eta = System.formatDuration(volume_status['eta_seconds'])
+            else:
+                done = speed = outstanding = eta = '-'
+            table.add_row((volume_status['volume'], volume_status['vm'],
+                           volume_status['connection_state'], done, speed, outstanding, eta))
+        return table.draw()
+
+    @staticmethod
+    def _formatProgress(status):
+        """Returns a summary of the progress of a sync or verification of a resource"""
+        if (not DRBDStatus.isSyncing(status)):
+            return ''
+        return '%.1f%%, ETA %s' % (status['sync_percent'],
+                                   System.formatDuration(status['sync_eta']))
+
+
+class DRBDAllocation(object):
+    """Maintains the table of DRBD minors and ports that have been allocated to DRBD
+    resources in the cluster. A copy of the table is held in the global configuration
+    of each node, which is updated on all nodes whilst the cluster is locked"""
+
+    # The first value of each of the allocated types
+    INITIAL_VALUES = {
+        'minor': DRBD.INITIAL_MINOR_ID,
+        'port': DRBD.INITIAL_PORT
+    }
+
+    @staticmethod
+    def getEmptyTable():
+        """Returns an allocation table without any allocated values"""
+        table = {}
+        for value_type, initial_value in DRBDAllocation.INITIAL_VALUES.items():
+            table[value_type] = {
+                'next': initial_value,
+                'free': [],
+                'allocated': {}
+            }
+        return table
+
+    @staticmethod
+    def buildTable(resources):
+        """Builds an allocation table from a list of (resource name, minor, port) tuples"""
+        table = DRBDAllocation.getEmptyTable()
+        for resource_name, minor, port in resources:
+            for value_type, value in (('minor', minor), ('port', port)):
+                if (value is not None):
+                    table[value_type]['allocated'][str(value)] = resource_name
+
+        # Determine the next unused value and the free values below it. The free
+        # list is kept in descending order, so that the lowest free value is re-used first
+        for value_type, pool in table.items():
+            allocated_values = [int(value) for value in pool['allocated']]
+            if (allocated_values):
+                pool['next'] = max(pool['next'], max(allocated_values) + 1)
+            pool['free'] = [value for value in
+                            range(pool['next'] - 1,
+                                  DRBDAllocation.INITIAL_VALUES[value_type] - 1, -1)
+                            if str(value) not in pool['allocated']]
+        return table
+
+    @staticmethod
+    def getTable():
+        """Returns the allocation table from the local configuration"""
+        drbd_config = DRBD.getConfig()
+        if ('allocation' in drbd_config):
+            return drbd_config['allocation']
+        else:
+            return DRBDAllocation.getEmptyTable()
+
+    @staticmethod
+    def getAllocatedValues(value_type):
+        """Returns the allocated values of a given type"""
+        return [int(value) for value in DRBDAllocation.getTable()[value_type]['allocated']]
+
+    @staticmethod
+    def _allocateValue(pool):
+        """Removes and returns an unallocated value from an allocation pool"""
+        while (pool['free']):
+            value = pool['free'].pop()
+            if (str(value) not in pool['allocated']):
+                return value
+
+        while (str(pool['next']) in pool['allocated']):
+            pool['next'] += 1
+        value = pool['next']
+        pool['next'] += 1
+        return value
+
+    @staticmethod
+    def _addFreeValues(pool, values):
+        """Adds values to the free list of an allocation pool, keeping it in descending order"""
+        pool['free'].extend(values)
+        pool['free'].sort(reverse=True)
+
+    @staticmethod
+    def _recordValue(pool, value, resource_name):
+        """Marks a value in an allocation pool as allocated to a resource"""
+        allocated_resource = pool['allocated'].get(str(value))
+        if (allocated_resource is not None and allocated_resource != resource_name):
+            raise DRBDAllocationConflictException(
+                'DRBD value %s cannot be allocated to %s, as it is allocated to %s' %
+                (value, resource_name, allocated_resource)
+            )
+        pool['allocated'][str(value)] = resource_name
+        if (value >= pool['next']):
+            # Values skipped over by the allocation are available for later use
+            DRBDAllocation._addFreeValues(pool, range(value - 1, pool['next'] - 1, -1))
+            pool['next'] = value + 1
+        elif (value in pool['free']):
+            pool['free'].remove(value)
+
+    @staticmethod
+    def reserve(mcvirt_instance, resource_name, minor=None, port=None):
+        """Reserves a DRBD minor and port for a resource, allocating any that have not
+        been specified, and records the reservation on all nodes in the cluster.
+        A DRBDAllocationConflictException is raised if a specified value is allocated
+        to another resource. This must be performed whilst the MCVirt lock is held,
+        which locks all nodes"""
+        from mcvirt.cluster.cluster import Cluster
+        allocation = {'minor': minor, 'port': port}
+
+        def updateConfig(config):
+            if ('allocation' not in config['drbd']):
+                config['drbd']['allocation'] = DRBDAllocation.getEmptyTable()
+            for value_type in ('minor', 'port'):
+                pool = config['drbd']['allocation'][value_type]
+                if (allocation[value_type] is None):
+                    allocation[value_type] = DRBDAllocation._allocateValue(pool)
+                DRBDAllocation._recordValue(pool, allocation[value_type], resource_name)
+        MCVirtConfig().updateConfig(updateConfig,
+                                    'Reserved DRBD minor and port for %s' % resource_name)
+
+        if (mcvirt_instance.initialiseNodes()):
+            cluster_object = Cluster(mcvirt_instance)
+            cluster_object.runRemoteCommand('node-drbd-reserveAllocation',
+                                            {'resource_name': resource_name,
+                                             'minor': allocation['minor'],
+                                             'port': allocation['port']})
+
+        return allocation['minor'], allocation['port']
+
+    @staticmethod
+    def release(mcvirt_instance, resource_name, minor, port):
+        """Releases the DRBD minor and port of a resource on all nodes in the cluster"""
+        from mcvirt.cluster.cluster import Cluster
+
+        def updateConfig(config):
+            if ('allocation' not in config['drbd']):
+                return
+            for value_type, value in (('minor', minor), ('port', port)):
+                pool = config['drbd']['allocation'][value_type]
+                if (value is not None and
+                        pool['allocated'].get(str(value)) == resource_name):
+                    del(pool['allocated'][str(value)])
+                    DRBDAllocation._addFreeValues(pool, [value])
+        MCVirtConfig().updateConfig(updateConfig,
+                                    'Released DRBD minor and port for %s' % resource_name)
+
+        if (mcvirt_instance.initialiseNodes()):
+            cluster_object = Cluster(mcvirt_instance)
+            cluster_object.runRemoteCommand('node-drbd-releaseAllocation',
+                                            {'resource_name': resource_name,
+                                             'minor': minor,
+                                             'port': port})
+
+    @staticmethod
+    def setTable(table):
+        """Replaces the allocation table in the local configuration"""
+        def updateConfig(config):
+            config['drbd']['allocation'] = table
+        MCVirtConfig().updateConfig(updateConfig, 'Updated DRBD allocation table')
+
+    @staticmethod
+    def reconcile(mcvirt_instance):
+        """Rebuilds the allocation table from the DRBD hard drives in the cluster
+        and replaces the table on all nodes"""
+        from mcvirt.cluster.cluster import Cluster
+        mcvirt_instance.getAuthObject().assertPermission(Auth.PERMISSIONS.MANAGE_DRBD)
+
+        # Use the configured values, as the config object getters would
+        # otherwise allocate values for hard drives without them
+        resources = []
+        for hard_drive_object in DRBD.getAllDrbdHardDriveObjects(mcvirt_instance,
+                                                                 include_remote=True):
+            config_object = hard_drive_object.getConfigObject()
+            resources.append((config_object._getResourceName(),
+                              config_object.config['drbd_minor'],
+                              config_object.config['drbd_port']))
+        table = DRBDAllocation.buildTable(resources)
+
+        DRBDAllocation.setTable(table)
+        if (mcvirt_instance.initialiseNodes()):
+            cluster_object = Cluster(mcvirt_instance)
+            cluster_object.runRemoteCommand('node-drbd-setAllocationTable', {'table': table})
+
+        return len(resources)
+
 
 class DRBDSocket():
-    """Creates a unix socket to communicate with the DRBD out-of-sync hook script"""
+    """Creates a unix socket to receive the names of resources with out-of-sync blocks
+    from the DRBD out-of-sync hook script. Events that are received in quick succession
+    are coalesced, so that the configuration of each resource is only updated once"""
 
     SOCKET_PATH = '/var/run/lock/mcvirt/mcvirt-drbd.sock'
+    # Directory in which the hook script records resources if no socket is running
+    SPOOL_DIR = MCVirt.NODE_STORAGE_DIR + '/drbd_spool'
+    # Lock held by the hook script whilst it processes the spool, so that only
+    # one hook script processes the spool at a time
+    SPOOL_LOCK_FILE = MCVirt.LOCK_FILE_DIR + '/drbd_spool.lock'
+    # Number of connections from hook scripts that can be queued
+    BACKLOG = 128
+    # Each resource name sent to the socket is terminated by a newline
+    MESSAGE_TERMINATOR = '\n'
+    MAX_MESSAGE_SIZE = 65536
+    RECEIVE_SIZE = 4096
+    # Number of seconds that further events are waited for, before the
+    # configuration of the resources is updated
+    COALESCE_INTERVAL = 1
+    ACCEPT_TIMEOUT = 0.5
+    CONNECTION_TIMEOUT = 5
+    RESOURCE_NAME_REGEX = r'^[a-zA-Z0-9_.-]+$'
 
     def __init__(self, mcvirt_instance):
-        """Stores member variables and creates thread for the socket server"""
-        self.connection = None
+        """Stores member variables, creates the socket and starts the threads
+        that receive and process events"""
         self.mcvirt_instance = mcvirt_instance
-        self.thread = thread.start_new_thread(DRBDSocket.server, (self,))
+        # Held whilst the configuration of resources is updated, so that
+        # callers can update the configuration without conflicting with the socket
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.running = True
+        # Number of times that the server has found no connections waiting to be
+        # accepted, used to determine when all sent events have been received
+        self.accept_timeouts = 0
+
+        # Process any events that were recorded by the hook script whilst no socket was running
+        self.pending = set(DRBDSocket.getSpooledResources())
+
+        # Create the socket before returning, so that events from DRBD are not
+        # missed whilst the thread is starting
+        try:
+            os.remove(self.SOCKET_PATH)
+        except OSError:
+            pass
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.SOCKET_PATH)
+        self.socket.listen(self.BACKLOG)
+        self.socket.settimeout(self.ACCEPT_TIMEOUT)
+
+        self.server_thread = threading.Thread(target=self.server)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.processor_thread = threading.Thread(target=self._processEvents)
+        self.processor_thread.daemon = True
+        self.processor_thread.start()
 
     def stop(self):
-        """Deletes the socket connection object, removes the socket file and
-           the MCVirt instance"""
-        # Destroy the socket connection
-        self.connection = None
+        """Stops the socket, processes any events that have been received and
+        removes the MCVirt instance"""
+        self.flush()
+
+        # Remove the socket file, so that the hook script records any further events
+        # in the spool, before stopping the threads, so that no further connections
+        # can be queued once the server has received the queued connections
         try:
             os.remove(self.SOCKET_PATH)
         except OSError:
             pass
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        # Wait for the threads to finish
+        self.server_thread.join()
+        self.processor_thread.join()
+
+        # Process the remaining events, including those recorded in the spool
+        # whilst the socket was being stopped
+        with self.condition:
+            self.pending.update(DRBDSocket.getSpooledResources())
+        self._processPending()
         self.mcvirt_instance = None
 
     def server(self):
-        """Listens on the socket and marks any resources as out-of-sync"""
-        # Remove MCVirt lock, so that other commands can run whilst the verify is taking place
-        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        """Accepts connections from the hook script, adding the received
+        resources to the pending events"""
+        while (self.running):
+            try:
+                connection, _ = self.socket.accept()
+            except socket.timeout:
+                with self.condition:
+                    self.accept_timeouts += 1
+                    self.condition.notify_all()
+                continue
+            except socket.error:
+                if (not self.running):
+                    break
+                raise
+            self._handleConnection(connection)
+
+        # Receive the events from the connections that are still queued, which would
+        # otherwise be dropped when the socket is closed, after the hook scripts
+        # have sent them. The socket file has been removed, so no further
+        # connections can be made.
+        self.socket.setblocking(0)
+        while (True):
+            try:
+                connection, _ = self.socket.accept()
+            except socket.error:
+                break
+            self._handleConnection(connection)
+        self.socket.close()
+
+    def _handleConnection(self, connection):
+        """Receives the resources sent on a connection from the hook script and adds
+        them to the pending events"""
         try:
-            os.remove(self.SOCKET_PATH)
-        except OSError:
+            resource_names = self._receiveResources(connection)
+        except socket.error:
+            resource_names = []
+        finally:
+            connection.close()
+
+        if (resource_names):
+            with self.condition:
+                self.pending.update(resource_names)
+                self.condition.notify_all()
+
+    def _receiveResources(self, connection):
+        """Reads the resource names sent on a connection"""
+        connection.settimeout(self.CONNECTION_TIMEOUT)
+        data = ''
+        complete = False
+        try:
+            while (len(data) < self.MAX_MESSAGE_SIZE):
+                received = connection.recv(self.RECEIVE_SIZE)
+                if (not received):
+                    complete = True
+                    break
+                data += received
+        except socket.timeout:
             pass
+        return DRBDSocket._parseMessage(data, complete)
 
-        self.socket.bind(self.SOCKET_PATH)
-        self.socket.listen(1)
-        while (1):
-            hard_drive_object = None
-            self.connection = None
-            self.connection, _ = self.socket.accept()
-            drbd_resource = self.connection.recv(1024)
-            if (drbd_resource):
-                from mcvirt.virtual_machine.hard_drive.factory import Factory as HardDriveFactory
-                hard_drive_object = HardDriveFactory.getDrbdObjectByResourceName(
-                    self.mcvirt_instance, drbd_resource
-                )
+    @staticmethod
+    def _parseMessage(data, complete=True):
+        """Returns the valid resource names from a message. Unless the whole message
+        has been received, the name following the last terminator is ignored, as it
+        may be incomplete. Older hook scripts do not terminate the resource name"""
+        resource_names = data.split(DRBDSocket.MESSAGE_TERMINATOR)
+        if (not complete):
+            resource_names = resource_names[:-1]
+        return [resource_name.strip() for resource_name in resource_names
+                if DRBDSocket._isValidResourceName(resource_name.strip())]
+
+    @staticmethod
+    def _isValidResourceName(resource_name):
+        """Determines whether a resource name is valid"""
+        return bool(re.match(DRBDSocket.RESOURCE_NAME_REGEX, resource_name))
+
+    def _processEvents(self):
+        """Waits for events to be received and processes them, once no further
+        events have been received within the coalesce interval"""
+        while (True):
+            with self.condition:
+                while (self.running and not self.pending):
+                    self.condition.wait()
+                if (not self.running):
+                    return
+
+                # Wait for the remaining events of a burst
+                pending_count = len(self.pending)
+                deadline = time.time() + self.COALESCE_INTERVAL
+                while (self.running and time.time() < deadline):
+                    self.condition.wait(deadline - time.time())
+                    if (len(self.pending) != pending_count):
+                        pending_count = len(self.pending)
+                        deadline = time.time() + self.COALESCE_INTERVAL
+                if (not self.running):
+                    return
+            self._processPending()
+
+    def flush(self):
+        """Processes the events that have been sent to the socket, without waiting
+        for further events to be coalesced"""
+        # Wait for the server to accept all connections that have been made
+        with self.condition:
+            accept_timeouts = self.accept_timeouts
+            while (self.running and self.accept_timeouts == accept_timeouts and
+                   self.server_thread.is_alive()):
+                self.condition.wait(self.ACCEPT_TIMEOUT)
+        self._processPending()
+
+    def _processPending(self):
+        """Marks the resources of the pending events as out-of-sync"""
+        with self.condition:
+            resource_names = self.pending
+            self.pending = set()
+        if (not resource_names):
+            return
+        with self.lock:
+            if (self.mcvirt_instance):
+                DRBDSocket.markOutOfSync(self.mcvirt_instance, resource_names)
+
+    @staticmethod
+    def markOutOfSync(mcvirt_instance, resource_names):
+        """Marks the hard drives of the given resources as out-of-sync, updating
+        the configuration of each hard drive once, and removes them from the spool"""
+        hard_drive_objects = dict(
+            (hard_drive_object.getConfigObject()._getResourceName(), hard_drive_object)
+            for hard_drive_object in DRBD.getAllDrbdHardDriveObjects(mcvirt_instance)
+        )
+        for resource_name in resource_names:
+            # Events for hard drives that have since been removed are ignored
+            hard_drive_object = hard_drive_objects.get(resource_name)
+            if (hard_drive_object is not None and hard_drive_object._isMarkedInSync()):
                 hard_drive_object.setSyncState(False, update_remote=False)
-            self.connection.close()
+            DRBDSocket._removeSpooledResource(resource_name)
+
+    @staticmethod
+    def sendResources(resource_names):
+        """Sends resource names to the socket. An exception is raised if no socket is
+        running"""
+        client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client_socket.connect(DRBDSocket.SOCKET_PATH)
+            client_socket.sendall(''.join('%s%s' % (resource_name, DRBDSocket.MESSAGE_TERMINATOR)
+                                          for resource_name in resource_names))
+        finally:
+            client_socket.close()
+
+    @staticmethod
+    def spoolResource(resource_name):
+        """Records a resource in the spool, to be marked as out-of-sync when
+        the spool is next processed"""
+        if (not DRBDSocket._isValidResourceName(resource_name)):
+            return
+        if (not os.path.isdir(DRBDSocket.SPOOL_DIR)):
+            os.makedirs(DRBDSocket.SPOOL_DIR)
+
+        # Each resource is recorded as a file, so that repeated events for
+        # a resource are coalesced. Flush the directory, so that the event
+        # is retained if the node fails
+        spool_fh = open(os.path.join(DRBDSocket.SPOOL_DIR, resource_name), 'a')
+        os.fsync(spool_fh.fileno())
+        spool_fh.close()
+        spool_dir_fd = os.open(DRBDSocket.SPOOL_DIR, os.O_RDONLY)
+        try:
+            os.fsync(spool_dir_fd)
+        finally:
+            os.close(spool_dir_fd)
+
+    @staticmethod
+    def getSpooledResources():
+        """Returns the resources recorded in the spool"""
+        if (not os.path.isdir(DRBDSocket.SPOOL_DIR)):
+            return []
+        return [resource_name for resource_name in os.listdir(DRBDSocket.SPOOL_DIR)
+                if DRBDSocket._isValidResourceName(resource_name)]
+
+    @staticmethod
+    def _removeSpooledResource(resource_name):
+        """Removes a resource from the spool, if it has been recorded"""
+        try:
+            os.remove(os.path.join(DRBDSocket.SPOOL_DIR, resource_name))
+        except OSError:
+            pass
+
+    @staticmethod
+    def obtainSpoolLock():
+        """Obtains the lock used to process the spool, without waiting. Returns the
+        file object holding the lock, which is released when it is closed, or None
+        if the spool is being processed by another process"""
+        if (not os.path.isdir(MCVirt.LOCK_FILE_DIR)):
+            os.mkdir(MCVirt.LOCK_FILE_DIR)
+        lock_fh = open(DRBDSocket.SPOOL_LOCK_FILE, 'a')
+        try:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            lock_fh.close()
+            return None
+        return lock_fh
+
+    @staticmethod
+    def drainSpool(mcvirt_instance):
+        """Marks all of the resources recorded in the spool as out-of-sync. Returns
+        the number of resources that were processed"""
+        processed = set()
+        resource_names = DRBDSocket.getSpooledResources()
+        while (resource_names):
+            DRBDSocket.markOutOfSync(mcvirt_instance, resource_names)
+            processed.update(resource_names)
+            # Process any resources that were recorded whilst the spool was processed
+            resource_names = [resource_name
+                              for resource_name in DRBDSocket.getSpooledResources()
+                              if resource_name not in processed]
+        return len(processed)
@@ -0,0 +1,295 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import json
+import os
+import re
+import time
+from texttable import Texttable
+
+from mcvirt.mcvirt import MCVirt, MCVirtException
+from mcvirt.node.drbd import DRBDMonitor, DRBDSocket, DRBDStateTimeoutException
+from mcvirt.virtual_machine.hard_drive.drbd import DRBD as HardDriveDRBD, DrbdConnectionState
+
+
+class InvalidVerificationOptionException(MCVirtException):
+    """The options given for the DRBD verifications are not valid"""
+    pass
+
+
+class DRBDVerificationScheduler(object):
+    """Runs DRBD verifications of a number of hard drives concurrently, limiting
+    the total rate of the verifications. The results are recorded as each verification
+    completes, so that an interrupted set of verifications can be resumed"""
+
+    STATE_FILE = MCVirt.NODE_STORAGE_DIR + '/drbd_verification.json'
+    DEFAULT_CONCURRENCY = 2
+    # Maximum time to wait for DRBD events before checking the running verifications
+    CHECK_INTERVAL = 5
+    # Multipliers to convert DRBD rate suffixes to KiB
+    RATE_UNITS = {'': 1, 'K': 1, 'M': 1024, 'G': 1024 ** 2}
+
+    RESULT_IN_SYNC = 'In sync'
+    RESULT_OUT_OF_SYNC = 'Out of sync'
+    RESULT_FAILED = 'Failed'
+
+    def __init__(self, mcvirt_instance, concurrency=None, rate=None):
+        """Sets member variables and validates the options"""
+        self.mcvirt_instance = mcvirt_instance
+        self.concurrency = self.DEFAULT_CONCURRENCY if concurrency is None else concurrency
+        if (self.concurrency < 1):
+            raise InvalidVerificationOptionException(
+                'At least one verification must be able to run at a time'
+            )
+        self.rate = None if rate is None else DRBDVerificationScheduler.parseRate(rate)
+
+    @staticmethod
+    def parseRate(rate):
+        """Converts a DRBD rate (e.g. 100M) to KiB/s"""
+        rate_match = re.match(r'^([0-9]+)([KMG]?)$', str(rate).upper())
+        if (not rate_match or not int(rate_match.group(1))):
+            raise InvalidVerificationOptionException(
+                'Invalid verification rate \'%s\': must be a number of KiB/s, optionally'
+                ' with a K, M or G suffix' % rate
+            )
+        return (int(rate_match.group(1)) *
+                DRBDVerificationScheduler.RATE_UNITS[rate_match.group(2)])
+
+    def getVerificationRate(self):
+        """Returns the rate of each verification, in KiB/s, so that the total rate
+        of the concurrent verifications is within the configured rate"""
+        return max(1, self.rate / self.concurrency)
+
+    def _loadState(self):
+        """Returns the results recorded by a previous, interrupted, set of verifications"""
+        if (not os.path.isfile(self.STATE_FILE)):
+            return {}
+        state_file = open(self.STATE_FILE, 'r')
+        results = json.loads(state_file.read())
+        state_file.close()
+        return results
+
+    def _saveState(self, results):
+        """Records the results of the completed verifications. The results are written
+        to a temporary file, which replaces the state file, so that an interruption
+        cannot leave a partially written state file"""
+        temp_state_file_path = self.STATE_FILE + '.tmp'
+        state_file = open(temp_state_file_path, 'w')
+        state_file.write(json.dumps(results, indent=2, separators=(',', ': ')))
+        state_file.flush()
+        os.fsync(state_file.fileno())
+        state_file.close()
+        os.rename(temp_state_file_path, self.STATE_FILE)
+
+    def _removeState(self):
+        """Removes the recorded results, once all verifications have completed"""
+        if (os.path.isfile(self.STATE_FILE)):
+            os.remove(self.STATE_FILE)
+
+    def run(self, disk_objects, resume=False):
+        """Verifies the given DRBD hard drive objects, returning the results, keyed by
+        resource name. If resume is specified, hard drives that were verified by a
+        previous, interrupted, set of verifications are not verified again"""
+        resource_names = [disk_object.getConfigObject()._getResourceName()
+                          for disk_object in disk_objects]
+        results = {}
+        if (resume):
+            results = dict((resource_name, result)
+                           for resource_name, result in self._loadState().items()
+                           if resource_name in resource_names)
+        pending = [disk_object for disk_object in disk_objects
+                   if disk_object.getConfigObject()._getResourceName() not in results]
+        running = []
+
+        # Release the MCVirt lock, so that other commands can be run, and create a
+        # single socket, to receive errors from DRBD about out-of-sync blocks
+        # for all of the verifications
+        self.mcvirt_instance.releaseLock()
+        drbd_socket = DRBDSocket(self.mcvirt_instance)
+        monitor = DRBDMonitor.getInstance()
+        try:
+            while (pending or running):
+                # Start verifications until the concurrency limit is reached
+                while (pending and len(running) < self.concurrency):
+                    started_verification = self._startVerification(pending.pop(0), results,
+                                                                   drbd_socket)
+                    if (started_verification):
+                        running.append(started_verification)
+                    else:
+                        self._saveState(results)
+
+                event_id = monitor.getEventId()
+                finished = [verification for verification in running
+                            if self._isVerificationComplete(verification)]
+                for verification in finished:
+                    running.remove(verification)
+                    self._completeVerification(verification, results, drbd_socket)
+                    self._saveState(results)
+
+                # Wait for a change in the state of the DRBD resources
+                if (running and not finished):
+                    monitor.waitForEvent(event_id, self.CHECK_INTERVAL)
+
+        except BaseException:
+            # Mark the hard drives with verifications that have not completed as
+            # not in-sync. These are verified again if the verifications are resumed
+            for verification in running:
+                with drbd_socket.lock:
+                    verification['disk_object'].setSyncState(False)
+            raise
+
+        finally:
+            if (self.rate):
+                for verification in running:
+                    verification['disk_object']._resetResyncRate()
+            drbd_socket.stop()
+            drbd_socket.mcvirt_instance = None
+            self.mcvirt_instance.obtainLock()
+
+        self._removeState()
+        return results
+
+    def _recordResult(self, results, disk_object, result, start_time, error=None):
+        """Records the result of the verification of a hard drive"""
+        results[disk_object.getConfigObject()._getResourceName()] = {
+            'vm_name': disk_object.getVmObject().getName(),
+            'disk_id': disk_object.getConfigObject().getId(),
+            'result': result,
+            'error': error,
+            'duration': int(time.time() - start_time)
+        }
+
+    def _startVerification(self, disk_object, results, drbd_socket):
+        """Starts the verification of a hard drive, returning the details of the running
+        verification, or None if the verification could not be started"""
+        start_time = time.time()
+        try:
+            # Ensure the socket does not update the configuration at the same time
+            with drbd_socket.lock:
+                disk_object._ensureVerifiable()
+                if (self.rate):
+                    disk_object._setResyncRate(self.getVerificationRate())
+                try:
+                    event_id = disk_object._startVerification()
+                except MCVirtException:
+                    if (self.rate):
+                        disk_object._resetResyncRate()
+                    raise
+        except MCVirtException, e:
+            self._recordResult(results, disk_object, self.RESULT_FAILED, start_time, str(e))
+            return None
+
+        return {
+            'disk_object': disk_object,
+            'minor': disk_object.getConfigObject()._getDrbdMinor(),
+            'event_id': event_id,
+            'start_time': start_time,
+            'started': False,
+            'status': None
+        }
+
+    def _isVerificationComplete(self, verification):
+        """Determines whether a running verification has completed"""
+        monitor = DRBDMonitor.getInstance()
+
+        # A verification of a small volume may complete before it is observed, so
+        # it is assumed to have started once the start timeout has passed
+        if (not verification['started']):
+            try:
+                monitor.waitForState(
+                    verification['minor'],
+                    lambda status: (status['connection_state'] ==
+                                    DrbdConnectionState.VERIFY_S.value),
+                    timeout=0, since=verification['event_id']
+                )
+                verification['started'] = True
+            except DRBDStateTimeoutException:
+                if (time.time() - verification['start_time'] <
+                        HardDriveDRBD.VERIFY_START_TIMEOUT):
+                    return False
+                verification['started'] = True
+
+        try:
+            verification['status'] = monitor.waitForState(
+                verification['minor'],
+                lambda status: (status['connection_state'] !=
+                                DrbdConnectionState.VERIFY_S.value),
+                timeout=0
+            )
+            return True
+        except DRBDStateTimeoutException:
+            return False
+
+    def _completeVerification(self, verification, results, drbd_socket):
+        """Records the result of a completed verification"""
+        disk_object = verification['disk_object']
+        try:
+            disk_object._finishVerification(verification['status'],
+                                            verification['event_id'])
+            if (self.rate):
+                disk_object._resetResyncRate()
+
+            # Wait for any message from the out-of-sync handler to be processed
+            drbd_socket.flush()
+            with drbd_socket.lock:
+                in_sync = disk_object._isInSync()
+        except MCVirtException, e:
+            with drbd_socket.lock:
+                disk_object.setSyncState(False)
+            self._recordResult(results, disk_object, self.RESULT_FAILED,
+                               verification['start_time'], str(e))
+            return
+
+        self._recordResult(results, disk_object,
+                           self.RESULT_IN_SYNC if in_sync else self.RESULT_OUT_OF_SYNC,
+                           verification['start_time'])
+
+    @staticmethod
+    def getFailures(results):
+        """Returns messages for the verifications that did not find the volumes in-sync"""
+        failures = []
+        for resource_name, result in sorted(results.items()):
+            if (result['result'] == DRBDVerificationScheduler.RESULT_OUT_OF_SYNC):
+                failures.append('The DRBD verification for \'%s\' failed' % resource_name)
+            elif (result['result'] == DRBDVerificationScheduler.RESULT_FAILED):
+                failures.append('The DRBD verification for \'%s\' could not be performed: %s' %
+                                (resource_name, result['error']))
+        return failures
+
+    @staticmethod
+    def getSummary(results):
+        """Returns a report of the results of the verifications"""
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('Volume Name', 'VM', 'Result', 'Duration'))
+        table.set_cols_width((30, 20, 12, 10))
+        table.set_cols_align(('l', 'l', 'l', 'r'))
+        for resource_name, result in sorted(results.items()):
+            table.add_row((resource_name, result['vm_name'], result['result'],
+                           '%is' % result['duration']))
+
+        counts = dict((result_type, 0) for result_type in
+                      (DRBDVerificationScheduler.RESULT_IN_SYNC,
+                       DRBDVerificationScheduler.RESULT_OUT_OF_SYNC,
+                       DRBDVerificationScheduler.RESULT_FAILED))
+        for result in results.values():
+            counts[result['result']] += 1
+        return '%s\n\n%i volume(s) verified: %i in sync, %i out of sync, %i failed' % (
+            table.draw(), len(results),
+            counts[DRBDVerificationScheduler.RESULT_IN_SYNC],
+            counts[DRBDVerificationScheduler.RESULT_OUT_OF_SYNC],
+            counts[DRBDVerificationScheduler.RESULT_FAILED])
@@ -64,7 +64,7 @@ class Network:
         # Ensure network is not connected to any VMs
         connected_vms = self._checkConnectedVirtualMachines()
         if (len(connected_vms)):
-            connected_vm_name_string = ', '.join(vm.getName() for vm in connected_vms)
+            connected_vm_name_string = ', '.join(connected_vms)
             raise NetworkUtilizedException(
                 'Network \'%s\' cannot be removed as it is used by the following VMs: %s' %
                 (self.getName(), connected_vm_name_string))
@@ -85,32 +85,59 @@ class Network:
         # Update MCVirt config
         def updateConfig(config):
             del config['networks'][self.getName()]
+            config['network_interfaces'].pop(self.getName(), None)
         from mcvirt.mcvirt_config import MCVirtConfig
         MCVirtConfig().updateConfig(updateConfig, 'Deleted network \'%s\'' % self.getName())
 
     def _checkConnectedVirtualMachines(self):
-        """Returns an array of VM objects that have an interface connected to the network"""
-        connected_vms = []
+        """Returns an array of the names of the VMs that have an interface
+        connected to the network"""
+        return sorted(set(self.getConnectedInterfaces().values()))
 
-        # Iterate over all VMs and determine if any use the network to be deleted
-        all_vm_objects = self.mcvirt_object.getAllVirtualMachineObjects()
-        for vm_object in all_vm_objects:
+    def getConnectedInterfaces(self):
+        """Returns a dict of the MAC addresses of the VM network interfaces connected
+        to the network, mapped to the names of their VMs"""
+        return dict(Network.getInterfaceIndex().get(self.getName(), {}))
 
-            # Iterate over each network interface for the VM and determine if it
-            # is connected to this network
-            all_vm_interfaces = vm_object.getNetworkObjects()
-            contains_connected_interface = False
-            for network_interface in all_vm_interfaces:
-                if (network_interface.getConnectedNetwork() == self.getName()):
-                    contains_connected_interface = True
+    @staticmethod
+    def getInterfaceIndex():
+        """Returns the index of the VM network interfaces, containing a dict for each
+        network, which maps the MAC address of each interface to the name of its VM"""
+        from mcvirt.mcvirt_config import MCVirtConfig
+        return MCVirtConfig().getConfig()['network_interfaces']
 
-            # If the VM contains at least one interface connected to the network,
-            # add it to the array to be returned
-            if (contains_connected_interface):
-                connected_vms.append(vm_object)
+    @staticmethod
+    def checkMacAddressExists(mac_address, interface_index=None):
+        """Determines if a MAC address is used by a VM network interface"""
+        if (interface_index is None):
+            interface_index = Network.getInterfaceIndex()
+        for interfaces in interface_index.values():
+            if (mac_address in interfaces):
+                return True
+        return False
+
+    @staticmethod
+    def _addInterfaceToIndex(network_name, mac_address, vm_name):
+        """Records a VM network interface in the index of the local node"""
+        def updateConfig(config):
+            config['network_interfaces'].setdefault(network_name, {})[mac_address] = vm_name
+        from mcvirt.mcvirt_config import MCVirtConfig
+        MCVirtConfig().updateConfig(updateConfig,
+                                    'Added interface %s of \'%s\' to \'%s\' network index' %
+                                    (mac_address, vm_name, network_name))
 
-        # Return array of VMs that use this network
-        return connected_vms
+    @staticmethod
+    def _removeInterfaceFromIndex(network_name, mac_address):
+        """Removes a VM network interface from the index of the local node"""
+        def updateConfig(config):
+            interfaces = config['network_interfaces'].get(network_name, {})
+            interfaces.pop(mac_address, None)
+            if (not interfaces):
+                config['network_interfaces'].pop(network_name, None)
+        from mcvirt.mcvirt_config import MCVirtConfig
+        MCVirtConfig().updateConfig(updateConfig,
+                                    'Removed interface %s from \'%s\' network index' %
+                                    (mac_address, network_name))
 
     def _getLibVirtObject(self):
         """Returns the LibVirt object for the network"""
@@ -192,10 +219,12 @@ class Network:
         # Create table and set headings
         table = Texttable()
         table.set_deco(Texttable.HEADER | Texttable.VLINES)
-        table.header(('Network', 'Physical Interface'))
+        table.header(('Network', 'Physical Interface', 'Attached Interfaces'))
 
         # Obtain network configurations and add to table
         networks = Network.getConfig()
+        interface_index = Network.getInterfaceIndex()
         for network_name in networks:
-            table.add_row((network_name, networks[network_name]))
+            table.add_row((network_name, networks[network_name],
+                           len(interface_index.get(network_name, {}))))
         return table.draw()
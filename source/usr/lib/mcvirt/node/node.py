@@ -53,9 +53,7 @@ class Node(object):
     def setClusterIpAddress(mcvirt_instance, ip_address):
         """Updates the cluster IP address for the node"""
         # Check validity of IP address (mainly to ensure that )
-        pattern = re.compile(r"^((([01]?[0-9]?[0-9]|2[0-4][0-9]|25[0-5])[ (\[]?(\.|dot)"
-                             "[ )\]]?){3}([01]?[0-9]?[0-9]|2[0-4][0-9]|25[0-5]))$")
-        if not pattern.match(ip_address):
+        if not Node._isValidIpAddress(ip_address):
             raise InvalidIPAddressException('%s is not a valid IP address' % ip_address)
 
         # Update global MCVirt configuration
@@ -64,3 +62,30 @@ class Node(object):
         mcvirt_config = MCVirtConfig(mcvirt_instance=mcvirt_instance)
         mcvirt_config.updateConfig(updateConfig, 'Set node cluster IP address to %s' %
                                                  ip_address)
+
+    @staticmethod
+    def setMigrationIpAddress(mcvirt_instance, ip_address):
+        """Updates the IP address that live migrations to the node are performed
+        over. An empty IP address causes the cluster network to be used"""
+        if (ip_address and not Node._isValidIpAddress(ip_address)):
+            raise InvalidIPAddressException('%s is not a valid IP address' % ip_address)
+
+        # Update global MCVirt configuration
+        def updateConfig(config):
+            config['cluster']['migration_ip'] = ip_address
+        mcvirt_config = MCVirtConfig(mcvirt_instance=mcvirt_instance)
+        mcvirt_config.updateConfig(updateConfig, 'Set node migration IP address to %s' %
+                                                 (ip_address or 'cluster IP address'))
+
+    @staticmethod
+    def getMigrationIpAddress():
+        """Returns the IP address that live migrations to the node are performed over,
+        or None if live migrations are performed over the cluster network"""
+        return MCVirtConfig().getConfig()['cluster']['migration_ip'] or None
+
+    @staticmethod
+    def _isValidIpAddress(ip_address):
+        """Determines whether an IP address is valid"""
+        pattern = re.compile(r"^((([01]?[0-9]?[0-9]|2[0-4][0-9]|25[0-5])[ (\[]?(\.|dot)"
+                             "[ )\]]?){3}([01]?[0-9]?[0-9]|2[0-4][0-9]|25[0-5]))$")
+        return bool(pattern.match(ip_address))
@@ -0,0 +1,347 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import threading
+import time
+from texttable import Texttable
+
+import libvirt
+
+from mcvirt.mcvirt import MCVirtException
+
+
+class NoSuitableNodeException(MCVirtException):
+    """None of the candidate nodes has the resources to host the VM"""
+    pass
+
+
+class Placement(object):
+    """Provides an index of the CPU, memory and storage usage of the nodes in the
+    cluster, used to place VMs on the least loaded nodes and to propose the
+    migrations that even out the load of the cluster"""
+
+    # Time (in seconds) over which the CPU usage of the node and the VMs is measured
+    SAMPLE_INTERVAL = 1
+    # Default difference between the load of the most and least loaded nodes
+    # (in percent), below which the cluster is considered balanced
+    DEFAULT_THRESHOLD = 10
+    # Default maximum number of migrations proposed by a rebalance
+    DEFAULT_MAXIMUM_MIGRATIONS = 5
+
+    def __init__(self, mcvirt_instance):
+        """Sets member variables"""
+        self.mcvirt_instance = mcvirt_instance
+        self.index = {}
+
+    @staticmethod
+    def _getHostCpuTimes():
+        """Returns the busy and total CPU time of the local node, in jiffies"""
+        with open('/proc/stat', 'r') as stat_fh:
+            cpu_times = [int(cpu_time) for cpu_time in stat_fh.readline().split()[1:]]
+        # The idle and iowait times are the 4th and 5th fields
+        idle_time = sum(cpu_times[3:5])
+        return (sum(cpu_times) - idle_time, sum(cpu_times))
+
+    @staticmethod
+    def _getHostMemory():
+        """Returns the total and available memory of the local node, in MiB"""
+        memory = {}
+        with open('/proc/meminfo', 'r') as meminfo_fh:
+            for line in meminfo_fh:
+                key, value = line.split(':', 1)
+                memory[key] = int(value.split()[0]) / 1024
+        return (memory['MemTotal'], memory.get('MemAvailable', memory['MemFree']))
+
+    @staticmethod
+    def _getDomainStats(libvirt_connection):
+        """Returns the CPU time (in nanoseconds), number of vCPUs and memory (in MiB)
+        of each of the running VMs, keyed by VM name"""
+        stats = libvirt_connection.getAllDomainStats(
+            libvirt.VIR_DOMAIN_STATS_CPU_TOTAL | libvirt.VIR_DOMAIN_STATS_BALLOON |
+            libvirt.VIR_DOMAIN_STATS_VCPU,
+            libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE
+        )
+        return dict((domain.name(), {'cpu_time': domain_stats.get('cpu.time', 0),
+                                     'vcpus': domain_stats.get('vcpu.current', 0),
+                                     'memory': domain_stats.get('balloon.current', 0) / 1024})
+                    for domain, domain_stats in stats)
+
+    @staticmethod
+    def getLocalLoad(mcvirt_instance):
+        """Returns the CPU, memory and storage usage of the local node, along with
+        the resources used by each of the running VMs. CPU usage is measured over
+        the sample interval and given as a fraction of the CPU of the node"""
+        from mcvirt.node.capacity import Capacity
+        libvirt_connection = mcvirt_instance.getLibvirtConnection()
+        host_cpus = libvirt_connection.getInfo()[2]
+
+        # Sample the CPU time of the node and the VMs at the start and end of the interval
+        start_host_times = Placement._getHostCpuTimes()
+        start_domain_stats = Placement._getDomainStats(libvirt_connection)
+        start_time = time.time()
+        time.sleep(Placement.SAMPLE_INTERVAL)
+        end_host_times = Placement._getHostCpuTimes()
+        end_domain_stats = Placement._getDomainStats(libvirt_connection)
+        interval = time.time() - start_time
+
+        busy_time = end_host_times[0] - start_host_times[0]
+        total_time = end_host_times[1] - start_host_times[1]
+        memory_total, memory_free = Placement._getHostMemory()
+        try:
+            storage_free = Capacity.getLocalCapacity()['free']
+        except MCVirtException:
+            storage_free = None
+
+        load = {
+            'cpus': host_cpus,
+            'cpu_usage': float(busy_time) / total_time if total_time else 0.0,
+            'memory_total': memory_total,
+            'memory_free': memory_free,
+            'storage_free': storage_free,
+            'vcpus': 0,
+            'vm_memory': 0,
+            'virtual_machines': {}
+        }
+        for vm_name, domain_stats in end_domain_stats.items():
+            cpu_time = (domain_stats['cpu_time'] -
+                        start_domain_stats.get(vm_name, domain_stats)['cpu_time'])
+            load['vcpus'] += domain_stats['vcpus']
+            load['vm_memory'] += domain_stats['memory']
+            load['virtual_machines'][vm_name] = {
+                'vcpus': domain_stats['vcpus'],
+                'memory': domain_stats['memory'],
+                'cpu_usage': min(1.0, cpu_time / (interval * 1e9 * host_cpus))
+            }
+        return load
+
+    def refresh(self, nodes=None):
+        """Obtains the load of the given nodes (or all nodes), querying
+        the remote nodes in parallel"""
+        from mcvirt.cluster.cluster import Cluster
+        local_hostname = Cluster.getHostname()
+        cluster_instance = Cluster(self.mcvirt_instance)
+        if (nodes is None):
+            nodes = [local_hostname]
+            if (self.mcvirt_instance.initialiseNodes()):
+                nodes += cluster_instance.getNodes()
+
+        threads = []
+        for node in set(nodes):
+            if (node == local_hostname):
+                continue
+            if (node in cluster_instance.getFailedNodes()):
+                self.index[node] = {'error': 'Node is unavailable'}
+                continue
+
+            # Obtain the remote node object before starting the thread, as the
+            # remote node objects are cached on the MCVirt instance
+            remote_object = cluster_instance.getRemoteNode(node)
+
+            def getRemoteLoad(node, remote_object):
+                try:
+                    self.index[node] = remote_object.runRemoteCommand(
+                        'node-placement-getLocalLoad', {})
+                except Exception, e:
+                    self.index[node] = {'error': str(e)}
+
+            thread = threading.Thread(target=getRemoteLoad, args=(node, remote_object))
+            thread.start()
+            threads.append(thread)
+
+        if (local_hostname in nodes):
+            try:
+                self.index[local_hostname] = Placement.getLocalLoad(self.mcvirt_instance)
+            except (MCVirtException, libvirt.libvirtError), e:
+                self.index[local_hostname] = {'error': str(e)}
+
+        for thread in threads:
+            thread.join()
+
+        return self.index
+
+    @staticmethod
+    def getScore(load, cpu_usage=0.0, memory=0):
+        """Returns the load of a node as the greater of its CPU and memory usage
+        (as a fraction), optionally with the given CPU usage and memory (in MiB) added"""
+        memory_usage = (float(load['memory_total'] - load['memory_free'] + memory) /
+                        load['memory_total'])
+        return max(load['cpu_usage'] + cpu_usage, memory_usage)
+
+    def getBestNode(self, nodes, memory=0, storage=0, cpu_usage=0.0):
+        """Returns the node, of the given nodes, that would be the least loaded
+        once hosting a VM with the given memory (in MiB), storage (in MB) and CPU usage"""
+        self.refresh(nodes)
+        scores = {}
+        failures = []
+        for node in sorted(set(nodes)):
+            load = self.index[node]
+            if ('error' in load):
+                failures.append('%s: could not determine load (%s)' % (node, load['error']))
+            elif (load['memory_free'] < memory):
+                failures.append('%s: %sMiB of memory required, %sMiB free' %
+                                (node, memory, load['memory_free']))
+            elif (storage and load['storage_free'] is not None and
+                    load['storage_free'] < storage):
+                failures.append('%s: %sMB of storage required, %sMB free' %
+                                (node, storage, load['storage_free']))
+            else:
+                scores[node] = Placement.getScore(load, cpu_usage, memory)
+
+        if (not scores):
+            raise NoSuitableNodeException(
+                'None of the nodes can host the VM:\n  %s' % '\n  '.join(failures)
+            )
+        return min(sorted(scores), key=lambda node: scores[node])
+
+    def getBestNodeForVirtualMachine(self, vm_object):
+        """Returns the node, of those that are able to host the VM, that would be
+        the least loaded once hosting the VM"""
+        from mcvirt.cluster.cluster import Cluster
+        nodes = [node for node in (vm_object.getAvailableNodes() +
+                                   vm_object.getDisklessNodes())
+                 if node not in Cluster(self.mcvirt_instance).getFailedNodes()]
+        return self.getBestNode(nodes, memory=int(vm_object.getRAM()) / 1024)
+
+    def getRebalancePlan(self, threshold=None, maximum_migrations=None):
+        """Returns the migrations that even out the load of the nodes, chosen by
+        repeatedly moving the running VM that most reduces the load of the most
+        loaded node, until the difference in load between the most and least
+        loaded nodes is within the threshold (in percent)"""
+        from mcvirt.virtual_machine.virtual_machine import VirtualMachine
+        threshold = (self.DEFAULT_THRESHOLD if threshold is None else threshold) / 100.0
+        if (maximum_migrations is None):
+            maximum_migrations = self.DEFAULT_MAXIMUM_MIGRATIONS
+
+        self.refresh()
+        loads = dict((node, dict(load)) for node, load in self.index.items()
+                     if 'error' not in load)
+        all_vms = VirtualMachine.getAllVms(self.mcvirt_instance)
+
+        # Determine the VMs that can be moved from each node. Only running DRBD-backed
+        # VMs can be migrated, to a node that holds a replica or is a diskless node
+        candidates = {}
+        for node, load in loads.items():
+            for vm_name, vm_load in load['virtual_machines'].items():
+                if (vm_name not in all_vms):
+                    continue
+                vm_object = VirtualMachine(self.mcvirt_instance, vm_name)
+                if (vm_object.getStorageType() != 'DRBD'):
+                    continue
+                candidates[vm_name] = {
+                    'node': node,
+                    'load': vm_load,
+                    'destinations': [destination for destination in
+                                     (vm_object.getAvailableNodes() +
+                                      vm_object.getDisklessNodes())
+                                     if destination != node and destination in loads]
+                }
+
+        migrations = []
+        while (len(migrations) < maximum_migrations and len(loads) > 1):
+            scores = dict((node, Placement.getScore(load)) for node, load in loads.items())
+            source_node = max(sorted(scores), key=lambda node: scores[node])
+            if (scores[source_node] - min(scores.values()) <= threshold):
+                break
+
+            # Find the migration from the most loaded node that results in the
+            # lowest load of the source and destination nodes
+            best_migration = None
+            for vm_name, candidate in sorted(candidates.items()):
+                if (candidate['node'] != source_node):
+                    continue
+                vm_load = candidate['load']
+                for destination in candidate['destinations']:
+                    if (loads[destination]['memory_free'] < vm_load['memory']):
+                        continue
+                    new_score = max(
+                        Placement.getScore(loads[source_node], -vm_load['cpu_usage'],
+                                           -vm_load['memory']),
+                        Placement.getScore(loads[destination], vm_load['cpu_usage'],
+                                           vm_load['memory'])
+                    )
+                    if (new_score < scores[source_node] and
+                            (best_migration is None or new_score < best_migration[2])):
+                        best_migration = (vm_name, destination, new_score)
+
+            if (best_migration is None):
+                break
+
+            # Update the loads of the nodes, as if the migration had been performed
+            vm_name, destination, _ = best_migration
+            vm_load = candidates.pop(vm_name)['load']
+            for node, sign in ((source_node, -1), (destination, 1)):
+                loads[node]['cpu_usage'] += sign * vm_load['cpu_usage']
+                loads[node]['memory_free'] -= sign * vm_load['memory']
+            migrations.append({'vm_name': vm_name, 'source': source_node,
+                               'destination': destination})
+
+        return migrations
+
+    def performMigrations(self, migrations, progress_callback=None):
+        """Performs the given migrations, recording the result of each. Migrations can
+        only be performed by the node that the VM is migrated from or to, so those between
+        two remote nodes must be performed by running the rebalance on the source node"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.virtual_machine.virtual_machine import VirtualMachine
+        local_hostname = Cluster.getHostname()
+        failures = []
+        for migration in migrations:
+            vm_object = VirtualMachine(self.mcvirt_instance, migration['vm_name'])
+            try:
+                if (migration['source'] == local_hostname):
+                    vm_object.onlineMigrate(migration['destination'],
+                                            progress_callback=progress_callback)
+                elif (migration['destination'] == local_hostname):
+                    vm_object.onlineMigrateToLocalNode(progress_callback=progress_callback)
+                else:
+                    migration['result'] = 'Run rebalance on %s' % migration['source']
+                    continue
+                migration['result'] = 'Completed'
+            except MCVirtException, e:
+                migration['result'] = 'Failed'
+                failures.append('The VM \'%s\' could not be migrated: %s' %
+                                (migration['vm_name'], str(e)))
+        return failures
+
+    def getLoadTable(self):
+        """Returns a table of the load of each node"""
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('Node', 'CPU (%)', 'Running vCPUs', 'Memory Free (MiB)',
+                      'Running VM Memory (MiB)', 'Storage Free (MB)', 'Load (%)'))
+        for node in sorted(self.index):
+            load = self.index[node]
+            if ('error' in load):
+                table.add_row((node, '-', '-', '-', '-', '-', 'Unavailable'))
+                continue
+            table.add_row((node, int(load['cpu_usage'] * 100),
+                           '%s/%s' % (load['vcpus'], load['cpus']), load['memory_free'],
+                           load['vm_memory'],
+                           '-' if load['storage_free'] is None else load['storage_free'],
+                           int(Placement.getScore(load) * 100)))
+        return table.draw()
+
+    @staticmethod
+    def getMigrationTable(migrations):
+        """Returns a table of proposed or performed migrations"""
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('VM', 'Source', 'Destination', 'Result'))
+        for migration in migrations:
+            table.add_row((migration['vm_name'], migration['source'],
+                           migration['destination'], migration.get('result', 'Proposed')))
+        return table.draw()
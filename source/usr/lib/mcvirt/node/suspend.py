@@ -0,0 +1,124 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+from texttable import Texttable
+
+from mcvirt.mcvirt import MCVirtException
+from mcvirt.concurrent_runner import ConcurrentRunner
+from mcvirt.cluster.cluster import Cluster
+from mcvirt.virtual_machine.virtual_machine import VirtualMachine, PowerStates
+
+
+class InvalidSuspendOptionException(MCVirtException):
+    """The options given for suspending the VMs on the node are not valid"""
+    pass
+
+
+class NodeSuspendFailedException(MCVirtException):
+    """The state of one or more VMs could not be saved or restored"""
+    pass
+
+
+class NodeSuspend(ConcurrentRunner):
+    """Saves the memory state of the VMs running on the local node to disk, so that
+    the node can be rebooted, and restores them afterwards, running a number of
+    saves or restores concurrently to bound the I/O load on the node"""
+
+    DEFAULT_CONCURRENCY = 2
+
+    FAILURE_MESSAGE = 'The state of the VM \'%s\' could not be saved or restored: %s'
+
+    def __init__(self, mcvirt_instance, concurrency=None):
+        """Sets member variables and validates the options"""
+        super(NodeSuspend, self).__init__(
+            self.DEFAULT_CONCURRENCY if concurrency is None else concurrency
+        )
+        self.mcvirt_instance = mcvirt_instance
+        if (self.concurrency < 1):
+            raise InvalidSuspendOptionException(
+                'At least one VM must be able to be suspended or resumed at a time'
+            )
+
+    def _getVirtualMachines(self):
+        """Returns the VMs registered on the local node"""
+        return [VirtualMachine(self.mcvirt_instance, vm_name) for vm_name in
+                sorted(VirtualMachine.getAllVms(self.mcvirt_instance,
+                                                node=Cluster.getHostname()))]
+
+    def _createEntry(self, vm_object):
+        """Returns the record of the operation performed on a VM"""
+        return ConcurrentRunner._initialiseResult({
+            'vm_object': vm_object,
+            'vm_name': vm_object.getName(),
+            'priority': vm_object.getResumePriority()
+        })
+
+    def suspendAll(self, progress_callback=None):
+        """Saves the state of each of the VMs running on the local node,
+        returning the result for each VM"""
+        results = []
+        pending = []
+        for vm_object in self._getVirtualMachines():
+            entry = self._createEntry(vm_object)
+            results.append(entry)
+            if (vm_object.getState() is PowerStates.RUNNING):
+                pending.append(entry)
+            else:
+                entry['error'] = 'The VM is not running'
+
+        def suspendVirtualMachine(entry):
+            if (progress_callback):
+                progress_callback('%s: Saving state' % entry['vm_name'])
+            entry['vm_object'].saveState()
+
+        self._run(pending, suspendVirtualMachine)
+        return results
+
+    def resumeAll(self, progress_callback=None):
+        """Restores the saved state of the VMs on the local node, in order of the
+        resume priority of the VMs, returning the result for each VM"""
+        results = []
+        for vm_object in self._getVirtualMachines():
+            if (vm_object.hasSavedState()):
+                results.append(self._createEntry(vm_object))
+        results.sort(key=lambda entry: (-entry['priority'], entry['vm_name']))
+
+        def resumeVirtualMachine(entry):
+            if (progress_callback):
+                progress_callback('%s: Restoring state' % entry['vm_name'])
+            entry['vm_object'].restoreState()
+
+        # Restore all VMs with the same priority before any VMs with a lower
+        # priority, so that the services that other VMs depend on are available first
+        for priority in sorted(set([entry['priority'] for entry in results]), reverse=True):
+            self._run([entry for entry in results if entry['priority'] == priority],
+                      resumeVirtualMachine)
+        return results
+
+    @staticmethod
+    def getSummary(results):
+        """Returns a report of the result for each VM"""
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('VM', 'Priority', 'Result', 'Duration'))
+        for entry in results:
+            result = entry['result']
+            if (entry['error']):
+                result = '%s: %s' % (result, entry['error'])
+            table.add_row((entry['vm_name'], entry['priority'], result,
+                           '%is' % entry['duration']))
+        return table.draw()
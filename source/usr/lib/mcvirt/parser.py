@@ -16,6 +16,7 @@
 # along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
 
 import argparse
+import json
 
 from mcvirt import MCVirt, MCVirtException
 from virtual_machine.virtual_machine import VirtualMachine, LockStates
@@ -23,15 +24,25 @@ from virtual_machine.hard_drive.config.base import (Base as HardDriveConfigBase,
                                                     Driver as HardDriveDriver)
 from virtual_machine.hard_drive.factory import Factory as HardDriveFactory
 from virtual_machine.hard_drive.drbd import DrbdVolumeNotInSyncException
+from virtual_machine.hard_drive.config.drbd import DRBD as ConfigDRBD
 from virtual_machine.network_adapter import NetworkAdapter
 from virtual_machine.disk_drive import DiskDrive
+from virtual_machine.migration_history import MigrationHistory
+from virtual_machine.migration_recovery import MigrationRecovery
+from virtual_machine.shutdown import VirtualMachineShutdown, ShutdownFailedException
 from node.network import Network
 from cluster.cluster import Cluster
 from system import System
-from node.drbd import DRBD as NodeDRBD
+from node.drbd import DRBD as NodeDRBD, DRBDAllocation
 from node.node import Node
+from node.capacity import Capacity
+from node.drain import NodeDrain, NodeDrainFailedException
+from node.suspend import NodeSuspend, NodeSuspendFailedException
+from node.placement import Placement
+from node.drbd_verification import DRBDVerificationScheduler
 from auth import Auth
 from iso import Iso
+from backup.repository import BackupRepository, BackupRepositoryVerificationException
 
 
 class ThrowingArgumentParser(argparse.ArgumentParser):
@@ -82,12 +93,38 @@ class Parser:
                                                        parents=[self.parent_parser])
         self.start_parser.add_argument('--iso', metavar='ISO Name', type=str,
                                        help='Path of ISO to attach to VM')
+        self.start_parser.add_argument('--best-node', dest='best_node', action='store_true',
+                                       help=('Moves the VM to the least loaded of the nodes'
+                                             ' that are able to host it before starting it'))
         self.start_parser.add_argument('vm_name', metavar='VM Name', type=str, help='Name of VM')
 
         # Add arguments for stopping a VM
         self.stop_parser = self.subparsers.add_parser('stop', help='Stop VM',
                                                       parents=[self.parent_parser])
-        self.stop_parser.add_argument('vm_name', metavar='VM Name', type=str, help='Name of VM')
+        self.stop_mutual_exclusive_group = self.stop_parser.add_mutually_exclusive_group(
+            required=True
+        )
+        self.stop_mutual_exclusive_group.add_argument(
+            '--all', dest='all', action='store_true',
+            help='Shuts down all of the VMs registered on the local node (requires --graceful)'
+        )
+        self.stop_mutual_exclusive_group.add_argument('vm_name', metavar='VM Name', nargs='?',
+                                                      help='Name of VM')
+        self.stop_parser.add_argument(
+            '--graceful', dest='graceful', action='store_true',
+            help=('Shuts down the guest using the QEMU guest agent or an ACPI event, powering'
+                  ' off the VM if it has not stopped by the end of the shutdown timeout')
+        )
+        self.stop_parser.add_argument('--timeout', dest='timeout', metavar='Seconds',
+                                      type=int, default=None,
+                                      help=('The time given for each VM to shut down, overriding'
+                                            ' the shutdown timeout of the VM (default: %i)' %
+                                            VirtualMachineShutdown.DEFAULT_TIMEOUT))
+        self.stop_parser.add_argument('--concurrency', dest='concurrency', metavar='Count',
+                                      type=int, default=None,
+                                      help=('The number of VMs to shut down at the same time'
+                                            ' (default: %i)' %
+                                            VirtualMachineShutdown.DEFAULT_CONCURRENCY))
 
         # Add arguments for resetting a VM
         self.reset_parser = self.subparsers.add_parser('reset', help='Reset VM',
@@ -203,6 +240,104 @@ class Parser:
                                         help='Increases VM disk by provided amount (MB)')
         self.update_parser.add_argument('--disk-id', dest='disk_id', metavar='Disk Id', type=int,
                                         help='The ID of the disk to be increased by')
+        for setting in ['cache', 'io', 'discard', 'detect_zeroes']:
+            self.update_parser.add_argument(
+                '--disk-%s' % setting.replace('_', '-'), dest='disk_%s' % setting,
+                metavar='Disk %s mode' % setting, type=str,
+                choices=HardDriveConfigBase.PERFORMANCE_SETTINGS[setting] + ['inherit'],
+                help=('Sets the %s mode for the disk specified by --disk-id, or for all disks.'
+                      ' \'inherit\' removes the setting.' % setting)
+            )
+        self.update_parser.add_argument(
+            '--disk-queues', dest='disk_queues', metavar='Disk Queues', type=int,
+            help=('Sets the number of virtio queues for the disk specified by --disk-id,'
+                  ' or for all disks. 0 removes the setting.')
+        )
+        self.update_parser.add_argument(
+            '--disk-iothread', dest='disk_iothread', metavar='Disk Iothread', type=int,
+            help=('Assigns the disk specified by --disk-id, or all disks, to an iothread.'
+                  ' 0 removes the setting.')
+        )
+        self.update_parser.add_argument('--iothreads', dest='iothreads', metavar='Iothreads',
+                                        type=int, help='Number of iothreads for the VM')
+        self.update_parser.add_argument(
+            '--iothread-pin', dest='iothread_pin', metavar=('Iothread ID', 'CPU Set'), nargs=2,
+            action='append',
+            help='Pins an iothread to a set of host CPUs. A CPU set of \'none\' removes the pin.'
+        )
+        self.update_parser.add_argument(
+            '--iotune', dest='iotune', metavar=('Limit', 'Value'), nargs=2, action='append',
+            help=('Sets an I/O limit for the disk specified by --disk-id, e.g. total_iops_sec'
+                  ' or read_bytes_sec_max. A value of 0 removes the limit. Available limits: %s' %
+                  ', '.join(HardDriveConfigBase.IOTUNE_SETTINGS))
+        )
+        self.update_parser.add_argument(
+            '--blkio-weight', dest='blkio_weight', metavar='Block I/O Weight', type=int,
+            help=('Sets the block I/O weight of the VM, relative to other VMs (%s-%s).'
+                  ' 0 removes the weight.' % (VirtualMachine.BLKIO_WEIGHT_MINIMUM,
+                                              VirtualMachine.BLKIO_WEIGHT_MAXIMUM))
+        )
+        self.update_parser.add_argument(
+            '--drbd-profile', dest='drbd_profile', metavar='DRBD Tuning Profile', type=str,
+            choices=sorted(ConfigDRBD.DRBD_TUNING_PROFILES) + ['inherit'],
+            help=('Sets the DRBD replication tuning profile for the disk specified by'
+                  ' --disk-id, or for all disks. \'inherit\' removes the profile.')
+        )
+        self.update_parser.add_argument(
+            '--drbd-option', dest='drbd_option', metavar=('Setting', 'Value'), nargs=2,
+            action='append',
+            help=('Sets a DRBD replication tuning setting for the disk specified by --disk-id,'
+                  ' or for all disks, overriding the profile. A value of \'inherit\' removes'
+                  ' the setting. Available settings: %s' %
+                  ', '.join(sorted(ConfigDRBD.DRBD_TUNING_SETTINGS)))
+        )
+        self.update_parser.add_argument(
+            '--migration-profile', dest='migration_profile', metavar='Migration Tuning Profile',
+            type=str, choices=sorted(VirtualMachine.MIGRATION_TUNING_PROFILES) + ['inherit'],
+            help=('Sets the live migration tuning profile for the VM.'
+                  ' \'inherit\' removes the profile.')
+        )
+        self.update_parser.add_argument(
+            '--migration-option', dest='migration_option', metavar=('Setting', 'Value'),
+            nargs=2, action='append',
+            help=('Sets a live migration tuning setting for the VM, overriding the profile.'
+                  ' A value of \'inherit\' removes the setting. Available settings: %s' %
+                  ', '.join(sorted(VirtualMachine.MIGRATION_TUNING_SETTINGS)))
+        )
+        self.update_parser.add_argument(
+            '--shutdown-timeout', dest='shutdown_timeout', metavar='Seconds', type=int,
+            help=('Sets the time given for the VM to shut down gracefully before it is powered'
+                  ' off. A value of -1 uses the default (%i seconds)' %
+                  VirtualMachineShutdown.DEFAULT_TIMEOUT)
+        )
+        self.update_parser.add_argument(
+            '--resume-priority', dest='resume_priority', metavar='Priority', type=int,
+            help=('Sets the priority of the VM when restoring the saved state of the VMs on'
+                  ' a node. VMs with a higher priority are restored first (default: 0)')
+        )
+        self.update_parser.add_argument(
+            '--add-diskless-node', dest='add_diskless_node', metavar='Node', type=str,
+            help=('Allows the DRBD-backed VM to be run on a node that does not hold a replica'
+                  ' of the data, accessing the data over the network (requires DRBD 9)')
+        )
+        self.update_parser.add_argument(
+            '--remove-diskless-node', dest='remove_diskless_node', metavar='Node', type=str,
+            help='Removes a diskless node from the DRBD-backed VM'
+        )
+        self.update_parser.add_argument(
+            '--convert-storage', dest='convert_storage', metavar='Storage Type', type=str,
+            choices=['DRBD'],
+            help=('Converts the local storage of the stopped VM to DRBD, replicating the data'
+                  ' to the nodes given by --nodes')
+        )
+        self.update_parser.add_argument(
+            '--nodes', dest='nodes', metavar='Node', type=str, nargs='+',
+            help='The nodes that the storage is replicated to, when converting the storage'
+        )
+        self.update_parser.add_argument(
+            '--sync-rate', dest='sync_rate', metavar='MiB/s', type=int,
+            help='Limits the rate of the initial sync, when converting the storage'
+        )
         self.update_parser.add_argument('--attach-iso', '--iso', dest='iso', metavar='ISO Name',
                                         type=str,
                                         help=('Attach an ISO to a running VM.'
@@ -320,6 +455,15 @@ class Parser:
             help='Displays which node that the VM is currently registered on',
             action='store_true'
         )
+        self.info_mutually_exclusive_group.add_argument(
+            '--migration-history',
+            dest='migration_history',
+            help=('Displays the statistics of the online-migrations performed in the cluster,'
+                  ' optionally for a single VM'),
+            action='store_true'
+        )
+        self.info_parser.add_argument('--json', dest='json', action='store_true',
+                                      help='Displays the migration history in JSON')
         self.info_parser.add_argument('vm_name', metavar='VM Name', type=str, help='Name of VM',
                                       nargs='?', default=None)
 
@@ -356,9 +500,15 @@ class Parser:
             dest='destination_node',
             metavar='Destination Node',
             type=str,
-            required=True,
             help='The name of the destination node for the VM to be migrated to'
         )
+        self.migrate_parser.add_argument(
+            '--recover',
+            dest='recover_migration',
+            help=('Resumes the recovery of the VM after a failed online-migration,'
+                  ' if the recovery was interrupted'),
+            action='store_true'
+        )
         self.migrate_parser.add_argument(
             '--online',
             dest='online_migration',
@@ -377,6 +527,19 @@ class Parser:
             help='Waits for the VM to shutdown before performing the migration',
             action='store_true'
         )
+        self.migrate_parser.add_argument(
+            '--migration-profile', dest='migration_profile', metavar='Migration Tuning Profile',
+            type=str, choices=sorted(VirtualMachine.MIGRATION_TUNING_PROFILES),
+            help=('The live migration tuning profile to use for an online-migration,'
+                  ' overriding the settings of the VM')
+        )
+        self.migrate_parser.add_argument(
+            '--migration-option', dest='migration_option', metavar=('Setting', 'Value'),
+            nargs=2, action='append',
+            help=('Sets a live migration tuning setting for an online-migration, overriding'
+                  ' the settings of the VM. Available settings: %s' %
+                  ', '.join(sorted(VirtualMachine.MIGRATION_TUNING_SETTINGS)))
+        )
         self.migrate_parser.add_argument('vm_name', metavar='VM Name', type=str, help='Name of VM')
 
         # Create sub-parser for moving VMs
@@ -448,6 +611,67 @@ class Parser:
                                       metavar='Cluster IP Address',
                                       help=('Sets the cluster IP address for the local node,'
                                             ' used for DRBD and cluster management.'))
+        self.node_parser.add_argument('--set-migration-ip-address', dest='migration_ip_address',
+                                      metavar='Migration IP Address',
+                                      help=('Sets the IP address that live migrations to the'
+                                            ' local node are performed over. An empty value'
+                                            ' uses the cluster IP address.'))
+        self.node_parser.add_argument('--capacity', dest='capacity', action='store_true',
+                                      help=('Displays the storage capacity and free space of'
+                                            ' each node in the cluster'))
+        self.node_drain_mutual_exclusive_group = self.node_parser.add_mutually_exclusive_group()
+        self.node_drain_mutual_exclusive_group.add_argument(
+            '--drain', dest='drain', action='store_true',
+            help=('Moves all VMs registered on the local node to other nodes, so that'
+                  ' maintenance can be performed on the node')
+        )
+        self.node_drain_mutual_exclusive_group.add_argument(
+            '--undrain', dest='undrain', action='store_true',
+            help='Returns the VMs that were moved by a drain of the local node'
+        )
+        self.node_drain_mutual_exclusive_group.add_argument(
+            '--suspend-all', dest='suspend_all', action='store_true',
+            help=('Saves the memory state of the VMs running on the local node to disk,'
+                  ' so that they can be restored after the node is rebooted')
+        )
+        self.node_drain_mutual_exclusive_group.add_argument(
+            '--resume-all', dest='resume_all', action='store_true',
+            help=('Restores the saved state of the VMs on the local node, in order of the'
+                  ' resume priority of the VMs')
+        )
+        self.node_parser.add_argument('--concurrency', dest='concurrency', metavar='Count',
+                                      type=int, default=None,
+                                      help=('The number of VMs to move, suspend or resume at'
+                                            ' the same time (default: %i when draining the'
+                                            ' node, %i when suspending or resuming VMs)' %
+                                            (NodeDrain.DEFAULT_CONCURRENCY,
+                                             NodeSuspend.DEFAULT_CONCURRENCY)))
+        self.node_parser.add_argument('--bandwidth', dest='bandwidth', metavar='MiB/s',
+                                      type=int, default=None,
+                                      help=('The bandwidth of the migration link, in MiB/s,'
+                                            ' which is divided between the concurrent'
+                                            ' migrations when draining the node'))
+
+        # Create subparser for rebalancing the load of the cluster
+        self.rebalance_parser = self.subparsers.add_parser(
+            'rebalance',
+            help='Propose or perform migrations to even out the load of the nodes',
+            parents=[self.parent_parser]
+        )
+        self.rebalance_parser.add_argument('--execute', dest='execute', action='store_true',
+                                           help=('Performs the proposed migrations that'
+                                                 ' involve the local node'))
+        self.rebalance_parser.add_argument('--threshold', dest='threshold', metavar='Percent',
+                                           type=int, default=None,
+                                           help=('The difference in load between the most'
+                                                 ' and least loaded nodes, below which the'
+                                                 ' cluster is balanced (default: %i)' %
+                                                 Placement.DEFAULT_THRESHOLD))
+        self.rebalance_parser.add_argument('--max-migrations', dest='maximum_migrations',
+                                           metavar='Count', type=int, default=None,
+                                           help=('The maximum number of migrations to'
+                                                 ' propose (default: %i)' %
+                                                 Placement.DEFAULT_MAXIMUM_MIGRATIONS))
 
         # Create subparser for VM verification
         self.verify_parser = self.subparsers.add_parser(
@@ -462,6 +686,18 @@ class Parser:
                                                         help='Verifies all of the VMs')
         self.verify_mutual_exclusive_group.add_argument('vm_name', metavar='VM Name', nargs='?',
                                                         help='Specify a single VM to verify')
+        self.verify_parser.add_argument('--concurrency', dest='concurrency', metavar='Count',
+                                        type=int, default=None,
+                                        help=('The number of verifications to run at the same'
+                                              ' time (default: %i)' %
+                                              DRBDVerificationScheduler.DEFAULT_CONCURRENCY))
+        self.verify_parser.add_argument('--rate', dest='rate', metavar='Rate', default=None,
+                                        help=('The total rate of the verifications, e.g. 100M.'
+                                              ' This is divided between the concurrent'
+                                              ' verifications'))
+        self.verify_parser.add_argument('--resume', dest='resume', action='store_true',
+                                        help=('Skip the volumes that were verified by a'
+                                              ' previous, interrupted, verification'))
 
         if (auth_object.checkPermission(Auth.PERMISSIONS.MANAGE_DRBD)):
             # Create subparser for drbd-related commands
@@ -478,6 +714,20 @@ class Parser:
                 '--list', dest='list', action='store_true',
                 help='List DRBD volumes on the system'
             )
+            self.drbd_mutually_exclusive_group.add_argument(
+                '--status', dest='status', action='store_true',
+                help=('Display the progress of syncs and verifications of the DRBD'
+                      ' volumes on the node')
+            )
+            self.drbd_mutually_exclusive_group.add_argument(
+                '--reconcile-allocations', dest='reconcile_allocations', action='store_true',
+                help=('Rebuild the table of allocated DRBD minors and ports from the'
+                      ' DRBD volumes in the cluster')
+            )
+            self.drbd_parser.add_argument(
+                '--json', dest='json', action='store_true',
+                help='Output the DRBD status as JSON, for use by monitoring tools'
+            )
 
         # Create subparser for backup commands
         self.backup_parser = self.subparsers.add_parser('backup',
@@ -498,15 +748,61 @@ class Parser:
             help='Enable DRBD support on the cluster',
             action='store_true'
         )
+        self.backup_mutual_exclusive_group.add_argument(
+            '--create-backup',
+            dest='create_backup',
+            help='Store a backup of the disk in the backup repository',
+            action='store_true'
+        )
+        self.backup_mutual_exclusive_group.add_argument(
+            '--restore-backup',
+            dest='restore_backup',
+            metavar='Backup ID',
+            type=str,
+            help='Overwrite the disk with a backup from the backup repository'
+        )
+        self.backup_mutual_exclusive_group.add_argument(
+            '--delete-backup',
+            dest='delete_backup',
+            metavar='Backup ID',
+            type=str,
+            help='Remove a backup from the backup repository'
+        )
+        self.backup_mutual_exclusive_group.add_argument(
+            '--list-backups',
+            dest='list_backups',
+            help='List the backups in the backup repository',
+            action='store_true'
+        )
+        self.backup_mutual_exclusive_group.add_argument(
+            '--garbage-collect',
+            dest='garbage_collect',
+            help='Remove data from the backup repository that is not used by any backup',
+            action='store_true'
+        )
+        self.backup_mutual_exclusive_group.add_argument(
+            '--verify-repository',
+            dest='verify_repository',
+            help='Check the integrity of the backups in the backup repository',
+            action='store_true'
+        )
         self.backup_parser.add_argument(
             '--disk-id',
             dest='disk_id',
             metavar='Disk Id',
             type=int,
-            required=True,
             help='The ID of the disk to manage the backup snapshot of'
         )
-        self.backup_parser.add_argument('vm_name', metavar='VM Name', type=str, help='Name of VM')
+        self.backup_parser.add_argument(
+            '--repository',
+            dest='repository',
+            metavar='Repository Path',
+            type=str,
+            default=None,
+            help='Path of the backup repository (default: %s)' % MCVirt.BACKUP_STORAGE_DIR
+        )
+        self.backup_parser.add_argument('vm_name', metavar='VM Name', type=str, help='Name of VM',
+                                        nargs='?', default=None)
 
         # Create subparser for managing VM locks
         self.lock_parser = self.subparsers.add_parser('lock', help='Perform verification of VMs',
@@ -532,6 +828,22 @@ class Parser:
         if (self.print_status):
             print status
 
+    def _getMigrationTuningConfig(self, args):
+        """Returns the live migration tuning settings given by the
+           --migration-profile and --migration-option arguments"""
+        tuning_config = {}
+        if (args.migration_profile):
+            tuning_config['profile'] = (None if args.migration_profile == 'inherit' else
+                                        args.migration_profile)
+        for setting, value in (args.migration_option or []):
+            if (value == 'inherit'):
+                tuning_config[setting] = None
+            elif (value.isdigit()):
+                tuning_config[setting] = int(value)
+            else:
+                tuning_config[setting] = value
+        return tuning_config
+
     def parse_arguments(self, script_args=None, mcvirt_instance=None):
         """Parses arguments and performs actions based on the arguments"""
         # If arguments have been specified, split, so that
@@ -576,13 +888,37 @@ class Parser:
                 iso_object = Iso(mcvirt_instance, args.iso)
             else:
                 iso_object = None
-            vm_object.start(iso_object)
+            vm_object.start(iso_object, best_node=args.best_node)
             self.printStatus('Successfully started VM')
 
         elif (action == 'stop'):
-            vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
-            vm_object.stop()
-            self.printStatus('Successfully stopped VM')
+            if (args.all and not args.graceful):
+                self.parser.error('--all can only be used with --graceful')
+            if ((args.timeout is not None or args.concurrency is not None) and
+                    not args.graceful):
+                self.parser.error('--timeout and --concurrency can only be used with --graceful')
+
+            if (args.all):
+                # Shut down the VMs registered on the local node concurrently
+                vm_shutdown = VirtualMachineShutdown(mcvirt_instance, timeout=args.timeout,
+                                                     concurrency=args.concurrency)
+                vm_objects = [VirtualMachine(mcvirt_instance, vm_name) for vm_name in
+                              sorted(VirtualMachine.getAllVms(mcvirt_instance,
+                                                              node=Cluster.getHostname()))]
+                results = vm_shutdown.shutdown(vm_objects, progress_callback=self.printStatus)
+                self.printStatus(VirtualMachineShutdown.getSummary(results))
+
+                failures = VirtualMachineShutdown.getFailures(results)
+                if (failures):
+                    raise ShutdownFailedException("\n".join(failures))
+            elif (args.graceful):
+                vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
+                method = vm_object.shutdown(timeout=args.timeout)
+                self.printStatus('Successfully stopped VM (%s)' % method.lower())
+            else:
+                vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
+                vm_object.stop()
+                self.printStatus('Successfully stopped VM')
 
         elif (action == 'reset'):
             vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
@@ -670,12 +1006,84 @@ class Parser:
                     # If DRBD is not enabled, assume the default storage type is being used
                     vm_storage_type = HardDriveFactory.DEFAULT_STORAGE_TYPE
 
-                HardDriveFactory.create(vm_object, size=args.add_disk, storage_type=storage_type,
-                                        driver=hard_disk_driver)
+                HardDriveFactory.create(vm_object, size=args.add_disk,
+                                        storage_type=vm_storage_type,
+                                        driver=args.hard_disk_driver)
             if (args.increase_disk and args.disk_id):
                 harddrive_object = HardDriveFactory.getObject(vm_object, args.disk_id)
                 harddrive_object.increaseSize(args.increase_disk)
 
+            performance_config = {}
+            for setting in ['cache', 'io', 'discard', 'detect_zeroes']:
+                value = getattr(args, 'disk_%s' % setting)
+                if (value is not None):
+                    performance_config[setting] = None if value == 'inherit' else value
+            for setting in ['queues', 'iothread']:
+                value = getattr(args, 'disk_%s' % setting)
+                if (value is not None):
+                    performance_config[setting] = value or None
+            if (args.iothreads is not None or args.iothread_pin):
+                iothread_pinning = {}
+                for iothread_id, cpuset in (args.iothread_pin or []):
+                    iothread_pinning[iothread_id] = None if cpuset == 'none' else cpuset
+                # Iothreads must exist before disks are assigned to them, but
+                # disks must be removed from iothreads before they are removed
+                if (performance_config and args.iothreads is not None and
+                        args.iothreads < vm_object.getIoThreadConfig()[0]):
+                    vm_object.updateDiskPerformance(performance_config, args.disk_id)
+                    performance_config = {}
+                vm_object.updateIoThreads(args.iothreads, iothread_pinning)
+            if (performance_config):
+                vm_object.updateDiskPerformance(performance_config, args.disk_id)
+            if (args.iotune):
+                if (args.disk_id is None):
+                    self.parser.error('--disk-id must be specified when setting I/O limits')
+                iotune_config = {}
+                for setting, value in args.iotune:
+                    if (not value.isdigit()):
+                        self.parser.error('I/O limit \'%s\' must be a number' % setting)
+                    iotune_config[setting] = int(value) or None
+                vm_object.updateDiskIoTune(iotune_config, args.disk_id)
+            if (args.blkio_weight is not None):
+                vm_object.updateBlkioWeight(args.blkio_weight or None)
+            if (args.drbd_profile or args.drbd_option):
+                tuning_config = {}
+                if (args.drbd_profile):
+                    tuning_config['profile'] = (None if args.drbd_profile == 'inherit' else
+                                                args.drbd_profile)
+                for setting, value in (args.drbd_option or []):
+                    if (value == 'inherit'):
+                        tuning_config[setting] = None
+                    elif (value.isdigit()):
+                        tuning_config[setting] = int(value)
+                    else:
+                        tuning_config[setting] = value
+                vm_object.updateDrbdTuning(tuning_config, args.disk_id)
+            if (args.migration_profile or args.migration_option):
+                vm_object.updateMigrationTuning(self._getMigrationTuningConfig(args))
+            if (args.resume_priority is not None):
+                vm_object.setResumePriority(args.resume_priority)
+            if (args.shutdown_timeout is not None):
+                vm_object.setShutdownTimeout(None if args.shutdown_timeout == -1
+                                             else args.shutdown_timeout)
+            if (args.convert_storage):
+                vm_object.convertStorage(args.convert_storage, args.nodes,
+                                         sync_rate=args.sync_rate,
+                                         progress_callback=self.printStatus)
+                self.printStatus('Converted the storage of %s to %s' %
+                                 (vm_object.getName(), args.convert_storage))
+            elif (args.nodes or args.sync_rate):
+                self.parser.error('--nodes and --sync-rate can only be used with'
+                                  ' --convert-storage')
+            if (args.add_diskless_node):
+                vm_object.addDisklessNode(args.add_diskless_node)
+                self.printStatus('Added diskless node %s to VM %s' %
+                                 (args.add_diskless_node, vm_object.getName()))
+            if (args.remove_diskless_node):
+                vm_object.removeDisklessNode(args.remove_diskless_node)
+                self.printStatus('Removed diskless node %s from VM %s' %
+                                 (args.remove_diskless_node, vm_object.getName()))
+
             if args.iso:
                 iso_object = Iso(mcvirt_instance, args.iso)
                 disk_object = DiskDrive(vm_object)
@@ -745,7 +1153,17 @@ class Parser:
         elif (action == 'info'):
             if (not args.vm_name and (args.vnc_port or args.node)):
                 self.parser.error('Must provide a VM Name')
-            if (args.vm_name):
+            if (args.json and not args.migration_history):
+                self.parser.error('--json can only be used with --migration-history')
+            if (args.migration_history):
+                if (mcvirt_instance is None):
+                    mcvirt_instance = MCVirt(ignore_failed_nodes=True)
+                records = MigrationHistory.getRecords(mcvirt_instance, args.vm_name)
+                if (args.json):
+                    self.printStatus(json.dumps(records, indent=4, sort_keys=True))
+                else:
+                    self.printStatus(MigrationHistory.getTable(records))
+            elif (args.vm_name):
                 vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
                 if (args.vnc_port):
                     self.printStatus(vm_object.getVncPort())
@@ -768,20 +1186,34 @@ class Parser:
 
         elif (action == 'migrate'):
             vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
-            if (args.online_migration):
-                vm_object.onlineMigrate(args.destination_node)
+            if (args.recover_migration):
+                owner_node = MigrationRecovery.resume(vm_object)
+                self.printStatus('Successfully recovered \'%s\', which is registered on %s' %
+                                 (vm_object.getName(), owner_node or 'no node'))
+            elif (not args.destination_node):
+                self.parser.error('The destination node must be specified using --node')
             else:
-                vm_object.offlineMigrate(
-                    args.destination_node,
-                    wait_for_vm_shutdown=args.wait_for_shutdown,
-                    start_after_migration=args.start_after_migration)
-            self.printStatus('Successfully migrated \'%s\' to %s' %
-                             (vm_object.getName(), args.destination_node))
+                if (args.online_migration):
+                    vm_object.onlineMigrate(
+                        args.destination_node,
+                        tuning_config=self._getMigrationTuningConfig(args),
+                        progress_callback=self.printStatus
+                    )
+                elif (args.migration_profile or args.migration_option):
+                    self.parser.error('Migration tuning settings can only be used with --online')
+                else:
+                    vm_object.offlineMigrate(
+                        args.destination_node,
+                        wait_for_vm_shutdown=args.wait_for_shutdown,
+                        start_after_migration=args.start_after_migration)
+                self.printStatus('Successfully migrated \'%s\' to %s' %
+                                 (vm_object.getName(), args.destination_node))
 
         elif (action == 'move'):
             vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
             vm_object.move(destination_node=args.destination_node,
-                           source_node=args.source_node)
+                           source_node=args.source_node,
+                           progress_callback=self.printStatus)
 
         elif (action == 'cluster'):
             if (args.cluster_action == 'add-node'):
@@ -805,33 +1237,74 @@ class Parser:
                 Node.setClusterIpAddress(mcvirt_instance, args.ip_address)
                 self.printStatus('Successfully set cluster IP address to %s' % args.ip_address)
 
+            if (args.migration_ip_address is not None):
+                Node.setMigrationIpAddress(mcvirt_instance, args.migration_ip_address)
+                self.printStatus('Successfully set migration IP address to %s' %
+                                 (args.migration_ip_address or 'the cluster IP address'))
+
+            if (args.capacity):
+                self.printStatus(Capacity(mcvirt_instance).getCapacityTable())
+
+            if (args.drain or args.undrain):
+                node_drain = NodeDrain(mcvirt_instance, concurrency=args.concurrency,
+                                       bandwidth=args.bandwidth)
+                if (args.drain):
+                    plan = node_drain.drain(progress_callback=self.printStatus)
+                else:
+                    plan = node_drain.undrain(progress_callback=self.printStatus)
+                self.printStatus(NodeDrain.getSummary(plan))
+
+                failures = NodeDrain.getFailures(plan)
+                if (failures):
+                    raise NodeDrainFailedException("\n".join(failures))
+
+            if (args.suspend_all or args.resume_all):
+                node_suspend = NodeSuspend(mcvirt_instance, concurrency=args.concurrency)
+                if (args.suspend_all):
+                    results = node_suspend.suspendAll(progress_callback=self.printStatus)
+                else:
+                    results = node_suspend.resumeAll(progress_callback=self.printStatus)
+                self.printStatus(NodeSuspend.getSummary(results))
+
+                failures = NodeSuspend.getFailures(results)
+                if (failures):
+                    raise NodeSuspendFailedException("\n".join(failures))
+
+        elif (action == 'rebalance'):
+            placement = Placement(mcvirt_instance)
+            migrations = placement.getRebalancePlan(threshold=args.threshold,
+                                                    maximum_migrations=args.maximum_migrations)
+            self.printStatus(placement.getLoadTable())
+            if (not migrations):
+                self.printStatus('The load of the nodes is balanced')
+            else:
+                failures = []
+                if (args.execute):
+                    failures = placement.performMigrations(migrations,
+                                                           progress_callback=self.printStatus)
+                self.printStatus(Placement.getMigrationTable(migrations))
+                if (failures):
+                    raise MCVirtException("\n".join(failures))
+
         elif (action == 'verify'):
             if (args.vm_name):
                 vm_objects = [VirtualMachine(mcvirt_instance, args.vm_name)]
             elif (args.all):
                 vm_objects = mcvirt_instance.getAllVirtualMachineObjects()
 
-            # Iterate over the VMs and check each disk
-            failures = []
-            for vm_object in vm_objects:
-                for disk_object in vm_object.getDiskObjects():
-                    if (disk_object.getType() == 'DRBD'):
-                        # Catch any exceptions due to the DRBD volume not being in-sync
-                        try:
-                            disk_object.verify()
-                            self.printStatus(
-                                ('DRBD verification for %s (%s) completed '
-                                 'without out-of-sync blocks') %
-                                (disk_object.getConfigObject()._getResourceName(),
-                                 vm_object.getName())
-                            )
-                        except DrbdVolumeNotInSyncException, e:
-                            # Append the not-in-sync exception message to an array,
-                            # so the rest of the disks can continue to be checked
-                            failures.append(e.message)
+            # Verify all of the DRBD disks of the VMs
+            disk_objects = [disk_object for vm_object in vm_objects
+                            for disk_object in vm_object.getDiskObjects()
+                            if disk_object.getType() == 'DRBD']
+            verification_scheduler = DRBDVerificationScheduler(mcvirt_instance,
+                                                               concurrency=args.concurrency,
+                                                               rate=args.rate)
+            results = verification_scheduler.run(disk_objects, resume=args.resume)
+            self.printStatus(DRBDVerificationScheduler.getSummary(results))
 
             # If there were any failures during the verification, raise the exception and print
             # all exception messages
+            failures = DRBDVerificationScheduler.getFailures(results)
             if (failures):
                 raise DrbdVolumeNotInSyncException("\n".join(failures))
 
@@ -840,14 +1313,48 @@ class Parser:
                 NodeDRBD.enable(mcvirt_instance)
             if (args.list):
                 self.printStatus(NodeDRBD.list(mcvirt_instance))
+            if (args.status):
+                self.printStatus(NodeDRBD.status(mcvirt_instance, json_output=args.json))
+            if (args.reconcile_allocations):
+                resource_count = DRBDAllocation.reconcile(mcvirt_instance)
+                self.printStatus('Rebuilt DRBD allocation table from %i DRBD volume(s)' %
+                                 resource_count)
 
         elif (action == 'backup'):
-            vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
-            hard_drive_object = HardDriveFactory.getObject(vm_object, args.disk_id)
-            if (args.create_snapshot):
-                self.printStatus(hard_drive_object.createBackupSnapshot())
-            elif (args.delete_snapshot):
-                hard_drive_object.deleteBackupSnapshot()
+            if (args.list_backups or args.delete_backup or args.garbage_collect or
+                    args.verify_repository):
+                backup_repository = BackupRepository(mcvirt_instance, args.repository)
+                if (args.list_backups):
+                    self.printStatus(backup_repository.list(args.vm_name))
+                elif (args.delete_backup):
+                    backup_repository.deleteBackup(args.delete_backup)
+                elif (args.garbage_collect):
+                    removed_chunks, removed_bytes = backup_repository.garbageCollect()
+                    self.printStatus('Removed %i chunk(s), freeing %iMB' %
+                                     (removed_chunks, removed_bytes / (1024 * 1024)))
+                elif (args.verify_repository):
+                    errors = backup_repository.verify()
+                    if (errors):
+                        raise BackupRepositoryVerificationException("\n".join(errors))
+                    self.printStatus('Backup repository verified successfully')
+            else:
+                if (not args.vm_name or args.disk_id is None):
+                    self.parser.error('Must provide a VM Name and disk ID')
+                vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
+                hard_drive_object = HardDriveFactory.getObject(vm_object, args.disk_id)
+                if (args.create_snapshot):
+                    self.printStatus(hard_drive_object.createBackupSnapshot())
+                elif (args.delete_snapshot):
+                    hard_drive_object.deleteBackupSnapshot()
+                elif (args.create_backup):
+                    backup_repository = BackupRepository(mcvirt_instance, args.repository)
+                    backup_id, statistics = hard_drive_object.createBackup(backup_repository)
+                    self.printStatus('Created backup %s: %i chunk(s), %i new, %iMB stored' %
+                                     (backup_id, statistics['chunks'], statistics['new_chunks'],
+                                      statistics['new_bytes'] / (1024 * 1024)))
+                elif (args.restore_backup):
+                    backup_repository = BackupRepository(mcvirt_instance, args.repository)
+                    hard_drive_object.restoreBackup(backup_repository, args.restore_backup)
 
         elif (action == 'lock'):
             vm_object = VirtualMachine(mcvirt_instance, args.vm_name)
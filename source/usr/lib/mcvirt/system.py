@@ -37,17 +37,19 @@ class System:
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             cwd=cwd)
-        if (command_process.wait() and raise_exception_on_failure):
+        # Read the output whilst waiting for the process, to avoid the process
+        # blocking once the pipe buffers have filled
+        stdout, stderr = command_process.communicate()
+        if (command_process.returncode and raise_exception_on_failure):
             raise MCVirtCommandException(
                 "Command: %s\nExit code: %s\nOutput:\n%s" %
                 (' '.join(command_args),
                  command_process.returncode,
-                 command_process.stdout.read() +
-                 command_process.stderr.read()))
+                 stdout + stderr))
         return (
             command_process.returncode,
-            command_process.stdout.read(),
-            command_process.stderr.read())
+            stdout,
+            stderr)
 
     @staticmethod
     def getUserInput(display_text, password=False):
@@ -57,3 +59,22 @@ class System:
         else:
             sys.stdout.write(display_text)
             return sys.stdin.readline()
+
+    @staticmethod
+    def formatSize(size_bytes, suffix=''):
+        """Returns a human-readable representation of a number of bytes"""
+        if (size_bytes is None):
+            return 'Unknown'
+        size = float(size_bytes)
+        for unit in ['B', 'KiB', 'MiB', 'GiB']:
+            if (size < 1024):
+                return '%.1f %s%s' % (size, unit, suffix)
+            size /= 1024
+        return '%.1f TiB%s' % (size, suffix)
+
+    @staticmethod
+    def formatDuration(seconds):
+        """Returns a number of seconds in the format h:mm:ss"""
+        if (seconds is None):
+            return 'Unknown'
+        return '%i:%02i:%02i' % (seconds / 3600, (seconds % 3600) / 60, seconds % 60)
@@ -0,0 +1,166 @@
+# Copyright (c) 2015 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from mcvirt.parser import Parser
+from mcvirt.mcvirt import MCVirt
+from mcvirt.virtual_machine.virtual_machine import VirtualMachine
+from mcvirt.backup.repository import BackupRepository, BackupDoesNotExistException
+from mcvirt.backup.chunker import Chunker
+from mcvirt.test.common import stop_and_delete
+
+
+class BackupTests(unittest.TestCase):
+    """Provides unit tests for the backup repository"""
+
+    @staticmethod
+    def suite():
+        """Returns a test suite"""
+        suite = unittest.TestSuite()
+        suite.addTest(BackupTests('test_backup_restore'))
+        suite.addTest(BackupTests('test_backup_deduplication'))
+        suite.addTest(BackupTests('test_backup_segment_chunking'))
+        suite.addTest(BackupTests('test_garbage_collect'))
+        return suite
+
+    def setUp(self):
+        """Creates various objects and deletes any test VMs"""
+        # Create MCVirt parser object
+        self.parser = Parser(print_status=False)
+
+        # Get an MCVirt instance
+        self.mcvirt = MCVirt()
+
+        # Setup variable for test VM
+        self.test_vm = \
+            {
+                'name': 'mcvirt-unittest-vm',
+                'cpu_count': 1,
+                'memory_allocation': 100,
+                'disk_size': [100],
+                'networks': ['Production']
+            }
+
+        # Create a temporary backup repository
+        self.repository_path = tempfile.mkdtemp()
+
+        # Ensure any test VM is stopped and removed from the machine
+        stop_and_delete(self.mcvirt, self.test_vm['name'])
+
+    def tearDown(self):
+        """Stops and tears down any test VMs"""
+        # Ensure any test VM is stopped and removed from the machine
+        stop_and_delete(self.mcvirt, self.test_vm['name'])
+        shutil.rmtree(self.repository_path)
+        self.mcvirt = None
+
+    def createTestVm(self):
+        """Creates the test VM and writes random data to the start of its disk"""
+        test_vm_object = VirtualMachine.create(
+            self.mcvirt,
+            self.test_vm['name'],
+            self.test_vm['cpu_count'],
+            self.test_vm['memory_allocation'],
+            self.test_vm['disk_size'],
+            self.test_vm['networks'],
+            storage_type='Local')
+        test_data = os.urandom(1024 * 1024)
+        disk_object = test_vm_object.getDiskObjects()[0]
+        with open(disk_object.getConfigObject()._getDiskPath(), 'r+b') as disk_fh:
+            disk_fh.write(test_data)
+        return test_vm_object, test_data
+
+    def test_backup_restore(self):
+        """Backs up a disk to a repository and restores it, using the argument parser"""
+        test_vm_object, test_data = self.createTestVm()
+        disk_object = test_vm_object.getDiskObjects()[0]
+
+        self.parser.parse_arguments('backup --create-backup --disk-id 1 --repository %s %s' %
+                                    (self.repository_path, self.test_vm['name']),
+                                    mcvirt_instance=self.mcvirt)
+        backup_repository = BackupRepository(self.mcvirt, self.repository_path)
+        backup_ids = backup_repository.getBackupIds(self.test_vm['name'])
+        self.assertEqual(len(backup_ids), 1)
+        self.assertEqual(backup_repository.verify(), [])
+
+        # Overwrite the disk and restore the backup
+        with open(disk_object.getConfigObject()._getDiskPath(), 'r+b') as disk_fh:
+            disk_fh.write(os.urandom(1024 * 1024))
+        self.parser.parse_arguments(
+            'backup --restore-backup %s --disk-id 1 --repository %s %s' %
+            (backup_ids[0], self.repository_path, self.test_vm['name']),
+            mcvirt_instance=self.mcvirt
+        )
+        with open(disk_object.getConfigObject()._getDiskPath(), 'rb') as disk_fh:
+            self.assertEqual(disk_fh.read(len(test_data)), test_data)
+
+    def test_backup_deduplication(self):
+        """Ensures that a second backup of an unchanged disk does not store any new data"""
+        test_vm_object, _ = self.createTestVm()
+        disk_object = test_vm_object.getDiskObjects()[0]
+        backup_repository = BackupRepository(self.mcvirt, self.repository_path)
+
+        first_backup_id, statistics = disk_object.createBackup(backup_repository)
+        self.assertTrue(statistics['new_chunks'] > 0)
+        second_backup_id, statistics = disk_object.createBackup(backup_repository)
+        self.assertEqual(statistics['new_chunks'], 0)
+        self.assertEqual(statistics['new_bytes'], 0)
+
+        # Ensure that both backups have been kept
+        self.assertNotEqual(first_backup_id, second_backup_id)
+        self.assertEqual(len(backup_repository.getBackupIds(self.test_vm['name'])), 2)
+
+    def test_backup_segment_chunking(self):
+        """Ensures that the chunks of a backup do not depend on the segments that
+        the source is read in"""
+        backup_repository = BackupRepository(self.mcvirt, self.repository_path)
+        backup_repository.SEGMENT_SIZE = 3 * 1024 * 1024 + 12345
+        source_data = (os.urandom(5 * 1024 * 1024) + '\0' * (6 * 1024 * 1024) +
+                       os.urandom(9 * 1024 * 1024))
+        source_path = os.path.join(self.repository_path, 'source')
+        with open(source_path, 'wb') as source_fh:
+            source_fh.write(source_data)
+
+        backup_id, statistics = backup_repository.createBackup(source_path,
+                                                               self.test_vm['name'], 1)
+        chunk_lengths = [chunk_length for _, chunk_length in
+                         backup_repository.getManifest(backup_id)['chunks']]
+        chunker = Chunker(**BackupRepository.DEFAULT_CHUNK_SIZES)
+        self.assertEqual(chunk_lengths, chunker.getChunkLengths(source_data))
+        self.assertEqual(statistics['chunks'], len(chunk_lengths))
+
+    def test_garbage_collect(self):
+        """Removes a backup and ensures that its data is removed by garbage collection"""
+        test_vm_object, _ = self.createTestVm()
+        disk_object = test_vm_object.getDiskObjects()[0]
+        backup_repository = BackupRepository(self.mcvirt, self.repository_path)
+        backup_id, _ = disk_object.createBackup(backup_repository)
+
+        self.parser.parse_arguments('backup --delete-backup %s --repository %s' %
+                                    (backup_id, self.repository_path),
+                                    mcvirt_instance=self.mcvirt)
+        with self.assertRaises(BackupDoesNotExistException):
+            backup_repository.getManifest(backup_id)
+
+        removed_chunks, removed_bytes = backup_repository.garbageCollect()
+        self.assertTrue(removed_chunks > 0)
+        self.assertTrue(removed_bytes > 0)
+        self.assertEqual(backup_repository.verify(), [])
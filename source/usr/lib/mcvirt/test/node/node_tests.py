@@ -21,6 +21,9 @@ from mcvirt.parser import Parser
 from mcvirt.mcvirt import MCVirt
 from mcvirt.node.node import Node, InvalidIPAddressException, InvalidVolumeGroupNameException
 from mcvirt.mcvirt_config import MCVirtConfig
+from mcvirt.node.capacity import Capacity, InsufficientStorageSpaceException
+from mcvirt.node.placement import Placement, NoSuitableNodeException
+from mcvirt.cluster.cluster import Cluster
 
 
 class NodeTests(unittest.TestCase):
@@ -35,6 +38,8 @@ class NodeTests(unittest.TestCase):
         suite.addTest(NodeTests('test_set_invalid_ip_address'))
         suite.addTest(NodeTests('test_set_volume_group'))
         suite.addTest(NodeTests('test_set_invalid_volume_group'))
+        suite.addTest(NodeTests('test_capacity'))
+        suite.addTest(NodeTests('test_placement'))
         return suite
 
     def setUp(self):
@@ -85,3 +90,32 @@ class NodeTests(unittest.TestCase):
             with self.assertRaises(InvalidVolumeGroupNameException):
                 self.parser.parse_arguments('node --set-vm-vg %s' % volume_group,
                                             mcvirt_instance=self.mcvirt)
+
+    def test_capacity(self):
+        """Obtains the capacity of the local node and ensures that an exception is
+           raised when more space is required than is available"""
+        capacity = Capacity.getLocalCapacity()
+        self.assertEqual(capacity['volume_group'], self.original_volume_group)
+        self.assertTrue(0 <= capacity['free'] <= capacity['size'])
+
+        capacity_object = Capacity(self.mcvirt)
+        capacity_object.ensureFreeSpace({Cluster.getHostname(): capacity['free']})
+        with self.assertRaises(InsufficientStorageSpaceException):
+            capacity_object.ensureFreeSpace({Cluster.getHostname(): capacity['free'] + 1})
+
+        self.parser.parse_arguments('node --capacity', mcvirt_instance=self.mcvirt)
+
+    def test_placement(self):
+        """Obtains the load of the local node and ensures that a VM can only be placed
+           on a node with enough free memory"""
+        load = Placement.getLocalLoad(self.mcvirt)
+        self.assertTrue(0 <= load['cpu_usage'] <= 1)
+        self.assertTrue(0 <= load['memory_free'] <= load['memory_total'])
+        self.assertTrue(0 <= Placement.getScore(load) <= 1)
+
+        placement = Placement(self.mcvirt)
+        self.assertEqual(placement.getBestNode([Cluster.getHostname()]), Cluster.getHostname())
+        with self.assertRaises(NoSuitableNodeException):
+            placement.getBestNode([Cluster.getHostname()], memory=load['memory_total'] + 1)
+
+        self.parser.parse_arguments('rebalance', mcvirt_instance=self.mcvirt)
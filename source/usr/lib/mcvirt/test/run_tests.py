@@ -27,6 +27,7 @@ from mcvirt.test.auth_tests import AuthTests
 from mcvirt.test.virtual_machine.hard_drive.drbd_tests import DrbdTests
 from mcvirt.test.update_tests import UpdateTests
 from mcvirt.test.virtual_machine.online_migrate_tests import OnlineMigrateTests
+from mcvirt.test.backup_tests import BackupTests
 
 if __name__ == '__main__':
     runner = unittest.TextTestRunner(verbosity=4)
@@ -37,8 +38,9 @@ if __name__ == '__main__':
     update_test_suite = UpdateTests.suite()
     online_migrate_test_suite = OnlineMigrateTests.suite()
     node_test_suite = NodeTests.suite()
+    backup_test_suite = BackupTests.suite()
     all_tests = unittest.TestSuite(
         [virtual_machine_test_suite, network_test_suite, auth_test_suite,
          drbd_test_suite, update_test_suite, node_test_suite,
-         online_migrate_test_suite])
+         online_migrate_test_suite, backup_test_suite])
     sys.exit(not runner.run(all_tests).wasSuccessful())
@@ -20,7 +20,13 @@ import unittest
 from mcvirt.parser import Parser
 from mcvirt.mcvirt import MCVirt
 from mcvirt.virtual_machine.virtual_machine import VirtualMachine, PowerStates
-from mcvirt.virtual_machine.network_adapter import NetworkAdapterDoesNotExistException
+from mcvirt.virtual_machine.network_adapter import (NetworkAdapter,
+                                                    NetworkAdapterDoesNotExistException,
+                                                    MacAddressAlreadyInUseException)
+from mcvirt.node.network import Network, NetworkUtilizedException
+from mcvirt.virtual_machine.hard_drive.config.base import (InvalidDiskPerformanceConfigException,
+                                                           InvalidIoTuneConfigException)
+from mcvirt.node.capacity import InsufficientStorageSpaceException
 
 
 def stopAndDelete(mcvirt_connection, vm_name):
@@ -42,6 +48,13 @@ class UpdateTests(unittest.TestCase):
         suite = unittest.TestSuite()
         suite.addTest(UpdateTests('test_remove_network'))
         suite.addTest(UpdateTests('test_remove_network_non_existant'))
+        suite.addTest(UpdateTests('test_network_interface_index'))
+        suite.addTest(UpdateTests('test_disk_performance'))
+        suite.addTest(UpdateTests('test_disk_performance_invalid'))
+        suite.addTest(UpdateTests('test_disk_iotune'))
+        suite.addTest(UpdateTests('test_disk_iotune_invalid'))
+        suite.addTest(UpdateTests('test_increase_disk_running'))
+        suite.addTest(UpdateTests('test_increase_disk_insufficient_space'))
         return suite
 
     def setUp(self):
@@ -99,6 +112,44 @@ class UpdateTests(unittest.TestCase):
         # Ensure there is no longer any network adapters attached to the VM
         self.assertEqual(len(test_vm_object.getNetworkObjects()), 0)
 
+    def test_network_interface_index(self):
+        """Ensures that the index of the interfaces connected to each network is
+           updated when network interfaces are added and removed"""
+        test_vm_object = VirtualMachine.create(
+            self.mcvirt,
+            self.test_vm['name'],
+            self.test_vm['cpu_count'],
+            self.test_vm['memory_allocation'],
+            self.test_vm['disks'],
+            self.test_vm['networks'])
+        network_object = Network(self.mcvirt, self.test_vm['networks'][0])
+        mac_address = test_vm_object.getNetworkObjects()[0].getMacAddress()
+        self.assertEqual(network_object.getConnectedInterfaces().get(mac_address),
+                         self.test_vm['name'])
+        self.assertTrue(Network.checkMacAddressExists(mac_address))
+
+        # Ensure that an interface cannot be created with a MAC address that is in use
+        with self.assertRaises(MacAddressAlreadyInUseException):
+            NetworkAdapter.create(test_vm_object, network_object, mac_address)
+
+        # Ensure that the network cannot be removed whilst the VM is connected to it
+        with self.assertRaises(NetworkUtilizedException):
+            network_object.delete()
+
+        # Remove the interface and ensure that it is removed from the index
+        self.parser.parse_arguments('update %s --remove-network %s' % (self.test_vm['name'],
+                                                                       mac_address),
+                                    mcvirt_instance=self.mcvirt)
+        self.assertFalse(mac_address in network_object.getConnectedInterfaces())
+        self.assertFalse(Network.checkMacAddressExists(mac_address))
+
+        # Ensure that the interfaces of the VM are removed from the index when
+        # the VM is removed
+        mac_address = NetworkAdapter.create(test_vm_object, network_object).getMacAddress()
+        self.assertTrue(Network.checkMacAddressExists(mac_address))
+        test_vm_object.delete(True)
+        self.assertFalse(Network.checkMacAddressExists(mac_address))
+
     def test_remove_network_non_existant(self):
         """Attempts to remove a network interface from a VM
            that doesn't exist"""
@@ -123,3 +174,163 @@ class UpdateTests(unittest.TestCase):
 
         # Ensure that the network adapter is still attached to the VM
         self.assertEqual(len(test_vm_object.getNetworkObjects()), 1)
+
+    def test_disk_performance(self):
+        """Configures disk performance settings and iothreads, using the parser,
+           and ensures that they are applied to the domain XML"""
+        test_vm_object = VirtualMachine.create(
+            self.mcvirt,
+            self.test_vm['name'],
+            self.test_vm['cpu_count'],
+            self.test_vm['memory_allocation'],
+            self.test_vm['disks'],
+            self.test_vm['networks'],
+            hard_drive_driver='VIRTIO')
+
+        self.parser.parse_arguments('update %s --disk-cache none --disk-io native' %
+                                    self.test_vm['name'],
+                                    mcvirt_instance=self.mcvirt)
+        self.parser.parse_arguments('update %s --iothreads 1 --iothread-pin 1 0 '
+                                    '--disk-iothread 1 --disk-queues 2 --disk-id 1' %
+                                    self.test_vm['name'],
+                                    mcvirt_instance=self.mcvirt)
+
+        domain_xml = test_vm_object.getLibvirtConfig()
+        driver_xml = domain_xml.find('./devices/disk[@device="disk"]/driver')
+        self.assertEqual(driver_xml.get('cache'), 'none')
+        self.assertEqual(driver_xml.get('io'), 'native')
+        self.assertEqual(driver_xml.get('iothread'), '1')
+        self.assertEqual(driver_xml.get('queues'), '2')
+        self.assertEqual(domain_xml.find('./iothreads').text, '1')
+        self.assertEqual(domain_xml.find('./cputune/iothreadpin').get('cpuset'), '0')
+
+        # Remove the disk settings and iothreads
+        self.parser.parse_arguments('update %s --disk-iothread 0 --disk-queues 0 --disk-id 1 '
+                                    '--iothreads 0 --iothread-pin 1 none' %
+                                    self.test_vm['name'],
+                                    mcvirt_instance=self.mcvirt)
+        domain_xml = test_vm_object.getLibvirtConfig()
+        driver_xml = domain_xml.find('./devices/disk[@device="disk"]/driver')
+        self.assertEqual(driver_xml.get('iothread'), None)
+        self.assertEqual(driver_xml.get('cache'), 'none')
+        self.assertEqual(domain_xml.find('./iothreads'), None)
+
+    def test_disk_performance_invalid(self):
+        """Attempts to configure conflicting disk performance settings"""
+        VirtualMachine.create(
+            self.mcvirt,
+            self.test_vm['name'],
+            self.test_vm['cpu_count'],
+            self.test_vm['memory_allocation'],
+            self.test_vm['disks'],
+            self.test_vm['networks'],
+            hard_drive_driver='VIRTIO')
+
+        with self.assertRaises(InvalidDiskPerformanceConfigException):
+            self.parser.parse_arguments('update %s --disk-cache writeback --disk-io native' %
+                                        self.test_vm['name'],
+                                        mcvirt_instance=self.mcvirt)
+
+        # Disks cannot be assigned to iothreads that do not exist
+        with self.assertRaises(InvalidDiskPerformanceConfigException):
+            self.parser.parse_arguments('update %s --disk-iothread 1' % self.test_vm['name'],
+                                        mcvirt_instance=self.mcvirt)
+
+    def test_disk_iotune(self):
+        """Configures I/O limits and the block I/O weight, using the parser, and ensures
+           that they are applied to the domain XML and the running VM"""
+        test_vm_object = VirtualMachine.create(
+            self.mcvirt,
+            self.test_vm['name'],
+            self.test_vm['cpu_count'],
+            self.test_vm['memory_allocation'],
+            self.test_vm['disks'],
+            self.test_vm['networks'])
+
+        self.parser.parse_arguments('update %s --disk-id 1 --iotune total_iops_sec 500 '
+                                    '--iotune total_iops_sec_max 1000 --blkio-weight 200' %
+                                    self.test_vm['name'],
+                                    mcvirt_instance=self.mcvirt)
+        domain_xml = test_vm_object.getLibvirtConfig()
+        iotune_xml = domain_xml.find('./devices/disk[@device="disk"]/iotune')
+        self.assertEqual(iotune_xml.find('./total_iops_sec').text, '500')
+        self.assertEqual(iotune_xml.find('./total_iops_sec_max').text, '1000')
+        self.assertEqual(domain_xml.find('./blkiotune/weight').text, '200')
+
+        # Update the limits whilst the VM is running
+        test_vm_object.start()
+        self.parser.parse_arguments('update %s --disk-id 1 --iotune total_iops_sec_max 0 '
+                                    '--iotune total_iops_sec 250' % self.test_vm['name'],
+                                    mcvirt_instance=self.mcvirt)
+        target_dev = test_vm_object.getDiskObjects()[0].getConfigObject()._getTargetDev()
+        live_iotune = test_vm_object._getLibvirtDomainObject().blockIoTune(target_dev, 0)
+        self.assertEqual(live_iotune['total_iops_sec'], 250)
+        self.assertEqual(live_iotune['total_iops_sec_max'], 0)
+        test_vm_object.stop()
+
+        iotune_xml = test_vm_object.getLibvirtConfig().find(
+            './devices/disk[@device="disk"]/iotune'
+        )
+        self.assertEqual(iotune_xml.find('./total_iops_sec').text, '250')
+        self.assertEqual(iotune_xml.find('./total_iops_sec_max'), None)
+
+    def test_disk_iotune_invalid(self):
+        """Attempts to configure conflicting I/O limits"""
+        VirtualMachine.create(
+            self.mcvirt,
+            self.test_vm['name'],
+            self.test_vm['cpu_count'],
+            self.test_vm['memory_allocation'],
+            self.test_vm['disks'],
+            self.test_vm['networks'])
+
+        # Total limits cannot be combined with read/write limits
+        with self.assertRaises(InvalidIoTuneConfigException):
+            self.parser.parse_arguments('update %s --disk-id 1 --iotune total_bytes_sec 1000 '
+                                        '--iotune read_bytes_sec 1000' % self.test_vm['name'],
+                                        mcvirt_instance=self.mcvirt)
+
+        # Burst limits require the base limit
+        with self.assertRaises(InvalidIoTuneConfigException):
+            self.parser.parse_arguments('update %s --disk-id 1 --iotune read_iops_sec_max 1000' %
+                                        self.test_vm['name'],
+                                        mcvirt_instance=self.mcvirt)
+
+    def test_increase_disk_running(self):
+        """Increases the size of a disk whilst the VM is running and ensures
+           that the new size is passed to the running VM"""
+        test_vm_object = VirtualMachine.create(
+            self.mcvirt,
+            self.test_vm['name'],
+            self.test_vm['cpu_count'],
+            self.test_vm['memory_allocation'],
+            self.test_vm['disks'],
+            self.test_vm['networks'])
+        test_vm_object.start()
+
+        self.parser.parse_arguments('update %s --disk-id 1 --increase-disk 100' %
+                                    self.test_vm['name'],
+                                    mcvirt_instance=self.mcvirt)
+
+        disk_object = test_vm_object.getDiskObjects()[0]
+        self.assertEqual(disk_object.getSize(), 200)
+        target_dev = disk_object.getConfigObject()._getTargetDev()
+        capacity, _, _ = test_vm_object._getLibvirtDomainObject().blockInfo(target_dev)
+        self.assertEqual(capacity, 200 * 1024 * 1024)
+
+    def test_increase_disk_insufficient_space(self):
+        """Attempts to increase the size of a disk by more than the free space
+           in the volume group"""
+        test_vm_object = VirtualMachine.create(
+            self.mcvirt,
+            self.test_vm['name'],
+            self.test_vm['cpu_count'],
+            self.test_vm['memory_allocation'],
+            self.test_vm['disks'],
+            self.test_vm['networks'])
+
+        with self.assertRaises(InsufficientStorageSpaceException):
+            self.parser.parse_arguments('update %s --disk-id 1 --increase-disk 1073741824' %
+                                        self.test_vm['name'],
+                                        mcvirt_instance=self.mcvirt)
+        self.assertEqual(test_vm_object.getDiskObjects()[0].getSize(), 100)
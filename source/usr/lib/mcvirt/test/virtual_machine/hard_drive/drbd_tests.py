@@ -16,13 +16,21 @@
 # along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
 
 import unittest
+import json
 import os
+import tempfile
 import time
 
 from mcvirt.test.common import stop_and_delete
-from mcvirt.node.drbd import DRBD as NodeDRBD
-from mcvirt.virtual_machine.hard_drive.drbd import DrbdConnectionState, DrbdVolumeNotInSyncException
-from mcvirt.virtual_machine.virtual_machine import VirtualMachine
+from mcvirt.node.drbd import (DRBD as NodeDRBD, DRBDStatus, DRBDMonitor,
+                              DRBDStateTimeoutException, DRBDAllocation, DRBDSocket,
+                              DRBDAllocationConflictException)
+from mcvirt.virtual_machine.hard_drive.drbd import (DrbdConnectionState, DrbdDiskState,
+                                                    DrbdRoleState, DrbdVolumeNotInSyncException)
+from mcvirt.node.drbd_verification import (DRBDVerificationScheduler,
+                                           InvalidVerificationOptionException)
+from mcvirt.virtual_machine.hard_drive.config.drbd import InvalidDrbdTuningConfigException
+from mcvirt.virtual_machine.virtual_machine import VirtualMachine, UnsuitableNodeException
 from mcvirt.parser import Parser
 from mcvirt.mcvirt import MCVirt
 from mcvirt.system import System
@@ -36,6 +44,20 @@ class DrbdTests(unittest.TestCase):
         """Returns a test suite of the Virtual Machine tests"""
         suite = unittest.TestSuite()
         suite.addTest(DrbdTests('test_verify'))
+        suite.addTest(DrbdTests('test_status'))
+        suite.addTest(DrbdTests('test_monitor'))
+        suite.addTest(DrbdTests('test_allocation'))
+        suite.addTest(DrbdTests('test_allocation_table'))
+        suite.addTest(DrbdTests('test_verify_concurrent'))
+        suite.addTest(DrbdTests('test_verification_rate'))
+        suite.addTest(DrbdTests('test_create_without_sync'))
+        suite.addTest(DrbdTests('test_tuning'))
+        suite.addTest(DrbdTests('test_sync_progress'))
+        suite.addTest(DrbdTests('test_status_json'))
+        suite.addTest(DrbdTests('test_socket_message'))
+        suite.addTest(DrbdTests('test_socket_events'))
+        suite.addTest(DrbdTests('test_diskless_status'))
+        suite.addTest(DrbdTests('test_diskless_node'))
 
         return suite
 
@@ -125,3 +147,379 @@ class DrbdTests(unittest.TestCase):
         # Attempt to start the VM, ensuring an exception is raised
         with self.assertRaises(DrbdVolumeNotInSyncException):
             test_vm_object.start()
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_status(self):
+        """Ensures that the status obtained for all DRBD resources matches drbdadm"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               self.test_vms['TEST_VM_1']['disk_size'],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+
+        for disk_object in test_vm_object.getDiskObjects():
+            resource_name = disk_object.getConfigObject()._getResourceName()
+            DRBDStatus.invalidate()
+            _, role, _ = System.runCommand([NodeDRBD.DRBDADM, 'role', resource_name])
+            _, disk_state, _ = System.runCommand([NodeDRBD.DRBDADM, 'dstate', resource_name])
+            self.assertEqual(disk_object._drbdGetRole(),
+                             tuple(DrbdRoleState(state) for state in role.strip().split('/')))
+            self.assertEqual(disk_object._drbdGetDiskState(),
+                             tuple(DrbdDiskState(state)
+                                   for state in disk_state.strip().split('/')))
+
+            # Ensure that the status for all resources is obtained in a single call
+            # and is then cached
+            self.assertTrue(disk_object.getConfigObject()._getDrbdMinor() in
+                            DRBDStatus.getAllResources())
+            self.assertTrue(DRBDStatus.getAllResources() is DRBDStatus.getAllResources())
+
+        # Ensure the DRBD list can be generated
+        NodeDRBD.list(self.mcvirt)
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_monitor(self):
+        """Uses the DRBD monitor to wait for state changes of a DRBD resource"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               self.test_vms['TEST_VM_1']['disk_size'],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+        monitor = DRBDMonitor.getInstance()
+        disk_object = test_vm_object.getDiskObjects()[0]
+        minor = disk_object.getConfigObject()._getDrbdMinor()
+
+        # Wait for the initial sync to complete
+        monitor.waitForState(
+            minor,
+            lambda status: status['connection_state'] == DrbdConnectionState.CONNECTED.value,
+            timeout=120
+        )
+
+        # Ensure that the change of role is observed when the VM is started
+        event_id = monitor.getEventId()
+        test_vm_object.start()
+        status = monitor.waitForState(minor,
+                                      lambda status: status['role'][0] == 'Primary',
+                                      timeout=10, since=event_id)
+        self.assertEqual(status['resource'], disk_object.getConfigObject()._getResourceName())
+
+        # Ensure that an exception is raised if the state is not reached within the timeout
+        with self.assertRaises(DRBDStateTimeoutException):
+            monitor.waitForState(minor, lambda status: status['role'][0] == 'Secondary',
+                                 timeout=1)
+        test_vm_object.stop()
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_allocation(self):
+        """Ensures that DRBD minors and ports are reserved and released in the
+        allocation table and that the table can be rebuilt"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               self.test_vms['TEST_VM_1']['disk_size'],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+        config_object = test_vm_object.getDiskObjects()[0].getConfigObject()
+        resource_name = config_object._getResourceName()
+        minor = config_object._getDrbdMinor()
+        port = config_object._getDrbdPort()
+
+        # Ensure that the minor and port of the disk have been reserved
+        table = DRBDAllocation.getTable()
+        self.assertEqual(table['minor']['allocated'][str(minor)], resource_name)
+        self.assertEqual(table['port']['allocated'][str(port)], resource_name)
+
+        # Ensure that the rebuilt table contains the same allocations
+        self.parser.parse_arguments('drbd --reconcile-allocations', mcvirt_instance=self.mcvirt)
+        reconciled_table = DRBDAllocation.getTable()
+        self.assertEqual(reconciled_table['minor']['allocated'], table['minor']['allocated'])
+        self.assertEqual(reconciled_table['port']['allocated'], table['port']['allocated'])
+
+        # Ensure that the minor and port are released when the VM is removed
+        test_vm_object.delete(remove_data=True)
+        table = DRBDAllocation.getTable()
+        self.assertFalse(str(minor) in table['minor']['allocated'])
+        self.assertFalse(str(port) in table['port']['allocated'])
+
+    def test_allocation_table(self):
+        """Ensures that values are allocated from the allocation table in order,
+        re-using released values"""
+        table = DRBDAllocation.buildTable([('resource_a', 1, 7789),
+                                           ('resource_c', 3, 7791)])
+        self.assertEqual(table['minor']['next'], 4)
+        self.assertEqual(table['minor']['free'], [2])
+        self.assertEqual(DRBDAllocation._allocateValue(table['minor']), 2)
+        self.assertEqual(DRBDAllocation._allocateValue(table['minor']), 4)
+
+        # Recording a value above the next value makes skipped values available,
+        # with the lowest free value still re-used first
+        DRBDAllocation._recordValue(table['port'], 7795, 'resource_d')
+        self.assertEqual(table['port']['next'], 7796)
+        self.assertEqual(DRBDAllocation._allocateValue(table['port']), 7790)
+        self.assertEqual(DRBDAllocation._allocateValue(table['port']), 7792)
+
+        # A value allocated to a resource cannot be recorded for another resource
+        with self.assertRaises(DRBDAllocationConflictException):
+            DRBDAllocation._recordValue(table['minor'], 3, 'resource_d')
+        self.assertEqual(table['minor']['allocated']['3'], 'resource_c')
+        DRBDAllocation._recordValue(table['minor'], 3, 'resource_c')
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_verify_concurrent(self):
+        """Performs concurrent, rate-limited, verifications of the disks of a VM"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               [100, 100],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+
+        # Wait for the initial sync of the disks to complete
+        for disk_object in test_vm_object.getDiskObjects():
+            DRBDMonitor.getInstance().waitForState(
+                disk_object.getConfigObject()._getDrbdMinor(),
+                lambda status: status['connection_state'] == DrbdConnectionState.CONNECTED.value,
+                timeout=120
+            )
+
+        self.parser.parse_arguments('verify --concurrency 2 --rate 20M %s' %
+                                    self.test_vms['TEST_VM_1']['name'],
+                                    mcvirt_instance=self.mcvirt)
+
+        # Ensure the disks are in-sync and that the progress of the
+        # verifications is removed once they have completed
+        for disk_object in test_vm_object.getDiskObjects():
+            self.assertTrue(disk_object._isInSync())
+        self.assertFalse(os.path.isfile(DRBDVerificationScheduler.STATE_FILE))
+
+    def test_verification_rate(self):
+        """Ensures that the verification rate is divided between the verifications"""
+        scheduler = DRBDVerificationScheduler(self.mcvirt, concurrency=4, rate='100M')
+        self.assertEqual(scheduler.getVerificationRate(), 25600)
+        self.assertEqual(DRBDVerificationScheduler.parseRate('512'), 512)
+        self.assertEqual(DRBDVerificationScheduler.parseRate('1g'), 1024 ** 2)
+
+        for invalid_rate in ['0', 'fast', '10T']:
+            with self.assertRaises(InvalidVerificationOptionException):
+                DRBDVerificationScheduler.parseRate(invalid_rate)
+        with self.assertRaises(InvalidVerificationOptionException):
+            DRBDVerificationScheduler(self.mcvirt, concurrency=0)
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_create_without_sync(self):
+        """Ensures that newly created DRBD volumes are up-to-date on both nodes,
+        without performing an initial sync"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               self.test_vms['TEST_VM_1']['disk_size'],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+
+        for disk_object in test_vm_object.getDiskObjects():
+            self.assertEqual(disk_object._drbdGetConnectionState(), DrbdConnectionState.CONNECTED)
+            self.assertEqual(disk_object._drbdGetDiskState(),
+                             (DrbdDiskState.UP_TO_DATE, DrbdDiskState.UP_TO_DATE))
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_tuning(self):
+        """Configures DRBD replication tuning settings for a VM and its disk, using the
+        parser, and ensures that they are rendered in the DRBD resource configuration"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               self.test_vms['TEST_VM_1']['disk_size'],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+
+        self.parser.parse_arguments('update %s --drbd-profile lan-10g' %
+                                    self.test_vms['TEST_VM_1']['name'],
+                                    mcvirt_instance=self.mcvirt)
+        self.parser.parse_arguments('update %s --disk-id 1 --drbd-option c-max-rate 1G '
+                                    '--drbd-option protocol B' %
+                                    self.test_vms['TEST_VM_1']['name'],
+                                    mcvirt_instance=self.mcvirt)
+
+        # Ensure that the disk settings override the settings of the VM profile
+        config_object = test_vm_object.getDiskObjects()[0].getConfigObject()
+        tuning_config = config_object.getDrbdTuningConfig()
+        self.assertEqual(tuning_config['c-max-rate'], '1G')
+        self.assertEqual(tuning_config['protocol'], 'B')
+        self.assertEqual(tuning_config['al-extents'], 6007)
+
+        drbd_config_file = open(config_object._getDrbdConfigFile(), 'r')
+        drbd_config = drbd_config_file.read()
+        drbd_config_file.close()
+        for setting in ['c-max-rate 1G;', 'protocol B;', 'al-extents 6007;']:
+            self.assertTrue(setting in drbd_config)
+
+        # Ensure that invalid settings are rejected
+        with self.assertRaises(InvalidDrbdTuningConfigException):
+            self.parser.parse_arguments('update %s --drbd-option al-extents many' %
+                                        self.test_vms['TEST_VM_1']['name'],
+                                        mcvirt_instance=self.mcvirt)
+        with self.assertRaises(InvalidDrbdTuningConfigException):
+            self.parser.parse_arguments('update %s --drbd-option sndbuf-size 1M' %
+                                        self.test_vms['TEST_VM_1']['name'],
+                                        mcvirt_instance=self.mcvirt)
+
+    def test_sync_progress(self):
+        """Ensures that the progress of a sync is obtained from /proc/drbd and that
+        speeds are estimated where they are not reported by DRBD"""
+        proc_fd, proc_path = tempfile.mkstemp()
+        os.write(proc_fd, (
+            ' 1: cs:SyncSource ro:Primary/Secondary ds:UpToDate/Inconsistent C r-----\n'
+            '    ns:0 nr:0 dw:0 dr:0 al:0 bm:0 lo:0 pe:0 ua:0 ap:0 ep:1 wo:f oos:716800\n'
+            "\t[=====>..............] sync'ed: 31.7% (700/1024)M\n"
+            '\tfinish: 0:01:10 speed: 10,240 (10,240) K/sec\n'
+        ))
+        os.close(proc_fd)
+        original_proc_path = DRBDStatus.PROC_DRBD
+        DRBDStatus.PROC_DRBD = proc_path
+        try:
+            status = DRBDStatus._obtainProcStatus()[1]
+        finally:
+            DRBDStatus.PROC_DRBD = original_proc_path
+            os.remove(proc_path)
+        self.assertEqual(status['sync_percent'], 31.7)
+        self.assertEqual(status['sync_remaining'], 716800)
+        self.assertEqual(status['sync_speed'], 10240)
+        self.assertEqual(status['sync_eta'], 70)
+
+        # Ensure that the speed and ETA are estimated from the previous status
+        previous_status = dict(status, sync_remaining=737280)
+        status.update({'sync_speed': None, 'sync_eta': None})
+        DRBDStatus._estimateSyncProgress({1: status}, {1: previous_status}, 2)
+        self.assertEqual(status['sync_speed'], 10240)
+        self.assertEqual(status['sync_eta'], 70)
+        self.assertEqual(NodeDRBD._formatProgress(status), '31.7%, ETA 0:01:10')
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_status_json(self):
+        """Ensures that the DRBD status can be obtained as JSON"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               self.test_vms['TEST_VM_1']['disk_size'],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+        resource_name = test_vm_object.getDiskObjects()[0].getConfigObject()._getResourceName()
+
+        volume_statuses = json.loads(NodeDRBD.status(self.mcvirt, json_output=True))
+        volume_status = [volume_status for volume_status in volume_statuses
+                         if volume_status['volume'] == resource_name][0]
+        self.assertEqual(volume_status['vm'], self.test_vms['TEST_VM_1']['name'])
+        self.assertTrue(volume_status['configured'])
+        for key in ['sync_percent', 'sync_speed_bytes', 'outstanding_bytes', 'eta_seconds']:
+            self.assertTrue(key in volume_status)
+
+        # Ensure that the status table can be generated using the parser
+        self.parser.parse_arguments('drbd --status', mcvirt_instance=self.mcvirt)
+
+    def test_socket_message(self):
+        """Ensures that resource names are parsed from the messages sent to the DRBD socket"""
+        self.assertEqual(DRBDSocket._parseMessage('resource_a\nresource_b\n'),
+                         ['resource_a', 'resource_b'])
+
+        # Ensure that messages without a terminator, from older hook scripts, are accepted
+        self.assertEqual(DRBDSocket._parseMessage('resource_a'), ['resource_a'])
+
+        # Ensure that incomplete and invalid resource names are ignored
+        self.assertEqual(DRBDSocket._parseMessage('resource_a\nresou', complete=False),
+                         ['resource_a'])
+        self.assertEqual(DRBDSocket._parseMessage('../resource_a\n'), [])
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_socket_events(self):
+        """Sends a burst of out-of-sync events to the DRBD socket and records events
+        in the spool, ensuring that the hard drive is marked as out-of-sync"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               self.test_vms['TEST_VM_1']['disk_size'],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+        disk_object = test_vm_object.getDiskObjects()[0]
+        resource_name = disk_object.getConfigObject()._getResourceName()
+        disk_object.setSyncState(True)
+
+        drbd_socket = DRBDSocket(self.mcvirt)
+        for _ in range(100):
+            DRBDSocket.sendResources([resource_name])
+        drbd_socket.stop()
+        self.assertFalse(disk_object._isInSync())
+
+        # Ensure that events recorded in the spool are processed
+        disk_object.setSyncState(True)
+        DRBDSocket.spoolResource(resource_name)
+        DRBDSocket.spoolResource(resource_name)
+        self.assertEqual(DRBDSocket.getSpooledResources(), [resource_name])
+
+        # Ensure that the hard drive is treated as out-of-sync whilst the
+        # event is in the spool
+        self.assertFalse(disk_object._isInSync())
+        with self.assertRaises(DrbdVolumeNotInSyncException):
+            disk_object._ensureInSync()
+        self.assertEqual(DRBDSocket.drainSpool(self.mcvirt), 1)
+        self.assertFalse(disk_object._isInSync())
+        self.assertEqual(DRBDSocket.getSpooledResources(), [])
+
+    def test_diskless_status(self):
+        """Ensures that the state of a resource with a DRBD 9 diskless client is obtained
+        from the replica of the data, rather than from the diskless client"""
+        events2_state = DRBDStatus._getEmptyEvents2State()
+        for line in [
+            'exists resource name:mcvirt_vm-test_disk-1 role:Primary suspended:no',
+            ('exists connection name:mcvirt_vm-test_disk-1 peer-node-id:1 conn-name:node2 '
+             'connection:Connected role:Secondary'),
+            ('exists connection name:mcvirt_vm-test_disk-1 peer-node-id:2 conn-name:node3 '
+             'connection:Connected role:Secondary'),
+            'exists device name:mcvirt_vm-test_disk-1 volume:0 minor:1 disk:UpToDate',
+            ('exists peer-device name:mcvirt_vm-test_disk-1 peer-node-id:2 conn-name:node3 '
+             'volume:0 replication:Established peer-disk:Diskless'),
+            ('exists peer-device name:mcvirt_vm-test_disk-1 peer-node-id:1 conn-name:node2 '
+             'volume:0 replication:SyncSource peer-disk:Inconsistent done:50.00 '
+             'out-of-sync:512')
+        ]:
+            DRBDStatus._parseEvents2Line(events2_state, line)
+        status = DRBDStatus._buildEvents2Status(events2_state)[1]
+        self.assertEqual(status['connection_state'], DrbdConnectionState.SYNC_SOURCE.value)
+        self.assertEqual(status['disk_state'], ['UpToDate', 'Inconsistent'])
+        self.assertEqual(status['peers']['2']['disk_state'], DrbdDiskState.DISKLESS.value)
+        self.assertEqual(status['peers']['2']['connection_state'],
+                         DrbdConnectionState.CONNECTED.value)
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_diskless_node(self):
+        """Ensures that nodes that hold a replica of the data of a VM
+        cannot be added as diskless nodes"""
+        test_vm_object = VirtualMachine.create(self.mcvirt, self.test_vms['TEST_VM_1']['name'],
+                                               self.test_vms['TEST_VM_1']['cpu_count'],
+                                               self.test_vms['TEST_VM_1']['memory_allocation'],
+                                               self.test_vms['TEST_VM_1']['disk_size'],
+                                               self.test_vms['TEST_VM_1']['networks'],
+                                               storage_type='DRBD')
+        self.assertEqual(test_vm_object.getDisklessNodes(), [])
+
+        with self.assertRaises(UnsuitableNodeException):
+            self.parser.parse_arguments('update %s --add-diskless-node %s' %
+                                        (self.test_vms['TEST_VM_1']['name'],
+                                         test_vm_object.getAvailableNodes()[0]),
+                                        mcvirt_instance=self.mcvirt)
+        with self.assertRaises(UnsuitableNodeException):
+            self.parser.parse_arguments('update %s --remove-diskless-node %s' %
+                                        (self.test_vms['TEST_VM_1']['name'],
+                                         test_vm_object.getAvailableNodes()[0]),
+                                        mcvirt_instance=self.mcvirt)
@@ -17,6 +17,7 @@
 
 import unittest
 import os
+import tempfile
 import time
 from enum import Enum
 
@@ -30,11 +31,20 @@ from mcvirt.cluster.remote import Remote
 from mcvirt.virtual_machine.virtual_machine import (VirtualMachine, VirtualMachineLockException,
                                                     VmRegisteredElsewhereException, LockStates,
                                                     UnsuitableNodeException, VmStoppedException,
-                                                    PowerStates)
+                                                    PowerStates,
+                                                    InvalidMigrationTuningConfigException,
+                                                    InvalidStorageConversionException,
+                                                    VmRunningException)
+from mcvirt.virtual_machine.hard_drive.local import CannotMigrateLocalDiskException
 from mcvirt.virtual_machine.hard_drive.drbd import (DrbdConnectionState,
                                                     DrbdVolumeNotInSyncException,
                                                     DrbdStateException, DrbdRoleState)
+from mcvirt.virtual_machine.migration_history import MigrationHistory
+from mcvirt.virtual_machine.migration_monitor import MigrationMonitor
+from mcvirt.virtual_machine.migration_recovery import (MigrationRecovery,
+                                                       NoMigrationRecoveryException)
 from mcvirt.cluster.cluster import Cluster
+from mcvirt.node.drain import NodeDrain
 from mcvirt.iso import Iso, IsoNotPresentOnDestinationNodeException
 
 
@@ -141,6 +151,12 @@ class OnlineMigrateTests(unittest.TestCase):
         suite.addTest(OnlineMigrateTests('test_migrate_libvirt_connection_failure'))
         suite.addTest(OnlineMigrateTests('test_migrate_stopped_vm'))
         suite.addTest(OnlineMigrateTests('test_migrate'))
+        suite.addTest(OnlineMigrateTests('test_migration_tuning'))
+        suite.addTest(OnlineMigrateTests('test_migration_history'))
+        suite.addTest(OnlineMigrateTests('test_drain'))
+        suite.addTest(OnlineMigrateTests('test_migration_recovery'))
+        suite.addTest(OnlineMigrateTests('test_migrate_local_storage'))
+        suite.addTest(OnlineMigrateTests('test_convert_storage'))
         return suite
 
     def setUp(self):
@@ -488,3 +504,264 @@ class OnlineMigrateTests(unittest.TestCase):
             local_role, remote_role = disk_object._drbdGetRole()
             self.assertEqual(local_role, DrbdRoleState.SECONDARY)
             self.assertEqual(remote_role, DrbdRoleState.PRIMARY)
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_migration_tuning(self):
+        """Configures live migration tuning settings for a VM, using the parser, and
+        ensures that they are converted to the libvirt migration parameters"""
+        self.parser.parse_arguments('update %s --migration-profile lan-1g '
+                                    '--migration-option bandwidth 500' %
+                                    self.test_vm_object.getName(),
+                                    mcvirt_instance=self.mcvirt)
+        tuning_config = self.test_vm_object.getMigrationTuningConfig()
+        self.assertEqual(tuning_config['bandwidth'], 500)
+        self.assertEqual(tuning_config['post-copy-after'], 5)
+
+        # Ensure that the settings given for a migration override those of the VM
+        tuning_config = self.test_vm_object.getMigrationTuningConfig(
+            {'post-copy-after': 2, 'compression': 'none'}
+        )
+        self.assertEqual(tuning_config['post-copy-after'], 2)
+        params, flags = self.test_vm_object._getMigrationParameters(tuning_config, '10.0.0.1')
+        self.assertEqual(params[libvirt.VIR_MIGRATE_PARAM_URI], 'tcp://10.0.0.1')
+        self.assertEqual(params[libvirt.VIR_MIGRATE_PARAM_BANDWIDTH], 500)
+        self.assertFalse(libvirt.VIR_MIGRATE_PARAM_COMPRESSION in params)
+        self.assertTrue(flags & libvirt.VIR_MIGRATE_POSTCOPY)
+        self.assertTrue(flags & libvirt.VIR_MIGRATE_AUTO_CONVERGE)
+
+        # Ensure that invalid settings are rejected
+        with self.assertRaises(InvalidMigrationTuningConfigException):
+            self.parser.parse_arguments('update %s --migration-option bandwidth fast' %
+                                        self.test_vm_object.getName(),
+                                        mcvirt_instance=self.mcvirt)
+        with self.assertRaises(InvalidMigrationTuningConfigException):
+            self.parser.parse_arguments('update %s --migration-option parallel-connections 4' %
+                                        self.test_vm_object.getName(),
+                                        mcvirt_instance=self.mcvirt)
+
+        # Ensure that a profile given for a migration replaces the profile and
+        # settings of the VM
+        self.parser.parse_arguments('update %s --migration-profile lan-10g '
+                                    '--migration-option bandwidth inherit' %
+                                    self.test_vm_object.getName(),
+                                    mcvirt_instance=self.mcvirt)
+        tuning_config = self.test_vm_object.getMigrationTuningConfig({'profile': 'lan-1g'})
+        self.assertEqual(tuning_config, VirtualMachine.MIGRATION_TUNING_PROFILES['lan-1g'])
+        VirtualMachine.validateMigrationTuningConfig(tuning_config)
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_migration_history(self):
+        """Records the statistics of migrations in the migration history and
+        ensures that they can be obtained"""
+        history_fd, history_path = tempfile.mkstemp()
+        os.close(history_fd)
+        original_history_file = MigrationHistory.HISTORY_FILE
+        original_maximum_records = MigrationHistory.MAXIMUM_RECORDS
+        MigrationHistory.HISTORY_FILE = history_path
+        MigrationHistory.MAXIMUM_RECORDS = 2
+        try:
+            for vm_name in ['vm-a', self.test_vm_object.getName(), 'vm-b']:
+                MigrationHistory.addRecord({
+                    'vm_name': vm_name, 'source_node': 'node1', 'destination_node': 'node2',
+                    'start_time': int(time.time()), 'duration': 30, 'status': 'completed',
+                    'tuning': {}, 'downtime': 250, 'data_transferred': 1073741824,
+                    'memory_iterations': 3, 'post_copy': False
+                })
+
+            # Ensure that the oldest record has been removed and that
+            # the records can be filtered by VM
+            self.assertEqual(len(MigrationHistory.getLocalRecords()), 2)
+            records = MigrationHistory.getLocalRecords(self.test_vm_object.getName())
+            self.assertEqual(len(records), 1)
+            self.assertEqual(records[0]['downtime'], 250)
+            self.assertTrue('1.0 GiB' in MigrationHistory.getTable(records))
+        finally:
+            MigrationHistory.HISTORY_FILE = original_history_file
+            MigrationHistory.MAXIMUM_RECORDS = original_maximum_records
+            os.remove(history_path)
+
+        # Ensure that the progress of a migration is summarised from the job statistics
+        progress = MigrationMonitor.formatProgress({
+            'data_remaining': 536870912, 'memory_bps': 104857600, 'memory_dirty_rate': 256,
+            'memory_page_size': 4096, 'memory_iteration': 2, 'downtime': 300
+        })
+        self.assertEqual(progress, 'Remaining: 512.0 MiB, transfer rate: 100.0 MiB/s,'
+                                   ' dirty rate: 1.0 MiB/s, iteration: 2,'
+                                   ' expected downtime: 300 ms')
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_drain(self):
+        """Drains the local node, using the argument parser, and ensures that
+        the VM is migrated to the remote node and returned by an undrain"""
+        state_fd, state_path = tempfile.mkstemp()
+        os.close(state_fd)
+        os.remove(state_path)
+        original_state_file = NodeDrain.STATE_FILE
+        NodeDrain.STATE_FILE = state_path
+        try:
+            # Ensure that the VM is planned to be migrated online to the remote node
+            plan = NodeDrain(self.mcvirt).getPlan()
+            entry = [plan_entry for plan_entry in plan
+                     if plan_entry['vm_name'] == self.test_vm_object.getName()][0]
+            self.assertEqual(entry['action'], NodeDrain.ACTION_ONLINE_MIGRATE)
+            self.assertEqual(entry['destination'], self.get_remote_node())
+
+            self.parser.parse_arguments('node --drain --concurrency 2 --bandwidth 200',
+                                        mcvirt_instance=self.mcvirt)
+            self.assertEqual(self.test_vm_object.getNode(), self.get_remote_node())
+            self.assertEqual(self.test_vm_object.getState(), PowerStates.RUNNING)
+            self.assertTrue(os.path.isfile(state_path))
+
+            self.parser.parse_arguments('node --undrain', mcvirt_instance=self.mcvirt)
+            self.assertEqual(self.test_vm_object.getNode(), Cluster.getHostname())
+            self.assertEqual(self.test_vm_object.getState(), PowerStates.RUNNING)
+            self.assertFalse(os.path.isfile(state_path))
+        finally:
+            NodeDrain.STATE_FILE = original_state_file
+            if (os.path.isfile(state_path)):
+                os.remove(state_path)
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_migration_recovery(self):
+        """Ensures that a failed migration is recovered and that an interrupted
+        recovery can be resumed, using the argument parser"""
+        journal_fd, journal_path = tempfile.mkstemp()
+        os.close(journal_fd)
+        os.remove(journal_path)
+        original_journal_file = MigrationRecovery.JOURNAL_FILE
+        MigrationRecovery.JOURNAL_FILE = journal_path
+        try:
+            # Ensure that the recovery of a failed migration is removed from the journal
+            self.mcvirt.libvirt_failure_mode = LibvirtFailureMode.PRE_MIGRATION_FAILURE
+            with self.assertRaises(LibvirtFailureSimulationException):
+                self.test_vm_object.onlineMigrate(self.get_remote_node())
+            self.mcvirt.libvirt_failure_mode = LibvirtFailureMode.NORMAL_RUN
+            self.assertFalse(os.path.isfile(journal_path))
+            self.assertEqual(MigrationRecovery.getPendingRecoveries(), [])
+
+            # Ensure that the VM cannot be recovered without an interrupted recovery
+            with self.assertRaises(NoMigrationRecoveryException):
+                self.parser.parse_arguments('migrate --recover %s' %
+                                            self.test_vm_object.getName(),
+                                            mcvirt_instance=self.mcvirt)
+
+            # Simulate a recovery that was interrupted before the VM was located
+            recovery = MigrationRecovery(self.test_vm_object, Cluster.getHostname(),
+                                         self.get_remote_node())
+            recovery._record()
+            self.assertEqual(MigrationRecovery.getPendingRecoveries(),
+                             [self.test_vm_object.getName()])
+
+            self.parser.parse_arguments('migrate --recover %s' %
+                                        self.test_vm_object.getName(),
+                                        mcvirt_instance=self.mcvirt)
+            self.assertFalse(os.path.isfile(journal_path))
+            self.assertEqual(self.test_vm_object.getNode(), Cluster.getHostname())
+            self.assertEqual(self.test_vm_object.getState(), PowerStates.RUNNING)
+            for disk_object in self.test_vm_object.getDiskObjects():
+                disk_object.setSyncState(True)
+                local_role, remote_role = disk_object._drbdGetRole()
+                self.assertEqual(local_role, DrbdRoleState.PRIMARY)
+                self.assertEqual(remote_role, DrbdRoleState.SECONDARY)
+        finally:
+            self.mcvirt.libvirt_failure_mode = LibvirtFailureMode.NORMAL_RUN
+            MigrationRecovery.JOURNAL_FILE = original_journal_file
+            if (os.path.isfile(journal_path)):
+                os.remove(journal_path)
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_migrate_local_storage(self):
+        """Performs an online migration of a VM using local storage and ensures that
+        the storage is copied to the remote node"""
+        remote_node = self.get_remote_node()
+        local_vm_name = 'mcvirt-unittest-vm-local'
+        stop_and_delete(self.mcvirt, local_vm_name)
+        VirtualMachine.create(self.mcvirt, local_vm_name,
+                              self.test_vm['cpu_count'],
+                              self.test_vm['memory_allocation'],
+                              self.test_vm['disk_size'],
+                              self.test_vm['networks'],
+                              storage_type='Local')
+        local_vm_object = VirtualMachine(self.mcvirt, local_vm_name)
+        disk_path = local_vm_object.getDiskObjects()[0].getConfigObject()._getDiskPath()
+        try:
+            local_vm_object.start()
+
+            # Ensure that a VM using local storage cannot be migrated offline
+            with self.assertRaises(CannotMigrateLocalDiskException):
+                local_vm_object.offlineMigrate(remote_node)
+
+            self.parser.parse_arguments('migrate --online --node %s %s' %
+                                        (remote_node, local_vm_name),
+                                        mcvirt_instance=self.mcvirt)
+
+            # Ensure that the storage is held by the remote node, on which the VM is running
+            self.assertEqual(local_vm_object.getNode(), remote_node)
+            self.assertEqual(local_vm_object.getAvailableNodes(), [remote_node])
+            self.assertEqual(local_vm_object.getState(), PowerStates.RUNNING)
+            self.assertFalse(os.path.lexists(disk_path))
+        finally:
+            # The VM can only be removed by the node holding its storage
+            if (local_vm_object.isRegisteredRemotely()):
+                remote_object = Cluster(self.mcvirt).getRemoteNode(local_vm_object.getNode())
+                if (local_vm_object.getState() is PowerStates.RUNNING):
+                    remote_object.runRemoteCommand('virtual_machine-stop',
+                                                   {'vm_name': local_vm_name})
+                remote_object.runRemoteCommand('virtual_machine-unregister',
+                                               {'vm_name': local_vm_name})
+                local_vm_object._setNode(None)
+                local_vm_object.delete(True)
+            else:
+                stop_and_delete(self.mcvirt, local_vm_name)
+
+    @unittest.skipIf(not NodeDRBD.isEnabled(),
+                     'DRBD is not enabled on this node')
+    def test_convert_storage(self):
+        """Converts the storage of a stopped VM from local storage to DRBD and ensures
+        that the VM can be started, using the DRBD volume"""
+        remote_node = self.get_remote_node()
+        local_vm_name = 'mcvirt-unittest-vm-local'
+        stop_and_delete(self.mcvirt, local_vm_name)
+        VirtualMachine.create(self.mcvirt, local_vm_name,
+                              self.test_vm['cpu_count'],
+                              self.test_vm['memory_allocation'],
+                              self.test_vm['disk_size'],
+                              self.test_vm['networks'],
+                              storage_type='Local')
+        local_vm_object = VirtualMachine(self.mcvirt, local_vm_name)
+        try:
+            # Ensure that the storage of a running VM cannot be converted
+            local_vm_object.start()
+            with self.assertRaises(VmRunningException):
+                local_vm_object.convertStorage('DRBD', [Cluster.getHostname(), remote_node])
+            local_vm_object.stop()
+
+            # Ensure that the storage cannot be replicated to only the local node
+            with self.assertRaises(InvalidStorageConversionException):
+                local_vm_object.convertStorage('DRBD', [Cluster.getHostname()])
+
+            self.parser.parse_arguments('update --convert-storage DRBD --nodes %s %s %s' %
+                                        (Cluster.getHostname(), remote_node, local_vm_name),
+                                        mcvirt_instance=self.mcvirt)
+
+            # Ensure that the VM can be started, using the replicated storage
+            self.assertEqual(local_vm_object.getStorageType(), 'DRBD')
+            self.assertEqual(sorted(local_vm_object.getAvailableNodes()),
+                             sorted([Cluster.getHostname(), remote_node]))
+            local_vm_object.start()
+            self.assertEqual(local_vm_object.getState(), PowerStates.RUNNING)
+            disk_object = local_vm_object.getDiskObjects()[0]
+            drbd_device = disk_object.getConfigObject()._getDrbdDevice()
+            self.assertTrue(drbd_device in local_vm_object._getLibvirtDomainObject().XMLDesc(0))
+            local_role, remote_role = disk_object._drbdGetRole()
+            self.assertEqual(local_role, DrbdRoleState.PRIMARY)
+            self.assertEqual(remote_role, DrbdRoleState.SECONDARY)
+            self.assertEqual(disk_object._drbdGetConnectionState(),
+                             DrbdConnectionState.CONNECTED)
+        finally:
+            stop_and_delete(self.mcvirt, local_vm_name)
@@ -33,7 +33,8 @@ from mcvirt.virtual_machine.virtual_machine import (VirtualMachine,
                                                     CannotStartClonedVmException,
                                                     CannotDeleteClonedVmException,
                                                     CannotCloneDrbdBasedVmsException,
-                                                    VirtualMachineLockException)
+                                                    VirtualMachineLockException,
+                                                    NoSavedStateException)
 from mcvirt.node.network import NetworkDoesNotExistException
 from mcvirt.virtual_machine.hard_drive.drbd import DrbdStateException
 from mcvirt.node.drbd import DRBD as NodeDRBD, DRBDNotEnabledOnNode
@@ -60,7 +61,10 @@ class VirtualMachineTests(unittest.TestCase):
         suite.addTest(VirtualMachineTests('test_lock'))
         suite.addTest(VirtualMachineTests('test_stop_local'))
         suite.addTest(VirtualMachineTests('test_stop_stopped_vm'))
+        suite.addTest(VirtualMachineTests('test_stop_graceful'))
+        suite.addTest(VirtualMachineTests('test_save_state'))
         suite.addTest(VirtualMachineTests('test_clone_local'))
+        suite.addTest(VirtualMachineTests('test_clone_relationship'))
         suite.addTest(VirtualMachineTests('test_duplicate_local'))
         suite.addTest(VirtualMachineTests('test_unspecified_storage_type_local'))
         suite.addTest(VirtualMachineTests('test_invalid_network_name'))
@@ -282,6 +286,27 @@ class VirtualMachineTests(unittest.TestCase):
         # Remove parent
         test_vm_parent.delete(True)
 
+    def test_clone_relationship(self):
+        """Clones a VM and ensures that the clone, its parent and the cloned
+        hard drives are recorded"""
+        test_vm_parent = VirtualMachine.create(
+            self.mcvirt,
+            self.test_vms['TEST_VM_1']['name'],
+            self.test_vms['TEST_VM_1']['cpu_count'],
+            self.test_vms['TEST_VM_1']['memory_allocation'],
+            self.test_vms['TEST_VM_1']['disk_size'],
+            self.test_vms['TEST_VM_1']['networks'],
+            storage_type='Local')
+
+        test_vm_clone = test_vm_parent.clone(self.mcvirt, self.test_vms['TEST_VM_2']['name'])
+        self.assertEqual(test_vm_clone.getCloneParent(), self.test_vms['TEST_VM_1']['name'])
+        self.assertEqual(test_vm_parent.getCloneChildren(), [self.test_vms['TEST_VM_2']['name']])
+        self.assertEqual(len(test_vm_clone.getDiskObjects()),
+                         len(test_vm_parent.getDiskObjects()))
+
+        test_vm_clone.delete(True)
+        test_vm_parent.delete(True)
+
     @unittest.skipIf(not NodeDRBD.isEnabled(),
                      'DRBD is not enabled on this node')
     def test_clone_drbd(self):
@@ -601,6 +626,101 @@ class VirtualMachineTests(unittest.TestCase):
                 self.test_vms['TEST_VM_1']['name'],
                 mcvirt_instance=self.mcvirt)
 
+    def test_stop_graceful(self):
+        """Gracefully shuts down VMs, ensuring that VMs that do not respond to the
+        shutdown request are powered off once the shutdown timeout has expired"""
+        from mcvirt.virtual_machine.shutdown import VirtualMachineShutdown
+        from mcvirt.virtual_machine.virtual_machine import LockStates
+        vm_objects = []
+        for test_vm in ['TEST_VM_1', 'TEST_VM_2']:
+            vm_objects.append(VirtualMachine.create(
+                self.mcvirt,
+                self.test_vms[test_vm]['name'],
+                self.test_vms[test_vm]['cpu_count'],
+                self.test_vms[test_vm]['memory_allocation'],
+                self.test_vms[test_vm]['disk_size'],
+                self.test_vms[test_vm]['networks'],
+                storage_type='Local'))
+
+        # Set the shutdown timeout of the VM, as the test VMs do not contain an
+        # operating system that responds to the shutdown request
+        self.parser.parse_arguments('update --shutdown-timeout 1 %s' %
+                                    self.test_vms['TEST_VM_1']['name'],
+                                    mcvirt_instance=self.mcvirt)
+        self.assertEqual(vm_objects[0].getShutdownTimeout(), 1)
+
+        # Use the argument parser to shut down the VM and ensure that it is stopped
+        vm_objects[0].start()
+        self.parser.parse_arguments('stop --graceful %s' %
+                                    self.test_vms['TEST_VM_1']['name'],
+                                    mcvirt_instance=self.mcvirt)
+        self.assertTrue(vm_objects[0].getState() is PowerStates.STOPPED)
+
+        # Shut down both VMs concurrently and ensure that they are powered off
+        for vm_object in vm_objects:
+            vm_object.start()
+
+        # Ensure that a locked VM is not shut down
+        vm_objects[0].setLockState(LockStates.LOCKED)
+        results = VirtualMachineShutdown(self.mcvirt, timeout=1).shutdown([vm_objects[0]])
+        self.assertEqual(results[0]['result'], VirtualMachineShutdown.RESULT_FAILED)
+        self.assertTrue(vm_objects[0].getState() is PowerStates.RUNNING)
+        vm_objects[0].setLockState(LockStates.UNLOCKED)
+
+        results = VirtualMachineShutdown(self.mcvirt, timeout=1).shutdown(vm_objects)
+        for entry in results:
+            self.assertEqual(entry['result'], VirtualMachineShutdown.RESULT_COMPLETED)
+            self.assertEqual(entry['method'], VirtualMachineShutdown.METHOD_DESTROY)
+        for vm_object in vm_objects:
+            self.assertTrue(vm_object.getState() is PowerStates.STOPPED)
+
+    def test_save_state(self):
+        """Saves the state of running VMs and ensures that they are restored
+        in order of their resume priority"""
+        from mcvirt.node.suspend import NodeSuspend
+        vm_objects = []
+        for test_vm in ['TEST_VM_1', 'TEST_VM_2']:
+            vm_objects.append(VirtualMachine.create(
+                self.mcvirt,
+                self.test_vms[test_vm]['name'],
+                self.test_vms[test_vm]['cpu_count'],
+                self.test_vms[test_vm]['memory_allocation'],
+                self.test_vms[test_vm]['disk_size'],
+                self.test_vms[test_vm]['networks'],
+                storage_type='Local'))
+            vm_objects[-1].start()
+
+        # Ensure that the state of a VM cannot be restored if it has not been saved
+        vm_objects[0].stop()
+        with self.assertRaises(NoSavedStateException):
+            vm_objects[0].restoreState()
+        vm_objects[0].start()
+
+        self.parser.parse_arguments('update --resume-priority 10 %s' %
+                                    self.test_vms['TEST_VM_2']['name'],
+                                    mcvirt_instance=self.mcvirt)
+        self.assertEqual(vm_objects[1].getResumePriority(), 10)
+
+        for vm_object in vm_objects:
+            vm_object.saveState()
+            self.assertTrue(vm_object.getState() is PowerStates.STOPPED)
+            self.assertTrue(vm_object.hasSavedState())
+
+        # Restore the VMs and ensure that the VM with the higher priority is restored first
+        results = NodeSuspend(self.mcvirt).resumeAll()
+        self.assertEqual([entry['vm_name'] for entry in results],
+                         [self.test_vms['TEST_VM_2']['name'],
+                          self.test_vms['TEST_VM_1']['name']])
+        for vm_object in vm_objects:
+            self.assertTrue(vm_object.getState() is PowerStates.RUNNING)
+            self.assertFalse(vm_object.hasSavedState())
+
+        # Ensure that a VM with a saved state can be removed
+        vm_objects[0].saveState()
+        vm_objects[0].delete(True)
+        self.assertFalse(VirtualMachine._checkExists(self.mcvirt.getLibvirtConnection(),
+                                                     self.test_vms['TEST_VM_1']['name']))
+
     @unittest.skipIf(not NodeDRBD.isEnabled(),
                      'DRBD is not enabled on this node')
     def test_offline_migrate(self):
@@ -18,6 +18,7 @@
 from mcvirt.mcvirt import MCVirtException
 import os
 from mcvirt.system import System, MCVirtCommandException
+from mcvirt.node.capacity import Capacity
 
 
 class HardDriveDoesNotExistException(MCVirtException):
@@ -48,6 +49,8 @@ class BackupSnapshotDoesNotExistException(MCVirtException):
 class Base(object):
     """Provides base operations to manage all hard drives, used by VMs"""
 
+    BLKDISCARD = '/sbin/blkdiscard'
+
     def __init__(self, disk_id):
         """Sets member variables"""
         pass
@@ -275,6 +278,126 @@ class Base(object):
                 perform_on_nodes=perform_on_nodes)
             raise MCVirtException("Error whilst creating disk logical volume:\n" + str(e))
 
+    @staticmethod
+    def _extendLogicalVolume(config_object, name, increase_size, perform_on_nodes=False):
+        """Increases the size of a logical volume on the node/cluster. The logical volume
+        is extended on the remote nodes at the same time as the local node. If the
+        logical volume cannot be extended on any of the nodes, the extension is undone
+        on the nodes that it had been extended on"""
+        import threading
+        from mcvirt.cluster.cluster import Cluster
+
+        remote_thread = None
+        remote_exceptions = []
+        extended_nodes = []
+        if (perform_on_nodes and config_object.vm_object.mcvirt_object.initialiseNodes()):
+            cluster = Cluster(config_object.vm_object.mcvirt_object)
+            nodes = config_object.vm_object._getRemoteNodes()
+
+            def extendRemote():
+                for node in nodes:
+                    try:
+                        cluster.runRemoteCommand(
+                            'virtual_machine-hard_drive-extendLogicalVolume',
+                            {'config': config_object._dumpConfig(),
+                             'name': name,
+                             'increase_size': increase_size},
+                            nodes=[node]
+                        )
+                    except Exception, e:
+                        remote_exceptions.append(e)
+                        return
+                    extended_nodes.append(node)
+
+            remote_thread = threading.Thread(target=extendRemote)
+            remote_thread.start()
+
+        command_args = ['lvextend', '-L', '+%sM' % increase_size,
+                        config_object._getLogicalVolumePath(name)]
+        local_exception = None
+        try:
+            System.runCommand(command_args)
+        except MCVirtCommandException, e:
+            local_exception = MCVirtException("Error whilst extending logical volume:\n" +
+                                              str(e))
+        finally:
+            if (remote_thread):
+                remote_thread.join()
+
+        if (local_exception or remote_exceptions):
+            # Return the logical volume to its original size on the nodes that it was
+            # extended on, so that it is the same size on all nodes
+            rollback_errors = []
+            if (local_exception is None):
+                try:
+                    Base._reduceLogicalVolume(config_object, name, increase_size)
+                except MCVirtException, e:
+                    rollback_errors.append(str(e))
+            if (extended_nodes):
+                try:
+                    cluster.runRemoteCommand('virtual_machine-hard_drive-reduceLogicalVolume',
+                                             {'config': config_object._dumpConfig(),
+                                              'name': name,
+                                              'decrease_size': increase_size},
+                                             nodes=extended_nodes)
+                except Exception, e:
+                    rollback_errors.append(str(e))
+
+            if (local_exception):
+                error_message = str(local_exception)
+            else:
+                error_message = ('Error whilst extending logical volume on remote node:\n' +
+                                 str(remote_exceptions[0]))
+            if (rollback_errors):
+                error_message += ('\nThe logical volume could not be returned to its'
+                                  ' original size:\n' + '\n'.join(rollback_errors))
+            raise MCVirtException(error_message)
+
+    @staticmethod
+    def _reduceLogicalVolume(config_object, name, decrease_size):
+        """Decreases the size of a logical volume on the local node. This is only used to
+        undo an extension of the logical volume, before the additional space is used"""
+        command_args = ['lvreduce', '--force', '-L', '-%sM' % decrease_size,
+                        config_object._getLogicalVolumePath(name)]
+        try:
+            System.runCommand(command_args)
+        except MCVirtCommandException, e:
+            raise MCVirtException("Error whilst reducing logical volume:\n" + str(e))
+
+    @staticmethod
+    def _ensureVolumeGroupFreeSpace(config_object, size, perform_on_nodes=False):
+        """Ensures that there is enough free space in the volume group for the
+        given size (in MB) on the local node and, optionally, the remote nodes"""
+        from mcvirt.cluster.cluster import Cluster
+        nodes = [Cluster.getHostname()]
+        if (perform_on_nodes and config_object.vm_object.mcvirt_object.initialiseNodes()):
+            nodes += config_object.vm_object._getRemoteNodes()
+        Capacity(config_object.vm_object.mcvirt_object).ensureFreeSpace(
+            dict((node, size) for node in nodes)
+        )
+
+    @staticmethod
+    def getRequiredStorageSpace(size):
+        """Returns the space (in MB) required on each node to create a hard drive
+        of the given size"""
+        return size
+
+    def _resizeLibvirtDisk(self):
+        """Notifies a running VM that the size of the disk has changed"""
+        import libvirt
+        from mcvirt.virtual_machine.virtual_machine import PowerStates
+        vm_object = self.getVmObject()
+        if (vm_object.isRegisteredLocally() and vm_object.getState() is PowerStates.RUNNING):
+            _, disk_size, _ = System.runCommand(['blockdev', '--getsize64',
+                                                 self.getConfigObject()._getDiskPath()])
+            try:
+                vm_object._getLibvirtDomainObject().blockResize(
+                    self.getConfigObject()._getTargetDev(), int(disk_size.strip()),
+                    libvirt.VIR_DOMAIN_BLOCK_RESIZE_BYTES
+                )
+            except libvirt.libvirtError, e:
+                raise MCVirtException('Failed to resize disk of running VM: %s' % str(e))
+
     @staticmethod
     def _removeLogicalVolume(
             config_object,
@@ -308,6 +431,15 @@ class Base(object):
         except MCVirtCommandException, e:
             raise MCVirtException("Error whilst removing disk logical volume:\n" + str(e))
 
+    @staticmethod
+    def _renameLogicalVolume(config_object, name, new_name):
+        """Renames a logical volume on the local node"""
+        command_args = ['lvrename', config_object._getVolumeGroup(), name, new_name]
+        try:
+            System.runCommand(command_args)
+        except MCVirtCommandException, e:
+            raise MCVirtException("Error whilst renaming logical volume:\n" + str(e))
+
     @staticmethod
     def _getLogicalVolumeSize(config_object, name):
         """Obtains the size of a logical volume"""
@@ -333,30 +465,73 @@ class Base(object):
 
     @staticmethod
     def _zeroLogicalVolume(config_object, name, size, perform_on_nodes=False):
-        """Blanks a logical volume by filling it with null data"""
+        """Blanks a logical volume by filling it with null data. The logical volume
+        is zeroed on the remote nodes at the same time as the local node"""
+        import threading
         from mcvirt.cluster.cluster import Cluster
 
-        # Obtain the path of the logical volume
-        lv_path = config_object._getLogicalVolumePath(name)
+        remote_thread = None
+        remote_exceptions = []
+        if (perform_on_nodes and config_object.vm_object.mcvirt_object.initialiseNodes()):
+            cluster = Cluster(config_object.vm_object.mcvirt_object)
+            nodes = config_object.vm_object._getRemoteNodes()
 
-        # Create command arguments
-        command_args = ['dd', 'if=/dev/zero', 'of=%s' % lv_path, 'bs=1M', 'count=%s' % size,
-                        'conv=fsync', 'oflag=direct']
-        try:
-            # Create logical volume on local node
-            System.runCommand(command_args)
+            def zeroRemote():
+                try:
+                    cluster.runRemoteCommand('virtual_machine-hard_drive-zeroLogicalVolume',
+                                             {'config': config_object._dumpConfig(),
+                                              'name': name, 'size': size},
+                                             nodes=nodes)
+                except Exception, e:
+                    remote_exceptions.append(e)
 
-            if (perform_on_nodes and config_object.vm_object.mcvirt_object.initialiseNodes()):
-                cluster = Cluster(config_object.vm_object.mcvirt_object)
-                nodes = config_object.vm_object._getRemoteNodes()
+            remote_thread = threading.Thread(target=zeroRemote)
+            remote_thread.start()
 
-                # Create logical volume on remote nodes
-                cluster.runRemoteCommand('virtual_machine-hard_drive-zeroLogicalVolume',
-                                         {'config': config_object._dumpConfig(),
-                                          'name': name, 'size': size},
-                                         nodes=nodes)
+        try:
+            Base._zeroLocalLogicalVolume(config_object._getLogicalVolumePath(name), size)
         except MCVirtCommandException, e:
             raise MCVirtException("Error whilst zeroing logical volume:\n" + str(e))
+        finally:
+            if (remote_thread):
+                remote_thread.join()
+
+        if (remote_exceptions):
+            raise MCVirtException('Error whilst zeroing logical volume on remote node:\n' +
+                                  str(remote_exceptions[0]))
+
+    @staticmethod
+    def _zeroLocalLogicalVolume(lv_path, size):
+        """Zeroes a logical volume on the local node. Where possible, the zeroing is
+        performed by the kernel using blkdiscard, which offloads it to storage
+        that supports zeroing (such as thin volumes and SSDs). Otherwise, zeros
+        are written to the logical volume using dd"""
+        if (os.path.isfile(Base.BLKDISCARD)):
+            try:
+                System.runCommand([Base.BLKDISCARD, '--zeroout', lv_path])
+                return
+            except MCVirtCommandException:
+                # The version of blkdiscard may not support zeroing
+                pass
+
+        System.runCommand(['dd', 'if=/dev/zero', 'of=%s' % lv_path, 'bs=1M',
+                           'count=%s' % size, 'conv=fsync', 'oflag=direct'])
+
+    @staticmethod
+    def _discardLocalLogicalVolume(lv_path):
+        """Discards the data in a logical volume on the local node, allowing storage
+        that supports discards (such as thin volumes and SSDs) to release the space.
+        The contents of the logical volume are undefined afterwards, so this must only
+        be used for volumes that will be overwritten. Returns whether the data was
+        discarded"""
+        if (not os.path.isfile(Base.BLKDISCARD)):
+            return False
+        try:
+            System.runCommand([Base.BLKDISCARD, lv_path])
+            return True
+        except MCVirtCommandException:
+            # The storage may not support discards
+            return False
 
     @staticmethod
     def _ensureLogicalVolumeExists(config_object, name):
@@ -478,6 +653,37 @@ class Base(object):
         # Unlock the VM
         self.getConfigObject().vm_object.setLockState(LockStates.UNLOCKED)
 
+    def createBackup(self, backup_repository):
+        """Stores a backup of the disk in a backup repository, using a backup
+        snapshot, so that the VM can continue running during the backup"""
+        snapshot_path = self.createBackupSnapshot()
+        try:
+            return backup_repository.createBackup(snapshot_path,
+                                                  self.getConfigObject().vm_object.getName(),
+                                                  self.getConfigObject().getId())
+        finally:
+            self.deleteBackupSnapshot()
+
+    def restoreBackup(self, backup_repository, backup_id):
+        """Overwrites the disk with the contents of a backup"""
+        self._ensureExists()
+        from mcvirt.virtual_machine.virtual_machine import PowerStates
+        vm_object = self.getConfigObject().vm_object
+        manifest = backup_repository.getManifest(backup_id)
+
+        # Ensure the VM is stopped and registered on the local node
+        vm_object.ensureRegisteredLocally()
+        if (vm_object.getState() is not PowerStates.STOPPED):
+            raise MCVirtException('VM must be stopped before restoring a backup')
+        vm_object.ensureUnlocked()
+
+        if (manifest['size'] > (self.getSize() * 1024 * 1024)):
+            raise MCVirtException('Backup %s is larger than disk %s' %
+                                  (backup_id, self.getConfigObject().getId()))
+
+        self.activateDisk()
+        backup_repository.restoreBackup(backup_id, self.getConfigObject()._getDiskPath())
+
     def increaseSize(self, increase_size):
         """Increases the size of a VM hard drive, given the size to increase the drive by"""
         raise NotImplementedError
@@ -504,12 +710,12 @@ class Base(object):
         """Deactivates the storage volume"""
         raise NotImplementedError
 
-    def preMigrationChecks(self, destination_node):
+    def preMigrationChecks(self, migrate_to_local_node=False):
         """Determines if the disk is in a state to allow the attached VM
            to be migrated to another node"""
         raise NotImplementedError
 
-    def preOnlineMigration(self):
+    def preOnlineMigration(self, destination_node):
         """Performs required tasks in order
            for the underlying VM to perform an
            online migration"""
@@ -520,10 +726,21 @@ class Base(object):
            has performed an online migration"""
         raise NotImplementedError
 
+    def preOnlineMigrationToLocalNode(self, source_node):
+        """Performs required tasks in order for the underlying VM
+           to perform an online migration to the local node"""
+        raise NotImplementedError
+
+    def postOnlineMigrationToLocalNode(self, source_node):
+        """Performs post tasks after the underlying VM has performed
+           an online migration to the local node"""
+        raise NotImplementedError
+
     def getSize(self):
         """Gets the size of the disk (in MB)"""
         raise NotImplementedError
 
-    def move(self, destination_node, source_node):
-        """Moves the storage to another node in the cluster"""
+    def move(self, destination_node, source_node, progress_callback=None):
+        """Moves the storage to another node in the cluster. If given, progress_callback
+        is called with messages describing the progress of the move"""
         raise NotImplementedError
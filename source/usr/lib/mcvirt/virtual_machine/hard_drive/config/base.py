@@ -27,6 +27,16 @@ class ReachedMaximumStorageDevicesException(MCVirtException):
     pass
 
 
+class InvalidDiskPerformanceConfigException(MCVirtException):
+    """The disk performance configuration is not valid"""
+    pass
+
+
+class InvalidIoTuneConfigException(MCVirtException):
+    """The disk I/O limit configuration is not valid"""
+    pass
+
+
 class Driver(Enum):
     """Enums for specifying the hard drive driver type"""
     VIRTIO = 'virtio'
@@ -44,10 +54,30 @@ class Base(object):
     SNAPSHOT_SUFFIX = '_snapshot'
     SNAPSHOT_SIZE = '500M'
 
+    # Performance settings that can be configured for the VM or for individual disks,
+    # with the values that each may take. Settings without a list take a positive integer.
+    PERFORMANCE_SETTINGS = {
+        'cache': ['default', 'none', 'writethrough', 'writeback', 'directsync', 'unsafe'],
+        'io': ['native', 'threads', 'io_uring'],
+        'discard': ['ignore', 'unmap'],
+        'detect_zeroes': ['off', 'on', 'unmap'],
+        'queues': None,
+        'iothread': None
+    }
+
+    # I/O limits that can be configured for disks. Each limit may be given a burst limit
+    # (<limit>_max) and a maximum burst duration in seconds (<limit>_max_length).
+    IOTUNE_LIMITS = ['total_bytes_sec', 'read_bytes_sec', 'write_bytes_sec',
+                     'total_iops_sec', 'read_iops_sec', 'write_iops_sec']
+    IOTUNE_SETTINGS = (IOTUNE_LIMITS + ['%s_max' % limit for limit in IOTUNE_LIMITS] +
+                       ['%s_max_length' % limit for limit in IOTUNE_LIMITS])
+
     def __init__(self, vm_object, disk_id=None, driver=None, config=None, registered=False):
         """Set member variables and obtains the stored configuration"""
         self.config['disk_id'] = disk_id
         self.config['driver'] = driver
+        self.config['performance'] = {}
+        self.config['iotune'] = {}
         self.vm_object = vm_object
 
         # If a configuration hash has been passed, overwrite all
@@ -136,10 +166,7 @@ class Base(object):
         device_xml.set('device', 'disk')
 
         # Configure the interface driver to the disk
-        driver_xml = ET.SubElement(device_xml, 'driver')
-        driver_xml.set('name', 'qemu')
-        driver_xml.set('type', 'raw')
-        driver_xml.set('cache', self.CACHE_MODE)
+        device_xml.append(self._generateDriverXml())
 
         # Configure the source of the disk
         source_xml = ET.SubElement(device_xml, 'source')
@@ -150,8 +177,141 @@ class Base(object):
         target_xml.set('dev', '%s' % self._getTargetDev())
         target_xml.set('bus', self._getLibvirtDriver())
 
+        # Configure the I/O limits
+        iotune_xml = self._generateIoTuneXml()
+        if (iotune_xml is not None):
+            device_xml.append(iotune_xml)
+
         return device_xml
 
+    def _generateIoTuneXml(self):
+        """Creates the libvirt XML for the I/O limits of the disk, if any are configured"""
+        iotune_config = self.getIoTuneConfig()
+        if (not iotune_config):
+            return None
+        iotune_xml = ET.Element('iotune')
+        for setting in self.IOTUNE_SETTINGS:
+            if (setting in iotune_config):
+                setting_xml = ET.SubElement(iotune_xml, setting)
+                setting_xml.text = str(iotune_config[setting])
+        return iotune_xml
+
+    def getIoTuneConfig(self):
+        """Returns the I/O limits configured for the disk"""
+        return self.config['iotune']
+
+    @staticmethod
+    def validateIoTuneConfig(iotune_config):
+        """Ensures that a set of I/O limits is valid"""
+        for setting, value in iotune_config.items():
+            if (setting not in Base.IOTUNE_SETTINGS):
+                raise InvalidIoTuneConfigException('Unknown I/O limit: %s' % setting)
+            if (not isinstance(value, (int, long)) or value < 1):
+                raise InvalidIoTuneConfigException(
+                    'I/O limit \'%s\' must be a positive integer' % setting
+                )
+
+        for limit_type in ['bytes_sec', 'iops_sec']:
+            # Total limits cannot be combined with read/write limits of the same type
+            for suffix in ['', '_max', '_max_length']:
+                if (('total_%s%s' % (limit_type, suffix)) in iotune_config and
+                        (('read_%s%s' % (limit_type, suffix)) in iotune_config or
+                         ('write_%s%s' % (limit_type, suffix)) in iotune_config)):
+                    raise InvalidIoTuneConfigException(
+                        'total_%s%s cannot be combined with read/write limits' %
+                        (limit_type, suffix)
+                    )
+
+            for direction in ['total', 'read', 'write']:
+                limit = '%s_%s' % (direction, limit_type)
+                # Burst limits require the base limit and must be larger than it
+                if ('%s_max' % limit in iotune_config):
+                    if (limit not in iotune_config):
+                        raise InvalidIoTuneConfigException(
+                            '%s_max requires %s to be set' % (limit, limit)
+                        )
+                    if (iotune_config['%s_max' % limit] < iotune_config[limit]):
+                        raise InvalidIoTuneConfigException(
+                            '%s_max cannot be lower than %s' % (limit, limit)
+                        )
+                if ('%s_max_length' % limit in iotune_config and
+                        '%s_max' % limit not in iotune_config):
+                    raise InvalidIoTuneConfigException(
+                        '%s_max_length requires %s_max to be set' % (limit, limit)
+                    )
+
+    def _generateDriverXml(self):
+        """Creates the libvirt XML for the disk driver, applying the performance settings"""
+        driver_xml = ET.Element('driver')
+        driver_xml.set('name', 'qemu')
+        driver_xml.set('type', 'raw')
+        for setting, value in sorted(self.getPerformanceConfig().items()):
+            if (value is not None):
+                driver_xml.set(setting, str(value))
+        return driver_xml
+
+    def getPerformanceConfig(self, vm_performance_config=None, disk_performance_config=None):
+        """Returns the performance settings for the disk, using the disk-specific settings,
+        falling back to the VM settings and the defaults for the storage type"""
+        if (vm_performance_config is None):
+            vm_performance_config = \
+                self.vm_object.getConfigObject().getConfig()['disk_performance']
+        if (disk_performance_config is None):
+            disk_performance_config = self.config['performance']
+
+        performance_config = dict([(setting, None) for setting in self.PERFORMANCE_SETTINGS])
+        performance_config['cache'] = self.CACHE_MODE
+        for config in [vm_performance_config, disk_performance_config]:
+            for setting in config:
+                if (config[setting] is not None):
+                    performance_config[setting] = config[setting]
+        return performance_config
+
+    def validatePerformanceConfig(self, performance_config, iothread_count):
+        """Ensures that the performance settings for the disk are valid"""
+        for setting, value in performance_config.items():
+            if (setting not in self.PERFORMANCE_SETTINGS):
+                raise InvalidDiskPerformanceConfigException(
+                    'Unknown disk performance setting: %s' % setting
+                )
+            if (value is None):
+                continue
+            if (self.PERFORMANCE_SETTINGS[setting] is None):
+                if (not isinstance(value, int) or value < 1):
+                    raise InvalidDiskPerformanceConfigException(
+                        'Disk performance setting \'%s\' must be a positive integer' % setting
+                    )
+            elif (value not in self.PERFORMANCE_SETTINGS[setting]):
+                raise InvalidDiskPerformanceConfigException(
+                    'Invalid value for disk performance setting \'%s\': %s' % (setting, value)
+                )
+
+        # Native AIO requires the host page cache to be bypassed
+        if (performance_config['io'] == 'native' and
+                performance_config['cache'] not in ['none', 'directsync']):
+            raise InvalidDiskPerformanceConfigException(
+                'io mode \'native\' requires cache mode \'none\' or \'directsync\''
+            )
+
+        if (performance_config['detect_zeroes'] == 'unmap' and
+                performance_config['discard'] != 'unmap'):
+            raise InvalidDiskPerformanceConfigException(
+                'detect_zeroes mode \'unmap\' requires discard mode \'unmap\''
+            )
+
+        # Multiqueue and iothreads are only supported by virtio disks
+        if ((performance_config['queues'] or performance_config['iothread']) and
+                self._getLibvirtDriver() != Driver.VIRTIO.value):
+            raise InvalidDiskPerformanceConfigException(
+                'Queues and iothreads can only be configured for disks using the VIRTIO driver'
+            )
+
+        if (performance_config['iothread'] and performance_config['iothread'] > iothread_count):
+            raise InvalidDiskPerformanceConfigException(
+                'Disk %s is assigned to iothread %s, but the VM only has %s iothread(s)' %
+                (self.getId(), performance_config['iothread'], iothread_count)
+            )
+
     def _getDriver(self):
         """Returns the disk drive driver name"""
         return self.config['driver']
@@ -167,7 +327,9 @@ class Base(object):
     def _getMCVirtConfig(self):
         """Returns the MCVirt configuration for the hard drive object"""
         config = {
-            'driver': self.config['driver']
+            'driver': self.config['driver'],
+            'performance': self.config['performance'],
+            'iotune': self.config['iotune']
         }
         return config
 
@@ -16,13 +16,19 @@
 # along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
 
 import os
+import re
 
 from mcvirt.virtual_machine.hard_drive.config.base import Base
-from mcvirt.node.drbd import DRBD as NodeDRBD
-from mcvirt.mcvirt import MCVirt
+from mcvirt.node.drbd import DRBD as NodeDRBD, DRBDAllocation
+from mcvirt.mcvirt import MCVirt, MCVirtException
 from mcvirt.system import System
 
 
+class InvalidDrbdTuningConfigException(MCVirtException):
+    """The DRBD replication tuning configuration is not valid"""
+    pass
+
+
 class DRBD(Base):
     """Provides a configuration interface for DRBD-based hard drive objects"""
 
@@ -34,6 +40,66 @@ class DRBD(Base):
     DRBD_CONFIG_TEMPLATE = MCVirt.TEMPLATE_DIR + '/drbd_resource.conf'
     CACHE_MODE = 'none'
 
+    # Replication tuning settings that can be configured for the VM or for individual disks,
+    # with the values that each may take. Settings without a list take a positive integer,
+    # with the sizes/rates in DRBD_TUNING_SIZE_SETTINGS also accepting a K, M or G suffix.
+    DRBD_TUNING_SETTINGS = {
+        'protocol': ['A', 'B', 'C'],
+        'resync-rate': None,
+        'c-plan-ahead': None,
+        'c-fill-target': None,
+        'c-max-rate': None,
+        'c-min-rate': None,
+        'al-extents': None,
+        'read-balancing': ['prefer-local', 'prefer-remote', 'round-robin', 'least-pending',
+                           'when-congested-remote'],
+        'max-buffers': None,
+        'max-epoch-size': None,
+        'csums-alg': ['md5', 'sha1', 'crc32c'],
+        'rs-discard-granularity': None
+    }
+    DRBD_TUNING_SIZE_SETTINGS = ['resync-rate', 'c-fill-target', 'c-max-rate', 'c-min-rate']
+    # The section of the DRBD resource configuration that each setting is rendered in
+    DRBD_TUNING_SECTIONS = {
+        'disk': ['resync-rate', 'c-plan-ahead', 'c-fill-target', 'c-max-rate', 'c-min-rate',
+                 'al-extents', 'read-balancing', 'rs-discard-granularity'],
+        'net': ['protocol', 'max-buffers', 'max-epoch-size', 'csums-alg']
+    }
+    # Profiles of tuning settings, which can be selected using the 'profile' setting
+    # and are overridden by any other settings
+    DRBD_TUNING_PROFILES = {
+        'lan-1g': {
+            'protocol': 'C',
+            'c-plan-ahead': 20,
+            'c-fill-target': '2M',
+            'c-min-rate': '10M',
+            'c-max-rate': '110M',
+            'al-extents': 3389,
+            'max-buffers': 8000,
+            'max-epoch-size': 8000
+        },
+        'lan-10g': {
+            'protocol': 'C',
+            'c-plan-ahead': 15,
+            'c-fill-target': '24M',
+            'c-min-rate': '80M',
+            'c-max-rate': '720M',
+            'al-extents': 6007,
+            'max-buffers': 36864,
+            'max-epoch-size': 20000
+        },
+        'wan': {
+            'protocol': 'A',
+            'c-plan-ahead': 20,
+            'c-fill-target': '1M',
+            'c-min-rate': '1M',
+            'c-max-rate': '20M',
+            'max-buffers': 8000,
+            'max-epoch-size': 8000,
+            'csums-alg': 'sha1'
+        }
+    }
+
     def __init__(
             self,
             vm_object,
@@ -48,7 +114,8 @@ class DRBD(Base):
             {
                 'drbd_minor': drbd_minor,
                 'drbd_port': drbd_port,
-                'sync_state': True
+                'sync_state': True,
+                'drbd_tuning': {}
             }
 
         Base.__init__(
@@ -59,39 +126,20 @@ class DRBD(Base):
             config=config,
             registered=registered)
 
-    def _getAvailableDrbdPort(self):
-        """Obtains the next available DRBD port"""
-        # Obtain list of currently used DRBD ports
-        used_ports = NodeDRBD.getUsedDrbdPorts(self.vm_object.mcvirt_object)
-        available_port = None
-
-        # Determine a free port
-        test_port = DRBD.INITIAL_PORT
-
-        while (available_port is None):
-            if (test_port in used_ports):
-                test_port += 1
-            else:
-                available_port = test_port
-
-        return available_port
-
-    def _getAvailableDrbdMinor(self):
-        """Obtains the next available DRBD minor"""
-        # Obtain list of currently used DRBD minors
-        used_minor_ids = NodeDRBD.getUsedDrbdMinors(self.vm_object.mcvirt_object)
-        available_minor_id = None
-
-        # Determine a free minor
-        test_minor_id = DRBD.INITIAL_MINOR
-
-        while (available_minor_id is None):
-            if (test_minor_id in used_minor_ids):
-                test_minor_id += 1
-            else:
-                available_minor_id = test_minor_id
-
-        return available_minor_id
+    def _reserveDrbdAllocation(self):
+        """Reserves the DRBD minor and port for the hard drive in the cluster allocation
+        table, allocating any that have not been assigned to the hard drive"""
+        minor, port = DRBDAllocation.reserve(self.vm_object.mcvirt_object,
+                                             self._getResourceName(),
+                                             minor=self.config['drbd_minor'],
+                                             port=self.config['drbd_port'])
+        self.config['drbd_minor'] = minor
+        self.config['drbd_port'] = port
+
+    def _releaseDrbdAllocation(self):
+        """Releases the DRBD minor and port of the hard drive in the cluster allocation table"""
+        DRBDAllocation.release(self.vm_object.mcvirt_object, self._getResourceName(),
+                               self.config['drbd_minor'], self.config['drbd_port'])
 
     def _getLogicalVolumeName(self, lv_type):
         """Returns the logical volume name for a given logical volume type"""
@@ -104,14 +152,14 @@ class DRBD(Base):
     def _getDrbdMinor(self):
         """Returns the DRBD port assigned to the hard drive"""
         if (self.config['drbd_minor'] is None):
-            self.config['drbd_minor'] = self._getAvailableDrbdMinor()
+            self._reserveDrbdAllocation()
 
         return self.config['drbd_minor']
 
     def _getDrbdPort(self):
         """Returns the DRBD port assigned to the hard drive"""
         if (self.config['drbd_port'] is None):
-            self.config['drbd_port'] = self._getAvailableDrbdPort()
+            self._reserveDrbdAllocation()
 
         return self.config['drbd_port']
 
@@ -139,7 +187,8 @@ class DRBD(Base):
                 'raw_lv_path': raw_lv_path,
                 'meta_lv_path': meta_lv_path,
                 'drbd_port': self._getDrbdPort(),
-                'nodes': []
+                'nodes': [],
+                'connection_mesh': None
             }
 
         # Add local node to the DRBD config
@@ -162,6 +211,38 @@ class DRBD(Base):
                 }
             drbd_config['nodes'].append(node_template_conf)
 
+        # Add any diskless clients to the DRBD config. Resources with more than two nodes
+        # require DRBD 9, in which each node is identified by a node ID and all nodes
+        # are connected to each other
+        diskless_node_ids = self.vm_object._getDisklessNodeIds()
+        for node in sorted(diskless_node_ids):
+            if (node != Cluster.getHostname()):
+                node_config = cluster_object.getNodeConfig(node)
+                drbd_config['nodes'].append({'name': node,
+                                             'ip_address': node_config['ip_address']})
+        available_nodes = self.vm_object.getAvailableNodes()
+        for node_template_conf in drbd_config['nodes']:
+            node_template_conf['diskless'] = node_template_conf['name'] in diskless_node_ids
+            if (not diskless_node_ids):
+                node_template_conf['node_id'] = None
+            elif (node_template_conf['diskless']):
+                node_template_conf['node_id'] = diskless_node_ids[node_template_conf['name']]
+            else:
+                node_template_conf['node_id'] = available_nodes.index(
+                    node_template_conf['name']
+                )
+        if (diskless_node_ids):
+            drbd_config['connection_mesh'] = ' '.join(node_template_conf['name'] for
+                                                      node_template_conf in drbd_config['nodes'])
+
+        # Add the replication tuning settings to the sections of the DRBD config
+        tuning_config = self.getDrbdTuningConfig()
+        for section, settings in self.DRBD_TUNING_SECTIONS.items():
+            drbd_config['%s_options' % section] = [
+                {'name': setting, 'value': tuning_config[setting]}
+                for setting in sorted(settings) if setting in tuning_config
+            ]
+
         # Replace the variables in the template with the local DRBD configuration
         config_content = Template(file=self.DRBD_CONFIG_TEMPLATE, searchList=[drbd_config])
 
@@ -170,6 +251,54 @@ class DRBD(Base):
         fh.write(config_content.respond())
         fh.close()
 
+    def getDrbdTuningConfig(self, vm_tuning_config=None, disk_tuning_config=None):
+        """Returns the replication tuning settings for the disk, applying the profile and
+        settings of the VM, followed by the profile and settings of the disk"""
+        if (vm_tuning_config is None):
+            vm_tuning_config = self.vm_object.getConfigObject().getConfig()['drbd_tuning']
+        if (disk_tuning_config is None):
+            disk_tuning_config = self.config['drbd_tuning']
+
+        tuning_config = {}
+        for config in [vm_tuning_config, disk_tuning_config]:
+            if (config.get('profile')):
+                tuning_config.update(self.DRBD_TUNING_PROFILES[config['profile']])
+            for setting, value in config.items():
+                if (setting != 'profile' and value is not None):
+                    tuning_config[setting] = value
+        return tuning_config
+
+    @staticmethod
+    def validateDrbdTuningConfig(tuning_config):
+        """Ensures that a set of replication tuning settings is valid"""
+        for setting, value in tuning_config.items():
+            if (setting == 'profile'):
+                if (value not in DRBD.DRBD_TUNING_PROFILES):
+                    raise InvalidDrbdTuningConfigException(
+                        'Unknown DRBD tuning profile \'%s\'. Available profiles: %s' %
+                        (value, ', '.join(sorted(DRBD.DRBD_TUNING_PROFILES)))
+                    )
+            elif (setting not in DRBD.DRBD_TUNING_SETTINGS):
+                raise InvalidDrbdTuningConfigException(
+                    'Unknown DRBD tuning setting: %s' % setting
+                )
+            elif (DRBD.DRBD_TUNING_SETTINGS[setting] is not None):
+                if (value not in DRBD.DRBD_TUNING_SETTINGS[setting]):
+                    raise InvalidDrbdTuningConfigException(
+                        'DRBD tuning setting \'%s\' must be one of: %s' %
+                        (setting, ', '.join(DRBD.DRBD_TUNING_SETTINGS[setting]))
+                    )
+            elif (setting in DRBD.DRBD_TUNING_SIZE_SETTINGS):
+                if (not re.match(r'^[1-9][0-9]*[KMG]?$', str(value))):
+                    raise InvalidDrbdTuningConfigException(
+                        'DRBD tuning setting \'%s\' must be a positive number,'
+                        ' optionally with a K, M or G suffix' % setting
+                    )
+            elif (not isinstance(value, (int, long)) or value < 1):
+                raise InvalidDrbdTuningConfigException(
+                    'DRBD tuning setting \'%s\' must be a positive integer' % setting
+                )
+
     def _removeDrbdConfig(self):
         """Remove the DRBD resource configuration from the node"""
         os.remove(self._getDrbdConfigFile())
@@ -178,31 +307,37 @@ class DRBD(Base):
         """Returns the path of the DRBD resource configuration file"""
         return NodeDRBD.CONFIG_DIRECTORY + '/' + self._getResourceName() + '.res'
 
-    def _calculateMetaDataSize(self):
-        """Determines the size of the DRBD meta volume"""
-        import math
-
+    def _calculateMetaDataSize(self, raw_size_mebibytes=None):
+        """Determines the size of the DRBD meta volume. If the size of the raw volume
+        (in MB) is not given, the size of the existing raw volume is used"""
         raw_logical_volume_name = self._getLogicalVolumeName(self.DRBD_RAW_SUFFIX)
         logical_volume_path = self._getLogicalVolumePath(raw_logical_volume_name)
 
-        # Obtain size of raw volume
-        _, raw_size_sectors, _ = System.runCommand(['blockdev', '--getsz', logical_volume_path])
-        raw_size_sectors = int(raw_size_sectors.strip())
+        # Obtain size of raw volume, in 512-byte sectors, as used by the DRBD formula
+        if (raw_size_mebibytes is None):
+            _, raw_size_sectors, _ = System.runCommand(['blockdev', '--getsz',
+                                                        logical_volume_path])
+            raw_size_sectors = int(raw_size_sectors.strip())
+        else:
+            raw_size_sectors = int(raw_size_mebibytes) * (1024 ** 2) / 512
 
-        # Obtain size of sectors
-        _, sector_size, _ = System.runCommand(['blockdev', '--getss', logical_volume_path])
-        sector_size = int(sector_size.strip())
+        return DRBD._getMetaDataSizeForSectors(raw_size_sectors)
+
+    @staticmethod
+    def _getMetaDataSizeForSectors(raw_size_sectors):
+        """Returns the size of the DRBD meta volume (in MB) required for a raw
+        volume of the given number of 512-byte sectors"""
+        import math
 
         # Follow the DRBD meta data calculation formula, see
         # https://drbd.linbit.com/users-guide/ch-internals.html#s-external-meta-data
-        meta_size_formula_step_1 = int(math.ceil(raw_size_sectors / 262144))
+        meta_size_formula_step_1 = int(math.ceil(raw_size_sectors / 262144.0))
         meta_size_formula_step_2 = meta_size_formula_step_1 * 8
         meta_size_sectors = meta_size_formula_step_2 + 72
 
         # Convert meta size in sectors to Mebibytes
-        meta_size_mebibytes = math.ceil((meta_size_sectors * sector_size) / (1024 ^ 2))
+        meta_size_mebibytes = math.ceil((meta_size_sectors * 512) / float(1024 ** 2))
 
-        # Convert from float to int and return
         return int(meta_size_mebibytes)
 
     def _getMCVirtConfig(self):
@@ -211,6 +346,7 @@ class DRBD(Base):
         config['drbd_port'] = self.config['drbd_port']
         config['drbd_minor'] = self.config['drbd_minor']
         config['sync_state'] = self.config['sync_state']
+        config['drbd_tuning'] = self.config['drbd_tuning']
         return config
 
     def _getBackupLogicalVolume(self):
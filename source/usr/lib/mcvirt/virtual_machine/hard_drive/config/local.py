@@ -58,4 +58,4 @@ class Local(Base):
 
     def _getBackupSnapshotLogicalVolume(self):
         """Returns the logical volume name for the backup snapshot"""
-        return self._getDiskName + self.SNAPSHOT_SUFFIX
+        return self._getDiskName() + self.SNAPSHOT_SUFFIX
@@ -17,10 +17,12 @@
 
 from enum import Enum
 import os
+import time
 
 from mcvirt.virtual_machine.hard_drive.base import Base
 from mcvirt.virtual_machine.hard_drive.config.drbd import DRBD as ConfigDRBD
-from mcvirt.node.drbd import DRBD as NodeDRBD, DRBDNotEnabledOnNode, DRBDSocket
+from mcvirt.node.drbd import (DRBD as NodeDRBD, DRBDNotEnabledOnNode, DRBDSocket, DRBDStatus,
+                              DRBDMonitor, DRBDStateTimeoutException)
 from mcvirt.auth import Auth
 from mcvirt.system import System, MCVirtCommandException
 from mcvirt.cluster.cluster import Cluster
@@ -37,6 +39,11 @@ class DrbdBlockDeviceDoesNotExistException(MCVirtException):
     pass
 
 
+class DrbdDisklessClientException(MCVirtException):
+    """The operation cannot be performed on a diskless client of the DRBD volume"""
+    pass
+
+
 class DrbdVolumeNotInSyncException(MCVirtException):
     """The last DRBD verification of the volume failed"""
     pass
@@ -160,6 +167,16 @@ class DrbdDiskState(Enum):
 class DRBD(Base):
     """Provides operations to manage DRBD-backed hard drives, used by VMs"""
 
+    CONVERT_PROGRESS = Enum('CONVERT_PROGRESS',
+                            ['START',
+                             'CREATE_REPLICA_R',
+                             'RENAME_LV',
+                             'CREATE_META_LV',
+                             'CREATE_DRBD_CONFIG',
+                             'DRBD_UP',
+                             'UPDATE_CONFIG',
+                             'UPDATE_LIBVIRT_CONFIG'])
+
     CREATE_PROGRESS = Enum('CREATE_PROGRESS',
                            ['START',
                             'CREATE_RAW_LV',
@@ -170,7 +187,8 @@ class DRBD(Base):
                             'DRBD_UP_R',
                             'ADD_TO_VM',
                             'DRBD_CONNECT',
-                            'DRBD_CONNECT_R'])
+                            'DRBD_CONNECT_R',
+                            'DRBD_UP_DISKLESS'])
 
     DRBD_STATES = {
         'CONNECTION': {
@@ -201,6 +219,22 @@ class DRBD(Base):
         }
     }
 
+    # Time (in seconds) to wait for the resource to connect after it has been created
+    CONNECT_TIMEOUT = 10
+    # Time to wait for DRBD to report a change of role
+    ROLE_CHANGE_TIMEOUT = 15
+    # Time to retry commands that fail whilst the device is briefly held open
+    COMMAND_RETRY_TIMEOUT = 10
+    # Time to wait for a verification to start and for the out-of-sync handler to complete
+    VERIFY_START_TIMEOUT = 30
+    HANDLER_TIMEOUT = 10
+    # Size (in bytes) of the resync requests used when a volume is moved. Requests that
+    # only contain zeros on the sync source are discarded on the sync target, rather
+    # than written, if supported by DRBD
+    MOVE_RS_DISCARD_GRANULARITY = 1048576
+    # Interval (in seconds) between reports of the progress of the sync of a moved volume
+    MOVE_PROGRESS_INTERVAL = 10
+
     def __init__(self, vm_object, disk_id):
         """Sets member variables"""
         # Get DRBD configuration from disk configuration
@@ -209,6 +243,10 @@ class DRBD(Base):
 
     def _checkExists(self):
         """Ensures the required storage elements exist on the system"""
+        # Diskless clients access the data on the replicas over the network, so do
+        # not have any local storage
+        if (self._isDisklessClient()):
+            return True
         raw_lv = self.getConfigObject()._getLogicalVolumeName(
             self.getConfigObject().DRBD_RAW_SUFFIX
         )
@@ -222,12 +260,13 @@ class DRBD(Base):
     def activateDisk(self):
         """Ensures that the disk is ready to be used by a VM on the local node"""
         self._ensureExists()
-        raw_lv = self.getConfigObject()._getLogicalVolumeName(
-            self.getConfigObject().DRBD_RAW_SUFFIX)
-        meta_lv = self.getConfigObject()._getLogicalVolumeName(
-            self.getConfigObject().DRBD_META_SUFFIX)
-        DRBD._ensureLogicalVolumeActive(self.getConfigObject(), raw_lv)
-        DRBD._ensureLogicalVolumeActive(self.getConfigObject(), meta_lv)
+        if (not self._isDisklessClient()):
+            raw_lv = self.getConfigObject()._getLogicalVolumeName(
+                self.getConfigObject().DRBD_RAW_SUFFIX)
+            meta_lv = self.getConfigObject()._getLogicalVolumeName(
+                self.getConfigObject().DRBD_META_SUFFIX)
+            DRBD._ensureLogicalVolumeActive(self.getConfigObject(), raw_lv)
+            DRBD._ensureLogicalVolumeActive(self.getConfigObject(), meta_lv)
         self._checkDrbdStatus()
 
         # If the disk is not already set to primary, set it to primary
@@ -251,6 +290,73 @@ class DRBD(Base):
             )
         )
 
+    @staticmethod
+    def getRequiredStorageSpace(size):
+        """Returns the space (in MB) required on each node to create a hard drive
+        of the given size, including the DRBD meta volume"""
+        return size + ConfigDRBD._getMetaDataSizeForSectors(size * 2048)
+
+    def increaseSize(self, increase_size):
+        """Increases the size of a DRBD hard drive, given the size to increase the drive by.
+        The backing storage is extended on all nodes before DRBD is resized, and the
+        new size of the disk is passed to the VM, if it is running"""
+        self.getVmObject().mcvirt_object.getAuthObject().assertPermission(
+            Auth.PERMISSIONS.MANAGE_DRBD,
+            self.getVmObject()
+        )
+        self._ensureExists()
+        self.getVmObject().ensureUnlocked()
+
+        # The resize must be performed on the node that the VM is registered on,
+        # so that the running VM can be notified of the new disk size
+        if (self.getVmObject().isRegisteredRemotely()):
+            self.getVmObject().ensureRegisteredLocally()
+
+        # DRBD can only be resized whilst the resource is connected and in-sync,
+        # as the new size is negotiated between the nodes
+        self._checkDrbdStatus()
+        if (self._drbdGetConnectionState() is not DrbdConnectionState.CONNECTED):
+            raise DrbdStateException(
+                'DRBD resource must be connected before the disk can be resized: %s' %
+                self.getConfigObject()._getResourceName())
+
+        # Determine the increase required for the meta volume, which grows with
+        # the size of the raw volume
+        raw_logical_volume_name = self.getConfigObject()._getLogicalVolumeName(
+            self.getConfigObject().DRBD_RAW_SUFFIX)
+        meta_logical_volume_name = self.getConfigObject()._getLogicalVolumeName(
+            self.getConfigObject().DRBD_META_SUFFIX)
+        meta_increase_size = max(
+            0,
+            self.getConfigObject()._calculateMetaDataSize(self.getSize() + increase_size) -
+            DRBD._getLogicalVolumeSize(self.getConfigObject(), meta_logical_volume_name)
+        )
+
+        # Ensure there is enough free space in the volume group on all nodes
+        # before modifying any storage
+        DRBD._ensureVolumeGroupFreeSpace(self.getConfigObject(),
+                                         increase_size + meta_increase_size,
+                                         perform_on_nodes=True)
+
+        # Extend the meta volume first, so that it is large enough to hold
+        # the bitmap for the new size when DRBD is resized
+        if (meta_increase_size):
+            DRBD._extendLogicalVolume(self.getConfigObject(), meta_logical_volume_name,
+                                      meta_increase_size, perform_on_nodes=True)
+        DRBD._extendLogicalVolume(self.getConfigObject(), raw_logical_volume_name,
+                                  increase_size, perform_on_nodes=True)
+
+        # Resize the DRBD resource, which resizes the resource on the remote node
+        try:
+            System.runCommand([NodeDRBD.DRBDADM, 'resize',
+                               self.getConfigObject()._getResourceName()])
+        except MCVirtCommandException, e:
+            raise MCVirtException('Error whilst resizing DRBD resource:\n' + str(e))
+        finally:
+            DRBDStatus.invalidate()
+
+        self._resizeLibvirtDisk()
+
     @staticmethod
     def create(vm_object, size, driver, disk_id=None, drbd_minor=None, drbd_port=None):
         """Creates a new hard drive, attaches the disk to the VM and records the disk
@@ -265,6 +371,12 @@ class DRBD(Base):
         if (not NodeDRBD.isEnabled()):
             raise DRBDNotEnabledOnNode('DRBD is not enabled on this node')
 
+        # The storage must be created on a node that holds a replica of the data
+        if (Cluster.getHostname() in vm_object.getDisklessNodes()):
+            raise DrbdDisklessClientException(
+                'DRBD hard drives must be created on a node holding a replica of the data'
+            )
+
         # Obtain disk ID, DRBD minor and DRBD port if one has not been specified
         config_object = ConfigDRBD(
             vm_object=vm_object,
@@ -273,6 +385,9 @@ class DRBD(Base):
             drbd_minor=drbd_minor,
             drbd_port=drbd_port)
 
+        # Reserve the DRBD minor and port in the cluster allocation table
+        config_object._reserveDrbdAllocation()
+
         # Create cluster object for running on remote nodes
         cluster_instance = Cluster(vm_object.mcvirt_object)
 
@@ -331,9 +446,19 @@ class DRBD(Base):
                                               nodes=remote_nodes)
             progress = DRBD.CREATE_PROGRESS.DRBD_UP_R
 
-            # Wait for 5 seconds to let DRBD connect
-            import time
-            time.sleep(5)
+            # Wait for DRBD to connect to the remote node
+            try:
+                DRBDMonitor.getInstance().waitForState(
+                    config_object._getDrbdMinor(),
+                    lambda status: (DrbdConnectionState(status['connection_state']) ==
+                                    DrbdConnectionState.CONNECTED),
+                    timeout=DRBD.CONNECT_TIMEOUT
+                )
+                connected = True
+            except DRBDStateTimeoutException:
+                # Continue, allowing the state checks of later operations
+                # to report the connection state
+                connected = False
 
             # Add to virtual machine
             DRBD._addToVirtualMachine(config_object)
@@ -342,8 +467,13 @@ class DRBD(Base):
             # Create disk object
             hard_drive_object = DRBD(vm_object, config_object.getId())
 
-            # Overwrite data on peer
-            hard_drive_object._drbdOverwritePeer()
+            if (connected):
+                # As the volumes have been zeroed on all nodes, mark the data as
+                # up-to-date without performing an initial sync
+                hard_drive_object._drbdSkipInitialSync()
+            else:
+                # Otherwise, overwrite the data on the peer once it has connected
+                hard_drive_object._drbdOverwritePeer()
 
             # Ensure the DRBD resource is connected
             hard_drive_object._drbdConnect()
@@ -367,10 +497,18 @@ class DRBD(Base):
                     'disk_id': hard_drive_object.getConfigObject().getId()},
                 nodes=remote_nodes)
 
+            # Bring up the DRBD resource on any diskless clients of the VM
+            progress = DRBD.CREATE_PROGRESS.DRBD_UP_DISKLESS
+            hard_drive_object._addDisklessClients(vm_object.getDisklessNodes())
+
             return hard_drive_object
 
         except Exception:
             # If the creation fails, tear down based on the progress of the creation
+            if (progress.value >= DRBD.CREATE_PROGRESS.DRBD_UP_DISKLESS.value):
+                hard_drive_object._removeDisklessClients(vm_object.getDisklessNodes(),
+                                                         ignore_failures=True)
+
             if (progress.value >= DRBD.CREATE_PROGRESS.DRBD_CONNECT_R.value):
                 cluster_instance.runRemoteCommand(
                     'virtual_machine-hard_drive-drbd-drbdDisconnect',
@@ -414,14 +552,177 @@ class DRBD(Base):
                     raw_logical_volume_name,
                     perform_on_nodes=True)
 
+            config_object._releaseDrbdAllocation()
+
+            raise
+
+    @staticmethod
+    def convertFromLocal(local_disk_object, sync_rate=None, progress_callback=None):
+        """Converts a local hard drive to a DRBD hard drive, replicating the data to the
+        other available node of the VM, which must already be configured. The existing
+        logical volume is used as the DRBD raw volume, with the meta data stored on a
+        separate volume, so that the data is not modified. The VM must be stopped, as
+        writes made directly to the raw volume would not be replicated. If given, the
+        initial sync is limited to sync_rate (in MiB/s) and its progress reported to
+        progress_callback"""
+        from mcvirt.virtual_machine.virtual_machine import VmRunningException
+        vm_object = local_disk_object.getVmObject()
+        if (vm_object.isRegisteredLocally() and
+                vm_object._getLibvirtDomainObject().isActive()):
+            raise VmRunningException('The storage of a VM can only be converted whilst the'
+                                     ' VM is stopped')
+
+        local_config_object = local_disk_object.getConfigObject()
+        cluster_instance = Cluster(vm_object.mcvirt_object)
+        remote_nodes = vm_object._getRemoteNodes()
+        size = local_disk_object.getSize()
+        disk_id = local_config_object.getId()
+
+        config_object = ConfigDRBD(vm_object=vm_object, disk_id=disk_id,
+                                   driver=local_config_object._getDriver())
+        config_object.config['performance'] = local_config_object.config['performance']
+        config_object.config['iotune'] = local_config_object.config['iotune']
+        config_object._reserveDrbdAllocation()
+        raw_logical_volume_name = config_object._getLogicalVolumeName(
+            config_object.DRBD_RAW_SUFFIX)
+        meta_logical_volume_name = config_object._getLogicalVolumeName(
+            config_object.DRBD_META_SUFFIX)
+        meta_logical_volume_size = config_object._calculateMetaDataSize(size)
+
+        # Keep track of progress, so that the local hard drive can be restored
+        # if something goes wrong
+        progress = DRBD.CONVERT_PROGRESS.START
+        try:
+            # Create the storage on the other node, ready to be synced from the local node
+            cluster_instance.runRemoteCommand('virtual_machine-hard_drive-drbd-createReplica',
+                                              {'config': config_object._dumpConfig(),
+                                               'size': size,
+                                               'meta_size': meta_logical_volume_size},
+                                              nodes=remote_nodes)
+            progress = DRBD.CONVERT_PROGRESS.CREATE_REPLICA_R
+
+            # Use the existing logical volume as the raw volume
+            DRBD._renameLogicalVolume(config_object, local_config_object._getDiskName(),
+                                      raw_logical_volume_name)
+            progress = DRBD.CONVERT_PROGRESS.RENAME_LV
+
+            DRBD._createLogicalVolume(config_object, meta_logical_volume_name,
+                                      meta_logical_volume_size)
+            progress = DRBD.CONVERT_PROGRESS.CREATE_META_LV
+            DRBD._activateLogicalVolume(config_object, meta_logical_volume_name)
+            DRBD._zeroLocalLogicalVolume(
+                config_object._getLogicalVolumePath(meta_logical_volume_name),
+                meta_logical_volume_size
+            )
+
+            config_object._generateDrbdConfig()
+            progress = DRBD.CONVERT_PROGRESS.CREATE_DRBD_CONFIG
+            DRBD._initialiseMetaData(config_object._getResourceName())
+            DRBD._drbdUp(config_object)
+            progress = DRBD.CONVERT_PROGRESS.DRBD_UP
+
+            # Replace the local hard drive in the VM configuration
+            vm_object.updateConfig(['hard_disks', str(disk_id)], config_object._getMCVirtConfig(),
+                                   'Converted disk \'%s\' of \'%s\' to DRBD' %
+                                   (disk_id, vm_object.getName()))
+            vm_object.updateConfig(['storage_type'], config_object._getType(),
+                                   'Updated storage type for \'%s\' to \'%s\'' %
+                                   (vm_object.getName(), config_object._getType()))
+            progress = DRBD.CONVERT_PROGRESS.UPDATE_CONFIG
+            hard_drive_object = DRBD(vm_object, disk_id)
+
+            # Make the local node the sync source, limiting the rate of the sync,
+            # which is controlled by the sync target
+            if (sync_rate):
+                cluster_instance.runRemoteCommand('virtual_machine-hard_drive-drbd-setResyncRate',
+                                                  {'vm_name': vm_object.getName(),
+                                                   'disk_id': disk_id,
+                                                   'rate': sync_rate * 1024},
+                                                  nodes=remote_nodes)
+            hard_drive_object._drbdOverwritePeer()
+
+            # Switch the VM to the DRBD volume
+            if (vm_object.isRegisteredLocally()):
+                DRBD._replaceLibvirtDisk(config_object)
+                progress = DRBD.CONVERT_PROGRESS.UPDATE_LIBVIRT_CONFIG
+
+        except Exception:
+            # If the conversion fails, restore the local hard drive based on
+            # the progress of the conversion
+            if (progress.value >= DRBD.CONVERT_PROGRESS.UPDATE_LIBVIRT_CONFIG.value):
+                DRBD._replaceLibvirtDisk(local_config_object)
+
+            if (progress.value >= DRBD.CONVERT_PROGRESS.UPDATE_CONFIG.value):
+                vm_object.updateConfig(['hard_disks', str(disk_id)],
+                                       local_config_object._getMCVirtConfig(),
+                                       'Restored local disk \'%s\' of \'%s\'' %
+                                       (disk_id, vm_object.getName()))
+                vm_object.updateConfig(['storage_type'], local_config_object._getType(),
+                                       'Updated storage type for \'%s\' to \'%s\'' %
+                                       (vm_object.getName(), local_config_object._getType()))
+
+            if (progress.value >= DRBD.CONVERT_PROGRESS.DRBD_UP.value):
+                DRBD._drbdDown(config_object)
+
+            if (progress.value >= DRBD.CONVERT_PROGRESS.CREATE_DRBD_CONFIG.value):
+                config_object._removeDrbdConfig()
+
+            if (progress.value >= DRBD.CONVERT_PROGRESS.CREATE_META_LV.value):
+                DRBD._removeLogicalVolume(config_object, meta_logical_volume_name)
+
+            if (progress.value >= DRBD.CONVERT_PROGRESS.RENAME_LV.value):
+                DRBD._renameLogicalVolume(config_object, raw_logical_volume_name,
+                                          local_config_object._getDiskName())
+
+            if (progress.value >= DRBD.CONVERT_PROGRESS.CREATE_REPLICA_R.value):
+                for action in ['virtual_machine-hard_drive-drbd-drbdDown',
+                               'virtual_machine-hard_drive-drbd-removeDrbdConfig']:
+                    cluster_instance.runRemoteCommand(action,
+                                                      {'config': config_object._dumpConfig()},
+                                                      nodes=remote_nodes)
+                for logical_volume_name in [meta_logical_volume_name, raw_logical_volume_name]:
+                    cluster_instance.runRemoteCommand(
+                        'virtual_machine-hard_drive-removeLogicalVolume',
+                        {'config': config_object._dumpConfig(),
+                         'name': logical_volume_name,
+                         'ignore_non_existent': True},
+                        nodes=remote_nodes
+                    )
+
+            config_object._releaseDrbdAllocation()
+
             raise
 
+        # Wait for the data to be synced to the other node, as the VM cannot be
+        # started until the DRBD volume is in sync
+        hard_drive_object._waitForPeerSync(progress_callback)
+        if (sync_rate):
+            cluster_instance.runRemoteCommand('node-drbd-adjust',
+                                              {'resource': config_object._getResourceName()},
+                                              nodes=remote_nodes)
+        return hard_drive_object
+
+    @staticmethod
+    def _replaceLibvirtDisk(config_object):
+        """Replaces the disk in the libvirt configuration of the VM with the disk
+        of the given configuration object, which uses the same target device"""
+        def updateXML(domain_xml):
+            device_xml = domain_xml.find('./devices')
+            device_xml.remove(device_xml.find('./disk/target[@dev="%s"]/..' %
+                                              config_object._getTargetDev()))
+            device_xml.append(config_object._generateLibvirtXml())
+
+        config_object.vm_object.editConfig(updateXML)
+
     def _removeStorage(self):
         """Removes the backing storage for the DRBD hard drive"""
         self._ensureExists()
         cluster_instance = Cluster(self.getVmObject().mcvirt_object)
         remote_nodes = self.getVmObject()._getRemoteNodes()
 
+        # Remove the DRBD resource from any diskless clients
+        self._removeDisklessClients(self.getVmObject().getDisklessNodes())
+
         # Disconnect and perform a 'down' on the DRBD volume on all nodes
         cluster_instance.runRemoteCommand('virtual_machine-hard_drive-drbd-drbdDisconnect',
                                           {'vm_name': self.getVmObject().getName(),
@@ -451,6 +752,9 @@ class DRBD(Base):
                 self.getConfigObject().DRBD_RAW_SUFFIX),
             perform_on_nodes=True)
 
+        # Release the DRBD minor and port, allowing them to be re-used
+        self.getConfigObject()._releaseDrbdAllocation()
+
     @staticmethod
     def _initialiseMetaData(resource_name):
         """Performs an initialisation of the meta data, using drbdadm"""
@@ -460,28 +764,48 @@ class DRBD(Base):
     def _drbdUp(config_object):
         """Performs a DRBD 'up' on the hard drive DRBD resource"""
         System.runCommand([NodeDRBD.DRBDADM, 'up', config_object._getResourceName()])
+        DRBDStatus.invalidate()
 
     @staticmethod
     def _drbdDown(config_object):
         """Performs a DRBD 'down' on the hard drive DRBD resource"""
-        try:
-            System.runCommand([NodeDRBD.DRBDADM, 'down', config_object._getResourceName()])
-        except MCVirtCommandException:
-            import time
-            # If the DRBD down fails, attempt to wait 5 seconds and try again
-            time.sleep(5)
-            System.runCommand([NodeDRBD.DRBDADM, 'down', config_object._getResourceName()])
+        DRBD._runDrbdCommandWithRetry(config_object,
+                                      [NodeDRBD.DRBDADM, 'down',
+                                       config_object._getResourceName()])
+
+    @staticmethod
+    def _runDrbdCommandWithRetry(config_object, command_args):
+        """Runs a DRBD command, which may fail whilst the DRBD device is still held open
+        after a VM has stopped. The command is retried as soon as the state of the
+        resource changes, or at least every second, until the retry timeout"""
+        monitor = DRBDMonitor.getInstance()
+        deadline = time.time() + DRBD.COMMAND_RETRY_TIMEOUT
+        while True:
+            event_id = monitor.getEventId()
+            try:
+                System.runCommand(command_args)
+                return
+            except MCVirtCommandException:
+                remaining_time = deadline - time.time()
+                if (remaining_time <= 0):
+                    raise
+                monitor.waitForChange(config_object._getDrbdMinor(), event_id,
+                                      min(remaining_time, 1))
+            finally:
+                DRBDStatus.invalidate()
 
     def _drbdConnect(self):
         """Performs a DRBD 'connect' on the hard drive DRBD resource"""
         if (self._drbdGetConnectionState() not in DRBD.DRBD_STATES['CONNECTION']['OK']):
             System.runCommand(
                 [NodeDRBD.DRBDADM, 'connect', self.getConfigObject()._getResourceName()])
+            DRBDStatus.invalidate()
 
     def _drbdDisconnect(self):
         """Performs a DRBD 'disconnect' on the hard drive DRBD resource"""
         System.runCommand(
             [NodeDRBD.DRBDADM, 'disconnect', self.getConfigObject()._getResourceName()])
+        DRBDStatus.invalidate()
 
     def _setTwoPrimariesConfig(self, allow=False):
         """Configures DRBD to temporarily allow or re-disable whether
@@ -522,7 +846,7 @@ class DRBD(Base):
                 {'vm_name': self.getVmObject().getName(),
                  'disk_id': self.getConfigObject().getId(),
                  'allow': allow},
-                nodes=self.getConfigObject().vm_object._getRemoteNodes()
+                nodes=self._getPeerNodes()
             )
 
     def _drbdSetPrimary(self, allow_two_primaries=False):
@@ -550,19 +874,86 @@ class DRBD(Base):
 
         # Set DRBD resource to primary
         System.runCommand([NodeDRBD.DRBDADM, 'primary', self.getConfigObject()._getResourceName()])
+        DRBDStatus.invalidate()
 
     def _drbdSetSecondary(self):
         """Performs a DRBD 'secondary' on the hard drive DRBD resource"""
-        # Attempt to set the disk as secondary
-        set_secondary_command = [NodeDRBD.DRBDADM, 'secondary',
-                                 self.getConfigObject()._getResourceName()]
-        try:
-            System.runCommand(set_secondary_command)
-        except MCVirtCommandException:
-            # If this fails, wait for 5 seconds, and attempt once more
-            from time import sleep
-            sleep(5)
-            System.runCommand(set_secondary_command)
+        DRBD._runDrbdCommandWithRetry(self.getConfigObject(),
+                                      [NodeDRBD.DRBDADM, 'secondary',
+                                       self.getConfigObject()._getResourceName()])
+
+    def _applyDrbdConfig(self):
+        """Regenerates the DRBD resource configuration on all nodes of the VM and
+        applies the configuration to the running resource"""
+        config_object = self.getConfigObject()
+        mcvirt_object = self.getVmObject().mcvirt_object
+        if (Cluster.getHostname() in (self.getVmObject().getAvailableNodes() +
+                                      self.getVmObject().getDisklessNodes())):
+            config_object._generateDrbdConfig()
+            NodeDRBD.adjustDRBDConfig(mcvirt_object, config_object._getResourceName())
+
+        if (mcvirt_object.initialiseNodes()):
+            cluster_instance = Cluster(mcvirt_object)
+            remote_nodes = self._getPeerNodes()
+            cluster_instance.runRemoteCommand('virtual_machine-hard_drive-drbd-generateDrbdConfig',
+                                              {'config': config_object._dumpConfig()},
+                                              nodes=remote_nodes)
+            cluster_instance.runRemoteCommand('node-drbd-adjust',
+                                              {'resource': config_object._getResourceName()},
+                                              nodes=remote_nodes)
+
+    def _isDisklessClient(self):
+        """Returns whether the local node is a diskless client of the DRBD resource"""
+        return (Cluster.getHostname() in self.getVmObject().getDisklessNodes())
+
+    def _getPeerNodes(self):
+        """Returns the remote nodes that the DRBD resource is configured on, including
+        both the replicas and the diskless clients"""
+        return [node for node in (self.getVmObject().getAvailableNodes() +
+                                  self.getVmObject().getDisklessNodes())
+                if node != Cluster.getHostname()]
+
+    def _addDisklessClients(self, nodes):
+        """Configures and brings up the DRBD resource on the given diskless clients,
+        which must already be recorded in the VM configuration"""
+        nodes = [node for node in nodes if node != Cluster.getHostname()]
+        if (not nodes):
+            return
+        cluster_instance = Cluster(self.getVmObject().mcvirt_object)
+        cluster_instance.runRemoteCommand('virtual_machine-hard_drive-drbd-generateDrbdConfig',
+                                          {'config': self.getConfigObject()._dumpConfig()},
+                                          nodes=nodes)
+        cluster_instance.runRemoteCommand('virtual_machine-hard_drive-drbd-drbdUp',
+                                          {'config': self.getConfigObject()._dumpConfig()},
+                                          nodes=nodes)
+
+    def _removeDisklessClients(self, nodes, ignore_failures=False):
+        """Takes down and removes the configuration of the DRBD resource
+        on the given diskless clients"""
+        nodes = [node for node in nodes if node != Cluster.getHostname()]
+        if (not nodes):
+            return
+        cluster_instance = Cluster(self.getVmObject().mcvirt_object)
+        for action in ['virtual_machine-hard_drive-drbd-drbdDown',
+                       'virtual_machine-hard_drive-drbd-removeDrbdConfig']:
+            try:
+                cluster_instance.runRemoteCommand(action,
+                                                  {'config': self.getConfigObject()._dumpConfig()},
+                                                  nodes=nodes)
+            except MCVirtException:
+                if (not ignore_failures):
+                    raise
+
+    def _drbdSkipInitialSync(self):
+        """Marks the data on all nodes as up-to-date, without performing an initial sync.
+        This must only be performed on a new, connected, resource, which
+        contains the same data on all nodes"""
+        System.runCommand([NodeDRBD.DRBDADM,
+                           '--',
+                           '--clear-bitmap',
+                           'new-current-uuid',
+                           self.getConfigObject()._getResourceName()])
+        DRBDStatus.invalidate()
 
     def _drbdOverwritePeer(self):
         """Force DRBD to overwrite the data on the peer"""
@@ -571,12 +962,94 @@ class DRBD(Base):
                            '--overwrite-data-of-peer',
                            'primary',
                            self.getConfigObject()._getResourceName()])
+        DRBDStatus.invalidate()
+
+    @staticmethod
+    def _createReplica(config_object, size, meta_size):
+        """Creates the storage for the DRBD volume on the local node and brings up the
+        DRBD resource, ready to be synced from the peer. Since the sync overwrites
+        the raw volume, the raw volume is discarded, rather than zeroed"""
+        raw_logical_volume_name = config_object._getLogicalVolumeName(
+            config_object.DRBD_RAW_SUFFIX)
+        DRBD._createLogicalVolume(config_object, raw_logical_volume_name, size)
+        DRBD._activateLogicalVolume(config_object, raw_logical_volume_name)
+        DRBD._discardLocalLogicalVolume(
+            config_object._getLogicalVolumePath(raw_logical_volume_name)
+        )
+
+        meta_logical_volume_name = config_object._getLogicalVolumeName(
+            config_object.DRBD_META_SUFFIX)
+        DRBD._createLogicalVolume(config_object, meta_logical_volume_name, meta_size)
+        DRBD._activateLogicalVolume(config_object, meta_logical_volume_name)
+        DRBD._zeroLocalLogicalVolume(
+            config_object._getLogicalVolumePath(meta_logical_volume_name), meta_size
+        )
+
+        config_object._generateDrbdConfig()
+        DRBD._initialiseMetaData(config_object._getResourceName())
+        DRBD._drbdUp(config_object)
+        DRBD._runDrbdCommandWithRetry(config_object,
+                                      [NodeDRBD.DRBDADM, 'secondary',
+                                       config_object._getResourceName()])
+        DRBD._setResyncDiscardGranularity(config_object)
+
+    @staticmethod
+    def _setResyncDiscardGranularity(config_object):
+        """Sets the size of resync requests for the resource, so that areas that only
+        contain zeros on the sync source are discarded on the sync target. The setting
+        is removed when the DRBD configuration is next adjusted. Returns whether the
+        setting was changed"""
+        # Do not override a granularity configured in the tuning settings
+        if ('rs-discard-granularity' in config_object.getDrbdTuningConfig()):
+            return False
+        try:
+            System.runCommand([NodeDRBD.DRBDSETUP, 'disk-options',
+                               str(config_object._getDrbdMinor()),
+                               '--rs-discard-granularity=%i' %
+                               DRBD.MOVE_RS_DISCARD_GRANULARITY])
+            return True
+        except MCVirtCommandException:
+            # The version of DRBD does not support discards during a resync
+            return False
+
+    def _waitForPeerSync(self, progress_callback=None):
+        """Waits for the data on the peer to be up-to-date, periodically reporting
+        the progress of the sync to the callback"""
+        resource_name = self.getConfigObject()._getResourceName()
+        minor = self.getConfigObject()._getDrbdMinor()
+
+        def isPeerUpToDate(status):
+            if (status['connection_state'] == DrbdConnectionState.STAND_ALONE.value):
+                raise DrbdStateException('DRBD resource %s disconnected whilst syncing' %
+                                         resource_name)
+            return (status['connection_state'] == DrbdConnectionState.CONNECTED.value and
+                    status['disk_state'][1] == DrbdDiskState.UP_TO_DATE.value)
+
+        monitor = DRBDMonitor.getInstance()
+        while (True):
+            try:
+                monitor.waitForState(minor, isPeerUpToDate, timeout=DRBD.MOVE_PROGRESS_INTERVAL)
+                break
+            except DRBDStateTimeoutException:
+                pass
+
+            if (progress_callback):
+                DRBDStatus.invalidate()
+                status = DRBDStatus.getResource(minor, resource_name)
+                if (DRBDStatus.isSyncing(status)):
+                    progress_callback('Syncing %s: %s' % (resource_name,
+                                                          NodeDRBD._formatProgress(status)))
+        DRBDStatus.invalidate()
 
     def _checkDrbdStatus(self):
         """Checks the status of the DRBD volume and returns the states"""
-        # Check the disk state
+        # Check the disk state. Since diskless clients do not hold the data, the
+        # disk state of the replica is checked instead
         local_disk_state, remote_disk_state = self._drbdGetDiskState()
-        self._checkStateType('DISK', local_disk_state)
+        if (self._isDisklessClient()):
+            self._checkStateType('DISK', remote_disk_state)
+        else:
+            self._checkStateType('DISK', local_disk_state)
 
         # Check connection state
         connection_state = self._drbdGetConnectionState()
@@ -611,40 +1084,46 @@ class DRBD(Base):
                     'DRBD connection state for the DRBD resource %s is %s so cannot continue. ' %
                     (self.getConfigObject()._getResourceName(), state.value))
 
+    def _drbdGetStatus(self):
+        """Returns the status of the DRBD resource, which is obtained for all
+           resources on the node at once"""
+        return DRBDStatus.getResource(self.getConfigObject()._getDrbdMinor(),
+                                      self.getConfigObject()._getResourceName())
+
     def _drbdGetConnectionState(self):
         """Returns the connection state of the DRBD resource"""
-        _, stdout, _ = System.runCommand([NodeDRBD.DRBDADM, 'cstate',
-                                          self.getConfigObject()._getResourceName()])
-        state = stdout.strip()
-        return DrbdConnectionState(state)
+        return DrbdConnectionState(self._drbdGetStatus()['connection_state'])
 
     def _drbdGetDiskState(self):
         """Returns the disk state of the DRBD resource"""
-        _, stdout, _ = System.runCommand([NodeDRBD.DRBDADM, 'dstate',
-                                          self.getConfigObject()._getResourceName()])
-        states = stdout.strip()
-        (local_state, remote_state) = states.split('/')
+        (local_state, remote_state) = self._drbdGetStatus()['disk_state']
         return (DrbdDiskState(local_state), DrbdDiskState(remote_state))
 
     def _drbdGetRole(self):
         """Returns the role of the DRBD resource"""
-        _, stdout, _ = System.runCommand([NodeDRBD.DRBDADM, 'role',
-                                          self.getConfigObject()._getResourceName()])
-        states = stdout.strip()
-        (local_state, remote_state) = states.split('/')
+        (local_state, remote_state) = self._drbdGetStatus()['role']
         return (DrbdRoleState(local_state), DrbdRoleState(remote_state))
 
-    def preMigrationChecks(self):
-        """Ensures that the DRBD state of the disk is in a state suitable for migration"""
+    def preMigrationChecks(self, migrate_to_local_node=False):
+        """Ensures that the DRBD state of the disk is in a state suitable for migration.
+        When migrating the VM to the local node, the remote volume must be primary"""
         # Ensure disk state is up-to-date on both local and remote nodes
         local_disk_state, remote_disk_state = self._drbdGetDiskState()
         local_role, remote_role = self._drbdGetRole()
         connection_state = self._drbdGetConnectionState()
+
+        # Diskless clients do not hold the data, so only the replica must be up-to-date
+        if (self._isDisklessClient() and local_disk_state is DrbdDiskState.DISKLESS):
+            local_disk_state = DrbdDiskState.UP_TO_DATE
+
+        expected_roles = (DrbdRoleState.PRIMARY, DrbdRoleState.SECONDARY)
+        if (migrate_to_local_node):
+            expected_roles = (DrbdRoleState.SECONDARY, DrbdRoleState.PRIMARY)
+
         if ((local_disk_state is not DrbdDiskState.UP_TO_DATE) or
                 (remote_disk_state is not DrbdDiskState.UP_TO_DATE) or
                 (connection_state is not DrbdConnectionState.CONNECTED) or
-                (local_role is not DrbdRoleState.PRIMARY) or
-                (remote_role is not DrbdRoleState.SECONDARY)):
+                ((local_role, remote_role) != expected_roles)):
             raise DrbdStateException('DRBD resource %s is not in a suitable state to be migrated. '
                                      % self.getConfigObject()._getResourceName() +
                                      'Both nodes must be up-to-date and connected')
@@ -665,24 +1144,65 @@ class DRBD(Base):
     def postOnlineMigration(self):
         """Performs post tasks after a VM
            has performed an online migration"""
-        import time
         # Set DRBD on local node as secondary
         self._drbdSetSecondary()
 
-        # Attempt to wait for DRBD to update status to secondary
-        # If, after 15 seconds, the local volume is still not
-        # primary, let the setTwiPrimariesConfig function raise
+        # Wait for DRBD to update status to secondary
+        # If, after the timeout, the local volume is still not
+        # secondary, let the setTwoPrimariesConfig function raise
         # an appropriate exception
-        for i in range(1, 3):
-            local_role, _ = self._drbdGetRole()
-            if (local_role is DrbdRoleState.SECONDARY):
-                break
-            else:
-                time.sleep(5)
+        try:
+            DRBDMonitor.getInstance().waitForState(
+                self.getConfigObject()._getDrbdMinor(),
+                lambda status: status['role'][0] == DrbdRoleState.SECONDARY.value,
+                timeout=DRBD.ROLE_CHANGE_TIMEOUT
+            )
+        except DRBDStateTimeoutException:
+            pass
+        DRBDStatus.invalidate()
 
         # Disable the DRBD volume from being a dual-primary mode
         self._setTwoPrimariesConfig(allow=False)
 
+    def preOnlineMigrationToLocalNode(self, source_node):
+        """Performs required tasks in order for the underlying VM
+           to perform an online migration from the given remote
+           node to the local node"""
+        # Temporarily allow the DRBD volume to be in a dual-primary mode
+        source_node.runRemoteCommand('virtual_machine-hard_drive-drbd-setTwoPrimariesConfig',
+                                     {'vm_name': self.getVmObject().getName(),
+                                      'disk_id': self.getConfigObject().getId(),
+                                      'allow': True})
+
+        # Set local node as primary
+        self._drbdSetPrimary(allow_two_primaries=True)
+
+    def postOnlineMigrationToLocalNode(self, source_node):
+        """Performs post tasks after the underlying VM has performed
+           an online migration from the given remote node to the
+           local node"""
+        # Set DRBD on remote node as secondary
+        source_node.runRemoteCommand('virtual_machine-hard_drive-drbd-drbdSetSecondary',
+                                     {'vm_name': self.getVmObject().getName(),
+                                      'disk_id': self.getConfigObject().getId()})
+
+        # Wait for DRBD to update the status of the remote node to secondary
+        try:
+            DRBDMonitor.getInstance().waitForState(
+                self.getConfigObject()._getDrbdMinor(),
+                lambda status: status['role'][1] == DrbdRoleState.SECONDARY.value,
+                timeout=DRBD.ROLE_CHANGE_TIMEOUT
+            )
+        except DRBDStateTimeoutException:
+            pass
+        DRBDStatus.invalidate()
+
+        # Disable the DRBD volume from being a dual-primary mode
+        source_node.runRemoteCommand('virtual_machine-hard_drive-drbd-setTwoPrimariesConfig',
+                                     {'vm_name': self.getVmObject().getName(),
+                                      'disk_id': self.getConfigObject().getId(),
+                                      'allow': False})
+
     def _ensureBlockDeviceExists(self):
         """Ensures that the DRBD block device exists"""
         drbd_block_device = self.getConfigObject()._getDrbdDevice()
@@ -701,8 +1221,15 @@ class DRBD(Base):
             )
 
     def _isInSync(self):
-        """Returns whether the last DRBD verification reported the
-           DRBD volume as in-sync"""
+        """Returns whether the last DRBD verification reported the DRBD volume as in-sync
+           and DRBD has not since reported out-of-sync blocks. Out-of-sync blocks reported
+           whilst no DRBD socket was running are recorded in the spool, until it is processed"""
+        if (self.getConfigObject()._getResourceName() in DRBDSocket.getSpooledResources()):
+            return False
+        return self._isMarkedInSync()
+
+    def _isMarkedInSync(self):
+        """Returns whether the DRBD volume is marked as in-sync in the VM configuration"""
         vm_config = self.getVmObject().getConfigObject().getConfig()
 
         # If the hard drive configuration exists, read the current state of the disk
@@ -744,45 +1271,43 @@ class DRBD(Base):
 
     def verify(self):
         """Performs a verification of a DRBD hard drive"""
-        import time
-
         # Check DRBD state of disk
-        if (self._drbdGetConnectionState() != DrbdConnectionState.CONNECTED):
-            raise DrbdStateException(
-                'DRBD resource must be connected before performing a verification: %s' %
-                self.getConfigObject()._getResourceName())
+        self._ensureVerifiable()
 
         self.getVmObject().mcvirt_object.releaseLock()
 
-        # Reset the disk to be marked in a consistent state
-        self.setSyncState(True)
-
         try:
             # Create a socket, to receive errors from DRBD about out-of-sync blocks
             drbd_socket = DRBDSocket(self.getVmObject().mcvirt_object)
 
             # Perform a drbdadm verification
-            System.runCommand([NodeDRBD.DRBDADM, 'verify',
-                               self.getConfigObject()._getResourceName()])
-
-            # Monitor the DRBD status, until the VM has started syncing
-            while True:
-                if (self._drbdGetConnectionState() == DrbdConnectionState.VERIFY_S):
-                    break
-                time.sleep(5)
-
-            # Monitor the DRBD status, until the VM has finished syncing
-            while True:
-                if (self._drbdGetConnectionState() != DrbdConnectionState.VERIFY_S):
-                    break
-                time.sleep(5)
-
-            # Provide DRBD 10 seconds to run the mcvirt_drbd command, if necessary
-            time.sleep(10)
+            monitor = DRBDMonitor.getInstance()
+            minor = self.getConfigObject()._getDrbdMinor()
+            event_id = self._startVerification()
+
+            # Wait for the verification to start. A verification of a small volume
+            # may complete before it is observed, so continue if it is not seen
+            try:
+                monitor.waitForState(
+                    minor,
+                    lambda status: (status['connection_state'] ==
+                                    DrbdConnectionState.VERIFY_S.value),
+                    timeout=DRBD.VERIFY_START_TIMEOUT, since=event_id
+                )
+            except DRBDStateTimeoutException:
+                pass
+
+            # Wait until the verification has finished
+            status = monitor.waitForState(
+                minor,
+                lambda status: (status['connection_state'] !=
+                                DrbdConnectionState.VERIFY_S.value)
+            )
+            self._finishVerification(status, event_id)
 
-            # Stop the DRBD connection socket
+            # Stop the DRBD connection socket, which waits for any message
+            # from the handler to be processed
             drbd_socket.stop()
-            time.sleep(10)
             drbd_socket.mcvirt_instance = None
             drbd_socket = None
 
@@ -805,7 +1330,53 @@ class DRBD(Base):
             raise DrbdVolumeNotInSyncException('The DRBD verification for \'%s\' failed' %
                                                self.getConfigObject()._getResourceName())
 
-    def move(self, destination_node, source_node):
+    def _ensureVerifiable(self):
+        """Ensures that the DRBD resource is in a state that can be verified"""
+        if (self._drbdGetConnectionState() not in [DrbdConnectionState.CONNECTED,
+                                                   DrbdConnectionState.VERIFY_S]):
+            raise DrbdStateException(
+                'DRBD resource must be connected before performing a verification: %s' %
+                self.getConfigObject()._getResourceName())
+
+    def _startVerification(self):
+        """Marks the hard drive as in-sync and starts a DRBD verification, returning
+        the ID of the latest DRBD event before the verification was started. If a
+        verification is already running (e.g. from an interrupted verify), it is used"""
+        # Reset the disk to be marked in a consistent state
+        self.setSyncState(True)
+
+        event_id = DRBDMonitor.getInstance().getEventId()
+        if (self._drbdGetConnectionState() != DrbdConnectionState.VERIFY_S):
+            System.runCommand([NodeDRBD.DRBDADM, 'verify',
+                               self.getConfigObject()._getResourceName()])
+            DRBDStatus.invalidate()
+        return event_id
+
+    def _finishVerification(self, status, event_id):
+        """Waits for the result of a completed verification to be reported"""
+        DRBDStatus.invalidate()
+
+        # If out-of-sync blocks have been found (or the number of out-of-sync
+        # blocks is unknown), wait for DRBD to run the out-of-sync handler,
+        # which notifies MCVirt through the socket
+        if (status['out_of_sync'] is None or status['out_of_sync']):
+            DRBDMonitor.getInstance().waitForHelper(self.getConfigObject()._getDrbdMinor(),
+                                                    'out-of-sync', event_id,
+                                                    DRBD.HANDLER_TIMEOUT)
+
+    def _setResyncRate(self, rate):
+        """Limits the rate of a resync or verification of the DRBD resource, in KiB/s.
+        The rate configured for the resource is restored by _resetResyncRate"""
+        System.runCommand([NodeDRBD.DRBDSETUP, 'disk-options',
+                           str(self.getConfigObject()._getDrbdMinor()),
+                           '--resync-rate=%iK' % rate, '--c-max-rate=%iK' % rate])
+
+    def _resetResyncRate(self):
+        """Restores the rates configured for the DRBD resource"""
+        NodeDRBD.adjustDRBDConfig(self.getVmObject().mcvirt_object,
+                                  self.getConfigObject()._getResourceName())
+
+    def move(self, destination_node, source_node, progress_callback=None):
         """Replaces a remote node for the DRBD volume with a new node
            and syncs the data"""
         cluster_instance = Cluster(self.getVmObject().mcvirt_object)
@@ -835,66 +1406,31 @@ class DRBD(Base):
         # Disconnect the local DRBD volume
         self._drbdDisconnect()
 
-        # Obtain the size of the disk to be created
-        disk_size = self.getSize()
-
-        # Create the storage on the destination node
-        raw_logical_volume_name = self.getConfigObject()._getLogicalVolumeName(
-            self.getConfigObject().DRBD_RAW_SUFFIX)
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-createLogicalVolume',
-                                          {'config': self.getConfigObject()._dumpConfig(),
-                                           'name': raw_logical_volume_name,
-                                           'size': disk_size})
-
-        # Activate and zero raw volume
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-activateLogicalVolume',
-                                          {'config': self.getConfigObject()._dumpConfig(),
-                                           'name': raw_logical_volume_name})
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-zeroLogicalVolume',
-                                          {'config': self.getConfigObject()._dumpConfig(),
-                                           'name': raw_logical_volume_name,
-                                           'size': disk_size})
-
-        meta_logical_volume_name = self.getConfigObject()._getLogicalVolumeName(
-            self.getConfigObject().DRBD_META_SUFFIX)
-        meta_volume_size = self.getConfigObject()._calculateMetaDataSize()
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-createLogicalVolume',
-                                          {'config': self.getConfigObject()._dumpConfig(),
-                                           'name': meta_logical_volume_name,
-                                           'size': meta_volume_size})
-
-        # Activate and zero meta volume
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-activateLogicalVolume',
-                                          {'config': self.getConfigObject()._dumpConfig(),
-                                           'name': meta_logical_volume_name})
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-zeroLogicalVolume',
-                                          {'config': self.getConfigObject()._dumpConfig(),
-                                           'name': meta_logical_volume_name,
-                                           'size': meta_volume_size})
-
-        # Generate DRBD configuration on local and remote node
-        self.getConfigObject()._generateDrbdConfig()
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-drbd-generateDrbdConfig',
-                                          {'config': self.getConfigObject()._dumpConfig()})
+        # Create the storage and bring up the DRBD resource on the destination node, using
+        # a single remote command
+        config_object = self.getConfigObject()
+        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-drbd-createReplica',
+                                          {'config': config_object._dumpConfig(),
+                                           'size': self.getSize(),
+                                           'meta_size': config_object._calculateMetaDataSize()})
 
+        # Connect the local DRBD volume to the destination node
+        config_object._generateDrbdConfig()
         NodeDRBD.adjustDRBDConfig(self.getVmObject().mcvirt_object,
-                                  self.getConfigObject()._getResourceName())
-
-        # Initialise meta-data on destination node
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-drbd-initialiseMetaData',
-                                          {'config': self.getConfigObject()._dumpConfig()})
-
-        # Bring up DRBD volume on destination node
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-drbd-drbdUp',
-                                          {'config': self.getConfigObject()._dumpConfig()})
-
-        # Set destination node to secondary
-        dest_node_object.runRemoteCommand('virtual_machine-hard_drive-drbd-drbdSetSecondary',
-                                          {'vm_name': self.getVmObject().getName(),
-                                           'disk_id': self.getConfigObject().getId()})
+                                  config_object._getResourceName())
 
-        # Overwrite peer with data from local node
+        # Overwrite peer with data from local node, discarding areas that only contain
+        # zeros on the destination node, rather than writing them
+        discard_granularity_set = DRBD._setResyncDiscardGranularity(config_object)
         self._drbdOverwritePeer()
+        self._waitForPeerSync(progress_callback)
+
+        # Restore the configured resync settings on both nodes
+        if (discard_granularity_set):
+            NodeDRBD.adjustDRBDConfig(self.getVmObject().mcvirt_object,
+                                      config_object._getResourceName())
+            dest_node_object.runRemoteCommand('node-drbd-adjust',
+                                              {'resource': config_object._getResourceName()})
 
         # Remove the raw logic volume from the source node
         if (source_node not in cluster_instance.getFailedNodes()):
@@ -903,3 +1439,13 @@ class DRBD(Base):
                                               'name': self.getConfigObject()._getLogicalVolumeName(
                                                   self.getConfigObject().DRBD_RAW_SUFFIX),
                                               'ignore_non_existent': False})
+
+        # Connect any diskless clients to the destination node
+        diskless_nodes = self.getVmObject().getDisklessNodes()
+        if (diskless_nodes):
+            cluster_instance.runRemoteCommand('virtual_machine-hard_drive-drbd-generateDrbdConfig',
+                                              {'config': config_object._dumpConfig()},
+                                              nodes=diskless_nodes)
+            cluster_instance.runRemoteCommand('node-drbd-adjust',
+                                              {'resource': config_object._getResourceName()},
+                                              nodes=diskless_nodes)
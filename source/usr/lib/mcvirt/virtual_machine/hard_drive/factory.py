@@ -61,10 +61,28 @@ class Factory():
                                        config=arguments['config'])
 
     @staticmethod
-    def create(vm_object, size, storage_type, driver):
+    def create(vm_object, size, storage_type, driver, check_capacity=True):
         """Performs the creation of a hard drive, using a given storage type"""
+        if (check_capacity):
+            Factory.ensureStorageCapacity(vm_object.mcvirt_object, storage_type, [size],
+                                          vm_object.getAvailableNodes())
         return Factory.getClass(storage_type).create(vm_object, size, driver)
 
+    @staticmethod
+    def ensureStorageCapacity(mcvirt_instance, storage_type, sizes, nodes):
+        """Ensures that each of the given nodes has enough free space to create
+        hard drives of the given sizes (in MB), before any storage is created"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.node.capacity import Capacity
+        if (not mcvirt_instance.initialiseNodes()):
+            nodes = [Cluster.getHostname()]
+        hard_drive_class = Factory.getClass(storage_type)
+        required_space = sum([hard_drive_class.getRequiredStorageSpace(int(size))
+                              for size in sizes])
+        Capacity(mcvirt_instance).ensureFreeSpace(
+            dict((node, required_space) for node in nodes)
+        )
+
     @staticmethod
     def getStorageTypes():
         """Returns the available storage types that MCVirt provides"""
@@ -36,25 +36,26 @@ class Local(Base):
         """Sets member variables and obtains libvirt domain object"""
         self.config = ConfigLocal(vm_object=vm_object, disk_id=disk_id, registered=True)
         super(Local, self).__init__(disk_id=disk_id)
+        self.migration_disk_path = None
 
     def increaseSize(self, increase_size):
-        """Increases the size of a VM hard drive, given the size to increase the drive by"""
+        """Increases the size of a VM hard drive, given the size to increase the drive by.
+        If the VM is running, the new size of the disk is passed to the running VM"""
         self._ensureExists()
-        # Ensure VM is stopped
-        from mcvirt.virtual_machine.virtual_machine import PowerStates
-        if (self.getVmObject().getState() is not PowerStates.STOPPED):
-            raise MCVirtException('VM must be stopped before increasing disk size')
+        self.getVmObject().ensureUnlocked()
 
         # Ensure that VM has not been cloned and is not a clone
         if (self.getVmObject().getCloneParent() or self.getVmObject().getCloneChildren()):
             raise MCVirtException('Cannot increase the disk of a cloned VM or a clone.')
 
-        command_args = ('lvextend', '-L', '+%sM' % increase_size,
-                        self.getConfigObject()._getDiskPath())
-        try:
-            System.runCommand(command_args)
-        except MCVirtCommandException, e:
-            raise MCVirtException("Error whilst extending logical volume:\n" + str(e))
+        # Ensure there is enough free space in the volume group
+        Local._ensureVolumeGroupFreeSpace(self.getConfigObject(), increase_size)
+
+        Local._extendLogicalVolume(self.getConfigObject(),
+                                   self.getConfigObject()._getDiskName(),
+                                   increase_size)
+
+        self._resizeLibvirtDisk()
 
     def _checkExists(self):
         """Checks if a disk exists, which is required before any operations
@@ -129,6 +130,42 @@ class Local(Base):
         self._ensureExists()
         pass
 
-    def preMigrationChecks(self):
-        """Perform pre-migration checks"""
-        raise CannotMigrateLocalDiskException('VMs using local disks cannot be migrated')
+    def preMigrationChecks(self, migrate_to_local_node=False):
+        """Ensures that the disk can be copied to another node during an online migration.
+        The storage can only be copied by the node that holds it"""
+        if (migrate_to_local_node):
+            raise CannotMigrateLocalDiskException(
+                'VMs using local disks can only be migrated by the node that they are'
+                ' registered on'
+            )
+        self._ensureExists()
+
+        # Clones and cloned VMs share logical volume snapshots, which cannot be copied
+        if (self.getVmObject().getCloneParent() or self.getVmObject().getCloneChildren()):
+            raise CannotMigrateLocalDiskException(
+                'Cannot migrate the disk of a cloned VM or a clone'
+            )
+
+    def preOnlineMigration(self, destination_node):
+        """Creates a logical volume on the destination node, to which the
+        disk is copied during the migration"""
+        disk_name = self.getConfigObject()._getDiskName()
+        destination_node.runRemoteCommand('virtual_machine-hard_drive-createLogicalVolume',
+                                          {'config': self.getConfigObject()._dumpConfig(),
+                                           'name': disk_name,
+                                           'size': self.getSize()})
+        self.migration_disk_path = destination_node.runRemoteCommand(
+            'virtual_machine-hard_drive-getLogicalVolumePath',
+            {'config': self.getConfigObject()._dumpConfig(),
+             'name': disk_name}
+        )
+
+    def getMigrationDiskPath(self):
+        """Returns the path of the logical volume on the destination node of
+        an online migration, to which the disk is copied"""
+        return self.migration_disk_path
+
+    def postOnlineMigration(self):
+        """Removes the logical volume on the local node, once the
+        disk has been copied to the destination node"""
+        Local._removeLogicalVolume(self.getConfigObject(), self.getConfigObject()._getDiskName())
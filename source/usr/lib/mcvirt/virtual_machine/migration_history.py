@@ -0,0 +1,122 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import fcntl
+import json
+import os
+import tempfile
+import time
+from texttable import Texttable
+
+from mcvirt.mcvirt import MCVirt
+from mcvirt.system import System
+
+
+class MigrationHistory(object):
+    """Records the statistics of the live migrations performed by the node, so that
+    the VMs that are expensive to migrate can be identified"""
+
+    # File containing a JSON record of each migration on each line
+    HISTORY_FILE = MCVirt.NODE_STORAGE_DIR + '/migration_history'
+    # Lock held whilst the history file is updated, as migrations performed
+    # concurrently may complete at the same time
+    LOCK_FILE = MCVirt.LOCK_FILE_DIR + '/migration_history.lock'
+    # Number of records that are retained in the history file
+    MAXIMUM_RECORDS = 1000
+
+    @staticmethod
+    def addRecord(record):
+        """Appends a record of a migration to the history file, removing
+        the oldest records once the maximum number of records is reached"""
+        if (not os.path.isdir(MCVirt.LOCK_FILE_DIR)):
+            os.mkdir(MCVirt.LOCK_FILE_DIR)
+        lock_fh = open(MigrationHistory.LOCK_FILE, 'a')
+        try:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            records = MigrationHistory.getLocalRecords()
+            records.append(record)
+            records = records[-MigrationHistory.MAXIMUM_RECORDS:]
+
+            # Write the records to a temporary file, which replaces the history file,
+            # so that the history is not lost if writing the file is interrupted
+            temp_fd, temp_file = tempfile.mkstemp(
+                dir=os.path.dirname(MigrationHistory.HISTORY_FILE),
+                prefix=os.path.basename(MigrationHistory.HISTORY_FILE) + '.'
+            )
+            try:
+                with os.fdopen(temp_fd, 'w') as history_fh:
+                    for history_record in records:
+                        history_fh.write('%s\n' % json.dumps(history_record, sort_keys=True))
+                os.rename(temp_file, MigrationHistory.HISTORY_FILE)
+            except:
+                if (os.path.exists(temp_file)):
+                    os.remove(temp_file)
+                raise
+        finally:
+            lock_fh.close()
+
+    @staticmethod
+    def getLocalRecords(vm_name=None):
+        """Returns the records of the migrations performed by the local node,
+        optionally for a single VM"""
+        if (not os.path.isfile(MigrationHistory.HISTORY_FILE)):
+            return []
+        records = []
+        with open(MigrationHistory.HISTORY_FILE, 'r') as history_fh:
+            for line in history_fh:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Ignore lines that were not completely written
+                    continue
+                if (vm_name is None or record['vm_name'] == vm_name):
+                    records.append(record)
+        return records
+
+    @staticmethod
+    def getRecords(mcvirt_instance, vm_name=None):
+        """Returns the records of the migrations performed by all nodes in the
+        cluster, optionally for a single VM, ordered by the time they started"""
+        records = MigrationHistory.getLocalRecords(vm_name)
+        if (mcvirt_instance.initialiseNodes()):
+            from mcvirt.cluster.cluster import Cluster
+            cluster_instance = Cluster(mcvirt_instance)
+            remote_records = cluster_instance.runRemoteCommand(
+                'virtual_machine-migration_history-getLocalRecords', {'vm_name': vm_name}
+            )
+            for node_records in remote_records.values():
+                records += node_records
+        return sorted(records, key=lambda record: record['start_time'])
+
+    @staticmethod
+    def getTable(records):
+        """Returns a table of migration records"""
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('Started', 'VM', 'Source', 'Destination', 'Status', 'Duration',
+                      'Downtime', 'Transferred', 'Iterations'))
+        for record in records:
+            downtime = ('%i ms' % record['downtime'] if record['downtime'] is not None
+                        else 'Unknown')
+            table.add_row((time.strftime('%Y-%m-%d %H:%M:%S',
+                                         time.localtime(record['start_time'])),
+                           record['vm_name'], record['source_node'],
+                           record['destination_node'], record['status'],
+                           System.formatDuration(record['duration']), downtime,
+                           System.formatSize(record['data_transferred']),
+                           record['memory_iterations'] or '-'))
+        return table.draw()
@@ -0,0 +1,162 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import sys
+import threading
+import time
+
+import libvirt
+
+from mcvirt.mcvirt import MCVirtException
+from mcvirt.system import System
+
+
+class MigrationCancelledException(MCVirtException):
+    """The migration was cancelled by the user"""
+    pass
+
+
+class MigrationMonitor(threading.Thread):
+    """Monitors the libvirt job of a live migration, whilst the migration is
+    performed by another thread, reporting the progress of the migration and
+    switching the migration to post-copy once the configured number of
+    iterations of the memory copy have been performed"""
+
+    # Interval (in seconds) between polls of the statistics of the migration job
+    POLL_INTERVAL = 1
+    # Interval (in seconds) between reports of the progress of the migration
+    PROGRESS_INTERVAL = 5
+
+    def __init__(self, libvirt_domain_object, post_copy_after=None, progress_callback=None):
+        """Sets member variables"""
+        super(MigrationMonitor, self).__init__()
+        self.daemon = True
+        self.libvirt_domain_object = libvirt_domain_object
+        self.post_copy_after = post_copy_after
+        self.progress_callback = progress_callback
+        self.post_copy_started = False
+        self.aborted = False
+        self.last_job_stats = {}
+        self.last_progress_time = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        """Polls the statistics of the migration job until the monitor is stopped"""
+        while (not self.stop_event.wait(self.POLL_INTERVAL)):
+            try:
+                job_stats = self.libvirt_domain_object.jobStats()
+            except libvirt.libvirtError:
+                # The job statistics are unavailable once the domain
+                # has been undefined on the source node
+                continue
+            self._processJobStats(job_stats)
+
+    def stop(self):
+        """Stops the monitor and waits for it to finish"""
+        self.stop_event.set()
+        if (self.is_alive()):
+            self.join()
+
+    def abort(self):
+        """Aborts the migration job"""
+        try:
+            self.libvirt_domain_object.abortJob()
+            self.aborted = True
+        except libvirt.libvirtError:
+            # The migration may have completed before it could be aborted
+            pass
+
+    def performMigration(self, migrate_function):
+        """Runs the migration function in a separate thread, so that the migration
+        can be cancelled by interrupting the calling thread (e.g. using Ctrl-C),
+        which aborts the migration job. Returns the result of the migration function"""
+        result = {}
+
+        def migrate():
+            try:
+                result['status'] = migrate_function()
+            except Exception:
+                result['exception'] = sys.exc_info()
+
+        migration_thread = threading.Thread(target=migrate)
+        migration_thread.daemon = True
+        migration_thread.start()
+        try:
+            # Wait with a timeout, as waiting indefinitely cannot be interrupted
+            while (migration_thread.is_alive()):
+                migration_thread.join(self.POLL_INTERVAL)
+        except KeyboardInterrupt:
+            self.abort()
+            migration_thread.join()
+            if ('exception' in result):
+                raise MigrationCancelledException('The migration was cancelled')
+
+        if ('exception' in result):
+            raise result['exception'][0], result['exception'][1], result['exception'][2]
+        return result['status']
+
+    def getStatistics(self, completed_job_stats=None):
+        """Returns the statistics of the migration, using the statistics of the
+        completed job, if available, otherwise the latest statistics obtained
+        whilst the migration was in progress"""
+        job_stats = completed_job_stats or self.last_job_stats
+        return {
+            'downtime': job_stats.get('downtime'),
+            'data_transferred': job_stats.get('data_processed'),
+            'memory_iterations': job_stats.get('memory_iteration'),
+            'post_copy': self.post_copy_started
+        }
+
+    def _processJobStats(self, job_stats):
+        """Records the statistics of the migration job, reports the progress of the
+        migration and switches the migration to post-copy, if required"""
+        if (job_stats.get('type', libvirt.VIR_DOMAIN_JOB_NONE) == libvirt.VIR_DOMAIN_JOB_NONE):
+            return
+        self.last_job_stats = job_stats
+
+        # Switch to post-copy once the memory of the VM has been copied the configured
+        # number of times without the migration converging. The iteration reported by
+        # libvirt is the pass of the memory copy in progress
+        if (self.post_copy_after and not self.post_copy_started and
+                job_stats.get('memory_iteration', 0) > self.post_copy_after):
+            try:
+                self.libvirt_domain_object.migrateStartPostCopy()
+                self.post_copy_started = True
+            except libvirt.libvirtError:
+                # The migration may have completed since the statistics were obtained
+                pass
+
+        if (self.progress_callback and
+                time.time() - self.last_progress_time >= self.PROGRESS_INTERVAL):
+            self.last_progress_time = time.time()
+            self.progress_callback(MigrationMonitor.formatProgress(job_stats))
+
+    @staticmethod
+    def formatProgress(job_stats):
+        """Returns a summary of the progress of a migration job"""
+        dirty_rate = None
+        if ('memory_dirty_rate' in job_stats and 'memory_page_size' in job_stats):
+            dirty_rate = job_stats['memory_dirty_rate'] * job_stats['memory_page_size']
+        expected_downtime = ('%i ms' % job_stats['downtime'] if 'downtime' in job_stats
+                             else 'Unknown')
+        return ('Remaining: %s, transfer rate: %s, dirty rate: %s, iteration: %s,'
+                ' expected downtime: %s' %
+                (System.formatSize(job_stats.get('data_remaining')),
+                 System.formatSize(job_stats.get('memory_bps'), '/s'),
+                 System.formatSize(dirty_rate, '/s'),
+                 job_stats.get('memory_iteration', 'Unknown'),
+                 expected_downtime))
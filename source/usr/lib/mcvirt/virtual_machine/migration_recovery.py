@@ -0,0 +1,344 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import json
+import os
+import sys
+import threading
+
+import libvirt
+
+from mcvirt.mcvirt import MCVirt, MCVirtException
+from mcvirt.cluster.cluster import Cluster
+
+
+class NoMigrationRecoveryException(MCVirtException):
+    """There is no interrupted migration recovery for the VM"""
+    pass
+
+
+class MigrationRecoveryFailedException(MCVirtException):
+    """The VM could not be recovered after a failed migration"""
+    pass
+
+
+class MigrationRecovery(object):
+    """Recovers a VM after a failed online migration. The node holding the domain is
+    determined from libvirt (or the DRBD roles, if the domain is not defined on either
+    node), the DRBD volumes on the other node are set to secondary and the dual-primary
+    configuration is removed. For VMs using local storage, the copy of the storage on
+    the other node is removed. Each step is journalled, so that an interrupted recovery
+    can be resumed"""
+
+    JOURNAL_FILE = MCVirt.NODE_STORAGE_DIR + '/migration_recovery.json'
+    # Maximum time (in seconds) to wait for a DRBD volume to become secondary
+    ROLE_CHANGE_TIMEOUT = 5
+
+    STATE_LOCATE = 'locate'
+    STATE_DEMOTE = 'demote'
+    STATE_RESET = 'reset'
+    STATE_REGISTER = 'register'
+
+    # Protects the journal, which may be updated by concurrent migrations
+    JOURNAL_LOCK = threading.Lock()
+
+    def __init__(self, vm_object, source_node, destination_node):
+        """Sets member variables"""
+        self.vm_object = vm_object
+        self.source_node = source_node
+        self.destination_node = destination_node
+        self.state = self.STATE_LOCATE
+        self.owner_node = None
+        self.dual_primary_disks = []
+        self.domain_states = {}
+
+    @staticmethod
+    def _loadJournal():
+        """Returns the recoveries that are in progress, keyed by VM name"""
+        if (not os.path.isfile(MigrationRecovery.JOURNAL_FILE)):
+            return {}
+        with open(MigrationRecovery.JOURNAL_FILE, 'r') as journal_fh:
+            return json.loads(journal_fh.read())
+
+    @staticmethod
+    def _saveJournal(journal):
+        """Writes the recoveries that are in progress to the journal"""
+        if (not journal):
+            if (os.path.isfile(MigrationRecovery.JOURNAL_FILE)):
+                os.remove(MigrationRecovery.JOURNAL_FILE)
+            return
+        temp_file = MigrationRecovery.JOURNAL_FILE + '.tmp'
+        with open(temp_file, 'w') as journal_fh:
+            journal_fh.write(json.dumps(journal, indent=2, separators=(',', ': ')))
+        os.rename(temp_file, MigrationRecovery.JOURNAL_FILE)
+
+    def _record(self, completed=False):
+        """Records the progress of the recovery, removing it from the
+        journal once the recovery has completed"""
+        with MigrationRecovery.JOURNAL_LOCK:
+            journal = MigrationRecovery._loadJournal()
+            if (completed):
+                journal.pop(self.vm_object.getName(), None)
+            else:
+                journal[self.vm_object.getName()] = {
+                    'source_node': self.source_node,
+                    'destination_node': self.destination_node,
+                    'state': self.state,
+                    'owner_node': self.owner_node,
+                    'dual_primary_disks': self.dual_primary_disks
+                }
+            MigrationRecovery._saveJournal(journal)
+
+    @staticmethod
+    def getPendingRecoveries():
+        """Returns the names of the VMs with an interrupted recovery"""
+        with MigrationRecovery.JOURNAL_LOCK:
+            return sorted(MigrationRecovery._loadJournal())
+
+    @staticmethod
+    def resume(vm_object):
+        """Resumes an interrupted recovery of a VM"""
+        from mcvirt.auth import Auth
+        vm_object.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MIGRATE_VM,
+                                                                 vm_object)
+        with MigrationRecovery.JOURNAL_LOCK:
+            journal = MigrationRecovery._loadJournal()
+        if (vm_object.getName() not in journal):
+            raise NoMigrationRecoveryException(
+                'There is no interrupted migration recovery for %s' % vm_object.getName()
+            )
+        entry = journal[vm_object.getName()]
+        recovery = MigrationRecovery(vm_object, entry['source_node'], entry['destination_node'])
+        recovery.state = entry['state']
+        recovery.owner_node = entry['owner_node']
+        recovery.dual_primary_disks = entry['dual_primary_disks']
+        recovery.run()
+        return recovery.owner_node
+
+    def run(self):
+        """Performs the remaining steps of the recovery, returning the node
+        that the VM is registered on"""
+        self._record()
+
+        if (self.state == self.STATE_LOCATE):
+            self.owner_node = self._locateDomain()
+            self._resumeDomain()
+            self.state = self.STATE_DEMOTE
+            self._record()
+
+        copy_storage = (self.vm_object.getStorageType() == 'Local')
+        if (self.state == self.STATE_DEMOTE):
+            if (not copy_storage):
+                self._processDisks(self._demoteDisk)
+            self.state = self.STATE_RESET
+            self._record()
+
+        if (self.state == self.STATE_RESET):
+            self._processDisks(self._removeStorageCopy if copy_storage else self._resetDisk)
+
+            # Only volumes that were primary on both nodes may have diverged. The sync
+            # states are updated in turn, as each updates the VM configuration
+            for disk_object in self.vm_object.getDiskObjects():
+                if (disk_object.getConfigObject().getId() in self.dual_primary_disks):
+                    disk_object.setSyncState(False)
+            self.state = self.STATE_REGISTER
+            self._record()
+
+        if (self.state == self.STATE_REGISTER and self.owner_node):
+            if (copy_storage and self.vm_object.getAvailableNodes() != [self.owner_node]):
+                self.vm_object.updateConfig(['available_nodes'], [self.owner_node],
+                                            'Migrated storage of VM \'%s\' to node \'%s\'' %
+                                            (self.vm_object.getName(), self.owner_node))
+            self.vm_object._setNode(self.owner_node)
+
+        self._record(completed=True)
+        return self.owner_node
+
+    def _getOtherNode(self):
+        """Returns the node of the migration that does not hold the domain"""
+        if (self.owner_node == self.source_node):
+            return self.destination_node
+        return self.source_node
+
+    def _getLibvirtDomain(self, node):
+        """Returns the libvirt domain object of the VM on the given node"""
+        mcvirt_object = self.vm_object.mcvirt_object
+        if (node == Cluster.getHostname()):
+            libvirt_connection = mcvirt_object.getLibvirtConnection()
+        else:
+            libvirt_connection = mcvirt_object.getRemoteLibvirtConnection(
+                Cluster(mcvirt_object).getRemoteNode(node)
+            )
+        return libvirt_connection.lookupByName(self.vm_object.getName())
+
+    def _getDomainState(self, node):
+        """Returns the libvirt state and reason of the domain on the given node, (None, None)
+        if the state cannot be obtained from libvirt, or None if the domain is not defined"""
+        from mcvirt.virtual_machine.virtual_machine import VirtualMachine
+        try:
+            return tuple(self._getLibvirtDomain(node).state())
+        except libvirt.libvirtError:
+            # The domain is not defined, or the libvirt daemon of the node cannot be
+            # contacted, in which case the domains defined on the node are obtained
+            # using MCVirt
+            if (self.vm_object.getName() in VirtualMachine.getAllVms(
+                    self.vm_object.mcvirt_object, node=node)):
+                return (None, None)
+            return None
+
+    def _locateDomain(self):
+        """Returns the node that holds the domain of the VM"""
+        for node in (self.source_node, self.destination_node):
+            domain_state = self._getDomainState(node)
+            if (domain_state is not None):
+                self.domain_states[node] = domain_state
+
+        # If the domain is running on a single node, the node holds the VM
+        running_nodes = [node for node in self.domain_states
+                         if self.domain_states[node][0] == libvirt.VIR_DOMAIN_RUNNING]
+        if (len(running_nodes) == 1):
+            return running_nodes[0]
+        if (len(self.domain_states) == 1):
+            return self.domain_states.keys()[0]
+        if (self.domain_states):
+            # The domain is defined on both nodes, but not running on either (or running on
+            # both). Until the migration completes, the source node holds the VM
+            return self.source_node
+
+        # The local storage on the source node is only removed once the
+        # migration has completed, so the source node holds the VM
+        if (self.vm_object.getStorageType() == 'Local'):
+            return self.source_node
+
+        # If the domain is not defined on either node, use the node on which
+        # the DRBD volumes are primary
+        from mcvirt.virtual_machine.hard_drive.drbd import DrbdRoleState
+        local_primary = remote_primary = True
+        for disk_object in self.vm_object.getDiskObjects():
+            local_role, remote_role = disk_object._drbdGetRole()
+            local_primary &= (local_role is DrbdRoleState.PRIMARY)
+            remote_primary &= (remote_role is DrbdRoleState.PRIMARY)
+        if (local_primary != remote_primary):
+            local_hostname = Cluster.getHostname()
+            remote_hostname = (self.destination_node if self.source_node == local_hostname
+                               else self.source_node)
+            return local_hostname if local_primary else remote_hostname
+        return None
+
+    def _resumeDomain(self):
+        """Resumes the domain, if it was paused by the migration"""
+        if (self.owner_node is None or
+                self.domain_states.get(self.owner_node) !=
+                (libvirt.VIR_DOMAIN_PAUSED, libvirt.VIR_DOMAIN_PAUSED_MIGRATION)):
+            return
+        try:
+            self._getLibvirtDomain(self.owner_node).resume()
+        except libvirt.libvirtError, e:
+            raise MigrationRecoveryFailedException(
+                'The VM could not be resumed on %s: %s' % (self.owner_node, str(e))
+            )
+
+    def _processDisks(self, disk_function):
+        """Runs the given function for each of the hard drives of the VM concurrently,
+        raising the first exception once all of the hard drives have been processed"""
+        exceptions = []
+
+        def processDisk(disk_object):
+            try:
+                disk_function(disk_object)
+            except Exception:
+                exceptions.append(sys.exc_info())
+
+        threads = []
+        for disk_object in self.vm_object.getDiskObjects():
+            thread = threading.Thread(target=processDisk, args=(disk_object,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if (exceptions):
+            raise exceptions[0][0], exceptions[0][1], exceptions[0][2]
+
+    def _demoteDisk(self, disk_object):
+        """Sets the DRBD volume on the node that does not hold the domain to secondary"""
+        from mcvirt.node.drbd import DRBDMonitor, DRBDStateTimeoutException
+        from mcvirt.virtual_machine.hard_drive.drbd import DrbdRoleState
+        if (self.owner_node is None):
+            return
+
+        local_role, remote_role = disk_object._drbdGetRole()
+        if (local_role is DrbdRoleState.PRIMARY and remote_role is DrbdRoleState.PRIMARY):
+            with MigrationRecovery.JOURNAL_LOCK:
+                self.dual_primary_disks.append(disk_object.getConfigObject().getId())
+
+        if (self._getOtherNode() == Cluster.getHostname()):
+            role_index, other_role = 0, local_role
+        else:
+            role_index, other_role = 1, remote_role
+        if (other_role is DrbdRoleState.SECONDARY):
+            return
+
+        if (role_index == 0):
+            disk_object._drbdSetSecondary()
+        else:
+            Cluster(self.vm_object.mcvirt_object).getRemoteNode(
+                self._getOtherNode()
+            ).runRemoteCommand('virtual_machine-hard_drive-drbd-drbdSetSecondary',
+                               {'vm_name': self.vm_object.getName(),
+                                'disk_id': disk_object.getConfigObject().getId()})
+
+        # Wait for DRBD to report the volume as secondary. If it does not, removing the
+        # dual-primary configuration raises an appropriate exception
+        try:
+            DRBDMonitor.getInstance().waitForState(
+                disk_object.getConfigObject()._getDrbdMinor(),
+                lambda status: status['role'][role_index] == DrbdRoleState.SECONDARY.value,
+                timeout=self.ROLE_CHANGE_TIMEOUT
+            )
+        except DRBDStateTimeoutException:
+            pass
+
+    def _resetDisk(self, disk_object):
+        """Removes the dual-primary configuration of the DRBD volume, which is
+        configured by the source node of the migration"""
+        from mcvirt.node.drbd import DRBDStatus
+        DRBDStatus.invalidate()
+        if (self.source_node == Cluster.getHostname()):
+            disk_object._setTwoPrimariesConfig(allow=False)
+        else:
+            Cluster(self.vm_object.mcvirt_object).getRemoteNode(
+                self.source_node
+            ).runRemoteCommand('virtual_machine-hard_drive-drbd-setTwoPrimariesConfig',
+                               {'vm_name': self.vm_object.getName(),
+                                'disk_id': disk_object.getConfigObject().getId(),
+                                'allow': False})
+
+    def _removeStorageCopy(self, disk_object):
+        """Removes the logical volume of a local disk from the node that does not hold
+        the domain, which is either a partial copy or has been copied to the other node"""
+        config_object = disk_object.getConfigObject()
+        if (self._getOtherNode() == Cluster.getHostname()):
+            disk_object._removeLogicalVolume(config_object, config_object._getDiskName(),
+                                             ignore_non_existent=True)
+        else:
+            Cluster(self.vm_object.mcvirt_object).getRemoteNode(
+                self._getOtherNode()
+            ).runRemoteCommand('virtual_machine-hard_drive-removeLogicalVolume',
+                               {'config': config_object._dumpConfig(),
+                                'name': config_object._getDiskName(),
+                                'ignore_non_existent': True})
@@ -26,6 +26,11 @@ class NetworkAdapterDoesNotExistException(MCVirtException):
     pass
 
 
+class MacAddressAlreadyInUseException(MCVirtException):
+    """The MAC address is already used by another network adapter"""
+    pass
+
+
 class NetworkAdapter:
     """Provides operations to network interfaces attached to a VM"""
 
@@ -92,14 +97,19 @@ class NetworkAdapter:
 
     @staticmethod
     def generateMacAddress():
-        """Generates a random MAC address for new VM network interfaces"""
+        """Generates a random MAC address for new VM network interfaces, which is
+        not used by any of the existing network interfaces"""
         import random
-        mac = [0x00, 0x16, 0x3e,
-               random.randint(0x00, 0x7f),
-               random.randint(0x00, 0xff),
-               random.randint(0x00, 0xff)]
-
-        return ':'.join(map(lambda x: "%02x" % x, mac))
+        from mcvirt.node.network import Network
+        interface_index = Network.getInterfaceIndex()
+        while (True):
+            mac = [0x00, 0x16, 0x3e,
+                   random.randint(0x00, 0x7f),
+                   random.randint(0x00, 0xff),
+                   random.randint(0x00, 0xff)]
+            mac_address = ':'.join(map(lambda x: "%02x" % x, mac))
+            if (not Network.checkMacAddressExists(mac_address, interface_index)):
+                return mac_address
 
     def getMacAddress(self):
         """Returns the MAC address of the current network object"""
@@ -114,6 +124,11 @@ class NetworkAdapter:
         # Generate a MAC address, if one has not been supplied
         if (mac_address is None):
             mac_address = NetworkAdapter.generateMacAddress()
+        elif (Network.checkMacAddressExists(mac_address)):
+            raise MacAddressAlreadyInUseException(
+                'The MAC address \'%s\' is already used by another network adapter' %
+                mac_address
+            )
 
         # Obtain an instance of MCVirt from the vm_object
         mcvirt_object = vm_object.mcvirt_object
@@ -124,6 +139,8 @@ class NetworkAdapter:
         vm_object.getConfigObject().updateConfig(
             updateVmConfig, 'Added network adapter to \'%s\' on \'%s\' network' %
             (vm_object.getName(), network_object.getName()))
+        Network._addInterfaceToIndex(network_object.getName(), mac_address,
+                                     vm_object.getName())
 
         if (mcvirt_object.initialiseNodes()):
             cluster_object = Cluster(mcvirt_object)
@@ -147,6 +164,9 @@ class NetworkAdapter:
 
     def delete(self):
         """Remove the given interface from the VM, based on the given MAC address"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.node.network import Network
+
         def updateXML(domain_xml):
             device_xml = domain_xml.find('./devices')
             interface_xml = device_xml.find(
@@ -160,11 +180,23 @@ class NetworkAdapter:
 
             device_xml.remove(interface_xml)
 
-        self.vm_object.editConfig(updateXML)
+        # Only update the LibVirt configuration if VM is registered on this node
+        if (self.vm_object.isRegisteredLocally()):
+            self.vm_object.editConfig(updateXML)
 
         # Update the VM configuration
+        network_name = self.getConnectedNetwork()
+
         def updateVmConfig(config):
             del config['network_interfaces'][self.getMacAddress()]
         self.vm_object.getConfigObject().updateConfig(
             updateVmConfig, 'Removed network adapter from \'%s\' on \'%s\' network: %s' %
-            (self.vm_object.getName(), self.getConnectedNetwork(), self.getMacAddress()))
+            (self.vm_object.getName(), network_name, self.getMacAddress()))
+        Network._removeInterfaceFromIndex(network_name, self.getMacAddress())
+
+        mcvirt_object = self.vm_object.mcvirt_object
+        if (mcvirt_object.initialiseNodes()):
+            cluster_object = Cluster(mcvirt_object)
+            cluster_object.runRemoteCommand('network_adapter-delete',
+                                            {'vm_name': self.vm_object.getName(),
+                                             'mac_address': self.getMacAddress()})
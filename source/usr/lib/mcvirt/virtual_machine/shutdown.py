@@ -0,0 +1,244 @@
+# Copyright (c) 2014 - I.T. Dev Ltd
+#
+# This file is part of MCVirt.
+#
+# MCVirt is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# MCVirt is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCVirt.  If not, see <http://www.gnu.org/licenses/>
+
+import threading
+import time
+from texttable import Texttable
+
+import libvirt
+
+from mcvirt.mcvirt import MCVirtException
+from mcvirt.auth import Auth
+from mcvirt.concurrent_runner import ConcurrentRunner
+
+
+class InvalidShutdownOptionException(MCVirtException):
+    """The options given for shutting down the VMs are not valid"""
+    pass
+
+
+class ShutdownFailedException(MCVirtException):
+    """One or more VMs could not be shut down"""
+    pass
+
+
+class VirtualMachineShutdown(ConcurrentRunner):
+    """Shuts down VMs registered on the local node, running a number of shutdowns
+    concurrently. The guest is asked to shut down using the QEMU guest agent or,
+    if the agent is not available, using an ACPI power button event. If the VM has
+    not stopped once the shutdown timeout has expired, it is powered off"""
+
+    # Default time (in seconds) that a VM is given to shut down before it is powered off
+    DEFAULT_TIMEOUT = 120
+    DEFAULT_CONCURRENCY = 10
+
+    METHOD_GUEST_AGENT = 'Guest agent'
+    METHOD_ACPI = 'ACPI'
+    METHOD_DESTROY = 'Powered off'
+
+    FAILURE_MESSAGE = 'The VM \'%s\' could not be shut down: %s'
+
+    # The libvirt event loop is process-wide, so a single connection is used to
+    # receive the lifecycle events of all domains, which are passed to the waiting
+    # shutdowns, indexed by domain name
+    _event_lock = threading.Lock()
+    _event_connection = None
+    _waiters = {}
+
+    def __init__(self, mcvirt_instance, timeout=None, concurrency=None):
+        """Sets member variables and validates the options"""
+        super(VirtualMachineShutdown, self).__init__(
+            self.DEFAULT_CONCURRENCY if concurrency is None else concurrency
+        )
+        self.mcvirt_instance = mcvirt_instance
+        self.timeout = timeout
+        if (self.timeout is not None and self.timeout < 0):
+            raise InvalidShutdownOptionException('The shutdown timeout cannot be negative')
+        if (self.concurrency < 1):
+            raise InvalidShutdownOptionException(
+                'At least one VM must be able to be shut down at a time'
+            )
+
+    @classmethod
+    def _registerLifecycleEvents(cls, mcvirt_instance):
+        """Starts the libvirt event loop and registers for the lifecycle events of
+        the domains on the local node, if this has not already been performed"""
+        with cls._event_lock:
+            if (cls._event_connection is not None):
+                return
+
+            # The event implementation must be registered before the connection
+            # receiving the events is opened
+            libvirt.virEventRegisterDefaultImpl()
+            event_thread = threading.Thread(target=cls._runEventLoop)
+            event_thread.daemon = True
+            event_thread.start()
+
+            connection = libvirt.open(mcvirt_instance.libvirt_uri)
+            if (connection is None):
+                raise MCVirtException('Failed to open connection to the hypervisor')
+            connection.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                                              cls._lifecycleCallback, None)
+            cls._event_connection = connection
+
+    @staticmethod
+    def _runEventLoop():
+        """Dispatches libvirt events"""
+        while (True):
+            libvirt.virEventRunDefaultImpl()
+
+    @classmethod
+    def _lifecycleCallback(cls, connection, domain, event, detail, opaque):
+        """Notifies the shutdown waiting for a domain that it has stopped"""
+        if (event == libvirt.VIR_DOMAIN_EVENT_STOPPED):
+            with cls._event_lock:
+                stopped_event = cls._waiters.get(domain.name())
+            if (stopped_event is not None):
+                stopped_event.set()
+
+    @classmethod
+    def waitForStop(cls, vm_object):
+        """Waits for a VM on the local node to stop, using the lifecycle events
+        of the domain, rather than polling the state of the VM"""
+        from mcvirt.virtual_machine.virtual_machine import PowerStates
+        cls._registerLifecycleEvents(vm_object.mcvirt_object)
+
+        # Register for the stopped event before checking the state of the VM,
+        # so that the event cannot be missed
+        stopped_event = threading.Event()
+        with cls._event_lock:
+            cls._waiters[vm_object.getName()] = stopped_event
+        try:
+            if (vm_object.getState() is not PowerStates.RUNNING):
+                return
+            # Wait with a timeout, as waiting indefinitely cannot be interrupted
+            while (not stopped_event.is_set()):
+                stopped_event.wait(cls.CHECK_INTERVAL)
+        finally:
+            with cls._event_lock:
+                if (cls._waiters.get(vm_object.getName()) is stopped_event):
+                    del cls._waiters[vm_object.getName()]
+
+    def getTimeout(self, vm_object):
+        """Returns the time (in seconds) that the VM is given to shut down"""
+        if (self.timeout is not None):
+            return self.timeout
+        vm_timeout = vm_object.getShutdownTimeout()
+        return self.DEFAULT_TIMEOUT if vm_timeout is None else vm_timeout
+
+    def shutdown(self, vm_objects, progress_callback=None):
+        """Shuts down each of the given VMs, returning the result of each shutdown"""
+        from mcvirt.virtual_machine.virtual_machine import PowerStates
+
+        results = []
+        pending = []
+        for vm_object in vm_objects:
+            vm_object.ensureRegisteredLocally()
+            entry = ConcurrentRunner._initialiseResult({
+                'vm_object': vm_object,
+                'vm_name': vm_object.getName(),
+                'method': None
+            })
+            results.append(entry)
+            if (vm_object.getState() is not PowerStates.RUNNING):
+                entry['error'] = 'The VM is not running'
+                continue
+
+            # Ensure that the user has permission to stop the VM and that it is unlocked
+            try:
+                self.mcvirt_instance.getAuthObject().assertPermission(
+                    Auth.PERMISSIONS.CHANGE_VM_POWER_STATE,
+                    vm_object)
+                vm_object.ensureUnlocked()
+            except MCVirtException, e:
+                entry['result'] = self.RESULT_FAILED
+                entry['error'] = str(e)
+                continue
+            pending.append(entry)
+
+        if (pending):
+            self._registerLifecycleEvents(self.mcvirt_instance)
+            self._run(pending,
+                      lambda entry: self._shutdownVirtualMachine(entry, progress_callback))
+        return results
+
+    def _shutdownVirtualMachine(self, entry, progress_callback):
+        """Asks the guest to shut down, using the guest agent or an ACPI event, and
+        powers off the VM if it has not stopped by the end of the timeout"""
+        from mcvirt.virtual_machine.virtual_machine import PowerStates
+
+        vm_object = entry['vm_object']
+        domain_object = vm_object._getLibvirtDomainObject()
+        deadline = time.time() + self.getTimeout(vm_object)
+
+        # Register for the stopped event of the domain before the shutdown is
+        # requested, so that the event cannot be missed
+        stopped_event = threading.Event()
+        with self._event_lock:
+            self._waiters[entry['vm_name']] = stopped_event
+        try:
+            for method, flags in ((self.METHOD_GUEST_AGENT,
+                                   libvirt.VIR_DOMAIN_SHUTDOWN_GUEST_AGENT),
+                                  (self.METHOD_ACPI,
+                                   libvirt.VIR_DOMAIN_SHUTDOWN_ACPI_POWER_BTN)):
+                try:
+                    domain_object.shutdownFlags(flags)
+                except libvirt.libvirtError:
+                    # The guest agent is not configured or is not responding, so
+                    # fall back to the next method
+                    continue
+                entry['method'] = method
+                if (progress_callback):
+                    progress_callback('%s: Shutting down using %s' %
+                                      (entry['vm_name'], method.lower()))
+                break
+
+            if (entry['method'] is not None):
+                stopped_event.wait(max(0, deadline - time.time()))
+                if (stopped_event.is_set() or
+                        vm_object.getState() is not PowerStates.RUNNING):
+                    return
+
+            # The guest has not shut down, so power off the VM
+            if (progress_callback):
+                progress_callback('%s: The VM has not shut down, powering off' %
+                                  entry['vm_name'])
+            entry['method'] = self.METHOD_DESTROY
+            try:
+                domain_object.destroy()
+            except libvirt.libvirtError:
+                # The VM may have stopped whilst it was being powered off
+                if (vm_object.getState() is PowerStates.RUNNING):
+                    raise
+        finally:
+            with self._event_lock:
+                if (self._waiters.get(entry['vm_name']) is stopped_event):
+                    del self._waiters[entry['vm_name']]
+
+    @staticmethod
+    def getSummary(results):
+        """Returns a report of the shutdown of each VM"""
+        table = Texttable()
+        table.set_deco(Texttable.HEADER | Texttable.VLINES)
+        table.header(('VM', 'Method', 'Result', 'Duration'))
+        for entry in results:
+            result = entry['result']
+            if (entry['error']):
+                result = '%s: %s' % (result, entry['error'])
+            table.add_row((entry['vm_name'], entry['method'] or '-', result,
+                           '%is' % entry['duration']))
+        return table.draw()
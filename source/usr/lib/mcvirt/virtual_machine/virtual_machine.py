@@ -20,6 +20,7 @@ import xml.etree.ElementTree as ET
 import re
 import os
 import shutil
+import time
 from texttable import Texttable
 from enum import Enum
 
@@ -64,6 +65,16 @@ class VmAlreadyStartedException(MCVirtException):
     pass
 
 
+class VmSavedStateException(MCVirtException):
+    """The VM has a saved state, which would be lost by the operation"""
+    pass
+
+
+class NoSavedStateException(MCVirtException):
+    """The VM does not have a saved state to be restored"""
+    pass
+
+
 class VmAlreadyRegisteredException(MCVirtException):
     """VM is already registered on a node"""
     pass
@@ -113,6 +124,26 @@ class VirtualMachineLockException(MCVirtException):
     pass
 
 
+class InvalidIoThreadConfigException(MCVirtException):
+    """The iothread configuration for the VM is not valid"""
+    pass
+
+
+class InvalidBlkioWeightException(MCVirtException):
+    """The block I/O weight for the VM is not valid"""
+    pass
+
+
+class InvalidMigrationTuningConfigException(MCVirtException):
+    """The live migration tuning configuration is not valid"""
+    pass
+
+
+class InvalidStorageConversionException(MCVirtException):
+    """The storage of the VM cannot be converted to the given storage type"""
+    pass
+
+
 class LockStates(Enum):
     """Library of virtual machine lock states"""
     UNLOCKED = 0
@@ -129,6 +160,47 @@ class PowerStates(Enum):
 class VirtualMachine(object):
     """Provides operations to manage a LibVirt virtual machine"""
 
+    BLKIO_WEIGHT_MINIMUM = 100
+    BLKIO_WEIGHT_MAXIMUM = 1000
+
+    # Live migration tuning settings, with the values that each may take. Settings
+    # without a list take a positive integer: the bandwidth in MiB/s, the number of
+    # parallel (multifd) connections and the number of iterations of the memory copy
+    # after which the migration is switched to post-copy
+    MIGRATION_TUNING_SETTINGS = {
+        'bandwidth': None,
+        'parallel-connections': None,
+        'compression': ['none', 'xbzrle', 'zstd'],
+        'auto-converge': ['yes', 'no'],
+        'post-copy-after': None
+    }
+    # Profiles of migration tuning settings, which can be selected using the 'profile'
+    # setting and are overridden by any other settings
+    MIGRATION_TUNING_PROFILES = {
+        'lan-1g': {
+            'bandwidth': 110,
+            'compression': 'xbzrle',
+            'auto-converge': 'yes',
+            'post-copy-after': 5
+        },
+        'lan-10g': {
+            'bandwidth': 1100,
+            'parallel-connections': 4,
+            'auto-converge': 'yes'
+        },
+        'large-memory': {
+            'compression': 'xbzrle',
+            'auto-converge': 'yes',
+            'post-copy-after': 2
+        },
+        'wan': {
+            'bandwidth': 20,
+            'parallel-connections': 2,
+            'compression': 'zstd',
+            'auto-converge': 'yes'
+        }
+    }
+
     def __init__(self, mcvirt_object, name):
         """Sets member variables and obtains LibVirt domain object"""
         self.name = name
@@ -183,8 +255,122 @@ class VirtualMachine(object):
                 'VM registered elsewhere and cluster is not initialised'
             )
 
-    def start(self, iso_object=None):
-        """Starts the VM"""
+    def shutdown(self, timeout=None):
+        """Shuts down the VM, using the QEMU guest agent or an ACPI event, powering
+        off the VM if it has not stopped by the end of the timeout. Returns the
+        method that stopped the VM"""
+        from mcvirt.virtual_machine.shutdown import (VirtualMachineShutdown,
+                                                     ShutdownFailedException)
+        # Check the user has permission to start/stop VMs
+        self.mcvirt_object.getAuthObject().assertPermission(
+            Auth.PERMISSIONS.CHANGE_VM_POWER_STATE,
+            self)
+
+        # Determine if VM is registered on the local machine
+        if self.isRegisteredLocally():
+            if (self.getState() is not PowerStates.RUNNING):
+                raise VmAlreadyStoppedException('The VM is already shutdown')
+            results = VirtualMachineShutdown(self.mcvirt_object,
+                                             timeout=timeout).shutdown([self])
+            failures = VirtualMachineShutdown.getFailures(results)
+            if (failures):
+                raise ShutdownFailedException("\n".join(failures))
+            return results[0]['method']
+        elif self.mcvirt_object.initialiseNodes():
+            from mcvirt.cluster.cluster import Cluster
+            cluster_object = Cluster(self.mcvirt_object)
+            remote = cluster_object.getRemoteNode(self.getNode())
+            return remote.runRemoteCommand('virtual_machine-shutdown',
+                                           {'vm_name': self.getName(),
+                                            'timeout': timeout})
+        else:
+            raise VmRegisteredElsewhereException(
+                'VM registered elsewhere and cluster is not initialised'
+            )
+
+    def saveState(self):
+        """Saves the memory state of the running VM to disk, using libvirt managed save,
+        stopping the VM. The state is restored when the VM is next started"""
+        # Check the user has permission to start/stop VMs
+        self.mcvirt_object.getAuthObject().assertPermission(
+            Auth.PERMISSIONS.CHANGE_VM_POWER_STATE,
+            self)
+
+        # Ensure VM is unlocked and registered locally
+        self.ensureUnlocked()
+        self.ensureRegisteredLocally()
+
+        if (self.getState() is not PowerStates.RUNNING):
+            raise VmAlreadyStoppedException('The VM is already shutdown')
+
+        # Bypass the page cache, so that saving the VMs does not evict the
+        # cache of the node
+        self._getLibvirtDomainObject().managedSave(libvirt.VIR_DOMAIN_SAVE_BYPASS_CACHE)
+
+    def restoreState(self):
+        """Starts the VM from the memory state saved by saveState"""
+        # Check the user has permission to start/stop VMs
+        self.mcvirt_object.getAuthObject().assertPermission(
+            Auth.PERMISSIONS.CHANGE_VM_POWER_STATE,
+            self)
+
+        # Ensure VM is unlocked and registered locally
+        self.ensureUnlocked()
+        self.ensureRegisteredLocally()
+
+        if (self.getState() is PowerStates.RUNNING):
+            raise VmAlreadyStartedException('The VM is already running')
+        if (not self.hasSavedState()):
+            raise NoSavedStateException('The VM %s does not have a saved state' %
+                                        self.getName())
+
+        # The disks must be available, with DRBD volumes in the primary role,
+        # before the VM is restored
+        for disk_object in self.getDiskObjects():
+            disk_object.activateDisk()
+
+        self._getLibvirtDomainObject().createWithFlags(libvirt.VIR_DOMAIN_START_BYPASS_CACHE)
+
+    def hasSavedState(self):
+        """Returns whether the VM has a memory state saved by saveState"""
+        return (self.isRegisteredLocally() and
+                bool(self._getLibvirtDomainObject().hasManagedSaveImage(0)))
+
+    def getResumePriority(self):
+        """Returns the priority of the VM when restoring the saved state of the VMs
+        on a node. VMs with a higher priority are restored first"""
+        return self.getConfigObject().getConfig()['resume_priority']
+
+    def setResumePriority(self, priority):
+        """Sets the priority of the VM when restoring the saved state of the VMs
+        on a node"""
+        # Check the user has permission to modify VMs
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MODIFY_VM, self)
+
+        self.updateConfig(['resume_priority'], priority,
+                          'Resume priority for %s has been changed' % self.getName())
+
+    def getShutdownTimeout(self):
+        """Returns the time (in seconds) that the VM is given to shut down before it
+        is powered off, or None if the default is used"""
+        return self.getConfigObject().getConfig()['shutdown_timeout']
+
+    def setShutdownTimeout(self, timeout):
+        """Sets the time (in seconds) that the VM is given to shut down before it
+        is powered off. The default is used if the timeout is None"""
+        from mcvirt.virtual_machine.shutdown import InvalidShutdownOptionException
+        # Check the user has permission to modify VMs
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MODIFY_VM, self)
+
+        if (timeout is not None and timeout < 0):
+            raise InvalidShutdownOptionException('The shutdown timeout cannot be negative')
+
+        self.updateConfig(['shutdown_timeout'], timeout,
+                          'Shutdown timeout for %s has been changed' % self.getName())
+
+    def start(self, iso_object=None, best_node=False):
+        """Starts the VM. If best_node is specified, the VM is first moved to
+        the least loaded of the nodes that are able to host it"""
         # Check the user has permission to start/stop VMs
         self.mcvirt_object.getAuthObject().assertPermission(
             Auth.PERMISSIONS.CHANGE_VM_POWER_STATE,
@@ -193,6 +379,11 @@ class VirtualMachine(object):
         # Ensure VM is unlocked
         self.ensureUnlocked()
 
+        if (best_node and self.getStorageType() == 'DRBD' and
+                self.mcvirt_object.initialiseNodes() and
+                self.getState() is not PowerStates.RUNNING):
+            self._moveToBestNode()
+
         # Ensure VM is registered locally
         if self.isRegisteredLocally():
             # Ensure VM hasn't been cloned
@@ -238,6 +429,20 @@ class VirtualMachine(object):
                 'VM registered elsewhere and cluster is not initialised'
             )
 
+    def _moveToBestNode(self):
+        """Moves the stopped VM to the least loaded of the nodes that are able to host it"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.node.placement import Placement
+        best_node = Placement(self.mcvirt_object).getBestNodeForVirtualMachine(self)
+        if (best_node == self.getNode()):
+            return
+        if (self.isRegisteredLocally()):
+            self.offlineMigrate(best_node)
+        elif (best_node == Cluster.getHostname()):
+            self.offlineMigrateToLocalNode()
+        else:
+            self.offlineMigrateBetweenRemoteNodes(best_node)
+
     def reset(self):
         """Resets the VM"""
         # Check the user has permission to start/stop VMs
@@ -311,6 +516,8 @@ class VirtualMachine(object):
         table.add_row(('State', self.getState().name))
         table.add_row(('Node', self.getNode()))
         table.add_row(('Available Nodes', ', '.join(self.getAvailableNodes())))
+        if (self.getDisklessNodes()):
+            table.add_row(('Diskless Nodes', ', '.join(self.getDisklessNodes())))
 
         # Display clone children, if they exist
         clone_children = self.getCloneChildren()
@@ -407,16 +614,25 @@ class VirtualMachine(object):
         if (self.getCloneChildren()):
             raise CannotDeleteClonedVmException('Can\'t delete cloned VM')
 
+        # The storage of the VM can only be removed from a node that holds the data
+        if (remove_data and Cluster.getHostname() in self.getDisklessNodes()):
+            raise UnsuitableNodeException(
+                'The VM %s must be deleted on a node that holds a replica of the data' %
+                self.getName()
+            )
+
         # If 'remove_data' has been passed as True, delete disks associated
         # with VM
         if (remove_data and Cluster.getHostname() in self.getAvailableNodes()):
             for disk_object in self.getDiskObjects():
                 disk_object.delete()
 
-        # 'Undefine' object from LibVirt
+        # 'Undefine' object from LibVirt, discarding any saved state of the VM
         if (self.isRegisteredLocally()):
             try:
-                self._getLibvirtDomainObject().undefine()
+                self._getLibvirtDomainObject().undefineFlags(
+                    libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE
+                )
             except:
                 raise MCVirtException('Failed to delete VM from libvirt')
 
@@ -439,9 +655,15 @@ class VirtualMachine(object):
             self.getConfigObject().gitRemove('VM \'%s\' has been removed' % self.name)
             shutil.rmtree(VirtualMachine.getVMDir(self.name))
 
-        # Remove VM from MCVirt configuration
+        # Remove VM and its network interfaces from MCVirt configuration
         def updateMCVirtConfig(config):
             config['virtual_machines'].remove(self.name)
+            for network_name, interfaces in config['network_interfaces'].items():
+                for mac_address, vm_name in interfaces.items():
+                    if (vm_name == self.name):
+                        del interfaces[mac_address]
+                if (not interfaces):
+                    del config['network_interfaces'][network_name]
         MCVirtConfig().updateConfig(
             updateMCVirtConfig,
             'Removed VM \'%s\' from global MCVirt config' %
@@ -505,6 +727,472 @@ class VirtualMachine(object):
         self.updateConfig(['cpu_cores'], str(cpu_count), 'CPU count has been changed to %s' %
                                                          cpu_count)
 
+    def getIoThreadConfig(self):
+        """Returns the number of iothreads and the iothread CPU pinning for the VM"""
+        vm_config = self.getConfigObject().getConfig()
+        return int(vm_config['iothreads']), vm_config['iothread_pinning']
+
+    def updateDiskPerformance(self, performance_config, disk_id=None):
+        """Updates the disk performance settings for all disks attached to the VM or,
+        if a disk ID is specified, for a single disk. Settings with a value of None
+        are reset, so that they are inherited"""
+        # Check the user has permission to modify VMs
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MODIFY_VM, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        # Ensure the VM is registered locally
+        self.ensureRegisteredLocally()
+
+        # Determine the new VM and disk performance configurations
+        vm_config = self.getConfigObject().getConfig()
+        vm_performance_config = dict(vm_config['disk_performance'])
+        disk_performance_config = None
+        if (disk_id is None):
+            vm_performance_config.update(performance_config)
+            attribute_path = ['disk_performance']
+        else:
+            disk_object = HardDriveFactory.getObject(self, disk_id)
+            disk_performance_config = dict(disk_object.getConfigObject().config['performance'])
+            disk_performance_config.update(performance_config)
+            attribute_path = ['hard_disks', str(disk_id), 'performance']
+
+        # Ensure that the resulting configuration is valid for each of the disks
+        iothread_count, _ = self.getIoThreadConfig()
+        for disk_object in self.getDiskObjects():
+            config_object = disk_object.getConfigObject()
+            if (disk_id is not None and str(config_object.getId()) == str(disk_id)):
+                resulting_config = config_object.getPerformanceConfig(vm_performance_config,
+                                                                      disk_performance_config)
+            else:
+                resulting_config = config_object.getPerformanceConfig(vm_performance_config)
+            config_object.validatePerformanceConfig(resulting_config, iothread_count)
+
+        new_config = disk_performance_config if disk_id is not None else vm_performance_config
+        new_config = dict([(setting, value) for setting, value in new_config.items()
+                           if value is not None])
+        self.updateConfig(attribute_path, new_config,
+                          'Disk performance settings for %s have been changed' %
+                          (('disk %s' % disk_id) if disk_id is not None else 'all disks'))
+
+        self.editConfig(self._updateDiskPerformanceXml)
+
+    def updateIoThreads(self, iothread_count=None, iothread_pinning=None):
+        """Updates the number of iothreads for the VM and the host CPUs
+        that the iothreads are pinned to"""
+        # Check the user has permission to modify VMs
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MODIFY_VM, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        # Ensure the VM is registered locally
+        self.ensureRegisteredLocally()
+
+        current_iothread_count, current_iothread_pinning = self.getIoThreadConfig()
+        if (iothread_count is None):
+            iothread_count = current_iothread_count
+        if (iothread_count < 0):
+            raise InvalidIoThreadConfigException('The number of iothreads cannot be negative')
+
+        # Merge the pinning into the existing pinning, where a CPU set of None
+        # removes the pinning for the iothread
+        new_iothread_pinning = dict(current_iothread_pinning)
+        for iothread_id, cpuset in (iothread_pinning or {}).items():
+            if (not str(iothread_id).isdigit()):
+                raise InvalidIoThreadConfigException('Invalid iothread ID: %s' % iothread_id)
+            elif (cpuset is None):
+                new_iothread_pinning.pop(str(iothread_id), None)
+            elif (not re.match(r'^\^?[0-9]+(-[0-9]+)?(,\^?[0-9]+(-[0-9]+)?)*$', cpuset)):
+                raise InvalidIoThreadConfigException('Invalid CPU set: %s' % cpuset)
+            else:
+                new_iothread_pinning[str(iothread_id)] = cpuset
+        for iothread_id in new_iothread_pinning:
+            if (not 1 <= int(iothread_id) <= iothread_count):
+                raise InvalidIoThreadConfigException(
+                    'Cannot pin iothread %s, as the VM has %s iothread(s)' %
+                    (iothread_id, iothread_count)
+                )
+
+        # Ensure that the disks are not assigned to iothreads that will be removed
+        for disk_object in self.getDiskObjects():
+            config_object = disk_object.getConfigObject()
+            config_object.validatePerformanceConfig(config_object.getPerformanceConfig(),
+                                                    iothread_count)
+
+        self.updateConfig(['iothreads'], iothread_count,
+                          'Number of iothreads has been changed to %s' % iothread_count)
+        self.updateConfig(['iothread_pinning'], new_iothread_pinning,
+                          'Iothread pinning has been changed')
+
+        self.editConfig(self._updateDiskPerformanceXml)
+
+    def updateDiskIoTune(self, iotune_config, disk_id):
+        """Updates the I/O limits for a disk, merging the limits into the existing limits.
+        Limits with a value of None are removed. If the VM is running, the limits
+        are also applied to the running VM"""
+        # Check the user has permission to modify VMs
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MODIFY_VM, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        # Ensure the VM is registered locally
+        self.ensureRegisteredLocally()
+
+        config_object = HardDriveFactory.getObject(self, disk_id).getConfigObject()
+        current_iotune_config = config_object.getIoTuneConfig()
+        new_iotune_config = dict(current_iotune_config)
+        for setting, value in iotune_config.items():
+            if (value is None):
+                new_iotune_config.pop(setting, None)
+            else:
+                new_iotune_config[setting] = value
+        HardDriveConfigBase.validateIoTuneConfig(new_iotune_config)
+
+        # Apply the limits to the running VM, setting removed limits to 0 to disable them
+        if (self.getState() is PowerStates.RUNNING):
+            iotune_parameters = {}
+            for setting in set(current_iotune_config.keys() + new_iotune_config.keys()):
+                iotune_parameters[setting] = new_iotune_config.get(setting, 0)
+            try:
+                self._getLibvirtDomainObject().setBlockIoTune(
+                    config_object._getTargetDev(), iotune_parameters,
+                    libvirt.VIR_DOMAIN_AFFECT_LIVE
+                )
+            except libvirt.libvirtError, e:
+                raise MCVirtException('Failed to apply I/O limits to running VM: %s' % str(e))
+
+        self.updateConfig(['hard_disks', str(disk_id), 'iotune'], new_iotune_config,
+                          'I/O limits for disk %s have been changed' % disk_id)
+        self.editConfig(self._updateDiskPerformanceXml)
+
+    def updateDrbdTuning(self, tuning_config, disk_id=None):
+        """Updates the DRBD replication tuning settings for a disk or, if a disk ID is not
+        given, for all disks of the VM. Settings with a value of None are removed. The
+        settings are applied to the DRBD resources of the VM on all nodes"""
+        from mcvirt.virtual_machine.hard_drive.config.drbd import (
+            DRBD as ConfigDRBD, InvalidDrbdTuningConfigException
+        )
+
+        # Check the user has permission to manage DRBD
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MANAGE_DRBD, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        if (self.getStorageType() != 'DRBD'):
+            raise InvalidDrbdTuningConfigException(
+                'DRBD tuning settings can only be configured for DRBD-backed VMs'
+            )
+
+        if (disk_id is None):
+            new_tuning_config = dict(self.getConfigObject().getConfig()['drbd_tuning'])
+            attribute_path = ['drbd_tuning']
+        else:
+            disk_object = HardDriveFactory.getObject(self, disk_id)
+            new_tuning_config = dict(disk_object.getConfigObject().config['drbd_tuning'])
+            attribute_path = ['hard_disks', str(disk_id), 'drbd_tuning']
+        for setting, value in tuning_config.items():
+            if (value is None):
+                new_tuning_config.pop(setting, None)
+            else:
+                new_tuning_config[setting] = value
+        ConfigDRBD.validateDrbdTuningConfig(new_tuning_config)
+
+        self.updateConfig(attribute_path, new_tuning_config,
+                          'DRBD tuning settings for %s have been changed' %
+                          (('disk %s' % disk_id) if disk_id is not None else 'all disks'))
+
+        # Apply the settings to the running DRBD resources
+        for disk_object in self.getDiskObjects():
+            if (disk_id is None or str(disk_object.getConfigObject().getId()) == str(disk_id)):
+                disk_object._applyDrbdConfig()
+
+    def getMigrationTuningConfig(self, tuning_config=None):
+        """Returns the live migration tuning settings for the VM, applying the profile
+        and settings of the VM, followed by the given settings. If a profile is given,
+        it replaces the profile and settings of the VM"""
+        tuning_config = tuning_config or {}
+        configs = [self.getConfigObject().getConfig()['migration_tuning'], tuning_config]
+        if (tuning_config.get('profile')):
+            configs = [tuning_config]
+
+        migration_tuning = {}
+        for config in configs:
+            if (config.get('profile')):
+                migration_tuning.update(
+                    VirtualMachine.MIGRATION_TUNING_PROFILES[config['profile']]
+                )
+            for setting, value in config.items():
+                if (setting != 'profile' and value is not None):
+                    migration_tuning[setting] = value
+        return migration_tuning
+
+    def updateMigrationTuning(self, tuning_config):
+        """Updates the live migration tuning settings for the VM. Settings with
+        a value of None are removed"""
+        # Check the user has permission to modify VMs
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MODIFY_VM, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        new_tuning_config = dict(self.getConfigObject().getConfig()['migration_tuning'])
+        for setting, value in tuning_config.items():
+            if (value is None):
+                new_tuning_config.pop(setting, None)
+            else:
+                new_tuning_config[setting] = value
+        VirtualMachine.validateMigrationTuningConfig(new_tuning_config)
+        VirtualMachine.validateMigrationTuningConfig(
+            self.getMigrationTuningConfig(new_tuning_config)
+        )
+
+        self.updateConfig(['migration_tuning'], new_tuning_config,
+                          'Migration tuning settings for %s have been changed' % self.getName())
+
+    @staticmethod
+    def validateMigrationTuningConfig(tuning_config):
+        """Ensures that a set of live migration tuning settings is valid"""
+        for setting, value in tuning_config.items():
+            if (setting == 'profile'):
+                if (value not in VirtualMachine.MIGRATION_TUNING_PROFILES):
+                    raise InvalidMigrationTuningConfigException(
+                        'Unknown migration tuning profile \'%s\'. Available profiles: %s' %
+                        (value, ', '.join(sorted(VirtualMachine.MIGRATION_TUNING_PROFILES)))
+                    )
+            elif (setting not in VirtualMachine.MIGRATION_TUNING_SETTINGS):
+                raise InvalidMigrationTuningConfigException(
+                    'Unknown migration tuning setting: %s' % setting
+                )
+            elif (VirtualMachine.MIGRATION_TUNING_SETTINGS[setting] is not None):
+                if (value not in VirtualMachine.MIGRATION_TUNING_SETTINGS[setting]):
+                    raise InvalidMigrationTuningConfigException(
+                        'Migration tuning setting \'%s\' must be one of: %s' %
+                        (setting, ', '.join(VirtualMachine.MIGRATION_TUNING_SETTINGS[setting]))
+                    )
+            elif (not isinstance(value, (int, long)) or value < 1):
+                raise InvalidMigrationTuningConfigException(
+                    'Migration tuning setting \'%s\' must be a positive integer' % setting
+                )
+
+        # Multifd compression requires parallel connections, which QEMU
+        # does not support in combination with post-copy
+        if (tuning_config.get('compression') == 'zstd' and
+                tuning_config.get('parallel-connections', 1) < 2):
+            raise InvalidMigrationTuningConfigException(
+                'zstd compression requires at least 2 parallel connections'
+            )
+        if (tuning_config.get('post-copy-after') and
+                tuning_config.get('parallel-connections', 1) > 1):
+            raise InvalidMigrationTuningConfigException(
+                'Post-copy cannot be used with parallel connections'
+            )
+
+    def _getMigrationParameters(self, tuning_config, migration_ip_address=None):
+        """Returns the libvirt migration parameters and the additional migration flags
+        for a set of live migration tuning settings"""
+        params = {}
+        flags = 0
+        if (migration_ip_address):
+            # Perform the migration over the migration network of the destination node
+            params[libvirt.VIR_MIGRATE_PARAM_URI] = 'tcp://%s' % migration_ip_address
+        if ('bandwidth' in tuning_config):
+            params[libvirt.VIR_MIGRATE_PARAM_BANDWIDTH] = tuning_config['bandwidth']
+        if (tuning_config.get('parallel-connections', 1) > 1):
+            flags |= libvirt.VIR_MIGRATE_PARALLEL
+            params[libvirt.VIR_MIGRATE_PARAM_PARALLEL_CONNECTIONS] = \
+                tuning_config['parallel-connections']
+        if (tuning_config.get('compression', 'none') != 'none'):
+            flags |= libvirt.VIR_MIGRATE_COMPRESSED
+            params[libvirt.VIR_MIGRATE_PARAM_COMPRESSION] = tuning_config['compression']
+        if (tuning_config.get('auto-converge') == 'yes'):
+            flags |= libvirt.VIR_MIGRATE_AUTO_CONVERGE
+        if (tuning_config.get('post-copy-after')):
+            flags |= libvirt.VIR_MIGRATE_POSTCOPY
+        return params, flags
+
+    def getDisklessNodes(self):
+        """Returns the nodes that the VM can be run on as a diskless DRBD client,
+        accessing the data on the available nodes over the network"""
+        return sorted(self._getDisklessNodeIds().keys())
+
+    def _getDisklessNodeIds(self):
+        """Returns the DRBD node IDs of the diskless nodes, indexed by node name"""
+        return self.getConfigObject().getConfig()['diskless_nodes']
+
+    def addDisklessNode(self, node):
+        """Allows the VM to be run on a node that does not hold a replica of the data,
+        by configuring the node as a diskless client of the DRBD resources of the VM"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.node.drbd import DRBD as NodeDRBD
+
+        # Check the user has permission to manage DRBD
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MANAGE_DRBD, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        if (self.getStorageType() != 'DRBD'):
+            raise UnsuitableNodeException(
+                'Diskless nodes can only be configured for DRBD-backed VMs'
+            )
+        cluster_instance = Cluster(self.mcvirt_object)
+        if (not cluster_instance.checkNodeExists(node)):
+            raise UnsuitableNodeException('Node does not exist: %s' % node)
+        if (node in self.getAvailableNodes() or node in self.getDisklessNodes()):
+            raise UnsuitableNodeException('Node %s is already able to run the VM %s' %
+                                          (node, self.getName()))
+
+        # Resources with more than two nodes require DRBD 9 on all of the nodes
+        NodeDRBD.ensureDisklessClientsSupported(
+            self.mcvirt_object, self.getAvailableNodes() + self.getDisklessNodes() + [node]
+        )
+
+        # Allocate the lowest DRBD node ID that is not used by the replicas or
+        # the other diskless nodes
+        diskless_node_ids = dict(self._getDisklessNodeIds())
+        node_id = NodeDRBD.CLUSTER_SIZE
+        while (node_id in diskless_node_ids.values()):
+            node_id += 1
+        diskless_node_ids[node] = node_id
+        self.updateConfig(['diskless_nodes'], diskless_node_ids,
+                          'Added diskless node %s to VM %s' % (node, self.getName()))
+
+        # Bring up the DRBD resources on the new node and connect the
+        # existing nodes to it
+        for disk_object in self.getDiskObjects():
+            disk_object._addDisklessClients([node])
+            disk_object._applyDrbdConfig()
+
+    def removeDisklessNode(self, node):
+        """Removes a diskless node from the VM, so that the VM can no
+        longer be run on the node"""
+        # Check the user has permission to manage DRBD
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MANAGE_DRBD, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        if (node not in self.getDisklessNodes()):
+            raise UnsuitableNodeException('Node %s is not a diskless node of the VM %s' %
+                                          (node, self.getName()))
+        if (self.getNode() == node):
+            raise UnsuitableNodeException(
+                'The VM %s must be migrated away from node %s before it is removed' %
+                (self.getName(), node)
+            )
+
+        # Take down the DRBD resources on the node and disconnect the remaining nodes
+        diskless_node_ids = dict(self._getDisklessNodeIds())
+        del diskless_node_ids[node]
+        for disk_object in self.getDiskObjects():
+            disk_object._removeDisklessClients([node])
+        self.updateConfig(['diskless_nodes'], diskless_node_ids,
+                          'Removed diskless node %s from VM %s' % (node, self.getName()))
+        for disk_object in self.getDiskObjects():
+            disk_object._applyDrbdConfig()
+
+    def getBlkioWeight(self):
+        """Returns the block I/O weight of the VM"""
+        return self.getConfigObject().getConfig()['blkiotune'].get('weight')
+
+    def updateBlkioWeight(self, weight):
+        """Updates the block I/O weight of the VM, relative to other VMs on the node.
+        A weight of None removes the weight, which takes effect when the VM is next started"""
+        # Check the user has permission to modify VMs
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MODIFY_VM, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        # Ensure the VM is registered locally
+        self.ensureRegisteredLocally()
+
+        if (weight is not None and not (self.BLKIO_WEIGHT_MINIMUM <= weight <=
+                                        self.BLKIO_WEIGHT_MAXIMUM)):
+            raise InvalidBlkioWeightException(
+                'Block I/O weight must be between %s and %s' %
+                (self.BLKIO_WEIGHT_MINIMUM, self.BLKIO_WEIGHT_MAXIMUM)
+            )
+
+        if (weight is not None and self.getState() is PowerStates.RUNNING):
+            try:
+                self._getLibvirtDomainObject().setBlkioParameters(
+                    {'weight': weight}, libvirt.VIR_DOMAIN_AFFECT_LIVE
+                )
+            except libvirt.libvirtError, e:
+                raise MCVirtException('Failed to apply block I/O weight to running VM: %s' %
+                                      str(e))
+
+        blkiotune_config = dict(self.getConfigObject().getConfig()['blkiotune'])
+        if (weight is None):
+            blkiotune_config.pop('weight', None)
+        else:
+            blkiotune_config['weight'] = weight
+        self.updateConfig(['blkiotune'], blkiotune_config,
+                          'Block I/O weight has been changed to %s' % weight)
+        self.editConfig(self._setBlkioTuneXml)
+
+    def _setBlkioTuneXml(self, domain_xml):
+        """Sets the block I/O tuning in the domain XML"""
+        blkiotune_xml = domain_xml.find('./blkiotune')
+        if (blkiotune_xml is not None):
+            domain_xml.remove(blkiotune_xml)
+        weight = self.getBlkioWeight()
+        if (weight is not None):
+            blkiotune_xml = ET.SubElement(domain_xml, 'blkiotune')
+            ET.SubElement(blkiotune_xml, 'weight').text = str(weight)
+
+    def _updateDiskPerformanceXml(self, domain_xml):
+        """Updates the disk drivers, I/O limits and iothreads in the domain XML,
+        using the disk performance configuration"""
+        device_xml = domain_xml.find('./devices')
+        for disk_object in self.getDiskObjects():
+            config_object = disk_object.getConfigObject()
+            disk_xml = device_xml.find('./disk/target[@dev="%s"]/..' %
+                                       config_object._getTargetDev())
+            if (disk_xml is None):
+                continue
+            driver_xml = disk_xml.find('./driver')
+            driver_index = list(disk_xml).index(driver_xml)
+            disk_xml.remove(driver_xml)
+            disk_xml.insert(driver_index, config_object._generateDriverXml())
+
+            iotune_xml = disk_xml.find('./iotune')
+            if (iotune_xml is not None):
+                disk_xml.remove(iotune_xml)
+            iotune_xml = config_object._generateIoTuneXml()
+            if (iotune_xml is not None):
+                disk_xml.append(iotune_xml)
+
+        self._setIoThreadXml(domain_xml)
+
+    def _setIoThreadXml(self, domain_xml):
+        """Sets the number of iothreads and the iothread pinning in the domain XML"""
+        iothread_count, iothread_pinning = self.getIoThreadConfig()
+        iothreads_xml = domain_xml.find('./iothreads')
+        if (iothread_count):
+            if (iothreads_xml is None):
+                iothreads_xml = ET.SubElement(domain_xml, 'iothreads')
+            iothreads_xml.text = str(iothread_count)
+        elif (iothreads_xml is not None):
+            domain_xml.remove(iothreads_xml)
+
+        cputune_xml = domain_xml.find('./cputune')
+        if (cputune_xml is None):
+            cputune_xml = ET.SubElement(domain_xml, 'cputune')
+        for iothreadpin_xml in cputune_xml.findall('./iothreadpin'):
+            cputune_xml.remove(iothreadpin_xml)
+        for iothread_id in sorted(iothread_pinning, key=int):
+            iothreadpin_xml = ET.SubElement(cputune_xml, 'iothreadpin')
+            iothreadpin_xml.set('iothread', str(iothread_id))
+            iothreadpin_xml.set('cpuset', iothread_pinning[iothread_id])
+        if (not len(cputune_xml)):
+            domain_xml.remove(cputune_xml)
+
     def getNetworkObjects(self):
         """Returns an array of network interface objects for each of the
         interfaces attached to the VM"""
@@ -609,8 +1297,8 @@ class VirtualMachine(object):
             start_after_migration=False,
             wait_for_vm_shutdown=False):
         """Performs an offline migration of a VM to another node in the cluster"""
-        import time
         from mcvirt.cluster.cluster import Cluster
+        from mcvirt.virtual_machine.shutdown import VirtualMachineShutdown
         # Ensure user has permission to migrate VM
         self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MIGRATE_VM, self)
 
@@ -624,7 +1312,7 @@ class VirtualMachine(object):
         self._preMigrationChecks(destination_node_name)
 
         # Check if VM is running
-        while (self.getState() is PowerStates.RUNNING):
+        if (self.getState() is PowerStates.RUNNING):
             # Unless the user has specified to wait for the VM to shutdown, throw an exception
             # if the VM is running
             if (not wait_for_vm_shutdown):
@@ -634,8 +1322,8 @@ class VirtualMachine(object):
                     'VM is powered off before migrating.'
                 )
 
-            # Wait for 5 seconds before checking the VM state again
-            time.sleep(5)
+            # Wait for the VM to stop
+            VirtualMachineShutdown.waitForStop(self)
 
         # Unregister the VM on the local node
         self.unregister()
@@ -655,8 +1343,78 @@ class VirtualMachine(object):
             remote_object.runRemoteCommand('virtual_machine-start',
                                            {'vm_name': self.getName()})
 
-    def onlineMigrate(self, destination_node_name):
-        """Performs an online migration of a VM to another node in the cluster"""
+    def offlineMigrateToLocalNode(self):
+        """Performs an offline migration of the VM from the remote node that it
+        is registered on to the local node"""
+        from mcvirt.cluster.cluster import Cluster
+        # Ensure user has permission to migrate VM
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MIGRATE_VM, self)
+
+        # Ensure VM is registered on a remote node and unlocked
+        if (not self.isRegisteredRemotely()):
+            raise VmNotRegistered('The VM %s is not registered on a remote node' %
+                                  self.getName())
+        self.ensureUnlocked()
+
+        if (self.getState() is PowerStates.RUNNING):
+            raise VmRunningException(
+                'An offline migration can only be performed on a powered off VM'
+            )
+
+        # Unregister the VM on the remote node and register it on the local node
+        remote_object = Cluster(self.mcvirt_object).getRemoteNode(self.getNode())
+        remote_object.runRemoteCommand('virtual_machine-unregister',
+                                       {'vm_name': self.getName()})
+        self._setNode(None)
+        self.register()
+
+    def offlineMigrateBetweenRemoteNodes(self, destination_node_name):
+        """Performs an offline migration of the VM from the remote node that it
+        is registered on to another remote node"""
+        from mcvirt.cluster.cluster import Cluster
+        # Ensure user has permission to migrate VM
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MIGRATE_VM, self)
+
+        # Ensure VM is registered on a remote node and unlocked
+        if (not self.isRegisteredRemotely()):
+            raise VmNotRegistered('The VM %s is not registered on a remote node' %
+                                  self.getName())
+        self.ensureUnlocked()
+
+        if (self.getState() is PowerStates.RUNNING):
+            raise VmRunningException(
+                'An offline migration can only be performed on a powered off VM'
+            )
+
+        # Ensure that the destination node is able to host the VM
+        cluster_instance = Cluster(self.mcvirt_object)
+        if (destination_node_name not in (self.getAvailableNodes() + self.getDisklessNodes())):
+            raise UnsuitableNodeException(
+                'The remote node %s is not marked as being able to host the VM %s' %
+                (destination_node_name, self.getName()))
+        destination_node = cluster_instance.getRemoteNode(destination_node_name)
+        for network_object in self.getNetworkObjects():
+            connected_network = network_object.getConnectedNetwork()
+            if (not destination_node.runRemoteCommand('node-network-checkExists',
+                                                      {'network_name': connected_network})):
+                raise UnsuitableNodeException(
+                    'The network %s does not exist on the remote node: %s' %
+                    (connected_network, destination_node_name)
+                )
+
+        # Unregister the VM on the source node and register it on the destination node
+        source_node = cluster_instance.getRemoteNode(self.getNode())
+        source_node.runRemoteCommand('virtual_machine-unregister',
+                                     {'vm_name': self.getName()})
+        self._setNode(None)
+        destination_node.runRemoteCommand('virtual_machine-register',
+                                          {'vm_name': self.getName()})
+        self._setNode(destination_node_name)
+
+    def onlineMigrate(self, destination_node_name, tuning_config=None, progress_callback=None):
+        """Performs an online migration of a VM to another node in the cluster. The
+        given migration tuning profile and settings override those of the VM. If given,
+        progress_callback is periodically called with the progress of the migration"""
         from mcvirt.cluster.cluster import Cluster
 
         # Ensure user has permission to migrate VM
@@ -667,30 +1425,187 @@ class VirtualMachine(object):
         self.ensureUnlocked()
 
         # Perform pre-migration checks
-        self._preMigrationChecks(destination_node_name)
+        self._preMigrationChecks(destination_node_name, online_migration=True)
 
         # Perform online-migration-specific checks
         self._preOnlineMigrationChecks(destination_node_name)
 
-        # Obtain cluster instance
+        # Obtain the migration tuning settings
+        if (tuning_config):
+            VirtualMachine.validateMigrationTuningConfig(tuning_config)
+        migration_tuning = self.getMigrationTuningConfig(tuning_config)
+        VirtualMachine.validateMigrationTuningConfig(migration_tuning)
+
+        # Perform the migration from the local node to the destination node
+        self._performOnlineMigration(Cluster.getHostname(), destination_node_name,
+                                     migration_tuning, progress_callback)
+
+        # Perform post migration checks
+        # Ensure VM is no longer registered with libvirt on the local node
+        if (self.getName() in VirtualMachine.getAllVms(self.mcvirt_object,
+                                                       node=Cluster.getHostname())):
+            raise VmAlreadyRegisteredException(
+                'The VM is unexpectedly registered with libvirt on the local node: %s' %
+                self.getName()
+            )
+
+        # Ensure VM is registered on the remote libvirt instance
+        if (self.getName() not in VirtualMachine.getAllVms(self.mcvirt_object,
+                                                           node=destination_node_name)):
+            raise VmNotRegistered(
+                'The VM is unexpectedly not registered with libvirt on the destination node: %s' %
+                destination_node_name
+            )
+
+        # Ensure VM is running on the remote node
+        if (self.getState() is not PowerStates.RUNNING):
+            raise VmStoppedException('VM is in unexpected %s power state after migration' %
+                                     self.getState())
+
+    def _getStorageMigrationParameters(self, libvirt_domain_object, disk_objects):
+        """Returns the libvirt migration parameters for copying the local disks of
+        the VM to the logical volumes created on the destination node"""
+        domain_xml = ET.fromstring(libvirt_domain_object.XMLDesc(
+            libvirt.VIR_DOMAIN_XML_SECURE | libvirt.VIR_DOMAIN_XML_MIGRATABLE
+        ))
+        target_devs = []
+        for disk_object in disk_objects:
+            target_dev = disk_object.getConfigObject()._getTargetDev()
+            target_devs.append(target_dev)
+
+            # The volume group of the destination node may differ from the local node
+            domain_xml.find('./devices/disk/target[@dev="%s"]/../source' % target_dev).set(
+                'dev', disk_object.getMigrationDiskPath()
+            )
+
+        return {
+            libvirt.VIR_MIGRATE_PARAM_MIGRATE_DISKS: target_devs,
+            libvirt.VIR_MIGRATE_PARAM_DEST_XML: ET.tostring(domain_xml, encoding='utf8',
+                                                            method='xml')
+        }
+
+    def onlineMigrateToLocalNode(self, tuning_config=None, progress_callback=None):
+        """Performs an online migration of the VM from the remote node that it is
+        registered on to the local node. This allows VMs to be returned to a node,
+        as migrations can only be performed by a node that can contact the other nodes"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.iso import Iso, IsoNotPresentOnDestinationNodeException
+
+        # Ensure user has permission to migrate VM
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MIGRATE_VM, self)
+
+        # Ensure VM is registered on a remote node and unlocked
+        if (not self.isRegisteredRemotely()):
+            raise VmNotRegistered('The VM %s is not registered on a remote node' %
+                                  self.getName())
+        self.ensureUnlocked()
+        source_node_name = self.getNode()
+        local_hostname = Cluster.getHostname()
+
+        # Perform pre-migration checks against the local node
+        if (local_hostname not in (self.getAvailableNodes() + self.getDisklessNodes())):
+            raise UnsuitableNodeException(
+                'The local node %s is not marked as being able to host the VM %s' %
+                (local_hostname, self.getName()))
+        for disk_object in self.getDiskObjects():
+            disk_object.preMigrationChecks(migrate_to_local_node=True)
+        for network_object in self.getNetworkObjects():
+            if (not Network._checkExists(network_object.getConnectedNetwork())):
+                raise UnsuitableNodeException(
+                    'The network %s does not exist on the local node: %s' %
+                    (network_object.getConnectedNetwork(), local_hostname)
+                )
+        if (self.getState() is not PowerStates.RUNNING):
+            raise VmStoppedException(
+                'An online migration can only be performed on a running VM: %s' %
+                self.getName()
+            )
+
+        # Obtain the migration tuning settings
+        if (tuning_config):
+            VirtualMachine.validateMigrationTuningConfig(tuning_config)
+        migration_tuning = self.getMigrationTuningConfig(tuning_config)
+        VirtualMachine.validateMigrationTuningConfig(migration_tuning)
+
+        # Obtain the domain from the libvirt daemon of the source node
+        cluster_instance = Cluster(self.mcvirt_object)
+        source_node = cluster_instance.getRemoteNode(source_node_name)
+        libvirt_domain_object = self.mcvirt_object.getRemoteLibvirtConnection(
+            source_node
+        ).lookupByName(self.getName())
+
+        # Ensure any attached ISO exists on the local node
+        iso_xml = ET.fromstring(libvirt_domain_object.XMLDesc(0)).find(
+            './devices/disk[@device="cdrom"]/source'
+        )
+        if (iso_xml is not None and
+                os.path.basename(iso_xml.get('file')) not in Iso.getIsos(self.mcvirt_object)):
+            raise IsoNotPresentOnDestinationNodeException(
+                'The ISO attached to \'%s\' (%s) is not present on %s' %
+                (self.getName(), os.path.basename(iso_xml.get('file')), local_hostname)
+            )
+
+        # Perform the migration from the source node to the local node
+        self._performOnlineMigration(source_node_name, local_hostname, migration_tuning,
+                                     progress_callback)
+
+        # Ensure VM is running on the local node
+        if (self.getState() is not PowerStates.RUNNING):
+            raise VmStoppedException('VM is in unexpected %s power state after migration' %
+                                     self.getState())
+
+    def _performOnlineMigration(self, source_node_name, destination_node_name, migration_tuning,
+                                progress_callback=None):
+        """Migrates the running VM from the source node to the destination node, one of
+        which must be the local node. The migration is recorded in the migration history
+        and, if it fails, the VM is recovered"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.node.node import Node
+        from mcvirt.virtual_machine.migration_monitor import (MigrationMonitor,
+                                                              MigrationCancelledException)
         cluster_instance = Cluster(self.mcvirt_object)
+        migrate_to_local_node = (destination_node_name == Cluster.getHostname())
+
+        # The disks of VMs using local storage are copied to the destination node
+        # during the migration
+        copy_storage = (self.getStorageType() == 'Local')
+        disk_objects = self.getDiskObjects()
+
+        # Record the start of the migration, for the migration history
+        start_time = time.time()
+        migration_monitor = None
+        completed_job_stats = None
 
         # Begin pre-migration tasks
         try:
-            # Obtain node object for destination node
-            destination_node = cluster_instance.getRemoteNode(destination_node_name)
-
-            # Obtain libvirt connection to destination node
-            destination_libvirt_connection = self.mcvirt_object.getRemoteLibvirtConnection(
-                destination_node
-            )
+            # Obtain the domain on the source node, the libvirt connection to the
+            # destination node and the address of the migration network of the destination node
+            if (migrate_to_local_node):
+                source_node = cluster_instance.getRemoteNode(source_node_name)
+                libvirt_domain_object = self.mcvirt_object.getRemoteLibvirtConnection(
+                    source_node
+                ).lookupByName(self.getName())
+                destination_libvirt_connection = self.mcvirt_object.getLibvirtConnection()
+                migration_ip_address = Node.getMigrationIpAddress()
+            else:
+                destination_node = cluster_instance.getRemoteNode(destination_node_name)
+                libvirt_domain_object = self._getLibvirtDomainObject()
+                destination_libvirt_connection = self.mcvirt_object.getRemoteLibvirtConnection(
+                    destination_node
+                )
+                migration_ip_address = destination_node.runRemoteCommand(
+                    'node-getMigrationIpAddress', {}
+                )
 
             # Clear the VM node configuration
             self._setNode(None)
 
             # Perform pre-migration tasks on disk objects
-            for disk_object in self.getDiskObjects():
-                disk_object.preOnlineMigration(destination_node)
+            for disk_object in disk_objects:
+                if (migrate_to_local_node):
+                    disk_object.preOnlineMigrationToLocalNode(source_node)
+                else:
+                    disk_object.preOnlineMigration(destination_node)
 
             # Build migration flags
             migration_flags = (
@@ -703,108 +1618,158 @@ class VirtualMachine(object):
                 # Abort migration on I/O errors
                 libvirt.VIR_MIGRATE_ABORT_ON_ERROR
             )
+            migration_params, tuning_flags = self._getMigrationParameters(migration_tuning,
+                                                                          migration_ip_address)
+            migration_flags |= tuning_flags
+
+            if (copy_storage):
+                # Copy the disks to the logical volumes created on the destination node.
+                # The copy is limited by the bandwidth of the migration
+                migration_flags |= libvirt.VIR_MIGRATE_NON_SHARED_DISK
+                migration_params.update(
+                    self._getStorageMigrationParameters(libvirt_domain_object, disk_objects)
+                )
 
-            # Perform migration
-            libvirt_domain_object = self._getLibvirtDomainObject()
-            status = libvirt_domain_object.migrate3(
-                destination_libvirt_connection,
-                params={},
-                flags=migration_flags
+            # Perform migration, monitoring the migration job to report the progress
+            # and to switch to post-copy, if configured. The migration is aborted if
+            # the migration is interrupted by the user
+            migration_monitor = MigrationMonitor(
+                libvirt_domain_object,
+                post_copy_after=migration_tuning.get('post-copy-after'),
+                progress_callback=progress_callback
             )
+            migration_monitor.start()
+            try:
+                status = migration_monitor.performMigration(
+                    lambda: libvirt_domain_object.migrate3(
+                        destination_libvirt_connection,
+                        params=migration_params,
+                        flags=migration_flags
+                    )
+                )
+            finally:
+                migration_monitor.stop()
 
             if (not status):
                 raise MigrationFailureExcpetion('Libvirt migration failed')
 
-            # Perform post steps on hard disks and check disks
-            for disk_object in self.getDiskObjects():
-                disk_object.postOnlineMigration()
-                disk_object._checkDrbdStatus()
+            # Obtain the statistics of the completed migration job from the destination
+            try:
+                completed_job_stats = status.jobStats(libvirt.VIR_DOMAIN_JOB_STATS_COMPLETED)
+            except libvirt.libvirtError:
+                pass
 
-            # Set the VM node to the destination node node
+            # The storage of the VM is now held by the destination node
+            if (copy_storage):
+                self.updateConfig(['available_nodes'], [destination_node_name],
+                                  'Migrated storage of VM \'%s\' to node \'%s\'' %
+                                  (self.getName(), destination_node_name))
+
+            # Perform post steps on hard disks and check disks
+            for disk_object in disk_objects:
+                if (migrate_to_local_node):
+                    disk_object.postOnlineMigrationToLocalNode(source_node)
+                else:
+                    disk_object.postOnlineMigration()
+                if (not copy_storage):
+                    disk_object._checkDrbdStatus()
+
+            # Set the VM node to the destination node
             self._setNode(destination_node_name)
 
         except Exception as e:
-            # Determine which node the VM is present on
-            vm_registration_found = False
-
-            # Wait 10 seconds before performing the tear-down, as DRBD
-            # will hold the block device open for a short period
-            import time
-            time.sleep(10)
-
-            if (self.getName() in VirtualMachine.getAllVms(self.mcvirt_object,
-                                                           node=Cluster.getHostname())):
-                # VM is registered on the local node.
-                vm_registration_found = True
-
-                # Set DRBD on remote node to secondary
-                for disk_object in self.getDiskObjects():
-                    cluster_instance.runRemoteCommand(
-                        'virtual_machine-hard_drive-drbd-drbdSetSecondary',
-                        {'vm_name': self.getName(),
-                         'disk_id': disk_object.getConfigObject().getId()},
-                        nodes=[destination_node_name])
-
-                # Re-register VM as being registered on the local node
-                self._setNode(Cluster.getHostname())
-
-            if (self.getName() in VirtualMachine.getAllVms(self.mcvirt_object,
-                                                           node=destination_node_name)):
-                # Otherwise, if VM is registered on remote node, set the
-                # local DRBD state to secondary
-                vm_registration_found = True
-                for disk_object in self.getDiskObjects():
-                    import time
-                    time.sleep(10)
-                    disk_object._drbdSetSecondary()
-
-                # Register VM as being registered on the local node
-                self._setNode(destination_node_name)
-
-            # Reset disks
-            for disk_object in self.getDiskObjects():
-                # Reset dual-primary configuration
-                disk_object._setTwoPrimariesConfig(allow=False)
-
-                # Mark hard drives as being out-of-sync
-                disk_object.setSyncState(False)
-
+            self._recordMigration(
+                destination_node_name, start_time,
+                'cancelled' if isinstance(e, MigrationCancelledException) else 'failed',
+                migration_tuning, migration_monitor, source_node_name=source_node_name
+            )
+            self._recoverMigration(source_node_name, destination_node_name, e)
             raise e
 
-        # Perform post migration checks
-        # Ensure VM is no longer registered with libvirt on the local node
-        if (self.getName() in VirtualMachine.getAllVms(self.mcvirt_object,
-                                                       node=Cluster.getHostname())):
-            raise VmAlreadyRegisteredException(
-                'The VM is unexpectedly registered with libvirt on the local node: %s' %
-                self.getName()
-            )
+        self._recordMigration(destination_node_name, start_time, 'completed', migration_tuning,
+                              migration_monitor, completed_job_stats,
+                              source_node_name=source_node_name)
 
-        # Ensure VM is registered on the remote libvirt instance
-        if (self.getName() not in VirtualMachine.getAllVms(self.mcvirt_object,
-                                                           node=destination_node_name)):
-            raise VmNotRegistered(
-                'The VM is unexpectedly not registered with libvirt on the destination node: %s' %
-                destination_node_name
+    def _recoverMigration(self, source_node_name, destination_node_name, migration_exception):
+        """Recovers the VM after a failed online migration, leaving it registered on the
+        node that holds the domain. An interrupted or failed recovery is journalled, so
+        that it can be resumed"""
+        from mcvirt.virtual_machine.migration_recovery import (MigrationRecovery,
+                                                               MigrationRecoveryFailedException)
+        try:
+            MigrationRecovery(self, source_node_name, destination_node_name).run()
+        except Exception, e:
+            raise MigrationRecoveryFailedException(
+                'The migration failed (%s) and the VM could not be recovered: %s\n'
+                'Once resolved, the recovery can be resumed using:'
+                ' mcvirt migrate --recover %s' % (str(migration_exception), str(e),
+                                                  self.getName())
             )
 
-        # Ensure VM is running on the remote node
-        if (self.getState() is not PowerStates.RUNNING):
-            raise VmStoppedException('VM is in unexpected %s power state after migration' %
-                                     self.getState())
+    def _recordMigration(self, destination_node_name, start_time, status, tuning_config,
+                         migration_monitor=None, completed_job_stats=None,
+                         source_node_name=None):
+        """Records the statistics of a live migration in the migration history"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.virtual_machine.migration_history import MigrationHistory
+        record = {
+            'vm_name': self.getName(),
+            'source_node': source_node_name or Cluster.getHostname(),
+            'destination_node': destination_node_name,
+            'start_time': int(start_time),
+            'duration': int(time.time() - start_time),
+            'status': status,
+            'tuning': tuning_config,
+            'downtime': None,
+            'data_transferred': None,
+            'memory_iterations': None,
+            'post_copy': False
+        }
+        if (migration_monitor):
+            record.update(migration_monitor.getStatistics(completed_job_stats))
+        try:
+            MigrationHistory.addRecord(record)
+        except (IOError, OSError):
+            # A failure to record the history must not cause the migration to fail
+            pass
 
-    def _preMigrationChecks(self, destination_node_name):
+    def _preMigrationChecks(self, destination_node_name, online_migration=False):
         """Performs checks on the state of the VM to determine if is it suitable to
            be migrated"""
+        from mcvirt.cluster.cluster import Cluster
+        from mcvirt.virtual_machine.hard_drive.local import CannotMigrateLocalDiskException
+        cluster_instance = Cluster(self.mcvirt_object)
+
+        if (self.getStorageType() == 'Local'):
+            # Local storage is copied to the destination node, which is only
+            # possible whilst the VM is running
+            if (not online_migration):
+                raise CannotMigrateLocalDiskException(
+                    'VMs using local disks can only be migrated online'
+                )
+            if (destination_node_name == Cluster.getHostname() or
+                    not cluster_instance.checkNodeExists(destination_node_name)):
+                raise UnsuitableNodeException(
+                    'The VM %s must be migrated to a remote node' % self.getName()
+                )
+
+            # Ensure that there is enough storage on the destination node for the hard drives
+            disk_objects = self.getDiskObjects()
+            if (disk_objects):
+                HardDriveFactory.ensureStorageCapacity(
+                    self.mcvirt_object, self.getStorageType(),
+                    [disk_object.getSize() for disk_object in disk_objects],
+                    [destination_node_name]
+                )
+
         # Ensure node is in the available nodes that the VM can be run on
-        if (destination_node_name not in self.getAvailableNodes()):
+        elif (destination_node_name not in (self.getAvailableNodes() +
+                                            self.getDisklessNodes())):
             raise UnsuitableNodeException(
                 'The remote node %s is not marked as being able to host the VM %s' %
                 (destination_node_name, self.getName()))
 
         # Obtain remote object for destination node
-        from mcvirt.cluster.cluster import Cluster
-        cluster_instance = Cluster(self.mcvirt_object)
         remote_node = cluster_instance.getRemoteNode(destination_node_name)
 
         # Checks the DRBD state of the disks and ensure that they are
@@ -841,6 +1806,101 @@ class VirtualMachine(object):
         """Returns the storage type of the VM"""
         return self.getConfigObject().getConfig()['storage_type']
 
+    def convertStorage(self, storage_type, nodes, sync_rate=None, progress_callback=None):
+        """Converts the storage of a stopped VM using local storage to DRBD, replicating
+        the data to the other given node. If given, the initial sync is limited to
+        sync_rate (in MiB/s) and its progress is reported to progress_callback"""
+        from mcvirt.cluster.cluster import Cluster, NodeDoesNotExistException
+        from mcvirt.node.drbd import DRBD as NodeDRBD, DRBDNotEnabledOnNode
+        from mcvirt.node.capacity import Capacity
+        from mcvirt.virtual_machine.hard_drive.drbd import DRBD
+        from mcvirt.virtual_machine.hard_drive.config.drbd import DRBD as ConfigDRBD
+
+        # Check the user has permission to modify VMs and manage DRBD volumes
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MODIFY_VM, self)
+        self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MANAGE_DRBD, self)
+
+        # Ensure VM is unlocked
+        self.ensureUnlocked()
+
+        if (storage_type != 'DRBD'):
+            raise InvalidStorageConversionException('VMs can only be converted to DRBD storage')
+        if (self.getStorageType() == 'DRBD'):
+            raise InvalidStorageConversionException('The VM %s already uses DRBD storage' %
+                                                    self.getName())
+        if (not NodeDRBD.isEnabled()):
+            raise DRBDNotEnabledOnNode('DRBD is not enabled on this node')
+
+        # The conversion must be performed by the node holding the storage, which
+        # must not be used by another VM
+        local_hostname = Cluster.getHostname()
+        if (local_hostname not in self.getAvailableNodes() or self.isRegisteredRemotely()):
+            raise UnsuitableNodeException(
+                'The storage of %s must be converted on the node that it is registered on' %
+                self.getName()
+            )
+
+        # Writes made by the VM to the logical volume whilst it is being converted
+        # would not be replicated, so the VM must be stopped
+        if (self.isRegisteredLocally() and self._getLibvirtDomainObject().isActive()):
+            raise VmRunningException('The storage of %s can only be converted whilst the'
+                                     ' VM is stopped' % self.getName())
+        if (self.getCloneParent() or self.getCloneChildren()):
+            raise InvalidStorageConversionException(
+                'Cannot convert the storage of a cloned VM or a clone'
+            )
+        disk_objects = self.getDiskObjects()
+        if (len(disk_objects) > ConfigDRBD.MAXIMUM_DEVICES):
+            raise InvalidStorageConversionException(
+                'VMs using DRBD storage can have a maximum of %i hard drive' %
+                ConfigDRBD.MAXIMUM_DEVICES
+            )
+
+        # Ensure that the nodes are valid
+        cluster_instance = Cluster(self.mcvirt_object)
+        nodes = list(nodes or [])
+        if (len(set(nodes)) != NodeDRBD.CLUSTER_SIZE):
+            raise InvalidStorageConversionException('Exactly two nodes must be specified')
+        if (local_hostname not in nodes):
+            raise InvalidStorageConversionException('One of the nodes must be the local node')
+        for node in nodes:
+            if (node != local_hostname and not cluster_instance.checkNodeExists(node)):
+                raise NodeDoesNotExistException('Node \'%s\' does not exist' % node)
+
+        # Ensure that there is enough storage for the replica on the other node and for
+        # the DRBD meta volumes on the local node, before any storage is created
+        remote_nodes = [node for node in nodes if node != local_hostname]
+        sizes = [disk_object.getSize() for disk_object in disk_objects]
+        if (sizes):
+            HardDriveFactory.ensureStorageCapacity(self.mcvirt_object, storage_type, sizes,
+                                                   remote_nodes)
+            Capacity(self.mcvirt_object).ensureFreeSpace({
+                local_hostname: sum([DRBD.getRequiredStorageSpace(size) - size
+                                     for size in sizes])
+            })
+
+        # Configure the VM to be replicated to the nodes, which is used to
+        # generate the DRBD configuration
+        original_available_nodes = self.getAvailableNodes()
+        self.updateConfig(['available_nodes'], nodes,
+                          'Replicating storage of \'%s\' to %s' %
+                          (self.getName(), ', '.join(remote_nodes)))
+        try:
+            for disk_object in disk_objects:
+                DRBD.convertFromLocal(disk_object, sync_rate=sync_rate,
+                                      progress_callback=progress_callback)
+        except Exception:
+            if (self.getStorageType() != storage_type):
+                self.updateConfig(['available_nodes'], original_available_nodes,
+                                  'Restored available nodes of \'%s\'' % self.getName())
+            raise
+
+        # A VM without hard drives only requires its storage type to be updated
+        if (not disk_objects):
+            self.updateConfig(['storage_type'], storage_type,
+                              'Updated storage type for \'%s\' to \'%s\'' %
+                              (self.getName(), storage_type))
+
     def clone(self, mcvirt_instance, clone_vm_name):
         """Clones a VM, creating an identical machine, using
            LVM snapshotting to duplicate the Hard disk. DRBD is not
@@ -869,6 +1929,8 @@ class VirtualMachine(object):
         if (self.getCloneParent()):
             raise MCVirtException('Cannot clone from a clone VM')
 
+        disk_objects = self.getDiskObjects()
+
         # Create new VM for clone, without hard disks
         network_objects = self.getNetworkObjects()
         networks = []
@@ -900,7 +1962,6 @@ class VirtualMachine(object):
         self.mcvirt_object.getAuthObject().copyPermissions(self, new_vm_object)
 
         # Clone the hard drives of the VM
-        disk_objects = self.getDiskObjects()
         for disk_object in disk_objects:
             disk_object.clone(new_vm_object)
 
@@ -922,6 +1983,15 @@ class VirtualMachine(object):
         # Ensure new VM name doesn't already exist
         VirtualMachine._checkExists(self.mcvirt_object, duplicate_vm_name)
 
+        # Ensure that there is enough storage for the duplicated hard drives
+        disk_objects = self.getDiskObjects()
+        if (disk_objects):
+            HardDriveFactory.ensureStorageCapacity(
+                self.mcvirt_object, self.getStorageType(),
+                [disk_object.getSize() for disk_object in disk_objects],
+                self.getAvailableNodes()
+            )
+
         # Create new VM for clone, without hard disks
         network_objects = self.getNetworkObjects()
         networks = []
@@ -943,8 +2013,9 @@ class VirtualMachine(object):
 
         return new_vm_object
 
-    def move(self, destination_node, source_node=None):
-        """Move a VM from one node to another"""
+    def move(self, destination_node, source_node=None, progress_callback=None):
+        """Move a VM from one node to another. If given, progress_callback is called
+        with messages describing the progress of the move"""
         # Ensure user has the ability to move VMs
         self.mcvirt_object.getAuthObject().assertPermission(Auth.PERMISSIONS.MOVE_VM, self)
 
@@ -978,6 +2049,9 @@ class VirtualMachine(object):
         if (destination_node in self.getAvailableNodes()):
             raise UnsuitableNodeException('Destination node is already' +
                                           ' an available node for the VM')
+        if (destination_node in self.getDisklessNodes()):
+            raise UnsuitableNodeException('Destination node is a diskless node for the VM.' +
+                                          ' Remove the diskless node before moving the VM')
         if (source_node not in self.getAvailableNodes()):
             raise UnsuitableNodeException('Source node is not configured for the VM')
 
@@ -987,18 +2061,28 @@ class VirtualMachine(object):
             raise UnsuitableNodeException('DRBD-backed VMs must be moved on the node' +
                                           ' that will remain attached to the VM')
 
-        # Remove the destination node from the list of available nodes for the VM and
-        # add the remote node as an available node
+        # Ensure that there is enough storage on the destination node for the hard drives
+        disk_objects = self.getDiskObjects()
+        if (disk_objects):
+            HardDriveFactory.ensureStorageCapacity(
+                self.mcvirt_object, self.getStorageType(),
+                [disk_object.getSize() for disk_object in disk_objects],
+                [destination_node]
+            )
+
+        # Replace the source node in the list of available nodes for the VM with the
+        # destination node, retaining the position of the node, which determines the
+        # DRBD node ID of the replica
         available_nodes = self.getAvailableNodes()
-        available_nodes.remove(source_node)
-        available_nodes.append(destination_node)
+        available_nodes[available_nodes.index(source_node)] = destination_node
         self.updateConfig(['available_nodes'], available_nodes,
                           'Moved VM \'%s\' from node \'%s\' to node \'%s\'' %
                           (self.getName(), source_node, destination_node))
 
         # Move each of the attached disks to the remote node
-        for disk_object in self.getDiskObjects():
-            disk_object.move(source_node=source_node, destination_node=destination_node)
+        for disk_object in disk_objects:
+            disk_object.move(source_node=source_node, destination_node=destination_node,
+                             progress_callback=progress_callback)
 
         # If the VM is a Local VM, unregister it from the local node
         if (self.getStorageType() == 'Local'):
@@ -1058,9 +2142,19 @@ class VirtualMachine(object):
         all_nodes.append(Cluster.getHostname())
         if (len(available_nodes) == 0):
             if (storage_type == 'DRBD' and mcvirt_instance.initialiseNodes()):
-                # If the available nodes are not specified, use the
-                # nodes in the cluster
-                available_nodes = all_nodes
+                # If the available nodes are not specified, replicate the storage
+                # to the least loaded of the remote nodes, with the space for the
+                # hard drives
+                from mcvirt.node.placement import Placement
+                hard_drive_class = HardDriveFactory.getClass(storage_type)
+                required_space = sum([hard_drive_class.getRequiredStorageSpace(int(size))
+                                      for size in hard_drives])
+                available_nodes = [Cluster.getHostname()]
+                if (cluster_object.getNodes()):
+                    available_nodes.append(Placement(mcvirt_instance).getBestNode(
+                        cluster_object.getNodes(), memory=int(memory_allocation) / 1024,
+                        storage=required_space
+                    ))
             else:
                 # For local VMs, only use the local node as the available nodes
                 available_nodes = [Cluster.getHostname()]
@@ -1078,6 +2172,14 @@ class VirtualMachine(object):
         if (Cluster.getHostname() not in available_nodes and mcvirt_instance.initialiseNodes()):
             raise MCVirtException('One of the nodes must be the local node')
 
+        # Ensure that there is enough storage for the hard drives on all nodes,
+        # before any part of the VM is created
+        if (hard_drives and mcvirt_instance.initialiseNodes()):
+            HardDriveFactory.ensureStorageCapacity(
+                mcvirt_instance, storage_type or HardDriveFactory.DEFAULT_STORAGE_TYPE,
+                hard_drives, available_nodes
+            )
+
         # Create directory for VM
         os.makedirs(VirtualMachine.getVMDir(name))
 
@@ -1129,7 +2231,8 @@ class VirtualMachine(object):
                     vm_object=vm_object,
                     size=hard_drive_size,
                     storage_type=storage_type,
-                    driver=hard_drive_driver)
+                    driver=hard_drive_driver,
+                    check_capacity=False)
 
             # If any have been specified, add a network configuration for each of the
             # network interfaces to the domain XML
@@ -1150,7 +2253,8 @@ class VirtualMachine(object):
                 'VM \'%s\' already registered on node: %s' %
                 (self.name, current_node))
 
-        if (Cluster.getHostname() not in self.getAvailableNodes()):
+        if (Cluster.getHostname() not in (self.getAvailableNodes() +
+                                          self.getDisklessNodes())):
             raise UnsuitableNodeException(
                 'VM \'%s\' cannot be registered on node: %s' %
                 (self.name, Cluster.getHostname())
@@ -1183,6 +2287,10 @@ class VirtualMachine(object):
             network_interface_xml = network_adapter_object._generateLibvirtXml()
             device_xml.append(network_interface_xml)
 
+        # Add iothread and block I/O tuning configuration
+        self._setIoThreadXml(domain_xml.getroot())
+        self._setBlkioTuneXml(domain_xml.getroot())
+
         domain_xml_string = ET.tostring(domain_xml.getroot(), encoding='utf8', method='xml')
 
         try:
@@ -1202,6 +2310,13 @@ class VirtualMachine(object):
         # Ensure VM is registered locally
         self.ensureRegisteredLocally()
 
+        # The saved state of the VM can only be restored on the local node
+        if (self.hasSavedState()):
+            raise VmSavedStateException(
+                'The VM %s has a saved state, which must be restored before the VM is moved' %
+                self.getName()
+            )
+
         # Remove VM from LibVirt
         try:
             self._getLibvirtDomainObject().undefine()
@@ -64,7 +64,16 @@ class VirtualMachineConfig(ConfigFile):
                 'network_interfaces': {},
                 'node': None,
                 'available_nodes': available_nodes,
-                'lock': LockStates.UNLOCKED.value
+                'lock': LockStates.UNLOCKED.value,
+                'disk_performance': {},
+                'iothreads': 0,
+                'iothread_pinning': {},
+                'blkiotune': {},
+                'drbd_tuning': {},
+                'diskless_nodes': {},
+                'migration_tuning': {},
+                'shutdown_timeout': None,
+                'resume_priority': 0
             }
 
         # Write the configuration to disk
@@ -111,3 +120,46 @@ class VirtualMachineConfig(ConfigFile):
             # disk configurations
             for disk in config['hard_disks']:
                 config['hard_disks'][disk]['driver'] = 'VIRTIO'
+
+        if self._getVersion() < 3:
+            # Add disk performance settings, for the VM and each of its disks,
+            # and the iothread configuration
+            config['disk_performance'] = {}
+            for disk in config['hard_disks']:
+                config['hard_disks'][disk]['performance'] = {}
+            config['iothreads'] = 0
+            config['iothread_pinning'] = {}
+
+        if self._getVersion() < 4:
+            # Add the I/O limit configuration to each of the disks and
+            # the block I/O tuning configuration for the VM
+            for disk in config['hard_disks']:
+                config['hard_disks'][disk]['iotune'] = {}
+            config['blkiotune'] = {}
+
+        if self._getVersion() < 6:
+            # Add the DRBD replication tuning configuration to the VM and
+            # each of its DRBD disks
+            config['drbd_tuning'] = {}
+            if (config['storage_type'] == 'DRBD'):
+                for disk in config['hard_disks']:
+                    config['hard_disks'][disk]['drbd_tuning'] = {}
+
+        if self._getVersion() < 7:
+            # Add the DRBD diskless client nodes, indexed by node name, with the
+            # DRBD node ID of each of the nodes
+            config['diskless_nodes'] = {}
+
+        if self._getVersion() < 8:
+            # Add the live migration tuning settings
+            config['migration_tuning'] = {}
+
+        if self._getVersion() < 9:
+            # Add the time given for the VM to shut down before it is powered off,
+            # which uses the default when not set
+            config['shutdown_timeout'] = None
+
+        if self._getVersion() < 10:
+            # Add the priority of the VM when restoring the saved state of the VMs
+            # on a node
+            config['resume_priority'] = 0